@@ -0,0 +1,626 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+"""
+Micro-benchmarks for performance sensitive parts of Flocker.
+
+Each benchmark is a sub-command of :file:`admin/run-benchmark`, e.g.::
+
+    admin/run-benchmark docker-list --containers 200
+
+Benchmarks talk to real system services (Docker, iptables, ZFS) so they
+typically need to be run as root on a development machine.
+"""
+
+import sys
+from os import urandom
+from socket import socket, error, SHUT_WR
+from tempfile import mkdtemp
+from threading import Thread
+from time import time
+
+from twisted.python.usage import Options, UsageError
+from twisted.internet.defer import gatherResults, succeed
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.task import react
+from twisted.internet.threads import deferToThread
+from twisted.python.filepath import FilePath
+
+from docker import Client
+from docker.unixconn.unixconn import UnixAdapter
+from ipaddr import IPAddress
+
+from flocker.node._docker import DockerClient, BASE_DOCKER_API_URL
+from flocker.route import make_host_network, make_userspace_network
+from flocker.volume.service import Volume, VolumeName, VolumeService
+from flocker.volume.filesystems.memory import FilesystemStoragePool
+from flocker.volume.filesystems.zfs import StoragePool
+from flocker.volume._amp import AMPRemoteVolumeManager, volume_transfer_factory
+from flocker.volume._compression import available_compressions
+from flocker.volume._transfer import ThreadedTransfers
+
+
+def time_repeatedly(function, iterations):
+    """
+    Call a function a number of times, one call after another, and measure
+    how long each call takes.
+
+    :param function: A callable returning a ``Deferred``.
+    :param int iterations: The number of times to call ``function``.
+
+    :return: ``Deferred`` firing with a ``list`` of the durations in
+        seconds of each call.
+    """
+    durations = []
+
+    def run_once(_):
+        start = time()
+        d = function()
+        d.addCallback(lambda _: durations.append(time() - start))
+        return d
+
+    d = succeed(None)
+    for i in range(iterations):
+        d.addCallback(run_once)
+    d.addCallback(lambda _: durations)
+    return d
+
+
+def report(name, durations):
+    """
+    Write a summary of measured durations to standard output.
+
+    :param bytes name: The name of what was measured.
+    :param list durations: Durations in seconds.
+    """
+    sys.stdout.write(
+        "%s: min %.4fs, mean %.4fs, max %.4fs (%d runs)\n" % (
+            name, min(durations), sum(durations) / len(durations),
+            max(durations), len(durations)))
+
+
+def count_connections(adapter):
+    """
+    Count the connections opened by the connection pools of a ``requests``
+    transport adapter.
+
+    :param HTTPAdapter adapter: The adapter.
+
+    :return: A ``list`` which has an element appended for each connection
+        opened.
+    """
+    opened = []
+    get_connection = adapter.get_connection
+
+    def counting_get_connection(url, proxies=None):
+        pool = get_connection(url, proxies)
+        if not getattr(pool, "_benchmark_counting", False):
+            new_conn = pool._new_conn
+
+            def counting_new_conn():
+                opened.append(None)
+                return new_conn()
+            pool._new_conn = counting_new_conn
+            pool._benchmark_counting = True
+        return pool
+    adapter.get_connection = counting_get_connection
+    return opened
+
+
+class DockerListOptions(Options):
+    """
+    Options for the ``docker-list`` benchmark.
+    """
+    description = (
+        "Measure DockerClient.list() with and without connection pooling.")
+
+    optParameters = [
+        ['containers', None, 200, 'The number of containers to create.', int],
+        ['iterations', None, 5, 'The number of times to measure.', int],
+        ['concurrency', None, 4,
+         'The number of list() calls to make at the same time.', int],
+    ]
+
+
+def benchmark_docker_list(reactor, options):
+    """
+    Create containers and measure how long ``DockerClient.list`` takes to
+    list them, both with the pooled transport used by ``DockerClient`` and
+    with ``docker-py``'s own transport, and how many connections to the
+    Docker socket each transport opens.
+    """
+    namespace = u"flocker-benchmark--"
+    names = [namespace + u"%d" % (i,) for i in range(options['containers'])]
+    docker = Client(version="1.15", base_url=BASE_DOCKER_API_URL)
+
+    def create():
+        docker.pull(u"busybox")
+        for name in names:
+            docker.create_container(
+                name=name, image=u"busybox", command=u"true")
+
+    def destroy():
+        for name in names:
+            docker.remove_container(name)
+
+    pooled = DockerClient(namespace=namespace)
+    unpooled = DockerClient(namespace=namespace)
+    unpooled._client.mount(u"http+unix://", UnixAdapter(
+        unpooled._client.base_url, unpooled._client._timeout))
+
+    def measure(_, name, client):
+        opened = count_connections(
+            client._client.get_adapter(client._client.base_url))
+        d = time_repeatedly(
+            lambda: gatherResults([client.list() for i in
+                                   range(options['concurrency'])]),
+            options['iterations'])
+
+        def measured(durations):
+            report(name, durations)
+            sys.stdout.write("  %d connections\n" % (len(opened),))
+        d.addCallback(measured)
+        return d
+
+    d = deferToThread(create)
+    d.addCallback(measure, "docker-py transport", unpooled)
+    d.addCallback(measure, "pooled transport", pooled)
+    d.addBoth(lambda result: deferToThread(destroy).addCallback(
+        lambda _: result))
+    return d
+
+
+class IPTablesPacketPathOptions(Options):
+    """
+    Options for the ``iptables-packet-path`` benchmark.
+    """
+    description = (
+        "Measure the cost of new local TCP connections with many proxies "
+        "configured.")
+
+    optParameters = [
+        ['proxies', None, 500, 'The number of proxies to create.', int],
+        ['connections', None, 1000,
+         'The number of connections to make in each measurement.', int],
+        ['iterations', None, 5, 'The number of times to measure.', int],
+    ]
+
+
+def benchmark_iptables_packet_path(reactor, options):
+    """
+    Measure how long it takes to make new TCP connections to a local server,
+    first with no proxies and then with many proxies configured by
+    ``HostNetwork``.
+
+    The first packet of each connection passes through the nat table, where
+    it is checked against the proxy rules.
+    """
+    network = make_host_network()
+    server = socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(128)
+    port = server.getsockname()[1]
+    proxies = []
+
+    def connect_repeatedly():
+        for i in range(options['connections']):
+            client = socket()
+            client.connect(("127.0.0.1", port))
+            server.accept()[0].close()
+            client.close()
+
+    def create():
+        with network.transaction():
+            for i in range(options['proxies']):
+                proxies.append(network.create_proxy_to(
+                    IPAddress("10.255.%d.%d" % divmod(i, 256)), 20000 + i))
+
+    def destroy():
+        with network.transaction():
+            for proxy in proxies:
+                network.delete_proxy(proxy)
+        server.close()
+
+    def measure():
+        return time_repeatedly(
+            lambda: deferToThread(connect_repeatedly), options['iterations'])
+
+    d = measure()
+    d.addCallback(lambda durations: report("no proxies", durations))
+    d.addCallback(lambda _: deferToThread(create))
+    d.addCallback(lambda _: measure())
+    d.addCallback(lambda durations: report(
+        "%d proxies" % (options['proxies'],), durations))
+    d.addBoth(lambda result: deferToThread(destroy).addCallback(
+        lambda _: result))
+    return d
+
+
+class ProxyOptions(Options):
+    """
+    Options for the ``proxy`` benchmark.
+    """
+    description = (
+        "Compare iptables and userspace proxies for throughput and "
+        "connection latency.")
+
+    optParameters = [
+        ['megabytes', None, 100,
+         'The number of megabytes to send in each transfer.', int],
+        ['connections', None, 200,
+         'The number of connections to make in each measurement.', int],
+        ['iterations', None, 3, 'The number of times to measure.', int],
+    ]
+
+
+def _sink(server):
+    """
+    Accept connections, read each one until the client stops sending and
+    then reply with one byte, until the server socket is closed.
+
+    :param socket server: A listening socket.
+    """
+    while True:
+        try:
+            connection = server.accept()[0]
+        except error:
+            return
+        while connection.recv(65536):
+            pass
+        connection.sendall(b"x")
+        connection.close()
+
+
+def _transfer(port, size):
+    """
+    Send some bytes to the local sink through a proxy and wait for the
+    reply.
+
+    :param int port: The port of the proxy on 127.0.0.1.
+    :param int size: The number of bytes to send.
+    """
+    chunk = b"x" * 65536
+    client = socket()
+    client.connect(("127.0.0.1", port))
+    while size > 0:
+        client.sendall(chunk[:size])
+        size -= len(chunk)
+    client.shutdown(SHUT_WR)
+    client.recv(1)
+    client.close()
+
+
+def benchmark_proxy(reactor, options):
+    """
+    Measure the throughput of a single connection and the time taken by
+    many short connections through a proxy created by ``HostNetwork`` and
+    through one created by ``UserspaceNetwork``.
+    """
+    server = socket()
+    server.bind(("127.0.0.2", 0))
+    server.listen(128)
+    port = server.getsockname()[1]
+    sink = Thread(target=_sink, args=(server,))
+    sink.daemon = True
+    sink.start()
+
+    size = options['megabytes'] * 1024 * 1024
+
+    def connect_repeatedly():
+        for i in range(options['connections']):
+            _transfer(port, 1)
+
+    def measure(name, network):
+        proxy = network.create_proxy_to(IPAddress("127.0.0.2"), port)
+        d = time_repeatedly(
+            lambda: deferToThread(_transfer, port, size),
+            options['iterations'])
+        d.addCallback(lambda durations: report(
+            "%s: %d MiB transfer" % (name, options['megabytes']), durations))
+        d.addCallback(lambda _: time_repeatedly(
+            lambda: deferToThread(connect_repeatedly),
+            options['iterations']))
+        d.addCallback(lambda durations: report(
+            "%s: %d connections" % (name, options['connections']),
+            durations))
+
+        def delete(result):
+            network.delete_proxy(proxy)
+            return result
+        d.addBoth(delete)
+        return d
+
+    d = measure("iptables", make_host_network())
+    d.addCallback(lambda _: measure(
+        "userspace", make_userspace_network(reactor, interface=b"127.0.0.1")))
+
+    def close(result):
+        server.close()
+        return result
+    d.addBoth(close)
+    return d
+
+
+class VolumePushOptions(Options):
+    """
+    Options for the ``volume-push`` benchmark.
+    """
+    description = (
+        "Measure volume push throughput with different compressions and "
+        "buffer sizes.")
+
+    optParameters = [
+        ['megabytes', None, 100, 'The size of the volume in megabytes.', int],
+        ['iterations', None, 3, 'The number of times to measure.', int],
+        ['compressions', None, None,
+         'A comma-separated list of the compressions to measure, "none" '
+         'meaning uncompressed.  Defaults to "none" and all the installed '
+         'compressions.'],
+        ['buffer-sizes', None, b"65536,1048576,4194304",
+         'A comma-separated list of the buffer sizes in bytes to measure.'],
+        ['content', None, b"text",
+         'The content of the volume: "text" (compressible) or "random".'],
+    ]
+
+    def postOptions(self):
+        if self['compressions'] is None:
+            self['compressions'] = [None] + available_compressions()
+        else:
+            self['compressions'] = [
+                None if name == b"none" else name
+                for name in self['compressions'].split(b",")]
+        self['buffer-sizes'] = [
+            int(size) for size in self['buffer-sizes'].split(b",")]
+        if self['content'] not in (b"text", b"random"):
+            raise UsageError("Content must be text or random.")
+
+
+def _volume_content(kind, size):
+    """
+    Create the contents of a benchmark volume.
+
+    :param bytes kind: ``b"text"`` for compressible data, ``b"random"`` for
+        incompressible data.
+    :param int size: The number of bytes.
+
+    :return: ``bytes``.
+    """
+    if kind == b"random":
+        return urandom(size)
+    lines = []
+    length = 0
+    while length < size:
+        line = b"%d flocker volume push benchmark line %d\n" % (
+            length, length % 7919)
+        lines.append(line)
+        length += len(line)
+    return b"".join(lines)[:size]
+
+
+def benchmark_volume_push(reactor, options):
+    """
+    Push a ``DirectoryFilesystem`` volume to another ``VolumeService`` in
+    the same process over the volume transfer protocol on the loopback
+    interface, measuring how long it takes with each combination of
+    compression and buffer size.
+
+    Directory filesystems produce their stream (a tarball) without touching
+    ZFS, so this measures the cost of the transfer machinery itself:
+    copying, compression and the protocol.
+    """
+    root = FilePath(mkdtemp())
+    name = VolumeName(namespace=u"benchmark", dataset_id=u"push")
+
+    def make_service(name, **kwargs):
+        service = VolumeService(
+            root.child(name + b".json"),
+            FilesystemStoragePool(root.child(name)), reactor=reactor,
+            **kwargs)
+        service.startService()
+        return service
+
+    receiving = ThreadedTransfers(reactor)
+    to_service = make_service(b"to", transfers=receiving)
+    port = reactor.listenTCP(
+        0, volume_transfer_factory(reactor, to_service, receiving),
+        interface=b"127.0.0.1")
+    remote = AMPRemoteVolumeManager(
+        reactor, TCP4ClientEndpoint(reactor, b"127.0.0.1",
+                                    port.getHost().port))
+
+    from_service = make_service(b"from")
+    creating = from_service.create(from_service.get(name))
+    creating.addCallback(
+        lambda volume: volume.get_filesystem().get_path().child(
+            b"data").setContent(_volume_content(
+                options['content'], options['megabytes'] * 1024 * 1024)))
+
+    def measure(_, compression, buffer_size):
+        sending = ThreadedTransfers(reactor)
+        service = make_service(
+            b"from", transfers=sending, chunk_size=buffer_size,
+            compressions=[] if compression is None else [compression])
+        volume = service.get(name)
+        d = time_repeatedly(
+            lambda: service.push(volume, remote), options['iterations'])
+
+        def measured(durations):
+            report("%s, %d byte buffers: %d MiB push" % (
+                compression or b"uncompressed", buffer_size,
+                options['megabytes']), durations)
+            sys.stdout.write("  %.1f MiB/s\n" % (
+                options['megabytes'] / (sum(durations) / len(durations)),))
+        d.addCallback(measured)
+
+        def stop(result):
+            sending.stop()
+            return result
+        d.addBoth(stop)
+        return d
+
+    d = creating
+    for compression in options['compressions']:
+        for buffer_size in options['buffer-sizes']:
+            d.addCallback(measure, compression, buffer_size)
+
+    def cleanup(result):
+        d = remote.disconnect()
+        d.addCallback(lambda _: port.stopListening())
+
+        def stopped(_):
+            receiving.stop()
+            root.remove()
+            return result
+        d.addCallback(stopped)
+        return d
+    d.addBoth(cleanup)
+    return d
+
+
+class ZFSChangeOwnerOptions(Options):
+    """
+    Options for the ``zfs-change-owner`` benchmark.
+    """
+    description = (
+        "Count the processes spawned by ZFS volume ownership changes and "
+        "clones, and measure how long they take.")
+
+    optParameters = [
+        ['pool', None, b"flocker",
+         'The ZFS pool to create the benchmark filesystems in.'],
+        ['iterations', None, 10,
+         'The number of ownership changes to measure.', int],
+    ]
+
+
+class _SpawnCounter(object):
+    """
+    Wrap a reactor to count the processes spawned through it.
+
+    :ivar list spawned: The arguments of each process spawned since the
+        last ``reset``.
+    """
+    def __init__(self, reactor):
+        self._reactor = reactor
+        self.spawned = []
+
+    def spawnProcess(self, protocol, executable, args=(), *a, **kw):
+        self.spawned.append(args)
+        return self._reactor.spawnProcess(
+            protocol, executable, args, *a, **kw)
+
+    def reset(self):
+        """
+        :return: The number of processes spawned since the last ``reset``.
+        """
+        count = len(self.spawned)
+        self.spawned = []
+        return count
+
+    def __getattr__(self, name):
+        return getattr(self._reactor, name)
+
+
+def benchmark_zfs_change_owner(reactor, options):
+    """
+    Hand a ZFS filesystem back and forth between two nodes with
+    ``StoragePool.change_owner`` and clone it with ``StoragePool.clone_to``,
+    reporting how many ``zfs`` processes each operation spawns and how long
+    it takes.
+    """
+    counter = _SpawnCounter(reactor)
+    root = FilePath(mkdtemp())
+    pool = StoragePool(counter, options['pool'], root)
+
+    class Service(object):
+        node_id = u"benchmark-local"
+
+    name = VolumeName(namespace=u"benchmark", dataset_id=u"change-owner")
+    owners = [Volume(node_id=node_id, name=name, service=Service())
+              for node_id in (u"benchmark-local", u"benchmark-remote")]
+    clone = Volume(node_id=u"benchmark-local", service=Service(),
+                   name=VolumeName(namespace=u"benchmark",
+                                   dataset_id=u"change-owner-clone"))
+    spawns = []
+
+    def change_owner():
+        d = pool.change_owner(owners[0], owners[1])
+        owners.reverse()
+        d.addCallback(lambda _: spawns.append(counter.reset()))
+        return d
+
+    def clone_to():
+        d = pool.clone_to(owners[0], clone)
+        d.addCallback(lambda _: spawns.append(counter.reset()))
+        d.addCallback(lambda _: pool.destroy(clone))
+        d.addCallback(lambda _: counter.reset())
+        return d
+
+    def measured(durations, description):
+        report(description, durations)
+        sys.stdout.write("  %.1f zfs processes each\n" % (
+            float(sum(spawns)) / len(spawns),))
+        del spawns[:]
+
+    d = pool.create(owners[0])
+    d.addCallback(lambda _: counter.reset())
+    d.addCallback(lambda _: time_repeatedly(
+        change_owner, options['iterations']))
+    d.addCallback(measured, "change_owner")
+    d.addCallback(lambda _: time_repeatedly(clone_to, options['iterations']))
+    d.addCallback(measured, "clone_to")
+
+    def cleanup(result):
+        d = pool.destroy(owners[0])
+        d.addBoth(lambda _: root.remove())
+        d.addCallback(lambda _: result)
+        return d
+    d.addBoth(cleanup)
+    return d
+
+
+class BenchmarkOptions(Options):
+    """
+    Options for :file:`admin/run-benchmark`.
+    """
+    synopsis = 'Usage: run-benchmark <benchmark> [options]'
+
+    subCommands = [
+        ['docker-list', None, DockerListOptions,
+         DockerListOptions.description],
+        ['iptables-packet-path', None, IPTablesPacketPathOptions,
+         IPTablesPacketPathOptions.description],
+        ['proxy', None, ProxyOptions, ProxyOptions.description],
+        ['volume-push', None, VolumePushOptions,
+         VolumePushOptions.description],
+        ['zfs-change-owner', None, ZFSChangeOwnerOptions,
+         ZFSChangeOwnerOptions.description],
+    ]
+
+    def postOptions(self):
+        if self.subCommand is None:
+            raise UsageError("A benchmark must be specified.")
+
+
+BENCHMARKS = {
+    'docker-list': benchmark_docker_list,
+    'iptables-packet-path': benchmark_iptables_packet_path,
+    'proxy': benchmark_proxy,
+    'volume-push': benchmark_volume_push,
+    'zfs-change-owner': benchmark_zfs_change_owner,
+}
+
+
+def main(args, base_path, top_level):
+    """
+    :param list args: The arguments passed to the script.
+    :param FilePath base_path: The executable being run.
+    :param FilePath top_level: The top-level of the flocker repository.
+    """
+    options = BenchmarkOptions()
+
+    try:
+        options.parseOptions(args)
+    except UsageError as e:
+        sys.stderr.write("%s: %s\n" % (base_path.basename(), e))
+        raise SystemExit(1)
+
+    react(BENCHMARKS[options.subCommand], [options.subOptions])
@@ -4,7 +4,9 @@
 Shared flocker components.
 """
 
-__all__ = ['INode', 'FakeNode', 'ProcessNode', 'gather_deferreds']
+__all__ = ['INode', 'FakeNode', 'ProcessNode', 'SSHControlMasterService',
+           'gather_deferreds', 'call_in_reactor_thread']
 
-from ._ipc import INode, FakeNode, ProcessNode
+from ._ipc import INode, FakeNode, ProcessNode, SSHControlMasterService
 from ._defer import gather_deferreds
+from ._thread import call_in_reactor_thread
@@ -4,9 +4,11 @@
 Inter-process communication for flocker.
 """
 
-from subprocess import Popen, PIPE, check_output, CalledProcessError
+from os import environ
+from subprocess import Popen, PIPE
 from contextlib import contextmanager
 from io import BytesIO
+from tempfile import mkdtemp
 from threading import current_thread
 from pipes import quote
 
@@ -14,6 +16,12 @@ from zope.interface import Interface, implementer
 
 from characteristic import with_cmp, with_repr
 
+from twisted.application.service import Service
+from twisted.internet.defer import Deferred, gatherResults
+from twisted.internet.error import ProcessExitedAlready
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python.filepath import FilePath
+
 
 class INode(Interface):
     """
@@ -34,7 +42,10 @@ class INode(Interface):
     def get_output(remote_command):
         """Run a remote command and return its stdout.
 
-        May raise an exception if an error of some sort occured.
+        May raise an exception if an error of some sort occured.  If the
+        command exits with a non-zero status it is an ``IOError`` whose
+        ``args`` are ``"Bad exit"``, the command, the exit status, and the
+        stdout and stderr of the command.
 
         :param remote_command: ``list`` of ``bytes``, the command to run
             remotely along with its arguments.
@@ -80,17 +91,20 @@ class ProcessNode(object):
                 raise IOError("Bad exit", remote_command, exit_code)
 
     def get_output(self, remote_command):
-        try:
-            return check_output(
-                self.initial_command_arguments +
-                tuple(map(self._quote, remote_command)))
-        except CalledProcessError as e:
-            # We should really capture this and stderr better:
+        process = Popen(
+            self.initial_command_arguments +
+            tuple(map(self._quote, remote_command)),
+            stdout=PIPE, stderr=PIPE)
+        output, error = process.communicate()
+        if process.returncode:
+            # We should really capture this better:
             # https://clusterhq.atlassian.net/browse/FLOC-155
-            raise IOError("Bad exit", remote_command, e.returncode, e.output)
+            raise IOError(
+                "Bad exit", remote_command, process.returncode, output, error)
+        return output
 
     @classmethod
-    def using_ssh(cls, host, port, username, private_key):
+    def using_ssh(cls, host, port, username, private_key, control_path=None):
         """Create a ``ProcessNode`` that communicate over SSH.
 
         :param bytes host: The hostname or IP.
@@ -98,31 +112,167 @@ class ProcessNode(object):
         :param bytes username: The username to SSH as.
         :param FilePath private_key: Path to private key to use when talking to
             SSH server.
+        :param control_path: ``None`` or the ``FilePath`` of the control
+            socket of a master connection to the SSH server, as started by
+            ``SSHControlMasterService``.  If the socket exists commands are
+            run over that connection, otherwise a new connection is made.
 
         :return: ``ProcessNode`` instance that communicates over SSH.
         """
-        return cls(initial_command_arguments=(
-            b"ssh",
-            b"-q",  # suppress warnings
-            b"-i", private_key.path,
-            b"-l", username,
-            # We're ok with unknown hosts; we'll be switching away from
-            # SSH by the time Flocker is production-ready and security is
-            # a concern.
-            b"-o", b"StrictHostKeyChecking=no",
-            # The tests hang if ControlMaster is set, since OpenSSH won't
-            # ever close the connection to the test server.
-            b"-o", b"ControlMaster=no",
-            # Some systems (notably Ubuntu) enable GSSAPI authentication which
-            # involves a slow DNS operation before failing and moving on to a
-            # working mechanism.  The expectation is that key-based auth will
-            # be in use so just jump straight to that.  An alternate solution,
-            # explicitly disabling GSSAPI, has cross-version platform and
-            # cross-version difficulties (the options aren't always recognized
-            # and result in an immediate failure).  As mentioned above, we'll
-            # switch away from SSH soon.
-            b"-o", b"PreferredAuthentications=publickey",
-            b"-p", b"%d" % (port,), host), quote=quote)
+        # The tests hang if ControlMaster is set, since OpenSSH won't ever
+        # close the connection to the test server.  Master connections are
+        # instead run as separate processes with a managed lifetime, see
+        # ``SSHControlMasterService``.
+        options = [b"ControlMaster=no"]
+        if control_path is not None:
+            options.append(b"ControlPath=" + control_path.path)
+        return cls(
+            initial_command_arguments=_ssh_arguments(
+                host, port, username, private_key, options),
+            quote=quote)
+
+
+def _ssh_arguments(host, port, username, private_key, options):
+    """
+    Create the command line for ``ssh``.
+
+    :param bytes host: The hostname or IP.
+    :param int port: The port number of the SSH server.
+    :param bytes username: The username to SSH as.
+    :param FilePath private_key: Path to private key to use when talking to
+        SSH server.
+    :param list options: Additional ``bytes`` options to pass with ``-o``.
+
+    :return: A ``tuple`` of ``bytes``.
+    """
+    arguments = [
+        b"ssh",
+        b"-q",  # suppress warnings
+        b"-i", private_key.path,
+        b"-l", username,
+        # We're ok with unknown hosts; we'll be switching away from
+        # SSH by the time Flocker is production-ready and security is
+        # a concern.
+        b"-o", b"StrictHostKeyChecking=no",
+        # Some systems (notably Ubuntu) enable GSSAPI authentication which
+        # involves a slow DNS operation before failing and moving on to a
+        # working mechanism.  The expectation is that key-based auth will
+        # be in use so just jump straight to that.  An alternate solution,
+        # explicitly disabling GSSAPI, has cross-version platform and
+        # cross-version difficulties (the options aren't always recognized
+        # and result in an immediate failure).  As mentioned above, we'll
+        # switch away from SSH soon.
+        b"-o", b"PreferredAuthentications=publickey",
+    ]
+    for option in options:
+        arguments.extend([b"-o", option])
+    arguments.extend([b"-p", b"%d" % (port,), host])
+    return tuple(arguments)
+
+
+class _MasterProcessProtocol(ProcessProtocol):
+    """
+    Track the lifetime of an ``ssh`` master connection process.
+
+    :ivar Deferred ended: Fires when the process has exited.
+    """
+    def __init__(self):
+        self.ended = Deferred()
+
+    def processEnded(self, reason):
+        self.ended.callback(None)
+
+
+class SSHControlMasterService(Service):
+    """
+    Keep a multiplexed SSH master connection open to each node that
+    ``ProcessNode``\ s are created for by ``using_ssh``, so that commands run
+    on those nodes skip the SSH handshake.
+
+    Master connections are started in the background the first time a node
+    is used; until one is ready commands make their own connections.  A
+    master that exits is restarted the next time its node is used.  All of
+    them are closed when the service stops.
+
+    :ivar dict _masters: Map ``(host, port, username)`` to the
+        ``_MasterProcessProtocol`` of the master connection.
+    """
+    def __init__(self, reactor, control_directory=None):
+        """
+        :param reactor: An ``IReactorProcess`` provider.
+        :param control_directory: The ``FilePath`` of the directory to put
+            control sockets in.  By default a new temporary directory is
+            used.  Socket paths are limited to around 100 bytes so this
+            should be short.
+        """
+        self._reactor = reactor
+        self._control_directory = control_directory
+        self._directory = None
+        self._masters = {}
+
+    def startService(self):
+        Service.startService(self)
+        if self._control_directory is None:
+            self._directory = FilePath(mkdtemp(prefix=b"flocker-ssh-"))
+        else:
+            self._directory = self._control_directory
+            if not self._directory.exists():
+                self._directory.makedirs()
+
+    def stopService(self):
+        Service.stopService(self)
+        masters, self._masters = self._masters, {}
+        for master in masters.values():
+            try:
+                master.transport.signalProcess("TERM")
+            except ProcessExitedAlready:
+                # It has exited but the reactor hasn't told the protocol
+                # yet; ``ended`` still fires once it has.
+                pass
+        d = gatherResults([master.ended for master in masters.values()])
+
+        def stopped(_):
+            if self._control_directory is None:
+                self._directory.remove()
+        d.addCallback(stopped)
+        return d
+
+    def _control_path(self, host, port, username):
+        return self._directory.child(b"%s@%s:%d" % (username, host, port))
+
+    def using_ssh(self, host, port, username, private_key):
+        """
+        Create a ``ProcessNode`` that communicates over SSH, multiplexed
+        over a master connection if this service is running.
+
+        See ``ProcessNode.using_ssh`` for the parameters.
+
+        :return: ``ProcessNode`` instance that communicates over SSH.
+        """
+        if not self.running:
+            return ProcessNode.using_ssh(host, port, username, private_key)
+        control_path = self._control_path(host, port, username)
+        key = (host, port, username)
+        if key not in self._masters:
+            master = _MasterProcessProtocol()
+            self._masters[key] = master
+            master.ended.addCallback(self._master_ended, key, master)
+            arguments = _ssh_arguments(
+                host, port, username, private_key,
+                [b"ControlMaster=yes", b"ControlPath=" + control_path.path])
+            # -N: run no command, just hold the connection open.
+            arguments = arguments[:-1] + (b"-N", arguments[-1])
+            self._reactor.spawnProcess(
+                master, arguments[0], arguments, env=environ)
+        return ProcessNode.using_ssh(
+            host, port, username, private_key, control_path=control_path)
+
+    def _master_ended(self, _, key, master):
+        """
+        Forget a master connection process that has exited.
+        """
+        if self._masters.get(key) is master:
+            del self._masters[key]
 
 
 @implementer(INode)
@@ -0,0 +1,27 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.common.test.test_thread -*-
+
+"""
+Helpers for code which may run in threads other than the reactor's.
+"""
+
+from twisted.python.threadable import isInIOThread
+
+
+def call_in_reactor_thread(reactor, f, *args, **kwargs):
+    """
+    Call a function in the reactor thread.
+
+    The function is called immediately if this is the reactor thread or if
+    the reactor is not running, since then nothing else can be using the
+    state it touches; otherwise it is scheduled with ``callFromThread``.
+
+    :param reactor: The reactor.
+    :param f: The function to call.
+    :param args: Positional arguments for ``f``.
+    :param kwargs: Keyword arguments for ``f``.
+    """
+    if isInIOThread() or not getattr(reactor, "running", False):
+        f(*args, **kwargs)
+    else:
+        reactor.callFromThread(f, *args, **kwargs)
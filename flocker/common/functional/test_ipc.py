@@ -4,11 +4,13 @@
 Functional tests for IPC.
 """
 
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
 from twisted.internet.threads import deferToThread
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
 
-from .. import ProcessNode
+from .. import ProcessNode, SSHControlMasterService
 from ..test.test_ipc import make_inode_tests
 from ...testtools.ssh import create_ssh_server
 
@@ -93,6 +95,18 @@ class ProcessNodeTests(TestCase):
         nonexistent = self.mktemp()
         self.assertRaises(IOError, node.get_output, [b"ls", nonexistent])
 
+    def test_get_output_bad_exit_details(self):
+        """
+        The ``IOError`` raised by ``get_output()`` for a non-zero exit code
+        includes the command, the exit code and the command's stdout and
+        stderr.
+        """
+        node = ProcessNode(initial_command_arguments=[b"sh", b"-c"])
+        command = [b"echo out; echo err >&2; exit 3"]
+        exception = self.assertRaises(IOError, node.get_output, command)
+        self.assertEqual(
+            ("Bad exit", command, 3, b"out\n", b"err\n"), exception.args)
+
 
 def make_sshnode(test_case):
     """
@@ -178,6 +192,46 @@ class SSHProcessNodeTests(TestCase):
         return d
 
 
+class SSHControlMasterServiceTests(TestCase):
+    """
+    Tests for ``SSHControlMasterService`` with a real SSH server.
+    """
+    def test_multiplexed(self):
+        """
+        Once the master connection is up, commands run by a ``ProcessNode``
+        created by ``SSHControlMasterService.using_ssh`` go over it, and the
+        master exits when the service is stopped.
+        """
+        server = create_ssh_server(FilePath(self.mktemp()))
+        self.addCleanup(server.restore)
+        directory = FilePath(self.mktemp())
+        service = SSHControlMasterService(reactor, directory)
+        service.startService()
+        self.addCleanup(service.stopService)
+        node = service.using_ssh(
+            unicode(server.ip).encode("ascii"), server.port, b"root",
+            server.key_path)
+        [control_socket] = [
+            option.split(b"=", 1)[1]
+            for option in node.initial_command_arguments
+            if option.startswith(b"ControlPath=")]
+        control_socket = FilePath(control_socket)
+
+        def wait_for_socket(attempts=100):
+            if control_socket.exists():
+                return
+            if not attempts:
+                self.fail("Control socket was never created.")
+            return deferLater(reactor, 0.1, wait_for_socket, attempts - 1)
+        d = wait_for_socket()
+        d.addCallback(lambda _: deferToThread(
+            node.get_output, [b"echo", b"-n", b"hello"]))
+        d.addCallback(self.assertEqual, b"hello")
+        d.addCallback(lambda _: service.stopService())
+        d.addCallback(lambda _: self.assertFalse(control_socket.exists()))
+        return d
+
+
 class MutatingProcessNode(ProcessNode):
     """Mutate the command being run in order to make tests work.
 
@@ -10,7 +10,12 @@ from unittest import TestCase as PyTestCase
 
 from zope.interface.verify import verifyObject
 
-from .. import INode, FakeNode
+from twisted.internet.error import ProcessDone, ProcessExitedAlready
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import INode, FakeNode, ProcessNode, SSHControlMasterService
 from ...testtools import assertNoFDsLeaked
 
 
@@ -95,3 +100,156 @@ def make_inode_tests(fixture):
 
 class FakeINodeTests(make_inode_tests(lambda t: FakeNode([b"hello"]))):
     """``INode`` tests for ``FakeNode``."""
+
+
+class FakeProcessTransport(object):
+    """
+    Record the signals sent to a process.
+
+    :ivar bool exited: Whether the process has exited, so it can't be
+        signalled.
+    """
+    def __init__(self):
+        self.signals = []
+        self.exited = False
+
+    def signalProcess(self, signal):
+        if self.exited:
+            raise ProcessExitedAlready()
+        self.signals.append(signal)
+
+
+class FakeProcessReactor(object):
+    """
+    Record the processes spawned using ``spawnProcess``.
+
+    :ivar list processes: ``(protocol, arguments)`` for each process.
+    """
+    def __init__(self):
+        self.processes = []
+
+    def spawnProcess(self, protocol, executable, args, env=None):
+        protocol.makeConnection(FakeProcessTransport())
+        self.processes.append((protocol, args))
+
+
+class SSHControlMasterServiceTests(SynchronousTestCase):
+    """
+    Tests for ``SSHControlMasterService``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.directory = FilePath(self.mktemp())
+        self.service = SSHControlMasterService(self.reactor, self.directory)
+        self.key = FilePath(b"/etc/key")
+
+    def test_not_running(self):
+        """
+        If the service is not running ``using_ssh`` returns the same
+        ``ProcessNode`` as ``ProcessNode.using_ssh`` and starts no master
+        connection.
+        """
+        self.assertEqual(
+            (ProcessNode.using_ssh(b"example.com", 22, b"root", self.key),
+             []),
+            (self.service.using_ssh(b"example.com", 22, b"root", self.key),
+             self.reactor.processes))
+
+    def test_control_path(self):
+        """
+        ``using_ssh`` returns a ``ProcessNode`` using a control socket in
+        the control directory.
+        """
+        self.service.startService()
+        path = self.directory.child(b"root@example.com:22")
+        self.assertEqual(
+            ProcessNode.using_ssh(b"example.com", 22, b"root", self.key,
+                                  control_path=path),
+            self.service.using_ssh(b"example.com", 22, b"root", self.key))
+
+    def test_master(self):
+        """
+        ``using_ssh`` starts an ``ssh`` master connection with the same
+        control socket.
+        """
+        self.service.startService()
+        self.service.using_ssh(b"example.com", 22, b"root", self.key)
+        path = self.directory.child(b"root@example.com:22")
+        [(_, arguments)] = self.reactor.processes
+        self.assertEqual(
+            (b"ssh", b"ControlMaster=yes", b"ControlPath=" + path.path,
+             (b"-N", b"example.com")),
+            (arguments[0], arguments[-7], arguments[-5], arguments[-2:]))
+
+    def test_one_master_per_node(self):
+        """
+        Only one master connection is started for each destination.
+        """
+        self.service.startService()
+        for i in range(2):
+            self.service.using_ssh(b"a.example.com", 22, b"root", self.key)
+            self.service.using_ssh(b"a.example.com", 2222, b"root", self.key)
+            self.service.using_ssh(b"b.example.com", 22, b"root", self.key)
+        self.assertEqual(3, len(self.reactor.processes))
+
+    def test_master_restarted(self):
+        """
+        If a master connection exits a new one is started the next time the
+        node is used.
+        """
+        self.service.startService()
+        self.service.using_ssh(b"example.com", 22, b"root", self.key)
+        [(master, _)] = self.reactor.processes
+        master.processEnded(Failure(ProcessDone(0)))
+        self.service.using_ssh(b"example.com", 22, b"root", self.key)
+        self.assertEqual(2, len(self.reactor.processes))
+
+    def test_stop(self):
+        """
+        Stopping the service terminates the master connections and the
+        returned ``Deferred`` fires once they have exited.
+        """
+        self.service.startService()
+        self.service.using_ssh(b"a.example.com", 22, b"root", self.key)
+        self.service.using_ssh(b"b.example.com", 22, b"root", self.key)
+        d = self.service.stopService()
+        masters = [master for (master, _) in self.reactor.processes]
+        self.assertEqual(
+            [[b"TERM"], [b"TERM"]],
+            [master.transport.signals for master in masters])
+        self.assertNoResult(d)
+        for master in masters:
+            master.processEnded(Failure(ProcessDone(0)))
+        self.successResultOf(d)
+
+    def test_stop_exited(self):
+        """
+        Stopping the service terminates the master connections which are
+        still running even if another has already exited, and the returned
+        ``Deferred`` fires once they all have.
+        """
+        self.service.startService()
+        self.service.using_ssh(b"a.example.com", 22, b"root", self.key)
+        self.service.using_ssh(b"b.example.com", 22, b"root", self.key)
+        masters = [master for (master, _) in self.reactor.processes]
+        masters[0].transport.exited = True
+        d = self.service.stopService()
+        self.assertEqual(
+            [[], [b"TERM"]],
+            [master.transport.signals for master in masters])
+        self.assertNoResult(d)
+        for master in masters:
+            master.processEnded(Failure(ProcessDone(0)))
+        self.successResultOf(d)
+
+    def test_temporary_directory(self):
+        """
+        Without a control directory the service creates a temporary one,
+        removing it when it stops.
+        """
+        service = SSHControlMasterService(self.reactor)
+        service.startService()
+        directory = service._directory
+        existed = directory.isdir()
+        self.successResultOf(service.stopService())
+        self.assertEqual((True, False), (existed, directory.exists()))
@@ -0,0 +1,60 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._thread``.
+"""
+
+from threading import Thread
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._thread import call_in_reactor_thread
+
+
+class RunningReactor(Clock):
+    """
+    A reactor which claims to be running and records the functions passed
+    to ``callFromThread``.
+    """
+    running = True
+
+    def __init__(self):
+        Clock.__init__(self)
+        self.from_thread = []
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.from_thread.append((f, args, kwargs))
+
+
+class CallInReactorThreadTests(SynchronousTestCase):
+    """
+    Tests for ``call_in_reactor_thread``.
+    """
+    def call_in_thread(self, reactor, calls):
+        """
+        Call ``call_in_reactor_thread`` from another thread and wait for it.
+        """
+        thread = Thread(target=call_in_reactor_thread,
+                        args=(reactor, calls.append, 1))
+        thread.start()
+        thread.join()
+
+    def test_other_thread(self):
+        """
+        Called from another thread while the reactor is running, the
+        function is scheduled with ``callFromThread``.
+        """
+        reactor = RunningReactor()
+        calls = []
+        self.call_in_thread(reactor, calls)
+        self.assertEqual(
+            ([], [(calls.append, (1,), {})]), (calls, reactor.from_thread))
+
+    def test_reactor_not_running(self):
+        """
+        If the reactor is not running the function is called immediately.
+        """
+        calls = []
+        self.call_in_thread(Clock(), calls)
+        self.assertEqual([1], calls)
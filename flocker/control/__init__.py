@@ -20,7 +20,7 @@ from ._model import (
     IClusterStateChange,
     Application, Deployment, DockerImage, Node, Port, Link, AttachedVolume,
     NodeState, Manifestation, Dataset, RestartNever, RestartOnFailure,
-    RestartAlways, DeploymentState, NonManifestDatasets,
+    RestartAlways, DeploymentState, NonManifestDatasets, DatasetUsage,
     )
 
 __all__ = [
@@ -46,4 +46,5 @@ __all__ = [
     'RestartOnFailure',
     'RestartAlways',
     'NonManifestDatasets',
+    'DatasetUsage',
 ]
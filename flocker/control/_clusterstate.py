@@ -36,6 +36,39 @@ class ClusterStateService(Service):
         node = self._deployment_state.get_node(hostname)
         return node.paths[dataset_id]
 
+    def manifestation_usage(self, hostname, dataset_id):
+        """
+        Get the space taken up by a dataset on a particular node.
+
+        :param unicode hostname: The name of the host.
+        :param unicode dataset_id: The dataset identifier.
+
+        :return: The ``DatasetUsage`` reported by the node, or ``None`` if
+            it hasn't been reported.
+        """
+        node = self._deployment_state.get_node(hostname)
+        if node.dataset_usage is None:
+            return None
+        return node.dataset_usage.get(dataset_id)
+
+    def node_space(self):
+        """
+        Total up the space accounting reported by each node.
+
+        :return: A ``dict`` mapping the hostname of each node to a ``tuple``
+            of the number of bytes free on the node and the number of bytes
+            its datasets take up.  Either is ``None`` if the node hasn't
+            reported it.
+        """
+        result = {}
+        for node in self._deployment_state.nodes:
+            if node.dataset_usage is None:
+                used = None
+            else:
+                used = sum(usage.used for usage in node.dataset_usage.values())
+            result[node.hostname] = (node.free_space, used)
+        return result
+
     def as_deployment(self):
         """
         Return cluster state as a ``DeploymentState`` object.
@@ -56,7 +56,8 @@ def pset_field(item_type, optional=False):
 _valid = lambda item: (True, "")
 
 
-def pmap_field(key_type, value_type, optional=False, invariant=_valid):
+def pmap_field(key_type, value_type, optional=False, invariant=_valid,
+               initial_none=False):
     """
     Create a checked ``PMap`` field.
 
@@ -65,6 +66,8 @@ def pmap_field(key_type, value_type, optional=False, invariant=_valid):
     :param bool optional: If true, ``None`` can be used as a value for
         this field.
     :param invariant: Pass-through to ``field``.
+    :param bool initial_none: If true, the field is ``None`` rather than an
+        empty map if not given.  Requires ``optional``.
 
     :return: A ``field`` containing a ``CheckedPMap``.
     """
@@ -82,7 +85,7 @@ def pmap_field(key_type, value_type, optional=False, invariant=_valid):
                 return TheMap(argument)
     else:
         factory = TheMap
-    return field(mandatory=True, initial=TheMap(),
+    return field(mandatory=True, initial=None if initial_none else TheMap(),
                  type=optional_type(TheMap) if optional else TheMap,
                  factory=factory, invariant=invariant)
 
@@ -547,6 +550,23 @@ class IClusterStateChange(Interface):
         """
 
 
+class DatasetUsage(PRecord):
+    """
+    How much space a dataset takes up on a node.
+
+    :ivar int used: The number of bytes the dataset (including any
+        snapshots) takes up.
+    :ivar int available: The number of bytes that can still be written to
+        the dataset, limited by its maximum size and the free space on the
+        node.
+    :ivar float compression_ratio: The size of the dataset's data divided by
+        the space it takes up; ``1.0`` if it isn't compressed.
+    """
+    used = field(mandatory=True, type=(int, long))
+    available = field(mandatory=True, type=(int, long))
+    compression_ratio = field(mandatory=True, type=float, initial=1.0)
+
+
 @implementer(IClusterStateChange)
 class NodeState(PRecord):
     """
@@ -564,6 +584,12 @@ class NodeState(PRecord):
         unknown.
     :ivar PMap paths: The filesystem paths of the manifestations on this
         node. Maps ``dataset_id`` to a ``FilePath``.
+    :ivar PMap dataset_usage: The space taken up by the datasets stored on
+        this node. Maps ``dataset_id`` to a ``DatasetUsage``. ``None`` if
+        this information is unknown, which is also the default since only
+        some convergence agents discover it.
+    :ivar free_space: The number of bytes which can still be stored on this
+        node, or ``None`` if this information is unknown.
     """
     def __invariant__(self):
         if self.manifestations is None:
@@ -578,6 +604,9 @@ class NodeState(PRecord):
     applications = pset_field(Application, optional=True)
     manifestations = pmap_field(unicode, Manifestation, optional=True)
     paths = pmap_field(unicode, FilePath, optional=True)
+    dataset_usage = pmap_field(unicode, DatasetUsage, optional=True,
+                               initial_none=True)
+    free_space = field(type=(int, long, type(None)), initial=None)
 
     def update_cluster_state(self, cluster_state):
         return cluster_state.update_node(self)
@@ -654,5 +683,5 @@ class NonManifestDatasets(PRecord):
 SERIALIZABLE_CLASSES = [
     Deployment, Node, DockerImage, Port, Link, RestartNever, RestartAlways,
     RestartOnFailure, Application, Dataset, Manifestation, AttachedVolume,
-    NodeState, DeploymentState, NonManifestDatasets,
+    DatasetUsage, NodeState, DeploymentState, NonManifestDatasets,
 ]
@@ -394,10 +394,40 @@ class ConfigurationAPIUserV1(object):
             dataset[u"path"] = self.cluster_state_service.manifestation_path(
                 dataset[u"primary"], dataset[u"dataset_id"]).path.decode(
                     "utf-8")
+            usage = self.cluster_state_service.manifestation_usage(
+                dataset[u"primary"], dataset[u"dataset_id"])
+            if usage is not None:
+                dataset[u"used_size"] = usage.used
+                dataset[u"available_size"] = usage.available
+                dataset[u"compression_ratio"] = usage.compression_ratio
             del dataset[u"metadata"]
             del dataset[u"deleted"]
         return datasets
 
+    @app.route("/state/nodes", methods=['GET'])
+    @user_documentation("""
+        Get the free space on each node and the space taken up by its
+        datasets.
+        """, examples=[u"get state nodes"])
+    @structured(
+        inputSchema={},
+        outputSchema={
+            '$ref': '/v1/endpoints.json#/definitions/state_nodes_array'
+            },
+        schema_store=SCHEMAS
+    )
+    def state_nodes(self):
+        """
+        Return the space accounting of the nodes in the cluster.
+
+        :return: A ``list`` containing a ``dict`` for each node.
+        """
+        return [
+            {u"host": hostname, u"free_size": free_size,
+             u"used_size": used_size}
+            for (hostname, (free_size, used_size))
+            in self.cluster_state_service.node_space().items()]
+
     @app.route("/configuration/containers", methods=['GET'])
     @user_documentation(
         """
@@ -12,7 +12,7 @@ from twisted.python.filepath import FilePath
 from .._clusterstate import ClusterStateService
 from .._model import (
     Application, DockerImage, NodeState, DeploymentState, Manifestation,
-    Dataset,
+    Dataset, DatasetUsage,
 )
 
 APP1 = Application(
@@ -135,3 +135,61 @@ class ClusterStateServiceTests(SynchronousTestCase):
         self.assertEqual(
             service.manifestation_path(u"host1", MANIFESTATION.dataset_id),
             FilePath(b"/xxx/yyy"))
+
+    def test_partial_update_space(self):
+        """
+        An update that is ignorant about space accounting leaves what was
+        previously reported in place.
+        """
+        service = self.service()
+        usage = {MANIFESTATION.dataset_id: DatasetUsage(used=10, available=20)}
+        service.apply_changes([
+            NodeState(hostname=u"host1", dataset_usage=usage,
+                      free_space=100),
+            NodeState(hostname=u"host1", applications=[APP1]),
+        ])
+        [node] = service.as_deployment().nodes
+        self.assertEqual((usage, 100), (node.dataset_usage, node.free_space))
+
+    def test_manifestation_usage(self):
+        """
+        ``manifestation_usage`` returns the ``DatasetUsage`` reported for
+        the dataset by the given node.
+        """
+        service = self.service()
+        usage = DatasetUsage(used=10, available=20, compression_ratio=1.5)
+        service.apply_changes([
+            NodeState(hostname=u"host1",
+                      dataset_usage={MANIFESTATION.dataset_id: usage})
+        ])
+        self.assertEqual(
+            usage,
+            service.manifestation_usage(u"host1", MANIFESTATION.dataset_id))
+
+    def test_manifestation_usage_unknown(self):
+        """
+        ``manifestation_usage`` returns ``None`` if the node has not reported
+        the usage of its datasets.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_MANIFESTATION])
+        self.assertEqual(
+            None,
+            service.manifestation_usage(u"host2", MANIFESTATION.dataset_id))
+
+    def test_node_space(self):
+        """
+        ``node_space`` returns the free space reported by each node and the
+        total space taken up by its datasets, ``None`` for either if not
+        reported.
+        """
+        service = self.service()
+        service.apply_changes([
+            NodeState(hostname=u"host1", free_space=1000, dataset_usage={
+                u"a": DatasetUsage(used=10, available=20),
+                u"b": DatasetUsage(used=5, available=20)}),
+            NodeState(hostname=u"host2", applications=[APP1]),
+        ])
+        self.assertEqual(
+            {u"host1": (1000, 15), u"host2": (None, None)},
+            service.node_space())
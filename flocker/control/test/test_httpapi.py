@@ -31,7 +31,7 @@ from ...restapi.testtools import (
 from .. import (
     Application, Dataset, Manifestation, Node, NodeState,
     Deployment, AttachedVolume, DockerImage, Port, RestartOnFailure,
-    RestartAlways, RestartNever, Link
+    RestartAlways, RestartNever, Link, DatasetUsage,
 )
 from ..httpapi import (
     ConfigurationAPIUserV1, create_api_service, datasets_from_deployment,
@@ -2821,10 +2821,82 @@ class DatasetsStateTestsMixin(APITestsMixin):
             b"GET", b"/state/datasets", None, OK, response
         )
 
+    def test_dataset_usage(self):
+        """
+        When the primary node has reported the space taken up by a dataset,
+        the endpoint includes it.
+        """
+        expected_dataset = Dataset(dataset_id=unicode(uuid4()))
+        expected_manifestation = Manifestation(
+            dataset=expected_dataset, primary=True)
+        expected_hostname = u"192.0.2.101"
+        self.cluster_state_service.apply_changes([
+            NodeState(
+                hostname=expected_hostname,
+                manifestations={expected_dataset.dataset_id:
+                                expected_manifestation},
+                paths={expected_dataset.dataset_id:
+                       FilePath(b"/path/dataset")},
+                dataset_usage={expected_dataset.dataset_id: DatasetUsage(
+                    used=1024, available=2048, compression_ratio=1.5)},
+            )
+        ])
+        response = [dict(
+            dataset_id=expected_dataset.dataset_id,
+            primary=expected_hostname,
+            path=u"/path/dataset",
+            used_size=1024,
+            available_size=2048,
+            compression_ratio=1.5,
+        )]
+        return self.assertResult(
+            b"GET", b"/state/datasets", None, OK, response
+        )
+
 RealTestsDatasetsStateAPI, MemoryTestsDatasetsStateAPI = buildIntegrationTests(
     DatasetsStateTestsMixin, "DatasetsStateAPI", _build_app)
 
 
+class NodesStateTestsMixin(APITestsMixin):
+    """
+    Tests for the node state description endpoint at ``/state/nodes``.
+    """
+    def test_empty(self):
+        """
+        When the cluster state includes no nodes, the endpoint returns an
+        empty list.
+        """
+        return self.assertResult(
+            b"GET", b"/state/nodes", None, OK, []
+        )
+
+    def test_nodes(self):
+        """
+        The endpoint returns the free space on each node and the total
+        space taken up by its datasets, ``null`` for those not reported.
+        """
+        self.cluster_state_service.apply_changes([
+            NodeState(
+                hostname=u"192.0.2.101", free_space=4096,
+                dataset_usage={
+                    u"a": DatasetUsage(used=1024, available=2048),
+                    u"b": DatasetUsage(used=512, available=2048)}),
+            NodeState(hostname=u"192.0.2.102", applications=[]),
+        ])
+        response = [
+            {u"host": u"192.0.2.101", u"free_size": 4096,
+             u"used_size": 1536},
+            {u"host": u"192.0.2.102", u"free_size": None,
+             u"used_size": None},
+        ]
+        return self.assertResultItems(
+            b"GET", b"/state/nodes", None, OK, response
+        )
+
+RealTestsNodesStateAPI, MemoryTestsNodesStateAPI = buildIntegrationTests(
+    NodesStateTestsMixin, "NodesStateAPI", _build_app)
+
+
 class DatasetsFromDeploymentTests(SynchronousTestCase):
     """
     Tests for ``datasets_from_deployment``.
@@ -287,6 +287,15 @@ class NodeStateTests(SynchronousTestCase):
             NodeState(hostname=u"1.2.3.4", used_ports=None).used_ports,
             None)
 
+    def test_space_unknown_by_default(self):
+        """
+        A ``NodeState`` has ``dataset_usage`` and ``free_space`` set to
+        ``None``, indicating ignorance, unless they are given, so that
+        updates from agents which don't discover them leave them alone.
+        """
+        node = NodeState(hostname=u"1.2.3.4")
+        self.assertEqual((None, None), (node.dataset_usage, node.free_space))
+
 
 class NonManifestDatasetsInitTests(make_with_init_tests(
         record_type=NonManifestDatasets,
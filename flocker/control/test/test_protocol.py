@@ -33,7 +33,7 @@ from .._protocol import (
 from .._clusterstate import ClusterStateService
 from .. import (
     Deployment, Application, DockerImage, Node, NodeState, Manifestation,
-    Dataset, DeploymentState, NonManifestDatasets,
+    Dataset, DeploymentState, NonManifestDatasets, DatasetUsage,
 )
 from .._persistence import ConfigurationPersistenceService
 
@@ -97,7 +97,10 @@ NODE_STATE = NodeState(hostname=u'node1.example.com',
                        applications=[APP1, APP2],
                        used_ports=[1, 2],
                        manifestations={MANIFESTATION.dataset_id:
-                                       MANIFESTATION})
+                                       MANIFESTATION},
+                       dataset_usage={MANIFESTATION.dataset_id: DatasetUsage(
+                           used=10, available=20, compression_ratio=1.5)},
+                       free_space=1000)
 
 dataset = Dataset(dataset_id=unicode(uuid4()))
 NONMANIFEST = NonManifestDatasets(
@@ -620,6 +620,18 @@ StateDatasetsArraySchemaTests = build_schema_test(
         # missing path
         [{u"primary": u"10.0.0.1",
           u"dataset_id": u"x" * 36}],
+
+        # negative used_size
+        [{u"primary": u"10.0.0.1",
+          u"dataset_id": u"x" * 36,
+          u"path": u"/123",
+          u"used_size": -1}],
+
+        # fractional available_size
+        [{u"primary": u"10.0.0.1",
+          u"dataset_id": u"x" * 36,
+          u"path": u"/123",
+          u"available_size": 1.5}],
     ],
 
     passing_instances=[
@@ -642,6 +654,42 @@ StateDatasetsArraySchemaTests = build_schema_test(
           u"dataset_id": u"y" * 36,
           u"path": u"/123",
           u"maximum_size": 1024 * 1024 * 64}],
+
+        # space accounting
+        [{u"primary": u"10.0.0.1",
+          u"dataset_id": u"x" * 36,
+          u"path": u"/123",
+          u"used_size": 1024,
+          u"available_size": 0,
+          u"compression_ratio": 1.5}],
+    ]
+)
+
+StateNodesArraySchemaTests = build_schema_test(
+    name="StateNodesArraySchemaTests",
+    schema={'$ref': '/v1/endpoints.json#/definitions/state_nodes_array'},
+    schema_store=SCHEMAS,
+    failing_instances=[
+        # not an array
+        {},
+
+        # missing host
+        [{u"free_size": 1024, u"used_size": 1024}],
+
+        # missing free_size
+        [{u"host": u"10.0.0.1", u"used_size": 1024}],
+
+        # missing used_size
+        [{u"host": u"10.0.0.1", u"free_size": 1024}],
+
+        # negative free_size
+        [{u"host": u"10.0.0.1", u"free_size": -1, u"used_size": 1024}],
+    ],
+    passing_instances=[
+        [],
+        [{u"host": u"10.0.0.1", u"free_size": 1024, u"used_size": 0}],
+        # not reported
+        [{u"host": u"10.0.0.1", u"free_size": None, u"used_size": None}],
     ]
 )
 
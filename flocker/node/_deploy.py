@@ -15,16 +15,18 @@ from pyrsistent import PRecord, field
 
 from eliot import write_failure, Logger
 
-from twisted.internet.defer import gatherResults, fail, succeed
+from twisted.internet.defer import (
+    gatherResults, fail, succeed, DeferredSemaphore,
+)
 
 from ._docker import DockerClient, PortMap, Environment, Volume as DockerVolume
 from ..control._model import (
     Application, DatasetChanges, AttachedVolume, DatasetHandoff,
-    NodeState, DockerImage, Port, Link, Manifestation, Dataset,
+    NodeState, DockerImage, Port, Link, Manifestation, Dataset, DatasetUsage,
     pset_field,
     )
-from ..route import make_host_network, Proxy, OpenPort
-from ..volume._ipc import RemoteVolumeManager, standard_node
+from ..route import make_host_network, Proxy, OpenPort, AddressCache
+from ..volume._ipc import ssh_volume_manager
 from ..volume._model import VolumeSize
 from ..volume.service import VolumeName
 from ..common import gather_deferreds
@@ -32,6 +34,9 @@ from ..common import gather_deferreds
 
 _logger = Logger()
 
+# The maximum number of Docker images ``PullImages`` will download at once:
+MAXIMUM_CONCURRENT_PULLS = 4
+
 
 def _to_volume_name(dataset_id):
     """
@@ -271,6 +276,30 @@ def _link_environment(protocol, alias, local_port, hostname, remote_port):
     }
 
 
+@implementer(IStateChange)
+class PullImages(PRecord):
+    """
+    Make sure the given Docker images are available locally, ahead of the
+    applications which use them being started.
+
+    At most ``MAXIMUM_CONCURRENT_PULLS`` images are downloaded at once.
+    Failed pulls are logged but do not cause this change to fail; starting
+    the application will try to pull the image again.
+
+    :ivar images: A set of ``DockerImage`` instances to pull.
+    """
+    images = pset_field(DockerImage)
+
+    def run(self, deployer):
+        semaphore = DeferredSemaphore(MAXIMUM_CONCURRENT_PULLS)
+        pulls = []
+        for image in self.images:
+            pulls.append(semaphore.run(
+                deployer.docker_client.pull, image.full_name).addErrback(
+                    write_failure, _logger, u"flocker:p2pdeployer:pull"))
+        return gatherResults(pulls)
+
+
 @implementer(IStateChange)
 @attributes(["application"])
 class StopApplication(object):
@@ -345,10 +374,9 @@ class HandoffDataset(object):
     """
     def run(self, deployer):
         service = deployer.volume_service
-        destination = standard_node(self.hostname)
         return service.handoff(
             service.get(_to_volume_name(self.dataset.dataset_id)),
-            RemoteVolumeManager(destination))
+            deployer.remote_volume_manager(self.hostname), self.hostname)
 
 
 @implementer(IStateChange)
@@ -366,10 +394,9 @@ class PushDataset(object):
     """
     def run(self, deployer):
         service = deployer.volume_service
-        destination = standard_node(self.hostname)
         return service.push(
             service.get(_to_volume_name(self.dataset.dataset_id)),
-            RemoteVolumeManager(destination))
+            deployer.remote_volume_manager(self.hostname), self.hostname)
 
 
 @implementer(IStateChange)
@@ -389,16 +416,15 @@ class DeleteDataset(PRecord):
 
     def run(self, deployer):
         service = deployer.volume_service
-        d = service.enumerate()
-
-        def got_volumes(volumes):
-            deletions = []
-            for volume in volumes:
-                if volume.name.dataset_id == self.dataset.dataset_id:
-                    deletions.append(service.pool.destroy(volume).addErrback(
-                        write_failure, _logger, u"flocker:p2pdeployer:delete"))
-            return gatherResults(deletions)
-        d.addCallback(got_volumes)
+        d = service.volumes_for_dataset(self.dataset.dataset_id)
+        d.addCallback(service.destroy_many)
+
+        def destroyed(results):
+            for success, result in results:
+                if not success:
+                    write_failure(
+                        result, _logger, u"flocker:p2pdeployer:delete")
+        d.addCallback(destroyed)
         return d
 
 
@@ -408,22 +434,32 @@ class SetProxies(object):
     """
     Set the ports which will be forwarded to other nodes.
 
+    Only proxies which are not already configured are created and only
+    proxies which are no longer wanted are deleted, so traffic through
+    unchanged proxies is not disrupted.
+
     :ivar proxy: A collection of ``Port`` objects.
     """
     def run(self, deployer):
         results = []
         # XXX: The proxy manipulation operations are blocking. Convert to a
         # non-blocking API. See https://clusterhq.atlassian.net/browse/FLOC-320
-        for proxy in deployer.network.enumerate_proxies():
-            try:
-                deployer.network.delete_proxy(proxy)
-            except:
-                results.append(fail())
-        for proxy in self.ports:
-            try:
-                deployer.network.create_proxy_to(proxy.ip, proxy.port)
-            except:
-                results.append(fail())
+        existing = set(deployer.network.enumerate_proxies())
+        desired = set(self.ports)
+        try:
+            with deployer.network.transaction():
+                for proxy in existing - desired:
+                    try:
+                        deployer.network.delete_proxy(proxy)
+                    except:
+                        results.append(fail())
+                for proxy in desired - existing:
+                    try:
+                        deployer.network.create_proxy_to(proxy.ip, proxy.port)
+                    except:
+                        results.append(fail())
+        except:
+            results.append(fail())
         return gather_deferreds(results)
 
 
@@ -432,6 +468,8 @@ class OpenPorts(PRecord):
     """
     Set the ports which will have the firewall opened.
 
+    Only ports whose state needs to change are opened or closed.
+
     :ivar ports: A list of :class:`OpenPort`s.
     """
 
@@ -441,16 +479,22 @@ class OpenPorts(PRecord):
         results = []
         # XXX: The proxy manipulation operations are blocking. Convert to a
         # non-blocking API. See https://clusterhq.atlassian.net/browse/FLOC-320
-        for open_port in deployer.network.enumerate_open_ports():
-            try:
-                deployer.network.delete_open_port(open_port)
-            except:
-                results.append(fail())
-        for open_port in self.ports:
-            try:
-                deployer.network.open_port(open_port.port)
-            except:
-                results.append(fail())
+        existing = set(deployer.network.enumerate_open_ports())
+        desired = set(self.ports)
+        try:
+            with deployer.network.transaction():
+                for open_port in existing - desired:
+                    try:
+                        deployer.network.delete_open_port(open_port)
+                    except:
+                        results.append(fail())
+                for open_port in desired - existing:
+                    try:
+                        deployer.network.open_port(open_port.port)
+                    except:
+                        results.append(fail())
+        except:
+            results.append(fail())
         return gather_deferreds(results)
 
 
@@ -461,10 +505,16 @@ class P2PManifestationDeployer(_OldToNewDeployer):
 
     :ivar unicode hostname: The hostname of the node that this is running on.
     :ivar VolumeService volume_service: The volume manager for this node.
+    :ivar remote_volume_manager: A one-argument callable which returns an
+        ``IRemoteVolumeManager`` for the node with the given hostname, used
+        to push datasets to other nodes.
     """
-    def __init__(self, hostname, volume_service):
+    def __init__(self, hostname, volume_service, remote_volume_manager=None):
         self.hostname = hostname
         self.volume_service = volume_service
+        if remote_volume_manager is None:
+            remote_volume_manager = ssh_volume_manager
+        self.remote_volume_manager = remote_volume_manager
 
     def discover_local_state(self, local_state):
         """
@@ -477,16 +527,27 @@ class P2PManifestationDeployer(_OldToNewDeployer):
 
         def map_volumes_to_size(volumes):
             primary_manifestations = {}
+            usage = {}
             for volume in volumes:
                 if volume.node_id == self.volume_service.node_id:
                     # FLOC-1240 non-primaries should be added in too
                     path = volume.get_filesystem().get_path()
                     primary_manifestations[path] = (
                         volume.name.dataset_id, volume.size.maximum_size)
-            return primary_manifestations
+                if volume.usage is not None:
+                    # Copies of other nodes' datasets take up space here
+                    # too, so they are counted whoever owns them.
+                    dataset_usage = usage.get(volume.name.dataset_id)
+                    usage[volume.name.dataset_id] = DatasetUsage(
+                        used=volume.usage.used + (
+                            dataset_usage.used if dataset_usage else 0),
+                        available=volume.usage.available,
+                        compression_ratio=volume.usage.compression_ratio)
+            return primary_manifestations, usage
         volumes.addCallback(map_volumes_to_size)
 
-        def got_volumes(available_manifestations):
+        def got_volumes(result):
+            available_manifestations, usage = result
             manifestation_paths = {dataset_id: path for (path, (dataset_id, _))
                                    in available_manifestations.items()}
 
@@ -497,14 +558,19 @@ class P2PManifestationDeployer(_OldToNewDeployer):
                 for (dataset_id, maximum_size) in
                 available_manifestations.values())
 
-            return NodeState(
+            # For ZFS this is answered by the listing the enumeration took:
+            free_space = self.volume_service.pool.free_space()
+            free_space.addCallback(lambda free_space: NodeState(
                 hostname=self.hostname,
                 applications=None,
                 used_ports=None,
                 manifestations={manifestation.dataset_id: manifestation
                                 for manifestation in manifestations},
                 paths=manifestation_paths,
-            )
+                dataset_usage=usage,
+                free_space=free_space,
+            ))
+            return free_space
         volumes.addCallback(got_volumes)
         return volumes
 
@@ -525,8 +591,11 @@ class ApplicationNodeDeployer(_OldToNewDeployer):
         deployment operations. Default ``DockerClient``.
     :ivar INetwork network: The network routing API to use in
         deployment operations. Default is iptables-based implementation.
+    :ivar AddressCache address_cache: The addresses of other nodes, used as
+        the targets of proxies.  Default uses the system DNS configuration.
     """
-    def __init__(self, hostname, docker_client=None, network=None):
+    def __init__(self, hostname, docker_client=None, network=None,
+                 address_cache=None):
         self.hostname = hostname
         if docker_client is None:
             docker_client = DockerClient()
@@ -534,6 +603,10 @@ class ApplicationNodeDeployer(_OldToNewDeployer):
         if network is None:
             network = make_host_network()
         self.network = network
+        if address_cache is None:
+            from twisted.internet import reactor
+            address_cache = AddressCache(reactor)
+        self.address_cache = address_cache
 
     def discover_local_state(self, local_state):
         """
@@ -555,6 +628,9 @@ class ApplicationNodeDeployer(_OldToNewDeployer):
             ``NodeState.manifestations`` and ``NodeState.paths`` will not be
             filled in.
         """
+        # Start a new convergence iteration with a fresh view of the
+        # network configuration; it is reused until the next discovery.
+        self.network.refresh()
         if local_state.manifestations is None:
             # Without manifestations we don't know if local applications'
             # volumes are manifestations or not. Rather than return
@@ -663,11 +739,12 @@ class ApplicationNodeDeployer(_OldToNewDeployer):
 
         1. Change proxies to point to new addresses (should really be
            last, see https://clusterhq.atlassian.net/browse/FLOC-380)
-        2. Stop all relevant containers.
-        3. Handoff volumes.
-        4. Wait for volumes.
-        5. Create volumes.
-        6. Start and restart any relevant containers.
+        2. Pull the images of all containers which will be started.
+        3. Stop all relevant containers.
+        4. Handoff volumes.
+        5. Wait for volumes.
+        6. Create volumes.
+        7. Start and restart any relevant containers.
 
         :param NodeState local_state: The local state of the node.
         :param Deployment desired_configuration: The intended
@@ -684,6 +761,8 @@ class ApplicationNodeDeployer(_OldToNewDeployer):
         phases = []
 
         desired_proxies = set()
+        # The ports of proxies to nodes whose addresses are not known yet:
+        unresolved_ports = set()
         desired_open_ports = set()
         desired_node_applications = []
         for node in desired_configuration.nodes:
@@ -695,13 +774,25 @@ class ApplicationNodeDeployer(_OldToNewDeployer):
                             OpenPort(port=port.external_port))
             else:
                 for application in node.applications:
+                    if not application.ports:
+                        continue
+                    address = self.address_cache.lookup(node.hostname)
+                    if address is None:
+                        # The address is being resolved; leave the proxies
+                        # on these ports alone until a later iteration knows
+                        # it.
+                        unresolved_ports.update(
+                            port.external_port for port in application.ports)
+                        continue
                     for port in application.ports:
-                        # XXX: also need to do DNS resolution. See
-                        # https://clusterhq.atlassian.net/browse/FLOC-322
-                        desired_proxies.add(Proxy(ip=node.hostname,
+                        desired_proxies.add(Proxy(ip=address,
                                                   port=port.external_port))
 
-        if desired_proxies != set(self.network.enumerate_proxies()):
+        current_proxies = set(self.network.enumerate_proxies())
+        desired_proxies.update(
+            proxy for proxy in current_proxies
+            if proxy.port in unresolved_ports)
+        if desired_proxies != current_proxies:
             phases.append(SetProxies(ports=desired_proxies))
 
         if desired_open_ports != set(self.network.enumerate_open_ports()):
@@ -745,6 +836,11 @@ class ApplicationNodeDeployer(_OldToNewDeployer):
             for app in desired_node_applications
             if app.name in not_running
         ]
+        # Images needed by the containers we are going to (re)start; images
+        # shared by several applications are only pulled once.
+        images_to_pull = {
+            app.image for app in desired_node_applications
+            if app.name in start_names | not_running}
 
         applications_to_inspect = current_state & desired_local_state
         current_applications_dict = dict(zip(
@@ -771,6 +867,12 @@ class ApplicationNodeDeployer(_OldToNewDeployer):
                 sequence = Sequentially(changes=changes)
                 if sequence not in restart_containers:
                     restart_containers.append(sequence)
+                    images_to_pull.add(inspect_desired.image)
+
+        # Download images early, in parallel, so that starting containers
+        # later doesn't have to wait for them one at a time:
+        if images_to_pull:
+            phases.append(PullImages(images=images_to_pull))
 
         # Find any dataset that are moving to or from this node - or
         # that are being newly created by this new configuration.
@@ -942,13 +1044,16 @@ class P2PNodeDeployer(_OldToNewDeployer):
     sub-task of FLOC-1443.
     """
     def __init__(self, hostname, volume_service, docker_client=None,
-                 network=None):
+                 network=None, address_cache=None,
+                 remote_volume_manager=None):
         self.manifestations_deployer = P2PManifestationDeployer(
-            hostname, volume_service)
+            hostname, volume_service, remote_volume_manager)
         self.applications_deployer = ApplicationNodeDeployer(
-            hostname, docker_client, network)
+            hostname, docker_client, network, address_cache)
         self.hostname = hostname
         self.volume_service = self.manifestations_deployer.volume_service
+        self.remote_volume_manager = (
+            self.manifestations_deployer.remote_volume_manager)
         self.docker_client = self.applications_deployer.docker_client
         self.network = self.applications_deployer.network
 
@@ -7,6 +7,9 @@ Docker API client.
 
 from __future__ import absolute_import
 
+from httplib import HTTPConnection
+from socket import socket, AF_UNIX, SOCK_STREAM
+from threading import Lock
 from time import sleep
 
 from zope.interface import Interface, implementer
@@ -15,6 +18,9 @@ from docker import Client
 from docker.errors import APIError
 from docker.utils import create_host_config
 
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool
+
 from pyrsistent import field, PRecord
 
 from twisted.python.components import proxyForInterface
@@ -217,6 +223,20 @@ class IDockerClient(Interface):
         :return: ``Deferred`` firing with ``set`` of :class:`Unit`.
         """
 
+    def pull(image_name):
+        """
+        Make sure the given image is available locally, downloading it if
+        it is missing.
+
+        Images which are already present are not downloaded again, so this
+        is cheap to call for images that were pulled previously.
+
+        :param unicode image_name: The Docker image to make available.
+
+        :return: ``Deferred`` that fires once the image is available
+            locally.
+        """
+
 
 @implementer(IDockerClient)
 class FakeDockerClient(object):
@@ -225,6 +245,7 @@ class FakeDockerClient(object):
     The state the the simulated units is stored in memory.
 
     :ivar dict _units: See ``units`` of ``__init__``\ .
+    :ivar set pulled_images: The names of images which have been pulled.
     """
 
     def __init__(self, units=None):
@@ -237,6 +258,7 @@ class FakeDockerClient(object):
         if units is None:
             units = {}
         self._units = units
+        self.pulled_images = set()
 
     def add(self, unit_name, image_name, ports=frozenset(), environment=None,
             volumes=frozenset(), mem_limit=None, cpu_shares=None,
@@ -269,11 +291,96 @@ class FakeDockerClient(object):
         units = set(self._units.values())
         return succeed(units)
 
+    def pull(self, image_name):
+        self.pulled_images.add(image_name)
+        return succeed(None)
+
 
 # Basic namespace for Flocker containers:
 BASE_NAMESPACE = u"flocker--"
 BASE_DOCKER_API_URL = u'unix://var/run/docker.sock'
 
+# ``DockerClient`` makes its blocking API calls from the reactor thread pool
+# (see ``deferToThread``), which by default has at most 10 threads. Keeping
+# that many connections to the Docker socket open lets each of those threads
+# reuse an existing connection rather than opening a new one per request.
+DOCKER_CONNECTION_POOL_SIZE = 10
+
+
+class _UnixHTTPConnection(HTTPConnection, object):
+    """
+    An HTTP connection over a UNIX socket.
+
+    :ivar bytes _socket_path: The path of the UNIX socket to connect to.
+    """
+    def __init__(self, socket_path, timeout):
+        HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self._socket_path)
+        self.sock = sock
+
+
+class _UnixHTTPConnectionPool(HTTPConnectionPool):
+    """
+    A thread-safe pool of persistent HTTP connections to a UNIX socket.
+
+    :ivar bytes _socket_path: The path of the UNIX socket to connect to.
+    """
+    def __init__(self, socket_path, timeout, maxsize):
+        HTTPConnectionPool.__init__(
+            self, "localhost", timeout=timeout, maxsize=maxsize)
+        self._socket_path = socket_path
+
+    def _new_conn(self):
+        self.num_connections += 1
+        return _UnixHTTPConnection(
+            self._socket_path, self.timeout.connect_timeout)
+
+
+class _UnixAdapter(HTTPAdapter):
+    """
+    A ``requests`` transport adapter which sends all requests for
+    ``http+unix://`` URLs over a single pool of keep-alive connections.
+
+    ``docker-py``'s own adapter keeps a separate single-connection pool for
+    every distinct URL, so e.g. inspecting 200 containers opens 200
+    connections, and concurrent requests for the same URL open throwaway
+    connections.
+
+    :ivar bytes _base_url: The ``http+unix://`` URL of the socket; request
+        URLs consist of this followed by the path to request.
+    :ivar _UnixHTTPConnectionPool _pool: The connection pool, or ``None``
+        if it has not been created yet.
+    """
+    def __init__(self, base_url, timeout, pool_size):
+        self._base_url = base_url
+        self._timeout = timeout
+        self._pool_size = pool_size
+        self._pool = None
+        self._pool_lock = Lock()
+        super(_UnixAdapter, self).__init__()
+
+    def get_connection(self, url, proxies=None):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = _UnixHTTPConnectionPool(
+                    self._base_url[len(u"http+unix:/"):],
+                    self._timeout, self._pool_size)
+            return self._pool
+
+    def request_url(self, request, proxies):
+        return request.url[len(self._base_url):]
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
 
 @implementer(IDockerClient)
 class DockerClient(object):
@@ -284,13 +391,20 @@ class DockerClient(object):
     use a thread pool. See https://clusterhq.atlassian.net/browse/FLOC-718
     for using a custom thread pool.
 
+    Connections to a local Docker socket are kept open and shared between
+    the threads, up to ``pool_size`` of them.
+
     :ivar unicode namespace: A namespace prefix to add to container names
         so we don't clobber other applications interacting with Docker.
     """
     def __init__(self, namespace=BASE_NAMESPACE,
-                 base_url=BASE_DOCKER_API_URL):
+                 base_url=BASE_DOCKER_API_URL,
+                 pool_size=DOCKER_CONNECTION_POOL_SIZE):
         self.namespace = namespace
         self._client = Client(version="1.15", base_url=base_url)
+        if self._client.base_url.startswith(u"http+unix://"):
+            self._client.mount(u"http+unix://", _UnixAdapter(
+                self._client.base_url, self._client._timeout, pool_size))
 
     def _to_container_name(self, unit_name):
         """
@@ -436,7 +550,9 @@ class DockerClient(object):
                 _create()
             except APIError as e:
                 if e.response.status_code == NOT_FOUND:
-                    # Image was not found, so we need to pull it first:
+                    # Image was not found, so we need to pull it first. The
+                    # deployer normally does this ahead of time (see
+                    # ``pull``), but the image may have been removed since.
                     self._client.pull(image_name)
                     _create()
                 else:
@@ -480,6 +596,17 @@ class DockerClient(object):
         container_name = self._to_container_name(unit_name)
         return deferToThread(self._blocking_exists, container_name)
 
+    def pull(self, image_name):
+        def _pull():
+            try:
+                self._client.inspect_image(image_name)
+            except APIError as e:
+                if e.response.status_code == NOT_FOUND:
+                    self._client.pull(image_name)
+                else:
+                    raise
+        return deferToThread(_pull)
+
     def remove(self, unit_name):
         container_name = self._to_container_name(unit_name)
 
@@ -523,6 +650,9 @@ class DockerClient(object):
     def list(self):
         def _list():
             result = set()
+            # Containers often share images, so only inspect each image
+            # once:
+            image_environments = {}
             ids = [d[u"Id"] for d in
                    self._client.containers(quiet=True, all=True)]
             for i in ids:
@@ -561,10 +691,12 @@ class DockerClient(object):
                 # Retrieve environment variables for this container,
                 # disregarding any environment variables that are part
                 # of the image, rather than supplied in the configuration.
-                image_data = self._client.inspect_image(image)
+                if image not in image_environments:
+                    image_data = self._client.inspect_image(image)
+                    image_environments[image] = image_data[u"Config"]["Env"]
+                image_environment = image_environments[image]
                 unit_environment = []
                 container_environment = data[u"Config"][u"Env"]
-                image_environment = image_data[u"Config"]["Env"]
                 for environment in container_environment:
                     if environment not in image_environment:
                         env_key, env_value = environment.split('=', 1)
@@ -16,6 +16,8 @@ from pyrsistent import PRecord, field
 
 from zope.interface import implementer
 
+from twisted.internet.endpoints import SSL4ClientEndpoint
+from twisted.python.filepath import FilePath
 from twisted.python.usage import Options, UsageError
 
 from ..control._config import (
@@ -26,6 +28,19 @@ from ..volume.service import (
     ICommandLineVolumeScript, VolumeScript)
 
 from ..volume.script import flocker_volume_options
+from ..volume._amp import (
+    AMPRemoteVolumeManagers, VolumeTransferService,
+    volume_transfer_tls_options,
+)
+from ..volume._ipc import ssh_volume_manager
+from ..volume._transfer import ThreadedTransfers
+from ..volume._retention import (
+    DEFAULT_PRUNE_INTERVAL, SnapshotPruningService,
+)
+from ..common import SSHControlMasterService
+from ..route import (
+    make_host_network, make_ipset_network, make_userspace_network,
+)
 from ..common.script import (
     ICommandLineScript,
     flocker_standard_options, FlockerScriptRunner, main_for_service)
@@ -226,6 +241,15 @@ def flocker_reportstate_main():
     ).main()
 
 
+# The ``INetwork`` providers ``flocker-zfs-agent --network`` selects from,
+# each a one-argument callable taking the reactor.
+_NETWORKS = {
+    "iptables": lambda reactor: make_host_network(),
+    "ipset": lambda reactor: make_ipset_network(),
+    "userspace": make_userspace_network,
+}
+
+
 @flocker_standard_options
 @flocker_volume_options
 class ZFSAgentOptions(Options):
@@ -243,6 +267,28 @@ class ZFSAgentOptions(Options):
     optParameters = [
         ["destination-port", "p", 4524,
          "The port on the control service to connect to.", int],
+        ["volume-listen", None, None,
+         "A TCP port on which to accept TLS volume transfers from other "
+         "nodes' agents.", int],
+        ["volume-connect", None, None,
+         "The TCP port on which other nodes' agents accept volume "
+         "transfers.  If not given volumes are pushed over multiplexed SSH "
+         "connections.", int],
+        ["volume-certificate", None, None,
+         "A PEM file containing this node's certificate and private key, "
+         "presented to other nodes' agents by volume transfers.",
+         FilePath],
+        ["volume-certificate-authority", None, None,
+         "A PEM file containing the certificate of the cluster's "
+         "certificate authority.  Volume transfers are only made with "
+         "agents presenting a certificate signed by it.", FilePath],
+        ["snapshot-prune-interval", None, DEFAULT_PRUNE_INTERVAL,
+         "Seconds between destroying the snapshots of volumes which are no "
+         "longer needed for incremental pushes.", float],
+        ["network", None, "iptables",
+         "How traffic for applications is routed: \"iptables\" proxies with "
+         "NAT rules, \"ipset\" also keeps open ports in an ipset, and "
+         "\"userspace\" proxies in this process where NAT is unavailable."],
     ]
 
     def parseArgs(self, hostname, host):
@@ -252,6 +298,19 @@ class ZFSAgentOptions(Options):
         self["hostname"] = unicode(hostname, "ascii")
         self["destination-host"] = unicode(host, "ascii")
 
+    def postOptions(self):
+        if self["network"] not in _NETWORKS:
+            raise UsageError(
+                "--network must be one of: " + ", ".join(sorted(_NETWORKS)))
+        transfers = (self["volume-listen"] is not None or
+                     self["volume-connect"] is not None)
+        certificates = (self["volume-certificate"] is not None and
+                        self["volume-certificate-authority"] is not None)
+        if transfers and not certificates:
+            raise UsageError(
+                "--volume-listen and --volume-connect require "
+                "--volume-certificate and --volume-certificate-authority.")
+
 
 @implementer(ICommandLineVolumeScript)
 class ZFSAgentScript(object):
@@ -262,11 +321,41 @@ class ZFSAgentScript(object):
     def main(self, reactor, options, volume_service):
         host = options["destination-host"]
         port = options["destination-port"]
+        control_masters = SSHControlMasterService(reactor)
+        tls_options = None
+        if options["volume-certificate"] is not None:
+            tls_options = volume_transfer_tls_options(
+                options["volume-certificate"],
+                options["volume-certificate-authority"])
+        if options["volume-connect"] is not None:
+            remote_volume_manager = AMPRemoteVolumeManagers(
+                reactor, lambda hostname: SSL4ClientEndpoint(
+                    reactor, hostname, options["volume-connect"],
+                    tls_options)
+            ).get
+        else:
+            # Queries over SSH block, so they run in a thread pool of their
+            # own rather than the reactor thread or behind running pushes.
+            remote_volume_manager = partial(
+                ssh_volume_manager, control_masters=control_masters,
+                transfers=ThreadedTransfers(reactor))
         deployer = P2PNodeDeployer(options["hostname"].decode("ascii"),
-                                   volume_service)
+                                   volume_service,
+                                   network=_NETWORKS[options["network"]](
+                                       reactor),
+                                   remote_volume_manager=remote_volume_manager)
         loop = AgentLoopService(reactor=reactor, deployer=deployer,
                                 host=host, port=port)
         volume_service.setServiceParent(loop)
+        control_masters.setServiceParent(loop)
+        SnapshotPruningService(
+            reactor, volume_service, options["snapshot-prune-interval"]
+        ).setServiceParent(loop)
+        if options["volume-listen"] is not None:
+            VolumeTransferService(
+                reactor, volume_service, options["volume-listen"],
+                tls_options,
+            ).setServiceParent(loop)
         return main_for_service(reactor, loop)
 
 
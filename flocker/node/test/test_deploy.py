@@ -5,9 +5,12 @@ Tests for ``flocker.node._deploy``.
 """
 
 from uuid import uuid4
+from contextlib import contextmanager
 
 from zope.interface.verify import verifyObject
 
+from ipaddr import IPv4Address
+
 from eliot.testing import validate_logging
 
 from pyrsistent import pmap, pset
@@ -15,6 +18,8 @@ from pyrsistent import pmap, pset
 from twisted.internet.defer import fail, FirstError, succeed, Deferred
 from twisted.trial.unittest import SynchronousTestCase, TestCase
 from twisted.python.filepath import FilePath
+from twisted.internet.task import Clock
+from twisted.names.hosts import Resolver as HostsResolver
 
 from .. import (
     P2PNodeDeployer, change_node_state, ApplicationNodeDeployer,
@@ -30,7 +35,7 @@ from .._deploy import (
     IStateChange, Sequentially, InParallel, StartApplication, StopApplication,
     CreateDataset, WaitForDataset, HandoffDataset, SetProxies, PushDataset,
     ResizeDataset, _link_environment, _to_volume_name,
-    DeleteDataset, OpenPorts
+    DeleteDataset, OpenPorts, PullImages
 )
 from ...testtools import CustomException
 from .. import _deploy
@@ -38,7 +43,7 @@ from ...control._model import AttachedVolume, Dataset, Manifestation
 from .._docker import (
     FakeDockerClient, AlreadyExists, Unit, PortMap, Environment,
     DockerClient, Volume as DockerVolume)
-from ...route import Proxy, OpenPort, make_memory_network
+from ...route import Proxy, OpenPort, make_memory_network, AddressCache
 from ...route._iptables import HostNetwork
 from ...volume.service import Volume, VolumeName
 from ...volume._model import VolumeSize
@@ -147,6 +152,10 @@ HandoffVolumeIStateChangeTests = make_istatechange_tests(
 PushVolumeIStateChangeTests = make_istatechange_tests(
     PushDataset, dict(dataset=1, hostname=b"123"),
     dict(dataset=2, hostname=b"123"))
+PullImagesIStateChangeTests = make_istatechange_tests(
+    PullImages,
+    dict(images=[DockerImage.from_string(u"busybox")]),
+    dict(images=[DockerImage.from_string(u"postgres")]))
 DeleteDatasetTests = make_istatechange_tests(
     DeleteDataset,
     dict(dataset=Dataset(dataset_id=unicode(uuid4()))),
@@ -663,8 +672,99 @@ class StopApplicationTests(SynchronousTestCase):
         self.assertIs(None, result)
 
 
+class PullImagesTests(SynchronousTestCase):
+    """
+    Tests for ``PullImages``.
+    """
+    def test_pulls(self):
+        """
+        ``PullImages.run()`` pulls all of its images using the deployer's
+        Docker client.
+        """
+        fake_docker = FakeDockerClient()
+        api = ApplicationNodeDeployer(u'example.com',
+                                      docker_client=fake_docker,
+                                      network=make_memory_network())
+        images = [DockerImage.from_string(u"clusterhq/flocker:release-14.0"),
+                  DockerImage.from_string(u"clusterhq/postgresql:9.1")]
+        self.successResultOf(PullImages(images=images).run(api))
+        self.assertEqual({image.full_name for image in images},
+                         fake_docker.pulled_images)
+
+    def test_bounded_concurrency(self):
+        """
+        ``PullImages.run()`` pulls at most ``MAXIMUM_CONCURRENT_PULLS`` images
+        at a time, starting another pull when an earlier one finishes.
+        """
+        pulling = []
+
+        class SlowDockerClient(FakeDockerClient):
+            def pull(self, image_name):
+                d = Deferred()
+                pulling.append(d)
+                return d
+
+        api = ApplicationNodeDeployer(u'example.com',
+                                      docker_client=SlowDockerClient(),
+                                      network=make_memory_network())
+        images = [DockerImage(repository=u"image%d" % (i,))
+                  for i in range(_deploy.MAXIMUM_CONCURRENT_PULLS + 1)]
+        result = PullImages(images=images).run(api)
+        started = len(pulling)
+        pulling[0].callback(None)
+        self.assertEqual(
+            (_deploy.MAXIMUM_CONCURRENT_PULLS,
+             _deploy.MAXIMUM_CONCURRENT_PULLS + 1),
+            (started, len(pulling)))
+        for d in pulling[1:]:
+            d.callback(None)
+        self.successResultOf(result)
+
+    @validate_logging(
+        lambda test, logger: logger.flush_tracebacks(CustomException))
+    def test_failed_pull(self, logger):
+        """
+        A failed pull does not result in a failed result from
+        ``PullImages.run()``, and other images are still pulled.
+
+        The traceback is, however, logged.
+        """
+        class BrokenDockerClient(FakeDockerClient):
+            def pull(self, image_name):
+                if image_name == u"broken:latest":
+                    return fail(CustomException())
+                return FakeDockerClient.pull(self, image_name)
+
+        fake_docker = BrokenDockerClient()
+        api = ApplicationNodeDeployer(u'example.com',
+                                      docker_client=fake_docker,
+                                      network=make_memory_network())
+        self.patch(_deploy, "_logger", logger)
+        images = [DockerImage.from_string(u"broken"),
+                  DockerImage.from_string(u"working")]
+        self.successResultOf(PullImages(images=images).run(api))
+        self.assertEqual({u"working:latest"}, fake_docker.pulled_images)
+
+
 # This models an application that has a volume.
 
+def make_address_cache(case, addresses):
+    """
+    Create an ``AddressCache`` which resolves hostnames using a hosts file.
+
+    :param TestCase case: The test which will use the cache.
+    :param dict addresses: Map hostnames to the IPv4 addresses the cache will
+        resolve them to.
+
+    :return: An ``AddressCache``.
+    """
+    hosts = FilePath(case.mktemp())
+    hosts.setContent(b"".join(
+        b"%s %s\n" % (address.encode("ascii"), hostname.encode("ascii"))
+        for hostname, address in addresses.items()))
+    return AddressCache(Clock(), HostsResolver(file=hosts.path))
+
+
 APPLICATION_WITH_VOLUME_NAME = b"psql-clusterhq"
 DATASET_ID = unicode(uuid4())
 DATASET = Dataset(dataset_id=DATASET_ID)
@@ -1657,6 +1757,22 @@ class ApplicationNodeDeployerDiscoverNodeConfigurationTests(
             state
         )
 
+    def test_discover_refreshes_network(self):
+        """
+        ``discover_local_state`` refreshes the deployer's ``INetwork``
+        provider so that each convergence iteration sees the current network
+        configuration.
+        """
+        refreshes = []
+        self.network.refresh = lambda: refreshes.append(None)
+        api = ApplicationNodeDeployer(
+            u'example.com',
+            docker_client=FakeDockerClient(),
+            network=self.network
+        )
+        self.successResultOf(api.discover_local_state(EMPTY_NODESTATE))
+        self.assertEqual([None], refreshes)
+
     def test_discover_application_restart_policy(self):
         """
         An ``Application`` with the appropriate ``IRestartPolicy`` is
@@ -1720,6 +1836,8 @@ class P2PManifestationDeployerDiscoveryTests(SynchronousTestCase):
         """
         Applications and ports are left as ``None`` in discovery results.
         """
+        self.patch(self.volume_service.pool, "free_space",
+                   lambda: succeed(1234))
         deployer = P2PManifestationDeployer(
             u'example.com', self.volume_service)
         self.assertEqual(
@@ -1727,7 +1845,8 @@ class P2PManifestationDeployerDiscoveryTests(SynchronousTestCase):
                 EMPTY_NODESTATE)),
             NodeState(hostname=deployer.hostname,
                       manifestations={}, paths={},
-                      applications=None, used_ports=None))
+                      applications=None, used_ports=None,
+                      dataset_usage={}, free_space=1234))
 
     def _setup_datasets(self):
         """
@@ -1781,6 +1900,39 @@ class P2PManifestationDeployerDiscoveryTests(SynchronousTestCase):
                  self.DATASET_ID2)).get_filesystem().get_path()},
             self.successResultOf(d).paths)
 
+    def test_discover_usage(self):
+        """
+        The space taken up by each dataset is added to
+        ``NodeState.dataset_usage``, including that of copies of datasets
+        owned by other nodes.
+        """
+        self.successResultOf(self.volume_service.create(
+            self.volume_service.get(_to_volume_name(self.DATASET_ID))
+        )).get_filesystem().get_path().child(b"file").setContent(b"x" * 10)
+        remote = Volume(node_id=unicode(uuid4()),
+                        name=_to_volume_name(self.DATASET_ID2),
+                        service=self.volume_service)
+        self.successResultOf(self.volume_service.pool.create(remote))
+        api = P2PManifestationDeployer(u'example.com', self.volume_service)
+        usage = self.successResultOf(
+            api.discover_local_state(EMPTY_NODESTATE)).dataset_usage
+        self.assertEqual(
+            {self.DATASET_ID: 10, self.DATASET_ID2: 0},
+            {dataset_id: dataset_usage.used
+             for (dataset_id, dataset_usage) in usage.items()})
+
+    def test_discover_free_space(self):
+        """
+        The free space in the storage pool is reported as
+        ``NodeState.free_space``.
+        """
+        self.patch(self.volume_service.pool, "free_space",
+                   lambda: succeed(1234))
+        api = self._setup_datasets()
+        self.assertEqual(
+            1234, self.successResultOf(
+                api.discover_local_state(EMPTY_NODESTATE)).free_space)
+
     def test_discover_manifestation_with_size(self):
         """
         Manifestation with a locally configured size have their
@@ -1847,7 +1999,9 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         api = P2PNodeDeployer(u'node2.example.com',
                               create_volume_service(self),
                               docker_client=fake_docker,
-                              network=make_memory_network())
+                              network=make_memory_network(),
+                              address_cache=make_address_cache(
+                                  self, {u'node1.example.com': u'192.0.2.1'}))
         expected_destination_port = 1001
         expected_destination_host = u'node1.example.com'
         port = Port(internal_port=3306,
@@ -1871,11 +2025,103 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             self.successResultOf(api.discover_local_state(
                 NodeState(hostname=api.hostname))),
             desired_configuration=desired, current_cluster_state=EMPTY)
-        proxy = Proxy(ip=expected_destination_host,
+        proxy = Proxy(ip=IPv4Address(u'192.0.2.1'),
                       port=expected_destination_port)
         expected = Sequentially(changes=[SetProxies(ports=frozenset([proxy]))])
         self.assertEqual(expected, result)
 
+    def test_proxy_unresolved(self):
+        """
+        ``P2PNodeDeployer.calculate_necessary_state_changes`` leaves the
+        existing proxies on the ports of a node's applications alone if the
+        address of that node has not been resolved yet.
+        """
+        network = make_memory_network()
+        network.create_proxy_to(ip=u'192.0.2.100', port=1001)
+        api = P2PNodeDeployer(u'node2.example.com',
+                              create_volume_service(self),
+                              docker_client=FakeDockerClient(),
+                              network=network,
+                              address_cache=make_address_cache(self, {}))
+        application = Application(
+            name=b'mysql-hybridcluster',
+            image=DockerImage.from_string(u'clusterhq/mysql'),
+            ports=frozenset([Port(internal_port=3306, external_port=1001)]),
+        )
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([application]))]))
+        result = api.calculate_necessary_state_changes(
+            self.successResultOf(api.discover_local_state(
+                NodeState(hostname=api.hostname))),
+            desired_configuration=desired, current_cluster_state=EMPTY)
+        self.assertEqual(Sequentially(changes=[]), result)
+
+    def test_proxy_unresolved_others_changed(self):
+        """
+        ``P2PNodeDeployer.calculate_necessary_state_changes`` still changes
+        the proxies which don't belong to a node whose address has not been
+        resolved yet, keeping the existing proxies of that node.
+        """
+        network = make_memory_network()
+        network.create_proxy_to(ip=IPv4Address(u'192.0.2.100'), port=1001)
+        network.create_proxy_to(ip=IPv4Address(u'192.0.2.101'), port=1003)
+        api = P2PNodeDeployer(u'node2.example.com',
+                              create_volume_service(self),
+                              docker_client=FakeDockerClient(),
+                              network=network,
+                              address_cache=make_address_cache(
+                                  self, {u'node3.example.com': u'192.0.2.3'}))
+
+        def application(name, port):
+            return Application(
+                name=name,
+                image=DockerImage.from_string(u'clusterhq/mysql'),
+                ports=frozenset([Port(internal_port=3306,
+                                      external_port=port)]))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([application(b'mysql1', 1001)])),
+            Node(hostname=u'node3.example.com',
+                 applications=frozenset([application(b'mysql3', 1002)])),
+        ]))
+        result = api.calculate_necessary_state_changes(
+            self.successResultOf(api.discover_local_state(
+                NodeState(hostname=api.hostname))),
+            desired_configuration=desired, current_cluster_state=EMPTY)
+        expected = Sequentially(changes=[SetProxies(ports=frozenset([
+            Proxy(ip=IPv4Address(u'192.0.2.100'), port=1001),
+            Proxy(ip=IPv4Address(u'192.0.2.3'), port=1002),
+        ]))])
+        self.assertEqual(expected, result)
+
+    def test_proxy_unchanged_address(self):
+        """
+        ``P2PNodeDeployer.calculate_necessary_state_changes`` does not change
+        proxies whose target is the resolved address of the node.
+        """
+        network = make_memory_network()
+        network.create_proxy_to(ip=IPv4Address(u'192.0.2.1'), port=1001)
+        api = P2PNodeDeployer(u'node2.example.com',
+                              create_volume_service(self),
+                              docker_client=FakeDockerClient(),
+                              network=network,
+                              address_cache=make_address_cache(
+                                  self, {u'node1.example.com': u'192.0.2.1'}))
+        application = Application(
+            name=b'mysql-hybridcluster',
+            image=DockerImage.from_string(u'clusterhq/mysql'),
+            ports=frozenset([Port(internal_port=3306, external_port=1001)]),
+        )
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([application]))]))
+        result = api.calculate_necessary_state_changes(
+            self.successResultOf(api.discover_local_state(
+                NodeState(hostname=api.hostname))),
+            desired_configuration=desired, current_cluster_state=EMPTY)
+        self.assertEqual(Sequentially(changes=[]), result)
+
     def test_proxy_empty(self):
         """
         ``P2PNodeDeployer.calculate_necessary_state_changes`` returns a
@@ -2024,11 +2270,36 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
                 NodeState(hostname=api.hostname))),
             desired_configuration=desired,
             current_cluster_state=EMPTY)
-        expected = Sequentially(changes=[InParallel(
-            changes=[StartApplication(application=application,
-                                      hostname="node.example.com")])])
+        expected = Sequentially(changes=[
+            PullImages(images=[application.image]),
+            InParallel(changes=[StartApplication(
+                application=application, hostname="node.example.com")])])
         self.assertEqual(expected, result)
 
+    def test_shared_image_pulled_once(self):
+        """
+        ``P2PNodeDeployer.calculate_necessary_state_changes`` pulls an image
+        only once even if several applications being started use it.
+        """
+        api = P2PNodeDeployer(u'node.example.com', create_volume_service(self),
+                              docker_client=FakeDockerClient(units={}),
+                              network=make_memory_network())
+        image = DockerImage(repository=u'clusterhq/flocker',
+                            tag=u'release-14.0')
+        applications = [Application(name=u'app1', image=image),
+                        Application(name=u'app2', image=image)]
+
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node.example.com',
+                 applications=frozenset(applications)),
+        ]))
+        result = api.calculate_necessary_state_changes(
+            self.successResultOf(api.discover_local_state(
+                NodeState(hostname=api.hostname))),
+            desired_configuration=desired,
+            current_cluster_state=EMPTY)
+        self.assertEqual(PullImages(images=[image]), result.changes[0])
+
     def test_only_this_node(self):
         """
         ``P2PNodeDeployer.calculate_necessary_state_changes`` does not specify
@@ -2177,6 +2448,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         volume = APPLICATION_WITH_VOLUME.volume
 
         expected = Sequentially(changes=[
+            PullImages(images=[APPLICATION_WITH_VOLUME.image]),
             InParallel(changes=[CreateDataset(dataset=volume.dataset)]),
             InParallel(changes=[StartApplication(
                 application=APPLICATION_WITH_VOLUME,
@@ -2324,6 +2596,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         volume = APPLICATION_WITH_VOLUME.volume
 
         expected = Sequentially(changes=[
+            PullImages(images=[APPLICATION_WITH_VOLUME.image]),
             InParallel(changes=[WaitForDataset(dataset=volume.dataset)]),
             InParallel(changes=[ResizeDataset(dataset=volume.dataset)]),
             InParallel(changes=[StartApplication(
@@ -2526,6 +2799,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         )
 
         expected = Sequentially(changes=[
+            PullImages(images=[APPLICATION_WITH_VOLUME_SIZE.image]),
             InParallel(
                 changes=[ResizeDataset(
                     dataset=APPLICATION_WITH_VOLUME_SIZE.volume.dataset,
@@ -2747,6 +3021,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         volume = APPLICATION_WITH_VOLUME_SIZE.volume
 
         expected = Sequentially(changes=[
+            PullImages(images=[APPLICATION_WITH_VOLUME_SIZE.image]),
             InParallel(changes=[WaitForDataset(dataset=volume.dataset)]),
             InParallel(changes=[ResizeDataset(dataset=volume.dataset)]),
             InParallel(changes=[StartApplication(
@@ -2787,11 +3062,13 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             desired_configuration=desired,
             current_cluster_state=EMPTY)
 
-        expected = Sequentially(changes=[InParallel(changes=[
-            Sequentially(changes=[StopApplication(application=application),
-                                  StartApplication(application=application,
-                                                   hostname="n.example.com")]),
-        ])])
+        expected = Sequentially(changes=[
+            PullImages(images=[application.image]),
+            InParallel(changes=[Sequentially(changes=[
+                StopApplication(application=application),
+                StartApplication(application=application,
+                                 hostname="n.example.com")])]),
+        ])
         self.assertEqual(expected, result)
 
     def test_not_local_not_running_applications_stopped(self):
@@ -2907,6 +3184,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         )
 
         expected = Sequentially(changes=[
+            PullImages(images=[another_application.image]),
             InParallel(changes=[PushDataset(
                 dataset=volume.dataset, hostname=another_node.hostname)]),
             InParallel(changes=[StopApplication(
@@ -2979,6 +3257,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         )
 
         expected = Sequentially(changes=[
+            PullImages(images=[new_postgres_app.image]),
             InParallel(changes=[
                 CreateDataset(dataset=new_postgres_app.volume.dataset)]),
             InParallel(changes=[
@@ -3039,13 +3318,14 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             current_cluster_state=EMPTY,
         )
 
-        expected = Sequentially(changes=[InParallel(changes=[
-            Sequentially(changes=[
+        expected = Sequentially(changes=[
+            PullImages(images=[new_postgres_app.image]),
+            InParallel(changes=[Sequentially(changes=[
                 StopApplication(application=old_postgres_app),
                 StartApplication(application=new_postgres_app,
                                  hostname="node1.example.com")
                 ]),
-        ])])
+            ])])
 
         self.assertEqual(expected, result)
 
@@ -3114,6 +3394,7 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
 
         expected = Sequentially(changes=[
             OpenPorts(ports=[OpenPort(port=50433)]),
+            PullImages(images=[new_postgres_app.image]),
             InParallel(changes=[
                 Sequentially(changes=[
                     StopApplication(application=old_postgres_app),
@@ -3184,13 +3465,14 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             current_cluster_state=EMPTY,
         )
 
-        expected = Sequentially(changes=[InParallel(changes=[
-            Sequentially(changes=[
+        expected = Sequentially(changes=[
+            PullImages(images=[new_wordpress_app.image]),
+            InParallel(changes=[Sequentially(changes=[
                 StopApplication(application=old_wordpress_app),
                 StartApplication(application=new_wordpress_app,
                                  hostname="node1.example.com")
                 ]),
-        ])])
+            ])])
 
         self.assertEqual(expected, result)
 
@@ -3543,6 +3825,15 @@ class DeployerCalculateNecessaryStateChangesDatasetOnlyTests(
         self.assertEqual(expected, changes)
 
 
+def failing_transaction():
+    """
+    An ``INetwork.transaction`` replacement which fails to apply the changes
+    made inside it.
+    """
+    yield
+    raise CustomException()
+
+
 class SetProxiesTests(SynchronousTestCase):
     """
     Tests for ``SetProxies``.
@@ -3611,6 +3902,28 @@ class SetProxiesTests(SynchronousTestCase):
             set(fake_network.enumerate_proxies())
         )
 
+    def test_unchanged_proxies_untouched(self):
+        """
+        Proxies which exist on the node and which are still required are
+        neither deleted nor re-created.
+        """
+        fake_network = make_memory_network()
+        required_proxy = fake_network.create_proxy_to(ip=u'192.0.2.101',
+                                                      port=3306)
+        calls = []
+        fake_network.delete_proxy = lambda proxy: calls.append(proxy)
+        fake_network.create_proxy_to = lambda ip, port: calls.append(
+            (ip, port))
+
+        api = P2PNodeDeployer(
+            u'example.com',
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = SetProxies(ports=[required_proxy]).run(api)
+        self.successResultOf(d)
+        self.assertEqual([], calls)
+
     def test_delete_proxy_errors_as_errbacks(self):
         """
         Exceptions raised in `delete_proxy` operations are reported as
@@ -3677,6 +3990,29 @@ class SetProxiesTests(SynchronousTestCase):
         failures = self.flushLoggedErrors(ZeroDivisionError)
         self.assertEqual(3, len(failures))
 
+    def test_changes_in_transaction(self):
+        """
+        All proxy changes are made inside a single ``INetwork.transaction``
+        and a failure to apply the transaction is reported as a failure in
+        the returned deferred.
+        """
+        fake_network = make_memory_network()
+        fake_network.create_proxy_to(ip=u'192.0.2.100', port=3306)
+        fake_network.transaction = contextmanager(failing_transaction)
+
+        api = P2PNodeDeployer(
+            u'example.com',
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = SetProxies(ports=[Proxy(ip=u'192.0.2.101', port=3306)]).run(api)
+        exception = self.failureResultOf(d, FirstError)
+        self.assertIsInstance(
+            exception.value.subFailure.value,
+            CustomException
+        )
+        self.flushLoggedErrors(CustomException)
+
 
 class OpenPortsTests(SynchronousTestCase):
     """
@@ -3746,6 +4082,26 @@ class OpenPortsTests(SynchronousTestCase):
             set(fake_network.enumerate_open_ports())
         )
 
+    def test_unchanged_open_ports_untouched(self):
+        """
+        Ports which are open on the node and which are still required are
+        neither closed nor re-opened.
+        """
+        fake_network = make_memory_network()
+        required_port = fake_network.open_port(port=3306)
+        calls = []
+        fake_network.delete_open_port = lambda port: calls.append(port)
+        fake_network.open_port = lambda port: calls.append(port)
+
+        api = P2PNodeDeployer(
+            u'example.com',
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = OpenPorts(ports=[required_port]).run(api)
+        self.successResultOf(d)
+        self.assertEqual([], calls)
+
     def test_delete_open_port_errors_as_errbacks(self):
         """
         Exceptions raised in `delete_open_port` operations are reported as
@@ -3812,6 +4168,29 @@ class OpenPortsTests(SynchronousTestCase):
         failures = self.flushLoggedErrors(ZeroDivisionError)
         self.assertEqual(3, len(failures))
 
+    def test_changes_in_transaction(self):
+        """
+        All open port changes are made inside a single
+        ``INetwork.transaction`` and a failure to apply the transaction is
+        reported as a failure in the returned deferred.
+        """
+        fake_network = make_memory_network()
+        fake_network.open_port(port=3306)
+        fake_network.transaction = contextmanager(failing_transaction)
+
+        api = P2PNodeDeployer(
+            u'example.com',
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = OpenPorts(ports=[OpenPort(port=3307)]).run(api)
+        exception = self.failureResultOf(d, FirstError)
+        self.assertIsInstance(
+            exception.value.subFailure.value,
+            CustomException
+        )
+        self.flushLoggedErrors(CustomException)
+
 
 class ChangeNodeStateTests(SynchronousTestCase):
     """
@@ -4154,15 +4533,15 @@ class HandoffVolumeTests(SynchronousTestCase):
     def test_handoff(self):
         """
         ``HandoffVolume.run()`` hands off the named volume to the given
-        destination nodex.
+        destination nodex, identified by its hostname.
         """
         volume_service = create_volume_service(self)
         hostname = b"dest.example.com"
 
         result = []
 
-        def _handoff(volume, destination):
-            result.extend([volume, destination])
+        def _handoff(volume, destination, peer):
+            result.extend([volume, destination, peer])
         self.patch(volume_service, "handoff", _handoff)
         deployer = P2PNodeDeployer(
             u'example.com',
@@ -4176,7 +4555,32 @@ class HandoffVolumeTests(SynchronousTestCase):
         self.assertEqual(
             result,
             [volume_service.get(_to_volume_name(DATASET.dataset_id)),
-             RemoteVolumeManager(standard_node(hostname))])
+             RemoteVolumeManager(standard_node(hostname)), hostname])
+
+    def test_remote_volume_manager(self):
+        """
+        ``HandoffDataset.run()`` uses the deployer's
+        ``remote_volume_manager`` to get the ``IRemoteVolumeManager`` for the
+        destination.
+        """
+        volume_service = create_volume_service(self)
+        hostname = b"dest.example.com"
+        manager = object()
+
+        result = []
+        self.patch(
+            volume_service, "handoff",
+            lambda volume, destination, peer: result.append(destination))
+        deployer = P2PNodeDeployer(
+            u'example.com',
+            volume_service,
+            docker_client=FakeDockerClient(),
+            network=make_memory_network(),
+            remote_volume_manager={hostname: manager}.get)
+        HandoffDataset(
+            dataset=APPLICATION_WITH_VOLUME.volume.dataset,
+            hostname=hostname).run(deployer)
+        self.assertEqual([manager], result)
 
     def test_return(self):
         """
@@ -4186,7 +4590,7 @@ class HandoffVolumeTests(SynchronousTestCase):
         result = Deferred()
         volume_service = create_volume_service(self)
         self.patch(volume_service, "handoff",
-                   lambda volume, destination: result)
+                   lambda volume, destination, peer: result)
         deployer = P2PNodeDeployer(
             u'example.com',
             volume_service,
@@ -4206,15 +4610,15 @@ class PushVolumeTests(SynchronousTestCase):
     def test_push(self):
         """
         ``PushVolume.run()`` pushes the named volume to the given destination
-        node.
+        node, identified by its hostname.
         """
         volume_service = create_volume_service(self)
         hostname = b"dest.example.com"
 
         result = []
 
-        def _push(volume, destination):
-            result.extend([volume, destination])
+        def _push(volume, destination, peer):
+            result.extend([volume, destination, peer])
         self.patch(volume_service, "push", _push)
         deployer = P2PNodeDeployer(
             u'example.com',
@@ -4228,7 +4632,31 @@ class PushVolumeTests(SynchronousTestCase):
         self.assertEqual(
             result,
             [volume_service.get(_to_volume_name(DATASET.dataset_id)),
-             RemoteVolumeManager(standard_node(hostname))])
+             RemoteVolumeManager(standard_node(hostname)), hostname])
+
+    def test_remote_volume_manager(self):
+        """
+        ``PushDataset.run()`` uses the deployer's ``remote_volume_manager`` to
+        get the ``IRemoteVolumeManager`` for the destination.
+        """
+        volume_service = create_volume_service(self)
+        hostname = b"dest.example.com"
+        manager = object()
+
+        result = []
+        self.patch(
+            volume_service, "push",
+            lambda volume, destination, peer: result.append(destination))
+        deployer = P2PNodeDeployer(
+            u'example.com',
+            volume_service,
+            docker_client=FakeDockerClient(),
+            network=make_memory_network(),
+            remote_volume_manager={hostname: manager}.get)
+        PushDataset(
+            dataset=APPLICATION_WITH_VOLUME.volume.dataset,
+            hostname=hostname).run(deployer)
+        self.assertEqual([manager], result)
 
     def test_return(self):
         """
@@ -4238,7 +4666,7 @@ class PushVolumeTests(SynchronousTestCase):
         result = Deferred()
         volume_service = create_volume_service(self)
         self.patch(volume_service, "push",
-                   lambda volume, destination: result)
+                   lambda volume, destination, peer: result)
         deployer = P2PNodeDeployer(
             u'example.com',
             volume_service,
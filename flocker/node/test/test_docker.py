@@ -2,17 +2,25 @@
 
 """Tests for :module:`flocker.node._docker`."""
 
+from BaseHTTPServer import BaseHTTPRequestHandler
+from json import dumps
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from tempfile import mkdtemp
+from threading import Thread
+from urlparse import urlparse
+
 from zope.interface.verify import verifyObject
 
 from pyrsistent import pset
 
+from twisted.internet.defer import gatherResults
 from twisted.trial.unittest import TestCase
 from twisted.python.filepath import FilePath
 
 from ...testtools import random_name, make_with_init_tests
 from .._docker import (
     IDockerClient, FakeDockerClient, AlreadyExists, PortMap, Unit,
-    Environment, Volume)
+    Environment, Volume, DockerClient, DOCKER_CONNECTION_POOL_SIZE)
 
 from ...control._model import RestartAlways, RestartNever, RestartOnFailure
 
@@ -235,6 +243,36 @@ def make_idockerclient_tests(fixture):
             return self.assert_restart_policy_round_trips(
                 RestartOnFailure(maximum_retry_count=5))
 
+        def test_pull(self):
+            """
+            ``pull`` fires with ``None`` once the image is available.
+            """
+            client = fixture(self)
+            d = client.pull(u"busybox")
+            d.addCallback(self.assertIs, None)
+            return d
+
+        def test_pull_twice(self):
+            """
+            Pulling an image that is already available succeeds.
+            """
+            client = fixture(self)
+            d = client.pull(u"busybox")
+            d.addCallback(lambda _: client.pull(u"busybox"))
+            d.addCallback(self.assertIs, None)
+            return d
+
+        def test_add_after_pull(self):
+            """
+            A unit can be added using an image that was pulled beforehand.
+            """
+            client = fixture(self)
+            name = random_name()
+            d = client.pull(u"busybox")
+            d.addCallback(lambda _: client.add(name, u"busybox"))
+            d.addCallback(lambda _: client.remove(name))
+            return d
+
     return IDockerClientTests
 
 
@@ -264,6 +302,116 @@ class FakeDockerClientImplementationTests(TestCase):
                               container_image=u'flocker/flocker:v1.0.0')}
         self.assertEqual(units, FakeDockerClient(units=units)._units)
 
+    def test_pulled_images(self):
+        """
+        ``FakeDockerClient.pull`` records the names of pulled images in
+        ``FakeDockerClient.pulled_images``.
+        """
+        client = FakeDockerClient()
+        client.pull(u"busybox")
+        client.pull(u"openshift/busybox-http-app")
+        self.assertEqual({u"busybox", u"openshift/busybox-http-app"},
+                         client.pulled_images)
+
+
+class _FakeDockerAPIHandler(BaseHTTPRequestHandler):
+    """
+    Respond to the Docker API requests made by ``DockerClient.list`` with
+    the containers of a ``_FakeDockerServer``.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.connection)
+
+    def do_GET(self):
+        segments = urlparse(self.path).path.split(b"/")[2:]
+        if segments == [b"containers", b"json"]:
+            result = [{u"Id": container_id}
+                      for container_id in self.server.container_ids]
+        elif segments[0] == b"containers":
+            result = {
+                u"Name": u"/flocker--" + segments[1],
+                u"State": {u"Running": True},
+                u"Config": {u"Image": u"busybox", u"Env": [],
+                            u"CpuShares": 0, u"Memory": 0},
+                u"HostConfig": {u"PortBindings": None, u"Binds": None,
+                                u"RestartPolicy": {u"Name": u""}},
+            }
+        else:
+            result = {u"Config": {u"Env": []}}
+        body = dumps(result)
+        self.send_response(200)
+        self.send_header(b"Content-Type", b"application/json")
+        self.send_header(b"Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FakeDockerServer(ThreadingMixIn, UnixStreamServer):
+    """
+    A minimal Docker API server listening on a UNIX socket.
+
+    :ivar list container_ids: The IDs of the containers to report.
+    :ivar list connections: Every connection accepted by the server.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, container_ids):
+        UnixStreamServer.__init__(self, socket_path, _FakeDockerAPIHandler)
+        self.container_ids = container_ids
+        self.connections = []
+
+
+class DockerClientConnectionPoolTests(TestCase):
+    """
+    Tests for the reuse of connections to the Docker socket by
+    ``DockerClient``.
+    """
+    def setUp(self):
+        directory = FilePath(mkdtemp())
+        self.addCleanup(directory.remove)
+        socket_path = directory.child(b"docker.sock").path
+        self.server = _FakeDockerServer(
+            socket_path, [u"%d" % (i,) for i in range(200)])
+        self.addCleanup(self.server.server_close)
+        serving = Thread(target=self.server.serve_forever)
+        serving.start()
+        self.addCleanup(serving.join)
+        self.addCleanup(self.server.shutdown)
+        self.client = DockerClient(base_url=b"unix://" + socket_path)
+        self.addCleanup(self.client._client.close)
+
+    def test_list_reuses_connection(self):
+        """
+        ``DockerClient.list`` makes all of its API requests, one per container
+        and more, over a single connection.
+        """
+        d = self.client.list()
+
+        def listed(units):
+            self.assertEqual(
+                (200, 1), (len(units), len(self.server.connections)))
+        d.addCallback(listed)
+        return d
+
+    def test_concurrent_list_bounded_connections(self):
+        """
+        Concurrent calls to ``DockerClient.list`` open no more connections
+        than ``DOCKER_CONNECTION_POOL_SIZE``.
+        """
+        d = gatherResults([self.client.list() for i in range(5)])
+
+        def listed(results):
+            self.assertTrue(
+                len(self.server.connections) <= DOCKER_CONNECTION_POOL_SIZE)
+        d.addCallback(listed)
+        return d
+
 
 class PortMapInitTests(
         make_with_init_tests(
@@ -18,8 +18,18 @@ from twisted.python.filepath import FilePath
 from twisted.application.service import Service
 
 from ...testtools import StandardOptionsTestsMixin, MemoryCoreReactor
-from ...volume.testtools import make_volume_options_tests
+from ...volume.testtools import (
+    make_volume_options_tests, make_volume_transfer_certificates,
+)
+from ...volume._amp import AMPRemoteVolumeManager, VolumeTransferService
+from ...volume._ipc import ssh_volume_manager
+from ...volume._transfer import ThreadedTransfers
+from ...volume._retention import SnapshotPruningService
 from ...route import make_memory_network
+from ...route._iptables import HostNetwork
+from ...route._ipset import IPSetNetwork
+from ...route._userspace import UserspaceNetwork
+from ...common import SSHControlMasterService
 from ...common.script import ICommandLineScript
 
 from ..script import (
@@ -466,6 +476,158 @@ class ZFSAgentScriptTests(SynchronousTestCase):
                                            port=1234),
                           P2PNodeDeployer, b"1.2.3.4", service, True))
 
+    def test_ssh_by_default(self):
+        """
+        Without ``--volume-connect`` datasets are pushed to other nodes over
+        SSH, multiplexed by a ``SSHControlMasterService`` that is a child of
+        the agent's service, with queries run in a thread pool.
+        """
+        service = Service()
+        options = ZFSAgentOptions()
+        options.parseOptions([b"1.2.3.4", b"example.com"])
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        loop = service.parent
+        remote_volume_manager = loop.deployer.remote_volume_manager
+        control_masters = remote_volume_manager.keywords["control_masters"]
+        self.assertEqual(
+            (ssh_volume_manager, True, loop, True),
+            (remote_volume_manager.func,
+             isinstance(control_masters, SSHControlMasterService),
+             control_masters.parent,
+             isinstance(remote_volume_manager.keywords["transfers"],
+                        ThreadedTransfers)))
+
+    def network(self, *arguments):
+        """
+        Run the agent with some arguments.
+
+        :param arguments: Further command line arguments.
+
+        :return: A ``tuple`` of the reactor the agent was run with and the
+            ``INetwork`` provider of its deployer.
+        """
+        service = Service()
+        options = ZFSAgentOptions()
+        options.parseOptions(list(arguments) + [b"1.2.3.4", b"example.com"])
+        test_reactor = MemoryCoreReactor()
+        ZFSAgentScript().main(test_reactor, options, service)
+        return test_reactor, service.parent.deployer.network
+
+    def test_iptables_network_by_default(self):
+        """
+        Without ``--network`` applications' traffic is routed with
+        ``iptables``.
+        """
+        test_reactor, network = self.network()
+        self.assertEqual(HostNetwork, network.__class__)
+
+    def test_ipset_network(self):
+        """
+        With ``--network ipset`` open ports are kept in an ``ipset``.
+        """
+        test_reactor, network = self.network(b"--network", b"ipset")
+        self.assertIsInstance(network, IPSetNetwork)
+
+    def test_userspace_network(self):
+        """
+        With ``--network userspace`` applications' traffic is proxied by
+        the agent, using its reactor.
+        """
+        test_reactor, network = self.network(b"--network", b"userspace")
+        self.assertEqual(
+            (UserspaceNetwork, test_reactor),
+            (network.__class__, network.reactor))
+
+    def test_unknown_network(self):
+        """
+        ``--network`` refuses anything but the supported ways of routing.
+        """
+        options = ZFSAgentOptions()
+        self.assertRaises(
+            UsageError, options.parseOptions,
+            [b"--network", b"carrier-pigeon", b"1.2.3.4", b"example.com"])
+
+    def volume_transfer_options(self, *arguments):
+        """
+        Parse agent options including the certificates volume transfers
+        need.
+
+        :param arguments: Further command line arguments.
+
+        :return: The parsed ``ZFSAgentOptions``.
+        """
+        certificates = make_volume_transfer_certificates(self)
+        options = ZFSAgentOptions()
+        options.parseOptions(list(arguments) + [
+            b"--volume-certificate", certificates.certificate.path,
+            b"--volume-certificate-authority",
+            certificates.certificate_authority.path,
+            b"1.2.3.4", b"example.com"])
+        return options
+
+    def test_volume_connect(self):
+        """
+        With ``--volume-connect`` datasets are pushed to other nodes with
+        ``AMPRemoteVolumeManager``\ s connecting to the given port over TLS.
+        """
+        service = Service()
+        options = self.volume_transfer_options(b"--volume-connect", b"4525")
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        manager = service.parent.deployer.remote_volume_manager(
+            b"node.example.com")
+        self.assertEqual(
+            (AMPRemoteVolumeManager, b"node.example.com", 4525, True),
+            (manager.__class__, manager._endpoint._host,
+             manager._endpoint._port,
+             manager._endpoint._sslContextFactory.requireCertificate))
+
+    def test_volume_listen(self):
+        """
+        With ``--volume-listen`` a ``VolumeTransferService`` is started
+        which listens on the given port with TLS, requiring peers to
+        present a certificate.
+        """
+        service = Service()
+        options = self.volume_transfer_options(b"--volume-listen", b"4525")
+        test_reactor = MemoryCoreReactor()
+        ZFSAgentScript().main(test_reactor, options, service)
+        transfer_services = [
+            child for child in service.parent
+            if isinstance(child, VolumeTransferService)]
+        [(port, factory, context_factory, backlog, interface)] = (
+            test_reactor.sslServers)
+        self.assertEqual(
+            (1, 4525, True),
+            (len(transfer_services), port,
+             context_factory.requireCertificate))
+
+    def test_volume_transfers_need_certificates(self):
+        """
+        ``--volume-listen`` and ``--volume-connect`` are refused without the
+        certificates needed to authenticate other nodes.
+        """
+        for option in [b"--volume-listen", b"--volume-connect"]:
+            options = ZFSAgentOptions()
+            self.assertRaises(
+                UsageError, options.parseOptions,
+                [option, b"4525", b"1.2.3.4", b"example.com"])
+
+    def test_snapshot_pruning(self):
+        """
+        A ``SnapshotPruningService`` for the volume service is started with
+        the interval given by ``--snapshot-prune-interval``.
+        """
+        service = Service()
+        options = ZFSAgentOptions()
+        options.parseOptions([
+            b"--snapshot-prune-interval", b"60", b"1.2.3.4", b"example.com"])
+        ZFSAgentScript().main(MemoryCoreReactor(), options, service)
+        [pruning] = [child for child in service.parent
+                     if isinstance(child, SnapshotPruningService)]
+        self.assertEqual(
+            (service, 60.0, True),
+            (pruning._volume_service, pruning._interval, pruning.running))
+
 
 class DatasetAgentServiceFactoryTests(SynchronousTestCase):
     """
@@ -17,12 +17,16 @@ cooperating nodes.
 """
 
 __all__ = [
-    "INetwork", "make_host_network", "make_memory_network",
-    "Proxy", "OpenPort",
+    "INetwork", "make_host_network", "make_ipset_network",
+    "make_memory_network", "make_userspace_network",
+    "Proxy", "OpenPort", "AddressCache",
 ]
 
 
 from ._interfaces import INetwork
 from ._iptables import make_host_network
+from ._ipset import make_ipset_network
 from ._memory import make_memory_network
+from ._userspace import make_userspace_network
 from ._model import Proxy, OpenPort
+from ._resolve import AddressCache
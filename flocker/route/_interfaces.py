@@ -59,6 +59,30 @@ class INetwork(Interface):
             :py:meth:`enumerate_open_ports`.
         """
 
+    def transaction():
+        """
+        Group changes to proxies and open ports so they are applied together.
+
+        Proxies and open ports created or deleted while the transaction is
+        active are applied when it exits without an exception, in as few
+        steps as the implementation allows.  If it exits with an exception
+        none of them are applied.  Enumeration results while the
+        transaction is active may or may not reflect the changes made
+        within it.
+
+        :return: A context manager.
+        """
+
+    def refresh():
+        """
+        Discard any cached view of the system's network configuration so
+        that later enumeration reflects changes made by other processes.
+
+        Changes made through this object are always reflected without a
+        refresh.  Callers which poll the configuration, such as the
+        convergence loop, should refresh at the start of each iteration.
+        """
+
     def enumerate_proxies():
         """
         Retrieve configured proxy information.
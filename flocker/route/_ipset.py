@@ -0,0 +1,233 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_ipset -*-
+
+"""
+Manage open ports on a node using an ``ipset`` matched by a single
+``iptables`` rule.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from subprocess import (
+    check_call, check_output, Popen, PIPE, CalledProcessError,
+)
+
+from zope.interface import implementer
+
+from ._logging import IPSET, IPSET_RESTORE, OPEN_PORT, DELETE_OPEN_PORT
+from ._interfaces import INetwork
+from ._iptables import (
+    HostNetwork, IPTablesSnapshot, FLOCKER_CHAINS, FLOCKER_INPUT_CHAIN,
+    chain_rules, iptables,
+)
+from ._model import OpenPort
+
+# The set holding the numbers of all of the open TCP ports.
+FLOCKER_OPEN_PORTS_SET = b"flocker-open-ports"
+
+# The FLOCKER-INPUT rule which accepts traffic to any port in the set.
+_SET_RULE = [
+    b"--protocol", b"tcp",
+    b"--match", b"set", b"--match-set", FLOCKER_OPEN_PORTS_SET, b"dst",
+    b"--jump", b"ACCEPT",
+]
+
+
+def ipset(logger, argv):
+    """
+    Run ``ipset`` with the given arguments.
+
+    :param list argv: A standard ``argv``-style argument list.  The path to
+        ipset is prepended to this list for execution.
+    """
+    with IPSET(logger=logger, argv=argv):
+        check_call([b"ipset"] + argv)
+
+
+def ipset_restore(logger, commands):
+    """
+    Apply several ipset commands with a single ``ipset restore`` process.
+
+    :param list commands: ``argv``-style argument lists, as would be passed to
+        ``ipset``.
+    """
+    lines = b"".join(b" ".join(argv) + b"\n" for argv in commands)
+    with IPSET_RESTORE(logger=logger, commands=lines):
+        argv = [b"ipset", b"restore"]
+        process = Popen(argv, stdin=PIPE)
+        process.communicate(lines)
+        if process.returncode != 0:
+            raise CalledProcessError(process.returncode, argv)
+
+
+def has_set_rule(output):
+    """
+    Determine whether ``FLOCKER-INPUT`` contains the rule matching the open
+    ports set.
+
+    :param bytes output: The output of ``iptables-save``.
+
+    :return: ``True`` if the rule exists, otherwise ``False``.
+    """
+    for argv in chain_rules(output, b"filter", FLOCKER_INPUT_CHAIN):
+        if b"--match-set" not in argv:
+            continue
+        index = argv.index(b"--match-set")
+        if (argv[index + 1:index + 3] == [FLOCKER_OPEN_PORTS_SET, b"dst"] and
+                argv[-2:] == [b"-j", b"ACCEPT"]):
+            return True
+    return False
+
+
+def parse_ipset_save(output):
+    """
+    Parse the output of ``ipset save`` for the open ports set.
+
+    :param bytes output: The output of ``ipset save``.
+
+    :return: A ``list`` of ``OpenPort`` instances, one for each member of the
+        set.
+    """
+    open_ports = []
+    for line in output.splitlines():
+        argv = line.split()
+        if argv[:2] == [b"add", FLOCKER_OPEN_PORTS_SET]:
+            open_ports.append(OpenPort(port=int(argv[2])))
+    return open_ports
+
+
+@implementer(INetwork)
+class IPSetNetwork(HostNetwork):
+    """
+    An ``INetwork`` implementation which manages proxies like
+    ``HostNetwork`` but keeps open ports in a ``bitmap:port`` ``ipset``.
+
+    The ``FLOCKER-INPUT`` chain holds a single rule matching the set, so
+    opening or closing a port is one set operation and the cost of filtering
+    a packet does not depend on the number of open ports.
+
+    :ivar list _ipset_pending: ``ipset`` argument lists queued up by the
+        active transaction, or ``None`` if there is no active transaction.
+    """
+    def __init__(self):
+        HostNetwork.__init__(self)
+        self._ipset_pending = None
+
+    def _ensure_set_up(self, output=None):
+        """
+        Create the Flocker chains, and unless ``FLOCKER-INPUT`` already
+        matches the open ports set create the set and make it the only rule
+        in ``FLOCKER-INPUT``.
+
+        Any per-port rules left in ``FLOCKER-INPUT`` by ``HostNetwork`` are
+        discarded; the ports will be re-opened in the set by convergence.
+
+        :see: ``HostNetwork._ensure_set_up``
+        """
+        if not self._set_up:
+            if output is None:
+                output = check_output([b"iptables-save"])
+            HostNetwork._ensure_set_up(self, output)
+            # A set can't be destroyed while a rule matches it, so if the
+            # rule exists so does the set.
+            if not has_set_rule(output):
+                ipset(self.logger, [
+                    b"create", FLOCKER_OPEN_PORTS_SET, b"bitmap:port",
+                    b"range", b"0-65535", b"-exist"])
+                iptables(self.logger, [
+                    b"--table", b"filter", b"--flush", FLOCKER_INPUT_CHAIN])
+                iptables(self.logger, [
+                    b"--table", b"filter", b"--append", FLOCKER_INPUT_CHAIN
+                ] + _SET_RULE)
+
+    def _ipset(self, logger, argv):
+        """
+        Run an ipset command, or queue it if a transaction is active.
+
+        :see: ``ipset`` for parameter documentation.
+        """
+        self._ensure_set_up()
+        if self._ipset_pending is None:
+            self._snapshot = None
+            ipset(logger, argv)
+        else:
+            self._ipset_pending.append(argv)
+
+    def _take_snapshot(self, output):
+        """
+        :param bytes output: The output of ``iptables-save``.
+
+        :return: A new ``IPTablesSnapshot`` with the proxies from the
+            ``FLOCKER-DNAT`` chain and the open ports from the set.
+        """
+        proxies = IPTablesSnapshot.from_iptables_save(output).proxies
+        open_ports = parse_ipset_save(
+            check_output([b"ipset", b"save", FLOCKER_OPEN_PORTS_SET]))
+        return IPTablesSnapshot(proxies=proxies, open_ports=open_ports)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Queue up iptables and ipset changes and apply them with a single
+        ``iptables-restore --noflush`` followed by a single
+        ``ipset restore`` when the transaction exits.
+
+        :see: :meth:`INetwork.transaction`
+        """
+        if self._ipset_pending is not None:
+            with HostNetwork.transaction(self):
+                yield
+            return
+        self._ipset_pending = []
+        try:
+            with HostNetwork.transaction(self):
+                yield
+            pending = self._ipset_pending
+        finally:
+            self._ipset_pending = None
+        if pending:
+            self._snapshot = None
+            ipset_restore(self.logger, pending)
+
+    def reset(self):
+        """
+        Remove all proxies and open ports by flushing the Flocker proxy
+        chains and the open ports set.
+        """
+        for table, chain in FLOCKER_CHAINS:
+            if chain != FLOCKER_INPUT_CHAIN:
+                self._iptables(
+                    self.logger, [b"--table", table, b"--flush", chain])
+        self._ipset(self.logger, [b"flush", FLOCKER_OPEN_PORTS_SET])
+
+    def open_port(self, port):
+        """
+        Add the given port to the open ports set.
+
+        :see: :meth:`INetwork.open_port` for parameter documentation.
+        """
+        with OPEN_PORT(logger=self.logger, target_port=port):
+            self._ipset(self.logger, [
+                b"add", FLOCKER_OPEN_PORTS_SET,
+                unicode(port).encode("ascii"), b"-exist"])
+        return OpenPort(port=port)
+
+    def delete_open_port(self, port):
+        """
+        Remove the given port from the open ports set.
+
+        :see: :meth:`INetwork.delete_open_port` for parameter documentation.
+        """
+        with DELETE_OPEN_PORT(logger=self.logger, target_port=port.port):
+            self._ipset(self.logger, [
+                b"del", FLOCKER_OPEN_PORTS_SET,
+                unicode(port.port).encode("ascii")])
+
+
+def make_ipset_network():
+    """
+    Create a new ``INetwork`` provider which will interact with the underlying
+    system's network configuration, using an ``ipset`` for open ports.
+    """
+    return IPSetNetwork()
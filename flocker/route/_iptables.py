@@ -8,26 +8,60 @@ Manipulate network routing behavior on a node using ``iptables``.
 from __future__ import unicode_literals
 
 import shlex
-from subprocess import check_call, check_output
+from collections import OrderedDict
+from contextlib import contextmanager
+from subprocess import (
+    check_call, check_output, Popen, PIPE, CalledProcessError,
+)
 
 from zope.interface import implementer
 from ipaddr import IPAddress
 from characteristic import attributes
 from eliot import Logger
-from psutil import net_connections
 from twisted.python.filepath import FilePath
 
 from ._logging import (
-    IPTABLES,
+    IPTABLES, IPTABLES_RESTORE,
     CREATE_PROXY_TO, DELETE_PROXY,
     OPEN_PORT, DELETE_OPEN_PORT,
 )
 from ._interfaces import INetwork
 from ._model import Proxy, OpenPort
+from ._ports import used_tcp_ports
 
+# Older versions of Flocker put their rules directly into the built-in chains
+# and tagged them with these comments.
 FLOCKER_PROXY_COMMENT_MARKER = b"flocker create_proxy_to"
 FLOCKER_OPENPORT_COMMENT_MARKER = b"flocker open_port"
 
+# All of the rules Flocker manages live in these chains, so that traffic
+# unrelated to Flocker only passes a single jump rule in each built-in chain
+# and so that Flocker's rules can be listed or flushed without looking at
+# anyone else's.
+FLOCKER_DNAT_CHAIN = b"FLOCKER-DNAT"
+FLOCKER_POSTROUTING_CHAIN = b"FLOCKER-POSTROUTING"
+FLOCKER_FORWARD_CHAIN = b"FLOCKER-FORWARD"
+FLOCKER_INPUT_CHAIN = b"FLOCKER-INPUT"
+
+FLOCKER_CHAINS = [
+    (b"nat", FLOCKER_DNAT_CHAIN),
+    (b"nat", FLOCKER_POSTROUTING_CHAIN),
+    (b"filter", FLOCKER_FORWARD_CHAIN),
+    (b"filter", FLOCKER_INPUT_CHAIN),
+]
+
+# The jumps from the built-in chains to the Flocker chains, as tuples of
+# table, built-in chain, additional match arguments and Flocker chain.  Only
+# traffic directed at this host is considered for proxying.
+_LOCAL = [b"--match", b"addrtype", b"--dst-type", b"LOCAL"]
+_JUMPS = [
+    (b"nat", b"PREROUTING", _LOCAL, FLOCKER_DNAT_CHAIN),
+    (b"nat", b"OUTPUT", _LOCAL, FLOCKER_DNAT_CHAIN),
+    (b"nat", b"POSTROUTING", [], FLOCKER_POSTROUTING_CHAIN),
+    (b"filter", b"FORWARD", [], FLOCKER_FORWARD_CHAIN),
+    (b"filter", b"INPUT", [], FLOCKER_INPUT_CHAIN),
+]
+
 
 @attributes(["comment", "destination_port", "to_destination"])
 class RuleOptions(object):
@@ -53,123 +87,184 @@ def iptables(logger, argv):
         check_call([b"iptables"] + argv)
 
 
-def create_proxy_to(logger, ip, port):
+def _restore_argument(argument):
     """
-    :see: ``HostNetwork.create_proxy_to``
+    Quote an argument for use in ``iptables-restore`` input if necessary.
+
+    :param bytes argument: An iptables argument.
+
+    :return: The argument, quoted if it contains whitespace.
     """
-    action = CREATE_PROXY_TO(
-        logger=logger, target_ip=ip, target_port=port)
+    if len(argument.split()) == 1:
+        return argument
+    return b'"' + argument + b'"'
 
-    with action:
-        encoded_ip = unicode(ip).encode("ascii")
-        encoded_port = unicode(port).encode("ascii")
-
-        # The first goal is to configure "Destination NAT" (DNAT).  We're just
-        # going to rewrite the destination address of traffic arriving on the
-        # specified port so it looks like it is destined for the specified ip
-        # instead of destined for "us".  This gets the packets delivered to the
-        # right destination.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # Destination NAT has to happen "pre"-routing so that the normal
-            # routing rules on the machine will use the re-written destination
-            # address and get the packet to that new destination.  Accomplish
-            # this by appending the rule to the PREROUTING chain.
-            b"--append", b"PREROUTING",
-
-            # Only re-route traffic with a destination port matching the one we
-            # were told to manipulate.  It is also necessary to specify TCP (or
-            # UDP) here since that is the layer of the network stack that
-            # defines ports.
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
-
-            # And only re-route traffic directed at this host.  Traffic
-            # originating on this host directed at some random other host that
-            # happens to be on the same port should be left alone.
-            b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-
-            # Tag it as a flocker-created rule so we can recognize it later.
-            b"--match", b"comment", b"--comment", FLOCKER_PROXY_COMMENT_MARKER,
-
-            # If the filter matched, jump to the DNAT chain to handle doing the
-            # actual packet mangling.  DNAT is a built-in chain that already
-            # knows how to do this.  Pass an argument to the DNAT chain so it
-            # knows how to mangle the packet - rewrite the destination IP of
-            # the address to the target we were told to use.
-            b"--jump", b"DNAT", b"--to-destination", encoded_ip,
-        ])
 
-        # Bonus round!  Having performed DNAT (changing the destination) during
-        # prerouting we are now prepared to send the packet on somewhere else.
-        # On its way out of this system it is also necessary to further
-        # modify and then track that packet.  We want it to look like it
-        # comes from us (the downstream client will be *very* confused if
-        # the node we're passing the packet on to replies *directly* to them;
-        # and by confused I mean it will be totally broken, of course) so we
-        # also need to "masquerade" in the postrouting chain.  This changes
-        # the source address (ip and port) of the packet to the address of
-        # the external interface the packet is exiting upon. Doing SNAT here
-        # would be a little bit more efficient because the kernel could avoid
-        # looking up the external interface's address for every single packet.
-        # But it requires this code to know that address and it requires that
-        # if it ever changes the rule gets updated and it may require some
-        # steps to do port allocation (not sure what they are yet).  So we'll
-        # just masquerade for now.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # As described above, this transformation happens after routing
-            # decisions have been made and the packet is on its way out of the
-            # system.  Therefore, append the rule to the POSTROUTING chain.
-            b"--append", b"POSTROUTING",
-
-            # We'll stick to matching the same kinds of packets we matched in
-            # the earlier stage.  We might want to change the factoring of this
-            # code to avoid the duplication - particularly in case we want to
-            # change the specifics of the filter.
-            #
-            # This omits the LOCAL addrtype check, though, because at this
-            # point the packet is definitely leaving this host.
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
-
-            # Do the masquerading.
-            b"--jump", b"MASQUERADE",
-        ])
+def restore_input(commands):
+    """
+    Convert iptables commands to the input format of ``iptables-restore``.
 
-        # Secret level!!  Traffic that originates *on* the host bypasses the
-        # PREROUTING chain.  Instead, it passes through the OUTPUT chain.  If
-        # we want connections from localhost to the forwarded port to be
-        # affected then we need a rule in the OUTPUT chain to do the same kind
-        # of DNAT that we did in the PREROUTING chain.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # As mentioned, this rule is for the OUTPUT chain.
-            b"--append", b"OUTPUT",
-
-            # Matching the exact same kinds of packets as the PREROUTING rule
-            # matches.
-            b"--protocol", b"tcp",
-            b"--destination-port", encoded_port,
-            b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-
-            # Do the same DNAT as we did in the rule for the PREROUTING chain.
-            b"--jump", b"DNAT", b"--to-destination", encoded_ip,
-        ])
+    :param list commands: ``argv``-style argument lists, as would be passed to
+        ``iptables``.  Each must include a ``--table`` option.
 
-        iptables(logger, [
-            b"--table", b"filter",
-            b"--insert", b"FORWARD",
+    :return: ``bytes`` to write to ``iptables-restore``.  Commands are grouped
+        by table, preserving their order within each table.
+    """
+    tables = OrderedDict()
+    for argv in commands:
+        index = argv.index(b"--table")
+        tables.setdefault(argv[index + 1], []).append(
+            argv[:index] + argv[index + 2:])
+
+    lines = []
+    for table, rules in tables.items():
+        lines.append(b"*" + table)
+        for rule in rules:
+            lines.append(b" ".join(map(_restore_argument, rule)))
+        lines.append(b"COMMIT")
+    return b"".join(line + b"\n" for line in lines)
+
+
+def iptables_restore(logger, commands):
+    """
+    Apply several iptables commands with a single ``iptables-restore``
+    process.
 
-            b"--destination", encoded_ip,
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
+    Each table is changed atomically: if any command fails, none of the
+    changes to that table are made.  Rules not mentioned in ``commands`` are
+    left alone.
 
-            b"--jump", b"ACCEPT",
-        ])
+    :param list commands: ``argv``-style argument lists, as would be passed to
+        ``iptables``.  Each must include a ``--table`` option.
+    """
+    rules = restore_input(commands)
+    with IPTABLES_RESTORE(logger=logger, rules=rules):
+        argv = [b"iptables-restore", b"--noflush"]
+        process = Popen(argv, stdin=PIPE)
+        process.communicate(rules)
+        if process.returncode != 0:
+            raise CalledProcessError(process.returncode, argv)
+
+
+def _dnat_rule(ip, port):
+    """
+    :return: The ``FLOCKER-DNAT`` rule arguments for a proxy.
+    """
+    return [
+        # Only re-route traffic with a destination port matching the one we
+        # were told to manipulate.  It is also necessary to specify TCP (or
+        # UDP) here since that is the layer of the network stack that defines
+        # ports.  The jump into this chain has already checked that the
+        # traffic is directed at this host.
+        b"--protocol", b"tcp", b"--destination-port", port,
+
+        # If the filter matched, jump to the DNAT chain to handle doing the
+        # actual packet mangling.  DNAT is a built-in chain that already knows
+        # how to do this.  Pass an argument to the DNAT chain so it knows how
+        # to mangle the packet - rewrite the destination IP of the address to
+        # the target we were told to use.
+        b"--jump", b"DNAT", b"--to-destination", ip,
+    ]
+
+
+def _masquerade_rule(ip, port):
+    """
+    :return: The ``FLOCKER-POSTROUTING`` rule arguments for a proxy.
+    """
+    return [
+        # We'll stick to matching the same kinds of packets we matched in the
+        # DNAT stage.  This omits the LOCAL addrtype check, though, because at
+        # this point the packet is definitely leaving this host.
+        b"--protocol", b"tcp", b"--destination-port", port,
+
+        # Do the masquerading.
+        b"--jump", b"MASQUERADE",
+    ]
+
+
+def _forward_rule(ip, port):
+    """
+    :return: The ``FLOCKER-FORWARD`` rule arguments for a proxy.
+    """
+    return [
+        b"--destination", ip,
+        b"--protocol", b"tcp", b"--destination-port", port,
+        b"--jump", b"ACCEPT",
+    ]
+
+
+def _proxy_commands(operation, ip, port):
+    """
+    :param bytes operation: ``b"--append"`` or ``b"--delete"``.
+    :param ip: The destination of the proxy.
+    :param int port: The port of the proxy.
+
+    :return: The ``iptables`` argument lists which add or remove the rules
+        implementing a proxy.
+    """
+    ip = unicode(ip).encode("ascii")
+    port = unicode(port).encode("ascii")
+    return [
+        # Destination NAT happens in the FLOCKER-DNAT chain.  It is reached
+        # from PREROUTING, so that the normal routing rules on the machine
+        # will use the re-written destination address, and from OUTPUT,
+        # because traffic that originates *on* the host bypasses PREROUTING.
+        [b"--table", b"nat", operation, FLOCKER_DNAT_CHAIN] +
+        _dnat_rule(ip, port),
+
+        # Having performed DNAT (changing the destination) we are now
+        # prepared to send the packet on somewhere else.  We want it to look
+        # like it comes from us (the downstream client will be *very*
+        # confused if the node we're passing the packet on to replies
+        # *directly* to them; and by confused I mean it will be totally
+        # broken, of course) so we also need to "masquerade" after routing.
+        # This changes the source address (ip and port) of the packet to the
+        # address of the external interface the packet is exiting upon.
+        # Doing SNAT here would be a little bit more efficient because the
+        # kernel could avoid looking up the external interface's address for
+        # every single packet.  But it requires this code to know that
+        # address and it requires that if it ever changes the rule gets
+        # updated.  So we'll just masquerade for now.
+        [b"--table", b"nat", operation, FLOCKER_POSTROUTING_CHAIN] +
+        _masquerade_rule(ip, port),
+
+        # Finally, let the re-written packets through the firewall.
+        [b"--table", b"filter", operation, FLOCKER_FORWARD_CHAIN] +
+        _forward_rule(ip, port),
+    ]
+
+
+def _open_port_commands(operation, port):
+    """
+    :param bytes operation: ``b"--append"`` or ``b"--delete"``.
+    :param int port: The port to open or close.
+
+    :return: The ``iptables`` argument lists which add or remove the rule
+        implementing an open port.
+    """
+    port = unicode(port).encode("ascii")
+    return [
+        [b"--table", b"filter", operation, FLOCKER_INPUT_CHAIN,
+         b"--protocol", b"tcp", b"--destination-port", port,
+         b"--jump", b"ACCEPT"],
+    ]
+
+
+def create_proxy_to(logger, ip, port, run_iptables=iptables):
+    """
+    :see: ``HostNetwork.create_proxy_to``
+
+    The Flocker chains must already have been set up.
+
+    :param run_iptables: The function to use to run iptables commands, with
+        the same signature as ``iptables``.
+    """
+    action = CREATE_PROXY_TO(
+        logger=logger, target_ip=ip, target_port=port)
+
+    with action:
+        for argv in _proxy_commands(b"--append", ip, port):
+            run_iptables(logger, argv)
 
         # The network stack only considers forwarding traffic when certain
         # system configuration is in place.
@@ -191,142 +286,234 @@ def create_proxy_to(logger, ip, port):
         return Proxy(ip=ip, port=port)
 
 
-def open_port(logger, port):
-    with OPEN_PORT(
-            logger=logger, target_port=port):
-        encoded_port = unicode(port).encode("ascii")
-        iptables(logger, [
-            b"--table", b"filter",
-            b"--insert", b"INPUT",
-
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
+def open_port(logger, port, run_iptables=iptables):
+    """
+    :see: ``HostNetwork.open_port``
 
-            # Tag it as a flocker-created rule so we can recognize it later.
-            b"--match", b"comment",
-            b"--comment", FLOCKER_OPENPORT_COMMENT_MARKER,
+    The Flocker chains must already have been set up.
 
-            b"--jump", b"ACCEPT",
-        ])
+    :param run_iptables: The function to use to run iptables commands, with
+        the same signature as ``iptables``.
+    """
+    with OPEN_PORT(
+            logger=logger, target_port=port):
+        for argv in _open_port_commands(b"--append", port):
+            run_iptables(logger, argv)
 
     return OpenPort(port=port)
 
 
-def delete_proxy(logger, proxy):
+def delete_proxy(logger, proxy, run_iptables=iptables):
     """
     :see: ``HostNetwork.delete_proxy``
-    """
-    ip = unicode(proxy.ip).encode("ascii")
-    port = unicode(proxy.port).encode("ascii")
-
-    commands = [
-        [b"--table", b"nat",
-         b"--delete", b"PREROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-         b"--match", b"comment", b"--comment", FLOCKER_PROXY_COMMENT_MARKER,
-         b"--jump", b"DNAT", b"--to-destination", ip],
-        [b"--table", b"nat",
-         b"--delete", b"POSTROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--jump", b"MASQUERADE"],
-        [b"--table", b"nat",
-         b"--delete", b"OUTPUT",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-         b"--jump", b"DNAT", b"--to-destination", ip],
-        [b"--table", b"filter",
-         b"--delete", b"FORWARD",
-         b"--destination", ip,
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--jump", b"ACCEPT"],
-    ]
 
+    :param run_iptables: The function to use to run iptables commands, with
+        the same signature as ``iptables``.
+    """
     with DELETE_PROXY(logger, target_ip=proxy.ip, target_port=proxy.port):
-        for argv in commands:
-            iptables(logger, argv)
+        for argv in _proxy_commands(b"--delete", proxy.ip, proxy.port):
+            run_iptables(logger, argv)
 
 
-def delete_open_port(logger, port):
+def delete_open_port(logger, port, run_iptables=iptables):
     """
     :see: ``HostNetwork.delete_open_port``
+
+    :param run_iptables: The function to use to run iptables commands, with
+        the same signature as ``iptables``.
     """
     action = DELETE_OPEN_PORT(
         logger=logger, target_port=port.port)
 
     with action:
-        encoded_port = unicode(port.port).encode("ascii")
-        iptables(logger, [
-            b"--table", b"filter",
-            b"--delete", b"INPUT",
+        for argv in _open_port_commands(b"--delete", port.port):
+            run_iptables(logger, argv)
 
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
 
-            # Tag it as a flocker-created rule so we can recognize it later.
-            b"--match", b"comment",
-            b"--comment", FLOCKER_OPENPORT_COMMENT_MARKER,
+def _legacy_commands(output):
+    """
+    Find the rules created by older versions of Flocker, which put proxies and
+    open ports directly into the built-in chains, and construct the commands
+    which delete them.
 
-            b"--jump", b"ACCEPT",
+    :param bytes output: The output of ``iptables-save``.
+
+    :return: A ``list`` of ``iptables`` argument lists.
+    """
+    commands = []
+    for rule in get_flocker_rules(
+            comment_marker=FLOCKER_PROXY_COMMENT_MARKER,
+            table=b'nat', output=output):
+        ip = unicode(rule.to_destination).encode("ascii")
+        port = unicode(rule.destination_port).encode("ascii")
+        marker = [b"--match", b"comment",
+                  b"--comment", FLOCKER_PROXY_COMMENT_MARKER]
+        commands.extend([
+            [b"--table", b"nat", b"--delete", b"PREROUTING",
+             b"--protocol", b"tcp", b"--destination-port", port] +
+            _LOCAL + marker +
+            [b"--jump", b"DNAT", b"--to-destination", ip],
+            [b"--table", b"nat", b"--delete", b"POSTROUTING"] +
+            _masquerade_rule(ip, port),
+            [b"--table", b"nat", b"--delete", b"OUTPUT",
+             b"--protocol", b"tcp", b"--destination-port", port] +
+            _LOCAL +
+            [b"--jump", b"DNAT", b"--to-destination", ip],
+            [b"--table", b"filter", b"--delete", b"FORWARD"] +
+            _forward_rule(ip, port),
         ])
+    for rule in get_flocker_rules(
+            comment_marker=FLOCKER_OPENPORT_COMMENT_MARKER,
+            table=b'filter', output=output):
+        port = unicode(rule.destination_port).encode("ascii")
+        commands.append(
+            [b"--table", b"filter", b"--delete", b"INPUT",
+             b"--protocol", b"tcp", b"--destination-port", port,
+             b"--match", b"comment",
+             b"--comment", FLOCKER_OPENPORT_COMMENT_MARKER,
+             b"--jump", b"ACCEPT"])
+    return commands
+
+
+def setup_commands(output):
+    """
+    Construct the commands which create the Flocker chains and the jumps to
+    them.
 
+    Rules left behind by older versions of Flocker are removed separately,
+    see ``_legacy_commands``.
 
-def enumerate_proxies():
-    """
-    Inspect the system's iptables configuration to determine what proxies
-    currently exist.
+    :param bytes output: The output of ``iptables-save``.
 
-    :see: :py:meth:`INetwork.enumerate_proxies` for parameter documentation.
+    :return: A ``list`` of ``iptables`` argument lists.  It is empty if
+        everything is already set up.
     """
-    proxies = []
-    for rule in get_flocker_rules(
-            comment_marker=FLOCKER_PROXY_COMMENT_MARKER,
-            table=b'nat'):
-        proxies.append(
-            Proxy(ip=rule.to_destination, port=rule.destination_port))
+    commands = []
+    for table, chain in FLOCKER_CHAINS:
+        declaration = b":" + chain + b" "
+        lines = _table_lines(output, table)
+        if not any(line.startswith(declaration) for line in lines):
+            commands.append([b"--table", table, b"--new-chain", chain])
+
+    for table, builtin, match, chain in _JUMPS:
+        exists = False
+        for line in _table_lines(output, table):
+            argv = shlex.split(line)
+            if argv[:2] == [b"-A", builtin] and argv[-2:] == [b"-j", chain]:
+                exists = True
+                break
+        if not exists:
+            # Nat rules are appended, to leave other software's rules in
+            # control, and filter rules are inserted, so that they take
+            # effect before any catch-all rejection.
+            operation = b"--append" if table == b"nat" else b"--insert"
+            commands.append(
+                [b"--table", table, operation, builtin] + match +
+                [b"--jump", chain])
+
+    return commands
+
+
+@attributes(["proxies", "open_ports"])
+class IPTablesSnapshot(object):
+    """
+    The Flocker-managed parts of the system's iptables configuration, parsed
+    from the rules in the Flocker chains.
 
-    return proxies
+    :ivar list proxies: ``Proxy`` instances describing the configured
+        proxies.
 
+    :ivar list open_ports: ``OpenPort`` instances describing the open ports.
+    """
+    @classmethod
+    def from_iptables_save(cls, output):
+        """
+        Parse the output of ``iptables-save``.
+
+        :param bytes output: The output of ``iptables-save``.
 
-def enumerate_open_ports():
+        :return: A new ``IPTablesSnapshot``.
+        """
+        # Rules without a port, e.g. one matching an ipset, are not
+        # proxies or open ports.
+        proxies = []
+        for argv in chain_rules(output, b"nat", FLOCKER_DNAT_CHAIN):
+            rule = parse_iptables_options(argv)
+            if None not in (rule.to_destination, rule.destination_port):
+                proxies.append(
+                    Proxy(ip=rule.to_destination, port=rule.destination_port))
+
+        open_ports = []
+        for argv in chain_rules(output, b"filter", FLOCKER_INPUT_CHAIN):
+            rule = parse_iptables_options(argv)
+            if rule.destination_port is not None:
+                open_ports.append(
+                    OpenPort(port=rule.destination_port))
+
+        return cls(proxies=proxies, open_ports=open_ports)
+
+
+def chain_rules(output, table, chain):
     """
-    Inspect the system's iptables configuration to determine which ports
-    are currently open.
+    :param bytes output: The output of ``iptables-save``.
+    :param bytes table: The name of the table the chain is in.
+    :param bytes chain: The name of the chain.
 
-    :see: :py:meth:`INetwork.enumerate_open_ports` for parameter documentation.
+    :return: An iterator of ``list``\ s of the arguments of each rule in
+        the chain, excluding the ``-A`` option.
     """
-    ports = []
-    for rule in get_flocker_rules(
-            comment_marker=FLOCKER_OPENPORT_COMMENT_MARKER,
-            table=b'filter'):
-        ports.append(
-            OpenPort(port=rule.destination_port))
+    prefix = b"-A " + chain + b" "
+    for line in _table_lines(output, table):
+        if line.startswith(prefix):
+            yield shlex.split(line)[2:]
+
 
-    return ports
+def take_snapshot(output=None):
+    """
+    Inspect the Flocker chains of the system's iptables configuration.
 
+    :param bytes output: The output of ``iptables-save`` to inspect, or
+        ``None`` to run ``iptables-save`` to get it.
 
-def get_flocker_rules(comment_marker, table):
+    :return: An ``IPTablesSnapshot`` of the current configuration.
     """
-    Look up all of the iptables rules created/managed by flocker.
+    if output is None:
+        output = check_output([b"iptables-save"])
+    return IPTablesSnapshot.from_iptables_save(output)
 
-    :return: An iterator of :py:class:`Options` instances, one for each rule
-        found.
+
+def _table_lines(output, table):
     """
-    # Life is horrible.
-    # https://stackoverflow.com/questions/109553/how-can-i-programmatically-manage-iptables-rules-on-the-fly
-    # At least we know all the rules we need to inspect are in the NAT table.
-    output = check_output([b"iptables-save"])
+    :param bytes output: The output of ``iptables-save``.
+    :param bytes table: The name of a table.
 
-    # Find the beginning of the NAT table
+    :return: A ``list`` of the lines describing ``table``, excluding its
+        header and ``COMMIT`` lines.
+    """
     header = b"*%s\n" % (table,)
-    begin = output.find(header) + len(header)
+    begin = output.find(header)
+    if begin == -1:
+        return []
+    begin += len(header)
+    end = output.find(b"COMMIT\n", begin)
+    return output[begin:end].splitlines()
+
+
+def get_flocker_rules(comment_marker, table, output=None):
+    """
+    Look up all of the iptables rules in the built-in chains tagged with a
+    comment by older versions of flocker.
 
-    # Find the end of the NAT table
-    footer = b"COMMIT\n"
-    end = output.find(footer, begin)
+    :param bytes output: The output of ``iptables-save`` to search, or
+        ``None`` to run ``iptables-save`` to get it.
 
-    # Slice it out.
-    nat = output[begin:end]
+    :return: An iterator of :py:class:`Options` instances, one for each rule
+        found.
+    """
+    if output is None:
+        output = check_output([b"iptables-save"])
 
-    for line in nat.splitlines():
+    for line in _table_lines(output, table):
         if line.startswith(b":"):
             # Skip these lines describing a chain or the table overall.
             continue
@@ -392,16 +579,155 @@ def parse_iptables_options(argv):
 class HostNetwork(object):
     """
     An ``INetwork`` implementation based on ``iptables``.
+
+    All rules are kept in the Flocker chains, which are created (and any
+    rules left behind by older versions of Flocker removed) the first time
+    the iptables configuration is inspected or changed.
+
+    Enumeration is served from an ``IPTablesSnapshot`` which is parsed from
+    a single ``iptables-save`` on first use, the same one used to check the
+    Flocker chains are set up, and discarded whenever this object changes
+    the iptables configuration or ``refresh`` is called.
+
+    :ivar list _pending: ``iptables`` argument lists queued up by the active
+        transaction, or ``None`` if there is no active transaction.
+
+    :ivar _snapshot: The current ``IPTablesSnapshot`` or ``None`` if a new
+        one must be taken.
+
+    :ivar bool _set_up: Whether the Flocker chains are known to be set up.
+        This is checked again after ``refresh`` in case something else
+        removed them.
+
+    :ivar _used_ports: The ``set`` of TCP ports used by sockets on this
+        node, discovered once per convergence iteration, or ``None`` if they
+        must be discovered again.
     """
     logger = Logger()
 
+    def __init__(self):
+        self._pending = None
+        self._snapshot = None
+        self._set_up = False
+        self._used_ports = None
+
+    def _ensure_set_up(self, output=None):
+        """
+        Create the Flocker chains and the jumps to them if they do not exist
+        yet, and remove any rules left behind by older versions of Flocker.
+
+        :param bytes output: The output of ``iptables-save`` to inspect, or
+            ``None`` to run ``iptables-save`` if it is needed.
+        """
+        if not self._set_up:
+            if output is None:
+                output = check_output([b"iptables-save"])
+            commands = setup_commands(output)
+            if commands:
+                iptables_restore(self.logger, commands)
+            self._set_up = True
+            self._remove_legacy_rules(output)
+
+    def _remove_legacy_rules(self, output):
+        """
+        Delete the rules left behind by older versions of Flocker, one at a
+        time, so that rules which have already gone don't stop the others
+        being deleted.
+
+        :param bytes output: The output of ``iptables-save``.
+        """
+        for argv in _legacy_commands(output):
+            try:
+                iptables(self.logger, argv)
+            except CalledProcessError:
+                # Already deleted, e.g. by an interrupted earlier cleanup;
+                # the failure has been logged.
+                pass
+
+    def _iptables(self, logger, argv):
+        """
+        Run an iptables command, or queue it if a transaction is active.
+
+        :see: ``iptables`` for parameter documentation.
+        """
+        self._ensure_set_up()
+        if self._pending is None:
+            self._snapshot = None
+            iptables(logger, argv)
+        else:
+            self._pending.append(argv)
+
+    def _current_snapshot(self):
+        """
+        :return: The current ``IPTablesSnapshot``, taking one if necessary.
+        """
+        if self._snapshot is None:
+            # Setting up only adds empty chains and jumps to them, so the
+            # same output describes the rules in the Flocker chains.
+            output = check_output([b"iptables-save"])
+            self._ensure_set_up(output)
+            self._snapshot = self._take_snapshot(output)
+        return self._snapshot
+
+    def _take_snapshot(self, output):
+        """
+        :param bytes output: The output of ``iptables-save``.
+
+        :return: A new ``IPTablesSnapshot`` of the system's configuration.
+        """
+        return take_snapshot(output)
+
+    def refresh(self):
+        """
+        Discard the current snapshot and used ports so the next
+        enumeration lists the Flocker chains and sockets again.
+
+        The Flocker chains and the jumps to them are also checked again,
+        and recreated if e.g. a firewall reload removed them.
+
+        :see: :meth:`INetwork.refresh`
+        """
+        self._snapshot = None
+        self._used_ports = None
+        self._set_up = False
+
+    @contextmanager
+    def transaction(self):
+        """
+        Queue up iptables changes and apply them all with a single
+        ``iptables-restore --noflush`` when the transaction exits.
+
+        Nested transactions are merged into the outermost one.
+
+        :see: :meth:`INetwork.transaction`
+        """
+        if self._pending is not None:
+            yield
+            return
+        self._pending = []
+        try:
+            yield
+            pending = self._pending
+        finally:
+            self._pending = None
+        if pending:
+            self._snapshot = None
+            iptables_restore(self.logger, pending)
+
+    def reset(self):
+        """
+        Remove all proxies and open ports by flushing the Flocker chains.
+        """
+        for table, chain in FLOCKER_CHAINS:
+            self._iptables(self.logger, [b"--table", table, b"--flush", chain])
+
     def create_proxy_to(self, ip, port):
         """
         Configure iptables to proxy TCP traffic on the given port.
 
         :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
         """
-        return create_proxy_to(self.logger, ip, port)
+        return create_proxy_to(self.logger, ip, port, self._iptables)
 
     def delete_proxy(self, proxy):
         """
@@ -409,20 +735,28 @@ class HostNetwork(object):
 
         :see: :meth:`INetwork.delete_proxy` for parameter documentation.
         """
-        return delete_proxy(self.logger, proxy)
+        return delete_proxy(self.logger, proxy, self._iptables)
 
     def open_port(self, port):
         """
         Configure iptables to allow TCP traffic to the given port.
         """
-        return open_port(self.logger, port)
+        return open_port(self.logger, port, self._iptables)
 
     def delete_open_port(self, port):
-        return delete_open_port(self.logger, port)
+        return delete_open_port(self.logger, port, self._iptables)
 
-    enumerate_proxies = staticmethod(enumerate_proxies)
+    def enumerate_proxies(self):
+        """
+        :see: :meth:`INetwork.enumerate_proxies`
+        """
+        return list(self._current_snapshot().proxies)
 
-    enumerate_open_ports = staticmethod(enumerate_open_ports)
+    def enumerate_open_ports(self):
+        """
+        :see: :meth:`INetwork.enumerate_open_ports`
+        """
+        return list(self._current_snapshot().open_ports)
 
     def enumerate_used_ports(self):
         """
@@ -432,21 +766,20 @@ class HostNetwork(object):
         :see: :meth:`INetwork.enumerate_used_ports` for parameter
             documentation.
         """
-        listening = set(
-            conn.laddr[1]
-            for conn
-            in net_connections(kind='tcp')
-        )
+        if self._used_ports is None:
+            self._used_ports = used_tcp_ports()
+        listening = self._used_ports
+        snapshot = self._current_snapshot()
         proxied = set(
             proxy.port
-            for proxy in self.enumerate_proxies()
+            for proxy in snapshot.proxies
         )
         open_ports = set(
             open_port.port
-            for open_port in self.enumerate_open_ports()
+            for open_port in snapshot.open_ports
         )
-        # net_connections won't tell us about ports bound by sockets that
-        # haven't entered the TCP state graph yet.
+        # The kernel's socket tables won't tell us about ports bound by
+        # sockets that haven't entered the TCP state graph yet.
         return frozenset(listening | proxied | open_ports)
 
 
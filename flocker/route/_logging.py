@@ -46,6 +46,19 @@ IPTABLES = ActionType(
     u"An iptables command which Flocker is executing against the system.")
 
 
+RULES = Field.forTypes(
+    u"rules", [bytes],
+    u"The input given to iptables-restore.")
+
+
+IPTABLES_RESTORE = ActionType(
+    _system(u"iptables_restore"),
+    [RULES],
+    [],
+    u"Flocker is applying a batch of iptables changes to the system in one "
+    u"iptables-restore transaction.")
+
+
 CREATE_PROXY_TO = ActionType(
     _system(u"create_proxy_to"),
     [TARGET_IP, TARGET_PORT],
@@ -72,3 +85,23 @@ DELETE_OPEN_PORT = ActionType(
     [TARGET_PORT],
     [],
     U"Flocker is close a firewall port.")
+
+
+IPSET = ActionType(
+    _system(u"ipset"),
+    [ARGV],
+    [],
+    u"An ipset command which Flocker is executing against the system.")
+
+
+IPSET_COMMANDS = Field.forTypes(
+    u"commands", [bytes],
+    u"The input given to ipset restore.")
+
+
+IPSET_RESTORE = ActionType(
+    _system(u"ipset_restore"),
+    [IPSET_COMMANDS],
+    [],
+    u"Flocker is applying a batch of ipset changes to the system with one "
+    u"ipset restore.")
@@ -4,6 +4,8 @@
 Objects related to an in-memory implementation of ``INetwork``.
 """
 
+from contextlib import contextmanager
+
 from zope.interface import implementer
 from eliot import Logger
 
@@ -42,6 +44,20 @@ class MemoryNetwork(object):
     def delete_open_port(self, open_port):
         self._open_ports.remove(open_port)
 
+    @contextmanager
+    def transaction(self):
+        proxies = set(self._proxies)
+        open_ports = set(self._open_ports)
+        try:
+            yield
+        except:
+            self._proxies = proxies
+            self._open_ports = open_ports
+            raise
+
+    def refresh(self):
+        pass
+
     def enumerate_proxies(self):
         return list(self._proxies)
 
@@ -0,0 +1,62 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_ports -*-
+
+"""
+Discover which TCP ports are in use on a node.
+"""
+
+from psutil import net_connections
+
+from twisted.python.filepath import FilePath
+
+# The kernel's tables of IPv4 and IPv6 TCP sockets for the current network
+# namespace.
+PROC_NET = FilePath(b"/proc/net")
+TCP_TABLES = [b"tcp", b"tcp6"]
+
+
+def parse_tcp_table(lines):
+    """
+    Find the local port numbers of the sockets in a ``/proc/net/tcp`` or
+    ``/proc/net/tcp6`` table.
+
+    :param lines: An iterable of ``bytes``, the lines of the table including
+        its header.
+
+    :return: A generator of ``int`` port numbers.
+    """
+    lines = iter(lines)
+    # Skip the header.
+    next(lines, None)
+    for line in lines:
+        # "   0: 0100007F:0CEA 00000000:0000 0A ..."
+        local_address = line.split(None, 2)[1]
+        yield int(local_address.rsplit(b":", 1)[1], 16)
+
+
+def used_tcp_ports(proc_net=PROC_NET):
+    """
+    Find the local port numbers of all TCP sockets on this node, including
+    listening sockets and both ends of established connections.
+
+    The kernel's socket tables are read line by line, which is far cheaper
+    than ``psutil.net_connections``: that also walks the open files of every
+    process to find each socket's owner, which is irrelevant here.  If the
+    tables are unavailable ``psutil`` is used instead.
+
+    :param FilePath proc_net: The directory holding the socket tables.
+
+    :return: A ``set`` of ``int`` port numbers.
+    """
+    ports = set()
+    try:
+        for name in TCP_TABLES:
+            table = proc_net.child(name)
+            if table.exists():
+                with table.open() as lines:
+                    ports.update(parse_tcp_table(lines))
+            elif name == TCP_TABLES[0]:
+                raise IOError("No TCP table at %s" % (table.path,))
+    except IOError:
+        return set(conn.laddr[1] for conn in net_connections(kind='tcp'))
+    return ports
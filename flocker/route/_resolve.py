@@ -0,0 +1,119 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_resolve -*-
+
+"""
+Resolve the hostnames of proxy targets to addresses, respecting DNS TTLs.
+"""
+
+from ipaddr import IPv4Address, AddressValueError
+
+from eliot import Logger, write_failure
+
+from twisted.names import dns
+
+# Resolved addresses are kept for at least this many seconds, whatever the
+# TTL of the records, so that a zero TTL does not cause a lookup for every
+# convergence iteration.
+MINIMUM_TTL = 5
+
+_logger = Logger()
+
+
+class AddressCache(object):
+    """
+    A cache of the IPv4 addresses of hostnames.
+
+    Lookups never wait for DNS: an expired address continues to be used
+    while it is resolved again in the background, so proxies only change
+    when the resolved address actually changes.
+
+    :ivar reactor: An ``IReactorTime`` provider used to expire addresses.
+    :ivar _resolver: The ``IResolver`` provider to use, or ``None`` to use
+        Twisted's default resolver once it is first needed.
+    :ivar dict _addresses: Map hostnames to tuples of their ``IPv4Address``
+        and the time at which it expires.
+    :ivar dict _resolving: Map hostnames to the ``Deferred`` of their
+        resolution in progress.
+    """
+    def __init__(self, reactor, resolver=None):
+        self.reactor = reactor
+        self._resolver = resolver
+        self._addresses = {}
+        self._resolving = {}
+
+    def lookup(self, hostname):
+        """
+        Find the address of a hostname without waiting.
+
+        If the hostname is not known or its address has expired it is
+        resolved again in the background.
+
+        :param unicode hostname: A hostname or an IPv4 address.
+
+        :return: The ``IPv4Address`` of the hostname, or ``None`` if it has
+            not been resolved yet.
+        """
+        try:
+            return IPv4Address(hostname)
+        except AddressValueError:
+            pass
+        cached = self._addresses.get(hostname)
+        if cached is None or cached[1] <= self.reactor.seconds():
+            self.resolve(hostname)
+            cached = self._addresses.get(hostname, cached)
+        if cached is None:
+            return None
+        return cached[0]
+
+    def resolve(self, hostname):
+        """
+        Resolve a hostname, updating the cache.
+
+        :param unicode hostname: The hostname to resolve.
+
+        :return: A ``Deferred`` which fires with ``None`` when the resolution
+            finishes.  Failures are logged rather than returned, and leave any
+            previously resolved address in place.
+        """
+        if hostname in self._resolving:
+            return self._resolving[hostname]
+        if self._resolver is None:
+            from twisted.names.client import getResolver
+            self._resolver = getResolver()
+        d = self._resolver.lookupAddress(hostname.encode("idna"))
+        d.addCallback(self._resolved, hostname)
+        d.addErrback(write_failure, _logger, u"flocker:route:resolve")
+        d.addBoth(self._finished, hostname)
+        if not d.called:
+            self._resolving[hostname] = d
+        return d
+
+    def _resolved(self, result, hostname):
+        """
+        Record the address found by a lookup.
+
+        If the current address is one of the results it is kept, so that
+        round-robin DNS does not cause proxies to be changed.
+
+        :param result: The three-tuple of answers, authority and additional
+            records from ``lookupAddress``.
+        :param unicode hostname: The hostname which was resolved.
+        """
+        records = [record for record in result[0] if record.type == dns.A]
+        if not records:
+            raise dns.DomainError(hostname)
+        addresses = [IPv4Address(record.payload.dottedQuad())
+                     for record in records]
+        ttl = max(MINIMUM_TTL, min(record.ttl for record in records))
+        address = addresses[0]
+        cached = self._addresses.get(hostname)
+        if cached is not None and cached[0] in addresses:
+            address = cached[0]
+        self._addresses[hostname] = (address, self.reactor.seconds() + ttl)
+
+    def _finished(self, result, hostname):
+        """
+        Forget the completed resolution of a hostname.
+        """
+        self._resolving.pop(hostname, None)
+        return None
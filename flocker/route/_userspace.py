@@ -0,0 +1,351 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_userspace -*-
+
+"""
+An ``INetwork`` implementation which proxies TCP connections in userspace,
+for hosts where NAT based proxying is unavailable.
+"""
+
+from contextlib import contextmanager
+
+from zope.interface import implementer
+from eliot import Logger, write_traceback
+
+from twisted.python.failure import Failure
+from twisted.protocols.portforward import (
+    ProxyClient, ProxyClientFactory, ProxyServer, ProxyFactory,
+)
+
+from ._logging import CREATE_PROXY_TO, DELETE_PROXY
+from ._interfaces import INetwork
+from ._model import Proxy, OpenPort
+from ._ports import used_tcp_ports
+
+# How long, in seconds, connections through a deleted proxy are allowed to
+# finish before they are closed.
+DEFAULT_DRAIN_TIMEOUT = 30
+
+
+class ProxyStatistics(object):
+    """
+    Counters describing the traffic through one userspace proxy.
+
+    :ivar int connections: The number of connections accepted.
+    :ivar int active: The number of connections currently open.
+    :ivar int bytes_received: The number of bytes received from clients and
+        forwarded to the target.
+    :ivar int bytes_sent: The number of bytes received from the target and
+        forwarded to clients.
+    :ivar float connect_time: The total number of seconds spent establishing
+        connections to the target.
+    :ivar int connects: The number of connections established to the target.
+    """
+    def __init__(self):
+        self.connections = 0
+        self.active = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.connect_time = 0.0
+        self.connects = 0
+
+    def mean_connect_latency(self):
+        """
+        :return: The mean number of seconds it took to connect to the target,
+            or ``None`` if no connections have been established.
+        """
+        if self.connects == 0:
+            return None
+        return self.connect_time / self.connects
+
+
+class _CountingProxyClient(ProxyClient):
+    """
+    The connection to the target, counting the bytes sent back to the
+    client.
+    """
+    def connectionMade(self):
+        statistics = self.peer.factory.statistics
+        statistics.connects += 1
+        statistics.connect_time += (
+            self.peer.factory.reactor.seconds() - self.peer.started)
+        ProxyClient.connectionMade(self)
+
+    def dataReceived(self, data):
+        self.peer.factory.statistics.bytes_sent += len(data)
+        ProxyClient.dataReceived(self, data)
+
+
+class _CountingProxyClientFactory(ProxyClientFactory):
+    protocol = _CountingProxyClient
+
+
+class _CountingProxyServer(ProxyServer):
+    """
+    The connection from a client, counting the bytes forwarded to the
+    target.
+
+    :ivar float started: When the client connected.
+    """
+    clientProtocolFactory = _CountingProxyClientFactory
+    noisy = False
+
+    def connectionMade(self):
+        self.reactor = self.factory.reactor
+        self.started = self.reactor.seconds()
+        self.factory.connections.add(self)
+        self.factory.statistics.connections += 1
+        self.factory.statistics.active += 1
+        ProxyServer.connectionMade(self)
+
+    def connectionLost(self, reason):
+        self.factory.connection_lost(self)
+        ProxyServer.connectionLost(self, reason)
+
+    def dataReceived(self, data):
+        self.factory.statistics.bytes_received += len(data)
+        ProxyServer.dataReceived(self, data)
+
+
+class _ProxyFactory(ProxyFactory):
+    """
+    Accept connections for one proxy.
+
+    :ivar reactor: The reactor used to connect to the target.
+    :ivar ProxyStatistics statistics: The statistics for this proxy.
+    :ivar set connections: The ``_CountingProxyServer`` instances for the
+        open connections.
+    :ivar closing: The ``IDelayedCall`` which will close the remaining
+        connections of a deleted proxy, or ``None``.
+    """
+    protocol = _CountingProxyServer
+    noisy = False
+
+    def __init__(self, reactor, host, port):
+        ProxyFactory.__init__(self, host, port)
+        self.reactor = reactor
+        self.statistics = ProxyStatistics()
+        self.connections = set()
+        self.closing = None
+
+    def connection_lost(self, connection):
+        """
+        Forget a connection which has been closed.  Once a deleted proxy has
+        no connections left there is nothing more to close.
+
+        :param _CountingProxyServer connection: The closed connection.
+        """
+        self.connections.discard(connection)
+        self.statistics.active -= 1
+        if not self.connections and self.closing is not None:
+            if self.closing.active():
+                self.closing.cancel()
+            self.closing = None
+
+
+@implementer(INetwork)
+class UserspaceNetwork(object):
+    """
+    An ``INetwork`` implementation which forwards TCP connections with a
+    Twisted proxy running in this process.
+
+    Proxied traffic is visible to the statistics returned by
+    ``proxy_statistics``.  When a proxy is deleted it stops accepting new
+    connections but existing ones are allowed to finish, for up to
+    ``drain_timeout`` seconds.
+
+    Open ports are only recorded; this implementation does not manage the
+    firewall.
+
+    The changes of a transaction are applied one at a time.  If one fails
+    those already applied are undone.  Undoing a deletion listens on the
+    proxy's port again, which fails if the reactor hasn't closed the old
+    listening port yet; that failure is logged and the proxy stays deleted
+    until the next convergence iteration creates it again.
+
+    :ivar reactor: The reactor to listen and connect with.
+    :ivar bytes interface: The address proxies listen on.
+    :ivar float drain_timeout: Seconds to wait for connections through a
+        deleted proxy to finish before closing them.
+    :ivar dict _proxies: Map ``Proxy`` to a tuple of the listening port and
+        the ``_ProxyFactory``.
+    :ivar set _open_ports: The ``OpenPort`` instances which were opened.
+    :ivar list _pending: Changes queued up by the active transaction, as
+        callables accepted by ``_change``, or ``None`` if there is no active
+        transaction.
+    :ivar _used_ports: The ``set`` of TCP ports used by sockets on this
+        node, discovered once per convergence iteration, or ``None``.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, interface=b"",
+                 drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        self.reactor = reactor
+        self.interface = interface
+        self.drain_timeout = drain_timeout
+        self._proxies = {}
+        self._open_ports = set()
+        self._pending = None
+        self._used_ports = None
+
+    def _change(self, change):
+        """
+        Apply a change now, or queue it if a transaction is active.
+
+        :param change: A no-argument callable making the change and returning
+            a no-argument callable which undoes it.
+        """
+        if self._pending is None:
+            change()
+        else:
+            self._pending.append(change)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Queue up changes and apply them when the transaction exits.
+
+        :see: :meth:`INetwork.transaction`
+        """
+        if self._pending is not None:
+            yield
+            return
+        self._pending = []
+        try:
+            yield
+            pending = self._pending
+        finally:
+            self._pending = None
+        undos = []
+        try:
+            for change in pending:
+                undos.append(change())
+        except Exception:
+            failure = Failure()
+            for undo in reversed(undos):
+                try:
+                    undo()
+                except Exception:
+                    write_traceback(
+                        self.logger, u"flocker:route:userspace:rollback")
+            failure.raiseException()
+
+    def refresh(self):
+        self._used_ports = None
+
+    def create_proxy_to(self, ip, port):
+        """
+        Listen on ``port`` and forward connections to ``ip`` on the same
+        port.
+
+        :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
+        """
+        proxy = Proxy(ip=ip, port=port)
+
+        def create():
+            with CREATE_PROXY_TO(
+                    logger=self.logger, target_ip=ip, target_port=port):
+                factory = _ProxyFactory(self.reactor, unicode(ip), port)
+                listening = self.reactor.listenTCP(
+                    port, factory, interface=self.interface)
+                self._proxies[proxy] = (listening, factory)
+
+            def undo():
+                del self._proxies[proxy]
+                listening.stopListening()
+            return undo
+        self._change(create)
+        return proxy
+
+    def delete_proxy(self, proxy):
+        """
+        Stop accepting connections for ``proxy`` and close its remaining
+        connections once ``drain_timeout`` has passed.
+
+        :see: :meth:`INetwork.delete_proxy` for parameter documentation.
+        """
+        def delete():
+            with DELETE_PROXY(
+                    logger=self.logger, target_ip=proxy.ip,
+                    target_port=proxy.port):
+                listening, factory = self._proxies.pop(proxy)
+                listening.stopListening()
+                if factory.connections:
+                    factory.closing = self.reactor.callLater(
+                        self.drain_timeout, self._close, factory)
+
+            def undo():
+                if factory.closing is not None:
+                    factory.closing.cancel()
+                    factory.closing = None
+                listening = self.reactor.listenTCP(
+                    proxy.port, factory, interface=self.interface)
+                self._proxies[proxy] = (listening, factory)
+            return undo
+        self._change(delete)
+
+    def _close(self, factory):
+        """
+        Close the remaining connections through a deleted proxy.
+
+        :param _ProxyFactory factory: The factory of the deleted proxy.
+        """
+        for connection in list(factory.connections):
+            connection.transport.abortConnection()
+
+    def proxy_statistics(self, proxy):
+        """
+        :param Proxy proxy: A proxy created by this object.
+
+        :return: The ``ProxyStatistics`` for the proxy.
+        """
+        return self._proxies[proxy][1].statistics
+
+    def open_port(self, port):
+        open_port = OpenPort(port=port)
+
+        def add():
+            self._open_ports.add(open_port)
+            return lambda: self._open_ports.remove(open_port)
+        self._change(add)
+        return open_port
+
+    def delete_open_port(self, open_port):
+        def remove():
+            self._open_ports.remove(open_port)
+            return lambda: self._open_ports.add(open_port)
+        self._change(remove)
+
+    def enumerate_proxies(self):
+        return list(self._proxies)
+
+    def enumerate_open_ports(self):
+        return list(self._open_ports)
+
+    def enumerate_used_ports(self):
+        """
+        Find all ports that are in use on this node by normal TCP servers or by
+        proxies managed by this object.
+
+        :see: :meth:`INetwork.enumerate_used_ports` for parameter
+            documentation.
+        """
+        if self._used_ports is None:
+            self._used_ports = used_tcp_ports()
+        listening = self._used_ports
+        proxied = set(proxy.port for proxy in self._proxies)
+        open_ports = set(open_port.port for open_port in self._open_ports)
+        return frozenset(listening | proxied | open_ports)
+
+
+def make_userspace_network(reactor=None, interface=b""):
+    """
+    Create a new ``INetwork`` provider which proxies TCP connections in this
+    process.
+
+    :param reactor: The reactor to use; the global reactor by default.
+    :param bytes interface: The address proxies listen on; all addresses by
+        default.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    return UserspaceNetwork(reactor, interface=interface)
@@ -186,4 +186,60 @@ def make_network_tests(make_network):
             self.network.open_port(port_number)
             self.assertIn(port_number, self.network.enumerate_used_ports())
 
+        def test_refresh(self):
+            """
+            :py:meth:`INetwork.refresh` does not lose track of proxies and
+            open ports.
+            """
+            proxy = self.network.create_proxy_to(IPAddress("10.2.3.4"), 2345)
+            open_port = self.network.open_port(3456)
+            self.network.enumerate_used_ports()
+            self.network.refresh()
+            self.assertEqual(
+                ([proxy], [open_port]),
+                (self.network.enumerate_proxies(),
+                 self.network.enumerate_open_ports()))
+
+        def test_transaction_applied(self):
+            """
+            Changes made inside :py:meth:`INetwork.transaction` are applied
+            once the transaction exits successfully.
+            """
+            existing_proxy = self.network.create_proxy_to(
+                IPAddress("10.1.2.3"), 1234)
+            with self.network.transaction():
+                self.network.delete_proxy(existing_proxy)
+                proxy = self.network.create_proxy_to(
+                    IPAddress("10.2.3.4"), 2345)
+                open_port = self.network.open_port(3456)
+            self.assertEqual(
+                ([proxy], [open_port]),
+                (self.network.enumerate_proxies(),
+                 self.network.enumerate_open_ports()))
+
+        def test_transaction_aborted(self):
+            """
+            If an exception is raised inside :py:meth:`INetwork.transaction`,
+            none of the changes made inside it are applied and the exception
+            is propagated.
+            """
+            existing_proxy = self.network.create_proxy_to(
+                IPAddress("10.1.2.3"), 1234)
+
+            class Abort(Exception):
+                pass
+
+            def abort():
+                with self.network.transaction():
+                    self.network.delete_proxy(existing_proxy)
+                    self.network.create_proxy_to(IPAddress("10.2.3.4"), 2345)
+                    self.network.open_port(3456)
+                    raise Abort()
+
+            self.assertRaises(Abort, abort)
+            self.assertEqual(
+                ([existing_proxy], []),
+                (self.network.enumerate_proxies(),
+                 self.network.enumerate_open_ports()))
+
     return NetworkTests
@@ -0,0 +1,38 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for :py:mod:`flocker.route._ipset`.
+"""
+
+from unittest import skipUnless
+
+from twisted.python.procutils import which
+
+from .. import make_ipset_network
+from .networktests import make_network_tests
+from .test_iptables_create import (
+    _dependency_skip, _environment_skip, NOMENCLATURE_INSTALLED,
+)
+
+if NOMENCLATURE_INSTALLED:
+    from .iptables import create_network_namespace
+
+_ipset_skip = skipUnless(
+    which(b"ipset"), "Cannot test open ports without ipset installed.")
+
+
+class IPSetNetworkTests(make_network_tests(make_ipset_network)):
+    """
+    Apply the generic ``INetwork`` test suite to the implementation which
+    uses an ``ipset`` for open ports.
+    """
+    @_dependency_skip
+    @_environment_skip
+    @_ipset_skip
+    def setUp(self):
+        """
+        Arrange for the tests to not corrupt the system network configuration.
+        """
+        self.namespace = create_network_namespace()
+        self.addCleanup(self.namespace.restore)
+        super(IPSetNetworkTests, self).setUp()
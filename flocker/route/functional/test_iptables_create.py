@@ -51,8 +51,9 @@ def create_user_rule():
     """
     check_call([
         b"iptables",
-        # Stick it in the PREROUTING chain based on our knowledge that the
-        # implementation inspects this chain to enumerate proxies.
+        # Stick it in the PREROUTING chain based on our knowledge that older
+        # versions of the implementation inspected this chain to enumerate
+        # proxies.
         b"--table", b"nat", b"--append", b"PREROUTING",
 
         b"--protocol", b"tcp", b"--dport", b"12345",
@@ -367,6 +368,9 @@ class DeleteTests(TestCase):
         deleted using :py:meth:`delete_proxy` the iptables rules which were
         added by the former are removed.
         """
+        # The Flocker chains are created on first use and are not removed
+        # along with the proxy.
+        self.network.enumerate_proxies()
         original_rules = get_iptables_rules()
 
         proxy = self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
@@ -406,6 +410,48 @@ class DeleteTests(TestCase):
             actual)
 
 
+class ChainTests(TestCase):
+    """
+    Tests for the use of dedicated Flocker chains.
+    """
+    @_dependency_skip
+    @_environment_skip
+    def setUp(self):
+        self.addCleanup(create_network_namespace().restore)
+        self.network = make_host_network()
+
+    def test_single_jump(self):
+        """
+        However many proxies and open ports are created, each built-in chain
+        has at most one Flocker rule: the jump to a Flocker chain.
+        """
+        for port in range(12345, 12350):
+            self.network.create_proxy_to(IPAddress("10.1.2.3"), port)
+            self.network.open_port(port)
+        builtin = [
+            rule for rule in get_iptables_rules()
+            if rule.split()[:2] in (
+                [b"-A", b"PREROUTING"], [b"-A", b"OUTPUT"],
+                [b"-A", b"POSTROUTING"], [b"-A", b"FORWARD"],
+                [b"-A", b"INPUT"])]
+        self.assertEqual(
+            [b"FLOCKER-DNAT", b"FLOCKER-DNAT", b"FLOCKER-FORWARD",
+             b"FLOCKER-INPUT", b"FLOCKER-POSTROUTING"],
+            sorted(rule.split()[-1] for rule in builtin))
+
+    def test_reset(self):
+        """
+        ``HostNetwork.reset`` removes all proxies and open ports.
+        """
+        self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
+        self.network.open_port(12345)
+        self.network.reset()
+        self.assertEqual(
+            ([], []),
+            (self.network.enumerate_proxies(),
+             self.network.enumerate_open_ports()))
+
+
 class UsedPortsTests(TestCase):
     """
     Tests for enumeration of used ports.
@@ -0,0 +1,18 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Functional tests for :py:mod:`flocker.route._userspace`.
+"""
+
+from twisted.test.proto_helpers import MemoryReactor
+
+from .. import make_userspace_network
+from .networktests import make_network_tests
+
+
+class UserspaceNetworkInterfaceTests(make_network_tests(
+        lambda: make_userspace_network(reactor=MemoryReactor()))):
+    """
+    Apply the generic ``INetwork`` test suite to the userspace proxy
+    implementation.
+    """
@@ -0,0 +1,198 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._ipset`.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import OpenPort
+from .. import _ipset, _iptables
+from .._ipset import has_set_rule, parse_ipset_save, IPSetNetwork
+from .test_iptables import IPTABLES_SAVE
+
+IPSET_SAVE = b"""\
+create flocker-open-ports bitmap:port range 0-65535
+add flocker-open-ports 22
+add flocker-open-ports 8080
+"""
+
+# ``IPTABLES_SAVE`` with the open ports set matched in ``FLOCKER-INPUT``
+# instead of a rule per port.
+IPSET_IPTABLES_SAVE = IPTABLES_SAVE.replace(
+    b"-A FLOCKER-INPUT -p tcp -m tcp --dport 8080 -j ACCEPT",
+    b"-A FLOCKER-INPUT -p tcp -m set --match-set flocker-open-ports dst "
+    b"-j ACCEPT")
+
+
+class HasSetRuleTests(SynchronousTestCase):
+    """
+    Tests for ``has_set_rule``.
+    """
+    def test_rule(self):
+        """
+        ``has_set_rule`` returns ``True`` if ``FLOCKER-INPUT`` contains the
+        rule matching the open ports set.
+        """
+        self.assertTrue(has_set_rule(IPSET_IPTABLES_SAVE))
+
+    def test_no_rule(self):
+        """
+        ``has_set_rule`` returns ``False`` if ``FLOCKER-INPUT`` does not
+        contain the rule matching the open ports set.
+        """
+        self.assertFalse(has_set_rule(IPTABLES_SAVE))
+
+
+class ParseIPSetSaveTests(SynchronousTestCase):
+    """
+    Tests for ``parse_ipset_save``.
+    """
+    def test_members(self):
+        """
+        Each member of the set is an open port.
+        """
+        self.assertEqual(
+            [OpenPort(port=22), OpenPort(port=8080)],
+            parse_ipset_save(IPSET_SAVE))
+
+    def test_empty(self):
+        """
+        An empty set has no open ports.
+        """
+        self.assertEqual(
+            [],
+            parse_ipset_save(
+                b"create flocker-open-ports bitmap:port range 0-65535\n"))
+
+
+class IPSetNetworkTests(SynchronousTestCase):
+    """
+    Tests for ``IPSetNetwork``.
+    """
+    def setUp(self):
+        self.iptables = []
+        self.ipset = []
+        self.ipset_restores = []
+        self.saves = 0
+        self.iptables_save = IPSET_IPTABLES_SAVE
+
+        def check_output(argv):
+            if argv == [b"iptables-save"]:
+                self.saves += 1
+                return self.iptables_save
+            return {b"ipset": IPSET_SAVE}[argv[0]]
+
+        for module in (_ipset, _iptables):
+            self.patch(module, "check_output", check_output)
+        self.patch(_ipset, "iptables",
+                   lambda logger, argv: self.iptables.append(argv))
+        self.patch(_iptables, "iptables",
+                   lambda logger, argv: self.iptables.append(argv))
+        self.patch(_ipset, "ipset",
+                   lambda logger, argv: self.ipset.append(argv))
+        self.patch(_ipset, "ipset_restore",
+                   lambda logger, commands: self.ipset_restores.append(
+                       commands))
+        self.network = IPSetNetwork()
+
+    def test_set_created(self):
+        """
+        If ``FLOCKER-INPUT`` does not contain the rule matching the set, the
+        open ports set is created when the network is first used.
+        """
+        self.iptables_save = IPTABLES_SAVE
+        self.network.enumerate_open_ports()
+        self.assertEqual(
+            [[b"create", b"flocker-open-ports", b"bitmap:port",
+              b"range", b"0-65535", b"-exist"]],
+            self.ipset)
+
+    def test_set_rule_added(self):
+        """
+        If ``FLOCKER-INPUT`` does not contain the rule matching the set, the
+        chain is flushed and the rule is added.
+        """
+        self.iptables_save = IPTABLES_SAVE
+        self.network.enumerate_open_ports()
+        self.assertEqual(
+            [[b"--table", b"filter", b"--flush", b"FLOCKER-INPUT"],
+             [b"--table", b"filter", b"--append", b"FLOCKER-INPUT",
+              b"--protocol", b"tcp", b"--match", b"set",
+              b"--match-set", b"flocker-open-ports", b"dst",
+              b"--jump", b"ACCEPT"]],
+            self.iptables)
+
+    def test_set_rule_exists(self):
+        """
+        If ``FLOCKER-INPUT`` already contains the rule matching the set, no
+        iptables or ipset commands are run.
+        """
+        self.network.enumerate_open_ports()
+        self.assertEqual(([], []), (self.iptables, self.ipset))
+
+    def test_refresh(self):
+        """
+        After ``IPSetNetwork.refresh`` the open ports set rule is checked
+        again using the same ``iptables-save`` as enumeration.
+        """
+        self.network.enumerate_open_ports()
+        self.network.refresh()
+        self.iptables_save = IPTABLES_SAVE
+        self.network.enumerate_proxies()
+        self.network.enumerate_open_ports()
+        self.assertEqual((2, 2), (self.saves, len(self.iptables)))
+
+    def test_enumerate_open_ports(self):
+        """
+        The open ports are the members of the set.
+        """
+        self.assertEqual(
+            [OpenPort(port=22), OpenPort(port=8080)],
+            self.network.enumerate_open_ports())
+
+    def test_open_port(self):
+        """
+        ``IPSetNetwork.open_port`` adds the port to the set without changing
+        any iptables rules.
+        """
+        result = self.network.open_port(1234)
+        self.assertEqual(
+            (OpenPort(port=1234),
+             [b"add", b"flocker-open-ports", b"1234", b"-exist"], []),
+            (result, self.ipset[-1], self.iptables))
+
+    def test_delete_open_port(self):
+        """
+        ``IPSetNetwork.delete_open_port`` removes the port from the set
+        without changing any iptables rules.
+        """
+        self.network.delete_open_port(OpenPort(port=1234))
+        self.assertEqual(
+            ([b"del", b"flocker-open-ports", b"1234"], []),
+            (self.ipset[-1], self.iptables))
+
+    def test_transaction(self):
+        """
+        Set changes made inside a transaction are applied with a single
+        ``ipset restore`` when it exits.
+        """
+        with self.network.transaction():
+            self.network.open_port(1234)
+            self.network.delete_open_port(OpenPort(port=22))
+        self.assertEqual(
+            [[[b"add", b"flocker-open-ports", b"1234", b"-exist"],
+              [b"del", b"flocker-open-ports", b"22"]]],
+            self.ipset_restores)
+
+    def test_aborted_transaction(self):
+        """
+        Set changes made inside a transaction which raises an exception are
+        not applied.
+        """
+        def abort():
+            with self.network.transaction():
+                self.network.open_port(1234)
+                raise ZeroDivisionError()
+        self.assertRaises(ZeroDivisionError, abort)
+        self.assertEqual(([], []), (self.ipset_restores, self.ipset))
@@ -0,0 +1,351 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._iptables`.
+"""
+
+from subprocess import CalledProcessError
+
+from ipaddr import IPAddress
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import Proxy, OpenPort
+from .. import _iptables
+from .._iptables import (
+    restore_input, setup_commands, IPTablesSnapshot, HostNetwork,
+    _legacy_commands,
+)
+
+# Abbreviated iptables-save output from a host where an older version of
+# Flocker created one proxy and one open port.
+LEGACY_IPTABLES_SAVE = b"""\
+*nat
+:PREROUTING ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+-A PREROUTING -p tcp -m tcp --dport 4567 -m addrtype --dst-type LOCAL \
+-m comment --comment "flocker create_proxy_to" -j DNAT \
+--to-destination 10.1.2.3
+-A PREROUTING -p tcp -m tcp --dport 80 -j DNAT --to-destination 10.0.0.1
+COMMIT
+*filter
+:INPUT ACCEPT [0:0]
+-A INPUT -p tcp -m tcp --dport 8080 -m comment --comment "flocker open_port" \
+-j ACCEPT
+-A INPUT -p tcp -m tcp --dport 22 -j ACCEPT
+COMMIT
+"""
+
+# Abbreviated iptables-save output from a host where the Flocker chains are
+# set up.
+IPTABLES_SAVE = b"""\
+*nat
+:PREROUTING ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:POSTROUTING ACCEPT [0:0]
+:FLOCKER-DNAT - [0:0]
+:FLOCKER-POSTROUTING - [0:0]
+-A PREROUTING -m addrtype --dst-type LOCAL -j FLOCKER-DNAT
+-A OUTPUT -m addrtype --dst-type LOCAL -j FLOCKER-DNAT
+-A POSTROUTING -j FLOCKER-POSTROUTING
+-A FLOCKER-DNAT -p tcp -m tcp --dport 4567 -j DNAT --to-destination 10.1.2.3
+-A FLOCKER-POSTROUTING -p tcp -m tcp --dport 4567 -j MASQUERADE
+COMMIT
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:FLOCKER-FORWARD - [0:0]
+:FLOCKER-INPUT - [0:0]
+-A INPUT -j FLOCKER-INPUT
+-A FORWARD -j FLOCKER-FORWARD
+-A FLOCKER-FORWARD -d 10.1.2.3/32 -p tcp -m tcp --dport 4567 -j ACCEPT
+-A FLOCKER-INPUT -p tcp -m tcp --dport 8080 -j ACCEPT
+COMMIT
+"""
+
+
+class RestoreInputTests(SynchronousTestCase):
+    """
+    Tests for ``restore_input``.
+    """
+    def test_grouped_by_table(self):
+        """
+        Commands are grouped into one section per table, each ending with
+        ``COMMIT``, with the ``--table`` option removed and the order of
+        commands within a table preserved.
+        """
+        commands = [
+            [b"--table", b"nat", b"--append", b"PREROUTING", b"--jump",
+             b"DNAT"],
+            [b"--table", b"filter", b"--insert", b"INPUT", b"--jump",
+             b"ACCEPT"],
+            [b"--append", b"OUTPUT", b"--table", b"nat", b"--jump",
+             b"DNAT"],
+        ]
+        self.assertEqual(
+            b"*nat\n"
+            b"--append PREROUTING --jump DNAT\n"
+            b"--append OUTPUT --jump DNAT\n"
+            b"COMMIT\n"
+            b"*filter\n"
+            b"--insert INPUT --jump ACCEPT\n"
+            b"COMMIT\n",
+            restore_input(commands))
+
+    def test_quoted_arguments(self):
+        """
+        Arguments containing whitespace are quoted.
+        """
+        commands = [
+            [b"--table", b"filter", b"--insert", b"INPUT",
+             b"--match", b"comment", b"--comment", b"flocker create_proxy"],
+        ]
+        self.assertEqual(
+            b"*filter\n"
+            b"--insert INPUT --match comment --comment "
+            b"\"flocker create_proxy\"\n"
+            b"COMMIT\n",
+            restore_input(commands))
+
+    def test_empty(self):
+        """
+        No commands result in empty input.
+        """
+        self.assertEqual(b"", restore_input([]))
+
+
+class SetupCommandsTests(SynchronousTestCase):
+    """
+    Tests for ``setup_commands``.
+    """
+    def test_nothing_set_up(self):
+        """
+        On a host without any Flocker configuration the Flocker chains are
+        created and a single jump to each is added from the built-in chains.
+        """
+        local = [b"--match", b"addrtype", b"--dst-type", b"LOCAL"]
+        self.assertEqual(
+            [[b"--table", b"nat", b"--new-chain", b"FLOCKER-DNAT"],
+             [b"--table", b"nat", b"--new-chain", b"FLOCKER-POSTROUTING"],
+             [b"--table", b"filter", b"--new-chain", b"FLOCKER-FORWARD"],
+             [b"--table", b"filter", b"--new-chain", b"FLOCKER-INPUT"],
+             [b"--table", b"nat", b"--append", b"PREROUTING"] + local +
+             [b"--jump", b"FLOCKER-DNAT"],
+             [b"--table", b"nat", b"--append", b"OUTPUT"] + local +
+             [b"--jump", b"FLOCKER-DNAT"],
+             [b"--table", b"nat", b"--append", b"POSTROUTING",
+              b"--jump", b"FLOCKER-POSTROUTING"],
+             [b"--table", b"filter", b"--insert", b"FORWARD",
+              b"--jump", b"FLOCKER-FORWARD"],
+             [b"--table", b"filter", b"--insert", b"INPUT",
+              b"--jump", b"FLOCKER-INPUT"]],
+            setup_commands(b"*nat\nCOMMIT\n*filter\nCOMMIT\n"))
+
+    def test_already_set_up(self):
+        """
+        No commands are needed if the Flocker chains and jumps exist.
+        """
+        self.assertEqual([], setup_commands(IPTABLES_SAVE))
+
+    def test_legacy_rules_not_deleted(self):
+        """
+        Rules created in the built-in chains by older versions of Flocker
+        are not deleted along with setting up the chains.
+        """
+        commands = setup_commands(LEGACY_IPTABLES_SAVE)
+        self.assertEqual(
+            [], [argv for argv in commands if argv[2] == b"--delete"])
+
+
+class LegacyCommandsTests(SynchronousTestCase):
+    """
+    Tests for ``_legacy_commands``.
+    """
+    def test_legacy_rules_deleted(self):
+        """
+        Rules created in the built-in chains by older versions of Flocker
+        are deleted.
+        """
+        commands = _legacy_commands(LEGACY_IPTABLES_SAVE)
+        self.assertEqual(
+            [(b"nat", b"PREROUTING"), (b"nat", b"POSTROUTING"),
+             (b"nat", b"OUTPUT"), (b"filter", b"FORWARD"),
+             (b"filter", b"INPUT")],
+            [(argv[1], argv[3]) for argv in commands
+             if argv[2] == b"--delete"])
+
+    def test_no_legacy_rules(self):
+        """
+        Nothing is deleted if there are no rules from older versions of
+        Flocker.
+        """
+        self.assertEqual([], _legacy_commands(IPTABLES_SAVE))
+
+
+class IPTablesSnapshotTests(SynchronousTestCase):
+    """
+    Tests for ``IPTablesSnapshot``.
+    """
+    def test_from_iptables_save(self):
+        """
+        ``IPTablesSnapshot.from_iptables_save`` finds the proxies and open
+        ports in the rules of the Flocker chains.
+        """
+        self.assertEqual(
+            IPTablesSnapshot(
+                proxies=[Proxy(ip=IPAddress("10.1.2.3"), port=4567)],
+                open_ports=[OpenPort(port=8080)]),
+            IPTablesSnapshot.from_iptables_save(IPTABLES_SAVE))
+
+    def test_other_chains_ignored(self):
+        """
+        Rules outside the Flocker chains, e.g. those left behind by older
+        versions of Flocker, are not proxies or open ports.
+        """
+        self.assertEqual(
+            IPTablesSnapshot(proxies=[], open_ports=[]),
+            IPTablesSnapshot.from_iptables_save(LEGACY_IPTABLES_SAVE))
+
+
+class HostNetworkSnapshotTests(SynchronousTestCase):
+    """
+    Tests for the snapshot used by ``HostNetwork`` enumeration.
+    """
+    def setUp(self):
+        self.commands = []
+        self.saves = []
+        self.iptables_save = IPTABLES_SAVE
+
+        def check_output(argv):
+            self.assertEqual([b"iptables-save"], argv)
+            self.saves.append(argv)
+            return self.iptables_save
+
+        self.patch(_iptables, "check_output", check_output)
+        self.patch(_iptables, "iptables",
+                   lambda logger, argv: self.commands.append(argv))
+        self.patch(_iptables, "iptables_restore",
+                   lambda logger, commands: self.commands.extend(commands))
+        self.port_scans = 0
+
+        def used_tcp_ports():
+            self.port_scans += 1
+            return {22}
+
+        self.patch(_iptables, "used_tcp_ports", used_tcp_ports)
+        self.network = HostNetwork()
+
+    def enumerate_all(self):
+        """
+        Call every enumeration method of the network.
+        """
+        self.network.enumerate_used_ports()
+        self.network.enumerate_proxies()
+        self.network.enumerate_open_ports()
+
+    def test_single_listing(self):
+        """
+        Setting up the Flocker chains and all enumeration methods are served
+        from a single ``iptables-save``.
+        """
+        self.enumerate_all()
+        self.enumerate_all()
+        self.assertEqual(1, len(self.saves))
+
+    def test_enumerate(self):
+        """
+        The proxies and open ports in the Flocker chains are enumerated.
+        """
+        self.assertEqual(
+            ([Proxy(ip=IPAddress("10.1.2.3"), port=4567)],
+             [OpenPort(port=8080)]),
+            (self.network.enumerate_proxies(),
+             self.network.enumerate_open_ports()))
+
+    def test_refresh(self):
+        """
+        After ``HostNetwork.refresh``, the chains are listed again.
+        """
+        self.enumerate_all()
+        self.network.refresh()
+        self.enumerate_all()
+        self.assertEqual(2, len(self.saves))
+
+    def test_refresh_sets_up_again(self):
+        """
+        After ``HostNetwork.refresh``, the Flocker chains and jumps are
+        checked again and recreated if they were removed.
+        """
+        self.enumerate_all()
+        self.iptables_save = b""
+        self.network.refresh()
+        self.enumerate_all()
+        self.assertEqual(
+            (2, setup_commands(b"")),
+            (len(self.saves), self.commands))
+
+    def test_invalidated_by_change(self):
+        """
+        Changing the iptables configuration causes the chains to be listed
+        again on the next enumeration.
+        """
+        self.enumerate_all()
+        self.network.open_port(1234)
+        self.enumerate_all()
+        self.assertEqual(2, len(self.saves))
+
+    def test_invalidated_by_transaction(self):
+        """
+        Applying a transaction causes the chains to be listed again on the
+        next enumeration.
+        """
+        self.enumerate_all()
+        with self.network.transaction():
+            self.network.open_port(1234)
+        self.enumerate_all()
+        self.assertEqual(
+            (2, 1), (len(self.saves), len(self.commands)))
+
+    def test_used_ports_cached(self):
+        """
+        The TCP sockets on the node are only inspected once until
+        ``HostNetwork.refresh`` is called.
+        """
+        self.enumerate_all()
+        self.enumerate_all()
+        self.network.refresh()
+        self.enumerate_all()
+        self.assertEqual(
+            (2, frozenset({22, 4567, 8080})),
+            (self.port_scans, self.network.enumerate_used_ports()))
+
+    def test_legacy_rules_deleted_separately(self):
+        """
+        Rules left behind by older versions of Flocker are deleted one at a
+        time after the Flocker chains have been set up, and a deletion
+        failing stops neither the others nor enumeration.
+        """
+        self.iptables_save = LEGACY_IPTABLES_SAVE
+        deleted = []
+
+        def iptables(logger, argv):
+            deleted.append(argv)
+            raise CalledProcessError(1, argv)
+        self.patch(_iptables, "iptables", iptables)
+        self.enumerate_all()
+        self.assertEqual(
+            (setup_commands(LEGACY_IPTABLES_SAVE),
+             _legacy_commands(LEGACY_IPTABLES_SAVE), []),
+            (self.commands, deleted, self.network.enumerate_proxies()))
+
+    def test_reset(self):
+        """
+        ``HostNetwork.reset`` flushes each of the Flocker chains.
+        """
+        self.network.reset()
+        self.assertEqual(
+            [[b"--table", b"nat", b"--flush", b"FLOCKER-DNAT"],
+             [b"--table", b"nat", b"--flush", b"FLOCKER-POSTROUTING"],
+             [b"--table", b"filter", b"--flush", b"FLOCKER-FORWARD"],
+             [b"--table", b"filter", b"--flush", b"FLOCKER-INPUT"]],
+            self.commands)
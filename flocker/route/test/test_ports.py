@@ -0,0 +1,90 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._ports`.
+"""
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import _ports
+from .._ports import parse_tcp_table, used_tcp_ports
+
+TCP = b"""\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt\
+   uid  timeout inode
+   0: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 00:00000000 00000000\
+     0        0 16411 1 0000000000000000 100 0 0 10 0
+   1: 0100007F:D431 0100007F:0CEA 01 00000000:00000000 00:00000000 00000000\
+  1000        0 16412 1 0000000000000000 20 4 30 10 -1
+"""
+
+TCP6 = b"""\
+  sl  local_address                         remote_address                \
+        st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000000000000000000000000000:0016 00000000000000000000000000000000\
+:0000 0A 00000000:00000000 00:00000000 00000000     0        0 14253 1 \
+0000000000000000 100 0 0 10 0
+"""
+
+
+class ParseTCPTableTests(SynchronousTestCase):
+    """
+    Tests for ``parse_tcp_table``.
+    """
+    def test_ipv4(self):
+        """
+        The local port of each IPv4 socket is found, whatever its state.
+        """
+        self.assertEqual(
+            [3306, 54321], list(parse_tcp_table(TCP.splitlines())))
+
+    def test_ipv6(self):
+        """
+        The local port of each IPv6 socket is found.
+        """
+        self.assertEqual([22], list(parse_tcp_table(TCP6.splitlines())))
+
+    def test_empty(self):
+        """
+        A table with only a header, or no lines at all, has no ports.
+        """
+        self.assertEqual(
+            ([], []),
+            (list(parse_tcp_table(TCP.splitlines()[:1])),
+             list(parse_tcp_table([]))))
+
+
+class UsedTCPPortsTests(SynchronousTestCase):
+    """
+    Tests for ``used_tcp_ports``.
+    """
+    def setUp(self):
+        self.proc_net = FilePath(self.mktemp())
+        self.proc_net.makedirs()
+
+    def test_tables(self):
+        """
+        The ports from both the IPv4 and IPv6 tables are returned.
+        """
+        self.proc_net.child(b"tcp").setContent(TCP)
+        self.proc_net.child(b"tcp6").setContent(TCP6)
+        self.assertEqual({22, 3306, 54321}, used_tcp_ports(self.proc_net))
+
+    def test_no_ipv6(self):
+        """
+        If there is no IPv6 table only the IPv4 table is used.
+        """
+        self.proc_net.child(b"tcp").setContent(TCP)
+        self.assertEqual({3306, 54321}, used_tcp_ports(self.proc_net))
+
+    def test_fallback(self):
+        """
+        If the kernel's socket tables are unavailable the ports reported by
+        ``psutil`` are used.
+        """
+        class Connection(object):
+            laddr = (b"127.0.0.1", 1234)
+
+        self.patch(_ports, "net_connections", lambda kind: [Connection()])
+        self.assertEqual({1234}, used_tcp_ports(self.proc_net))
@@ -0,0 +1,143 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._resolve`.
+"""
+
+from ipaddr import IPv4Address
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.names import dns
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import AddressCache
+from .._resolve import MINIMUM_TTL
+
+
+class FakeResolver(object):
+    """
+    An ``IResolver`` whose ``lookupAddress`` results are fired by the test.
+
+    :ivar list lookups: Tuples of the name and ``Deferred`` of each lookup.
+    """
+    def __init__(self):
+        self.lookups = []
+
+    def lookupAddress(self, name, timeout=None):
+        d = Deferred()
+        self.lookups.append((name, d))
+        return d
+
+
+def answer(addresses, ttl=60):
+    """
+    Create a ``lookupAddress`` result.
+
+    :param list addresses: The addresses, as ``bytes``, to return in A
+        records.
+    :param int ttl: The TTL of the records.
+    """
+    return ([dns.RRHeader(b"example.com", dns.A, ttl=ttl,
+                          payload=dns.Record_A(address, ttl=ttl))
+             for address in addresses], [], [])
+
+
+class AddressCacheTests(SynchronousTestCase):
+    """
+    Tests for ``AddressCache``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.resolver = FakeResolver()
+        self.cache = AddressCache(self.clock, self.resolver)
+
+    def test_address(self):
+        """
+        An IPv4 address is returned as is, without a lookup.
+        """
+        self.assertEqual(
+            (IPv4Address(u"192.0.2.1"), []),
+            (self.cache.lookup(u"192.0.2.1"), self.resolver.lookups))
+
+    def test_unresolved(self):
+        """
+        ``AddressCache.lookup`` of a hostname which has not been resolved
+        returns ``None`` and starts resolving it.
+        """
+        result = self.cache.lookup(u"example.com")
+        self.assertEqual(
+            (None, [b"example.com"]),
+            (result, [name for name, d in self.resolver.lookups]))
+
+    def test_single_lookup(self):
+        """
+        Only one lookup of a hostname is in progress at a time.
+        """
+        self.cache.lookup(u"example.com")
+        self.cache.lookup(u"example.com")
+        self.assertEqual(1, len(self.resolver.lookups))
+
+    def test_resolved(self):
+        """
+        Once resolved, the address of a hostname is returned without another
+        lookup until its TTL passes.
+        """
+        self.cache.lookup(u"example.com")
+        self.resolver.lookups[0][1].callback(answer([b"192.0.2.1"], ttl=60))
+        self.clock.advance(59)
+        self.assertEqual(
+            (IPv4Address(u"192.0.2.1"), 1),
+            (self.cache.lookup(u"example.com"), len(self.resolver.lookups)))
+
+    def test_expired(self):
+        """
+        After the TTL passes the old address is still returned while the
+        hostname is resolved again, and the new address is returned once
+        that finishes.
+        """
+        self.cache.lookup(u"example.com")
+        self.resolver.lookups[0][1].callback(answer([b"192.0.2.1"], ttl=60))
+        self.clock.advance(60)
+        stale = self.cache.lookup(u"example.com")
+        self.resolver.lookups[1][1].callback(answer([b"192.0.2.2"]))
+        self.assertEqual(
+            (IPv4Address(u"192.0.2.1"), IPv4Address(u"192.0.2.2")),
+            (stale, self.cache.lookup(u"example.com")))
+
+    def test_minimum_ttl(self):
+        """
+        Addresses are kept for at least ``MINIMUM_TTL`` seconds.
+        """
+        self.cache.lookup(u"example.com")
+        self.resolver.lookups[0][1].callback(answer([b"192.0.2.1"], ttl=0))
+        self.clock.advance(MINIMUM_TTL - 1)
+        self.cache.lookup(u"example.com")
+        self.assertEqual(1, len(self.resolver.lookups))
+
+    def test_current_address_kept(self):
+        """
+        If the current address is among the addresses returned by a new
+        lookup it continues to be used.
+        """
+        self.cache.lookup(u"example.com")
+        self.resolver.lookups[0][1].callback(answer([b"192.0.2.2"]))
+        self.clock.advance(60)
+        self.cache.lookup(u"example.com")
+        self.resolver.lookups[1][1].callback(
+            answer([b"192.0.2.1", b"192.0.2.2"]))
+        self.assertEqual(
+            IPv4Address(u"192.0.2.2"), self.cache.lookup(u"example.com"))
+
+    def test_failure_keeps_address(self):
+        """
+        If a lookup fails the previously resolved address continues to be
+        used.
+        """
+        self.cache.lookup(u"example.com")
+        self.resolver.lookups[0][1].callback(answer([b"192.0.2.1"]))
+        self.clock.advance(60)
+        self.cache.lookup(u"example.com")
+        self.resolver.lookups[1][1].errback(dns.DomainError(b"example.com"))
+        self.assertEqual(
+            IPv4Address(u"192.0.2.1"), self.cache.lookup(u"example.com"))
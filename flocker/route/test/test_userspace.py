@@ -0,0 +1,300 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._userspace`.
+"""
+
+from ipaddr import IPAddress
+
+from eliot.testing import validate_logging
+
+from twisted.internet import reactor
+from twisted.internet.address import IPv4Address
+from twisted.internet.defer import Deferred, gatherResults
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.error import CannotListenError
+from twisted.internet.protocol import Factory, Protocol
+from twisted.test.proto_helpers import MemoryReactor, StringTransport
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from ...testtools import MemoryCoreReactor
+from .. import make_userspace_network
+
+# The proxies listen on one loopback address and forward to another, so the
+# proxy and its target can use the same port number.
+PROXY_ADDRESS = b"127.0.0.1"
+TARGET_ADDRESS = IPAddress("127.0.0.2")
+
+
+class Echo(Protocol):
+    """
+    Send back everything that is received.
+
+    :ivar Deferred lost: Fires when the connection is lost.
+    """
+    def __init__(self):
+        self.lost = Deferred()
+
+    def dataReceived(self, data):
+        self.transport.write(data)
+
+    def connectionLost(self, reason):
+        self.lost.callback(None)
+
+
+class Collect(Protocol):
+    """
+    Collect received data, firing ``received`` once ``expected`` bytes have
+    arrived and ``lost`` when the connection is lost.
+    """
+    def __init__(self, expected):
+        self.expected = expected
+        self.data = b""
+        self.received = Deferred()
+        self.lost = Deferred()
+
+    def dataReceived(self, data):
+        self.data += data
+        if len(self.data) == self.expected:
+            self.received.callback(self.data)
+
+    def connectionLost(self, reason):
+        self.lost.callback(None)
+
+
+class UserspaceProxyTests(TestCase):
+    """
+    Tests for proxying through ``UserspaceNetwork``.
+    """
+    def setUp(self):
+        self.echoes = []
+
+        def echo():
+            self.echoes.append(Echo())
+            return self.echoes[-1]
+
+        target = reactor.listenTCP(
+            0, Factory.forProtocol(echo), interface=TARGET_ADDRESS.exploded)
+        self.addCleanup(target.stopListening)
+        self.port = target.getHost().port
+        self.network = make_userspace_network(interface=PROXY_ADDRESS)
+        self.proxy = self.network.create_proxy_to(TARGET_ADDRESS, self.port)
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        """
+        Delete the proxy if the test did not and wait for the target's
+        connections to close.
+        """
+        if self.proxy in self.network.enumerate_proxies():
+            self.network.delete_proxy(self.proxy)
+        return gatherResults([echo.lost for echo in self.echoes])
+
+    def connect(self, expected):
+        """
+        Connect to the proxy.
+
+        :param int expected: The number of bytes the client expects.
+
+        :return: ``Deferred`` firing with the connected ``Collect``.
+        """
+        endpoint = TCP4ClientEndpoint(reactor, PROXY_ADDRESS, self.port)
+        client = Collect(expected)
+        return endpoint.connect(Factory.forProtocol(lambda: client))
+
+    def test_forwarded(self):
+        """
+        Data sent to the proxy reaches the target, and the target's response
+        reaches the client.
+        """
+        d = self.connect(5)
+
+        def connected(client):
+            client.transport.write(b"hello")
+            client.received.addCallback(
+                lambda data: client.transport.loseConnection() or data)
+            return client.received
+        d.addCallback(connected)
+        d.addCallback(self.assertEqual, b"hello")
+        return d
+
+    def test_statistics(self):
+        """
+        ``UserspaceNetwork.proxy_statistics`` reports connections and bytes
+        through the proxy.
+        """
+        d = self.connect(5)
+
+        def connected(client):
+            client.transport.write(b"hello")
+            client.received.addCallback(
+                lambda _: client.transport.loseConnection())
+            return client.received.addCallback(lambda _: client.lost)
+        d.addCallback(connected)
+
+        def check(_):
+            statistics = self.network.proxy_statistics(self.proxy)
+            self.assertEqual(
+                (1, 5, 5, 1),
+                (statistics.connections, statistics.bytes_received,
+                 statistics.bytes_sent, statistics.connects))
+            self.assertIsNot(None, statistics.mean_connect_latency())
+        d.addCallback(check)
+        return d
+
+    def test_draining(self):
+        """
+        Connections established before ``delete_proxy`` keep working until
+        they finish.
+        """
+        d = self.connect(10)
+
+        def connected(client):
+            client.transport.write(b"hello")
+            self.network.delete_proxy(self.proxy)
+            client.transport.write(b"world")
+            client.received.addCallback(
+                lambda data: client.transport.loseConnection() or data)
+            return client.received
+        d.addCallback(connected)
+        d.addCallback(self.assertEqual, b"helloworld")
+        return d
+
+
+class DrainTimeoutTests(SynchronousTestCase):
+    """
+    Tests for closing connections through a deleted proxy.
+    """
+    def test_closed_after_timeout(self):
+        """
+        Connections still open ``drain_timeout`` seconds after the proxy is
+        deleted are aborted.
+        """
+        memory = MemoryReactor()
+        network = make_userspace_network(reactor=memory)
+        network.drain_timeout = 10
+        proxy = network.create_proxy_to(TARGET_ADDRESS, 1234)
+        factory = memory.tcpServers[0][1]
+
+        aborted = []
+
+        class Transport(object):
+            def abortConnection(self):
+                aborted.append(True)
+
+        class Connection(object):
+            transport = Transport()
+
+        factory.connections.add(Connection())
+        delayed = []
+        memory.callLater = lambda *args: delayed.append(args)
+        network.delete_proxy(proxy)
+        timeout, close, closed_factory = delayed[0]
+        close(closed_factory)
+        self.assertEqual((10, [True]), (timeout, aborted))
+
+
+class ConnectLatencyTests(SynchronousTestCase):
+    """
+    Tests for the connection latency reported by ``ProxyStatistics``.
+    """
+    def test_reactor_time(self):
+        """
+        The latency of connecting to the target is measured with the
+        reactor's clock.
+        """
+        memory = MemoryCoreReactor()
+        network = make_userspace_network(reactor=memory)
+        proxy = network.create_proxy_to(TARGET_ADDRESS, 1234)
+        factory = memory.tcpServers[0][1]
+        server = factory.buildProtocol(IPv4Address("TCP", "10.0.0.1", 5678))
+        server.makeConnection(StringTransport())
+        memory.advance(2.5)
+        client_factory = memory.tcpClients[0][2]
+        client = client_factory.buildProtocol(
+            IPv4Address("TCP", TARGET_ADDRESS.exploded, 1234))
+        client.makeConnection(StringTransport())
+        self.assertEqual(
+            2.5, network.proxy_statistics(proxy).mean_connect_latency())
+
+
+class RefusingReactor(MemoryCoreReactor):
+    """
+    A fake reactor which keeps track of the ports being listened on and
+    refuses to listen on some of them.
+
+    :ivar set refused: Port numbers ``listenTCP`` fails for.
+    :ivar set listening: Port numbers being listened on.
+    """
+    def __init__(self, refused):
+        MemoryCoreReactor.__init__(self)
+        self.refused = refused
+        self.listening = set()
+
+    def listenTCP(self, port, factory, backlog=50, interface=''):
+        if port in self.refused or port in self.listening:
+            raise CannotListenError(interface, port, None)
+        MemoryCoreReactor.listenTCP(self, port, factory, backlog, interface)
+        self.listening.add(port)
+        reactor = self
+
+        class Port(object):
+            def stopListening(self):
+                reactor.listening.remove(port)
+        return Port()
+
+
+class TransactionRollbackTests(SynchronousTestCase):
+    """
+    Tests for undoing the changes of a ``UserspaceNetwork`` transaction
+    which failed part way through being applied.
+    """
+    def setUp(self):
+        self.reactor = RefusingReactor({3456})
+        self.network = make_userspace_network(reactor=self.reactor)
+        self.existing_proxy = self.network.create_proxy_to(
+            TARGET_ADDRESS, 1234)
+        self.existing_port = self.network.open_port(5000)
+
+    def apply(self):
+        """
+        Apply a transaction which deletes the existing proxy and open port,
+        and creates a proxy and an open port before creating a proxy on a
+        refused port.
+
+        :return: The ``CannotListenError`` the transaction failed with.
+        """
+        def change():
+            with self.network.transaction():
+                self.network.delete_proxy(self.existing_proxy)
+                self.network.delete_open_port(self.existing_port)
+                self.network.create_proxy_to(TARGET_ADDRESS, 2345)
+                self.network.open_port(6000)
+                self.network.create_proxy_to(TARGET_ADDRESS, 3456)
+        return self.assertRaises(CannotListenError, change)
+
+    def test_rolled_back(self):
+        """
+        If applying a change fails, the changes applied before it are undone
+        and the error is propagated.
+        """
+        error = self.apply()
+        self.assertEqual(
+            (3456, [self.existing_proxy], [self.existing_port], {1234}),
+            (error.port, self.network.enumerate_proxies(),
+             self.network.enumerate_open_ports(), self.reactor.listening))
+
+    @validate_logging(None)
+    def test_rollback_failure_logged(self, logger):
+        """
+        If undoing a change fails the failure is logged, the other changes
+        are still undone and the original error is propagated.
+        """
+        self.patch(self.network, "logger", logger)
+        self.reactor.refused.add(1234)
+        error = self.apply()
+        self.assertEqual(
+            (3456, [], [self.existing_port], set(), 1),
+            (error.port, self.network.enumerate_proxies(),
+             self.network.enumerate_open_ports(), self.reactor.listening,
+             len(logger.flushTracebacks(CannotListenError))))
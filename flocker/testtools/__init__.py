@@ -51,17 +51,44 @@ from ..common.script import (
 @implementer(IProcessTransport)
 class FakeProcessTransport(object):
     """
-    Mock process transport to observe signals sent to a process.
+    Mock process transport to observe signals sent to a process, data
+    written to its standard input and its flow control.
 
     @ivar signals: L{list} of signals sent to process.
+    @ivar data: L{bytes} written to the process's standard input.
+    @ivar stdin_closed: Whether the process's standard input was closed.
+    @ivar producer: The producer registered with the transport, or L{None}.
+    @ivar paused: Whether reading from the process is paused.
     """
 
     def __init__(self):
         self.signals = []
+        self.data = b""
+        self.stdin_closed = False
+        self.producer = None
+        self.paused = False
 
     def signalProcess(self, signal):
         self.signals.append(signal)
 
+    def write(self, data):
+        self.data += data
+
+    def closeStdin(self):
+        self.stdin_closed = True
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
 
 class SpawnProcessArguments(namedtuple(
                             'ProcessData',
@@ -689,13 +716,14 @@ from twisted.internet.base import _ThreePhaseEvent
 
 
 @implementer(IReactorCore)
-class MemoryCoreReactor(MemoryReactor):
+class MemoryCoreReactor(MemoryReactor, Clock):
     """
-    Fake reactor with listenTCP and just enough of an implementation of
-    IReactorCore.
+    Fake reactor with listenTCP, a fake clock and just enough of an
+    implementation of IReactorCore.
     """
     def __init__(self):
         MemoryReactor.__init__(self)
+        Clock.__init__(self)
         self._triggers = {}
 
     def addSystemEventTrigger(self, phase, eventType, callable, *args, **kw):
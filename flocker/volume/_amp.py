@@ -0,0 +1,785 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_amp -*-
+
+"""
+Agent-to-agent volume transfer protocol.
+
+``RemoteVolumeManager`` runs ``flocker-volume`` over SSH for every
+operation, paying for an SSH handshake and a Python interpreter start-up on
+the remote node each time.  The AMP protocol here lets the volume manager
+of one node talk to another node's over a single long-lived connection
+instead, with snapshot listing, ownership changes and volume data all
+multiplexed over it.
+
+Anyone who can talk the protocol to a node can make it take ownership of
+volumes or overwrite its replicas, so ``VolumeTransferService`` only
+accepts TLS connections from peers presenting a certificate signed by the
+cluster's certificate authority; see ``volume_transfer_tls_options``.
+"""
+
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+from itertools import count
+from Queue import Queue
+
+from zope.interface import implementer
+
+from twisted.application.internet import StreamServerEndpointService
+from twisted.application.service import MultiService
+from twisted.internet.defer import Deferred, fail, gatherResults, succeed
+from twisted.internet.endpoints import SSL4ServerEndpoint, connectProtocol
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.protocol import ServerFactory
+from twisted.internet.ssl import (
+    Certificate, CertificateOptions, PrivateCertificate,
+)
+from twisted.internet.threads import blockingCallFromThread
+from twisted.python.failure import Failure
+from twisted.protocols.amp import (
+    AMP, Boolean, Command, Integer, ListOf, String, Unicode, UnhandledCommand,
+)
+
+from ._ipc import IRemoteVolumeManager
+from ._compression import available_compressions
+from ._transfer import ThreadedTransfers
+from .filesystems.zfs import Snapshot
+from .service import Volume, VolumeName
+
+# AMP values are limited to 65535 bytes, so volume data is sent in pieces
+# no bigger than this.
+MAXIMUM_DATA_SIZE = 60 * 1024
+
+
+class VolumeSnapshotsCommand(Command):
+    """
+    List the snapshots of a volume.
+    """
+    arguments = [('node_id', Unicode()),
+                 ('name', String())]
+    response = [('snapshots', ListOf(String()))]
+
+
+class AcquireVolumeCommand(Command):
+    """
+    Take ownership of a volume.
+    """
+    arguments = [('node_id', Unicode()),
+                 ('name', String())]
+    response = [('node_id', Unicode())]
+    errors = {ValueError: 'VALUE_ERROR'}
+
+
+class CloneVolumeCommand(Command):
+    """
+    Clone a volume to create a new one.
+    """
+    arguments = [('node_id', Unicode()),
+                 ('parent_name', String()),
+                 ('name', String())]
+    response = []
+
+
+class CompressionsCommand(Command):
+    """
+    List the compressions volume data can be received with.
+    """
+    arguments = []
+    response = [('compressions', ListOf(String()))]
+
+
+class ResumeTokenCommand(Command):
+    """
+    Get the token of an interrupted receive of a volume.
+    """
+    arguments = [('node_id', Unicode()),
+                 ('name', String())]
+    response = [('token', String(optional=True))]
+
+
+class StartReceiveCommand(Command):
+    """
+    Start receiving a volume's data.  The data follows in
+    ``ReceiveDataCommand``\ s with the same transfer identifier.
+    """
+    arguments = [('transfer', Integer()),
+                 ('node_id', Unicode()),
+                 ('name', String()),
+                 ('compression', String(optional=True)),
+                 ('resume', Boolean(optional=True))]
+    response = []
+    errors = {KeyError: 'UNKNOWN_TRANSFER'}
+
+
+class ReceiveDataCommand(Command):
+    """
+    Some of the data of a volume being received.
+    """
+    arguments = [('transfer', Integer()),
+                 ('data', String())]
+    response = []
+    errors = {KeyError: 'UNKNOWN_TRANSFER', IOError: 'RECEIVE_FAILED'}
+
+
+class FinishReceiveCommand(Command):
+    """
+    Finish receiving a volume's data.  The response is sent once the data
+    has been written to the volume.
+    """
+    arguments = [('transfer', Integer()),
+                 ('succeeded', Boolean())]
+    response = []
+    errors = {KeyError: 'UNKNOWN_TRANSFER', ValueError: 'VALUE_ERROR',
+              IOError: 'RECEIVE_FAILED'}
+
+
+class _ReceiveStream(object):
+    """
+    A file-like object from which ``VolumeService.receive`` reads, in a
+    transfer thread, the data delivered by ``ReceiveDataCommand``\ s in the
+    reactor thread.
+
+    The ``Deferred`` returned by ``feed`` fires once the receiving thread
+    has taken the data, so a sender waiting for responses can not get far
+    ahead of the filesystem writer.
+    """
+    def __init__(self, reactor):
+        """
+        :param reactor: The reactor whose thread ``feed`` is called in.
+        """
+        self._reactor = reactor
+        self._queue = Queue()
+        self._buffer = b""
+        self._eof = False
+        self._aborted = False
+        self._closed = False
+
+    def feed(self, data):
+        """
+        Add some data to the stream.
+
+        :param bytes data: The data.
+
+        :return: ``Deferred`` that fires when the data has been read.
+        """
+        if self._closed:
+            return fail(IOError("Volume receive has already finished."))
+        consumed = Deferred()
+        self._queue.put((data, consumed))
+        return consumed
+
+    def finish(self):
+        """
+        Mark the end of the data.
+        """
+        self._queue.put((b"", None))
+
+    def abort(self):
+        """
+        Make reading fail, so the filesystem writer discards what it has
+        received.
+        """
+        self._queue.put((None, None))
+
+    def closed(self, result):
+        """
+        The receive has finished.  Fail any data it did not read.
+
+        :param result: The result of the receive, which is passed through.
+        """
+        self._closed = True
+        while not self._queue.empty():
+            data, consumed = self._queue.get()
+            if consumed is not None:
+                consumed.errback(
+                    IOError("Volume receive finished before reading data."))
+        return result
+
+    def _fill(self):
+        """
+        Block until there is data in the buffer or the end of the stream has
+        been reached.
+        """
+        while not self._buffer and not self._eof:
+            if self._aborted:
+                raise IOError("Volume transfer was aborted.")
+            data, consumed = self._queue.get()
+            if data is None:
+                self._aborted = True
+                continue
+            if consumed is not None:
+                self._reactor.callFromThread(consumed.callback, None)
+            if not data:
+                self._eof = True
+            self._buffer = data
+
+    def read(self, size=-1):
+        """
+        Read data from the stream, blocking until some is available.
+
+        :param int size: The maximum number of bytes to read, or a negative
+            number to read everything until the end of the stream.
+
+        :return: ``bytes``, empty at the end of the stream.
+        """
+        if size < 0:
+            return b"".join(iter(lambda: self.read(MAXIMUM_DATA_SIZE), b""))
+        self._fill()
+        result, self._buffer = self._buffer[:size], self._buffer[size:]
+        return result
+
+
+@implementer(IPushProducer)
+class _ReceiverFeed(object):
+    """
+    Write the data delivered by ``ReceiveDataCommand``\ s straight to the
+    ``IFilesystemReceiver`` returned by ``VolumeService.receiver``, in the
+    reactor thread.
+
+    The feed registers itself as the receiver's producer.  While the
+    receiver has it paused, the ``Deferred``\ s returned by ``feed`` don't
+    fire, so a sender waiting for responses waits for the filesystem to
+    catch up too.
+
+    :ivar Deferred receiving: Fires with the result of the receive.
+    """
+    def __init__(self):
+        self.receiving = Deferred()
+        self._receiver = None
+        self._paused = False
+        self._waiting = []
+        self._closed = False
+        self._ended = False
+
+    def start(self, receiving):
+        """
+        Start feeding a receiver.
+
+        :param Deferred receiving: The result of ``VolumeService.receiver``.
+
+        :return: ``Deferred`` that fires when data can be fed.
+        """
+        def started(receiver):
+            if self._ended:
+                # The transfer ended while the receiver was being set up.
+                receiver.abort().chainDeferred(self.receiving)
+                return
+            self._receiver = receiver
+            receiver.registerProducer(self, True)
+
+        def failed(reason):
+            self._ended = True
+            self._close(IOError("Volume receive has already finished."))
+            self.receiving.errback(reason)
+        receiving.addCallbacks(started, failed)
+        return receiving
+
+    def feed(self, data):
+        """
+        Write some data to the receiver.
+
+        :param bytes data: The data.
+
+        :return: ``Deferred`` that fires when the receiver can take more
+            data.
+        """
+        if self._closed:
+            return fail(IOError("Volume receive has already finished."))
+        self._receiver.write(data)
+        if not self._paused:
+            return succeed(None)
+        waiting = Deferred()
+        self._waiting.append(waiting)
+        return waiting
+
+    def finish(self):
+        """
+        Mark the end of the data.
+        """
+        self._end(lambda receiver: receiver.finish())
+
+    def abort(self):
+        """
+        Interrupt the receive, so the filesystem discards what it has
+        received or keeps it to be resumed.
+        """
+        self._end(lambda receiver: receiver.abort())
+
+    def _end(self, end):
+        """
+        Stop feeding the receiver and end the receive.
+
+        :param end: A one-argument callable which ends the receive given the
+            receiver, returning a ``Deferred``.
+        """
+        if self._ended:
+            return
+        self._ended = True
+        self._close(IOError("Volume receive finished before reading data."))
+        if self._receiver is not None:
+            self._receiver.unregisterProducer()
+            end(self._receiver).chainDeferred(self.receiving)
+
+    def _close(self, exception):
+        """
+        Fail any data still waiting for the receiver, and any more that is
+        fed.
+
+        :param exception: The exception to fail with.
+        """
+        self._closed = True
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.errback(exception)
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(None)
+
+    def stopProducing(self):
+        # The receiver has gone away, e.g. ``zfs receive`` exited; the
+        # result of the receive says why.
+        self._close(IOError("Volume receive has already finished."))
+
+
+def _no_delay(transport):
+    """
+    Disable Nagle's algorithm on a connection's transport, if it is TCP.
+
+    Every piece of volume data is a small command waiting for an even
+    smaller response; with Nagle's algorithm and delayed ACKs each of those
+    round trips takes tens of milliseconds.
+
+    :param transport: The transport of the connection.
+    """
+    set_no_delay = getattr(transport, "setTcpNoDelay", None)
+    if set_no_delay is not None:
+        set_no_delay(True)
+
+
+class _VolumeTransferServerProtocol(AMP):
+    """
+    The receiving side of the volume transfer protocol.
+
+    Uncompressed data is fed straight to the volume's filesystem by a
+    ``_ReceiverFeed``.  Decompressing is blocking, so compressed data is
+    instead read from a ``_ReceiveStream`` by ``VolumeService.receive`` in a
+    transfer thread.
+
+    :ivar dict _receives: Map transfer identifiers to a ``tuple`` of the
+        ``_ReceiverFeed`` or ``_ReceiveStream`` and the ``Deferred`` result
+        of the receive.
+    """
+    def __init__(self, reactor, volume_service, transfers):
+        """
+        :param reactor: The reactor.
+        :param VolumeService volume_service: The local volume manager.
+        :param transfers: A ``ThreadedTransfers`` to run receives in.
+        """
+        AMP.__init__(self)
+        self._reactor = reactor
+        self._volume_service = volume_service
+        self._transfers = transfers
+        self._receives = {}
+
+    def _volume(self, node_id, name):
+        return Volume(node_id=node_id, name=VolumeName.from_bytes(name),
+                      service=self._volume_service)
+
+    @VolumeSnapshotsCommand.responder
+    def snapshots(self, node_id, name):
+        d = self._volume(node_id, name).get_filesystem().snapshots()
+        d.addCallback(lambda snapshots: {
+            "snapshots": [snapshot.name for snapshot in snapshots]})
+        return d
+
+    @AcquireVolumeCommand.responder
+    def acquire(self, node_id, name):
+        d = self._volume_service.acquire(node_id, VolumeName.from_bytes(name))
+        d.addCallback(lambda _: {"node_id": self._volume_service.node_id})
+        return d
+
+    @CloneVolumeCommand.responder
+    def clone_to(self, node_id, parent_name, name):
+        d = self._volume_service.clone_to(
+            self._volume(node_id, parent_name), VolumeName.from_bytes(name))
+        d.addCallback(lambda _: {})
+        return d
+
+    @CompressionsCommand.responder
+    def compressions(self):
+        return {"compressions": available_compressions()}
+
+    @ResumeTokenCommand.responder
+    def resume_token(self, node_id, name):
+        d = self._volume(node_id, name).get_filesystem().resume_token()
+        d.addCallback(lambda token: {"token": token})
+        return d
+
+    @StartReceiveCommand.responder
+    def start_receive(self, transfer, node_id, name, compression=None,
+                      resume=False):
+        if transfer in self._receives:
+            raise KeyError(transfer)
+        name = VolumeName.from_bytes(name)
+        if compression is None:
+            feed = _ReceiverFeed()
+            self._receives[transfer] = (feed, feed.receiving)
+            started = feed.start(self._volume_service.receiver(
+                node_id, name, bool(resume)))
+            # Failures are reported by ``FinishReceiveCommand``.
+            started.addBoth(lambda _: {})
+            return started
+        stream = _ReceiveStream(self._reactor)
+        receiving = self._transfers.run(
+            self._volume_service.receive, node_id, name, stream, compression,
+            bool(resume))
+        receiving.addBoth(stream.closed)
+        self._receives[transfer] = (stream, receiving)
+        return {}
+
+    @ReceiveDataCommand.responder
+    def receive_data(self, transfer, data):
+        feed, receiving = self._receives[transfer]
+        d = feed.feed(data)
+        d.addCallback(lambda _: {})
+        return d
+
+    @FinishReceiveCommand.responder
+    def finish_receive(self, transfer, succeeded):
+        feed, receiving = self._receives.pop(transfer)
+        if succeeded:
+            feed.finish()
+        else:
+            feed.abort()
+        receiving.addCallback(lambda _: {})
+        return receiving
+
+    def connectionMade(self):
+        AMP.connectionMade(self)
+        _no_delay(self.transport)
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        receives, self._receives = self._receives, {}
+        for feed, receiving in receives.values():
+            feed.abort()
+            receiving.addErrback(lambda _: None)
+
+
+def volume_transfer_factory(reactor, volume_service, transfers):
+    """
+    Create a factory for the receiving side of the volume transfer
+    protocol.
+
+    :param reactor: The reactor.
+    :param VolumeService volume_service: The local volume manager.
+    :param transfers: A ``ThreadedTransfers`` to run receives in.
+
+    :return: A ``ServerFactory``.
+    """
+    return ServerFactory.forProtocol(
+        lambda: _VolumeTransferServerProtocol(
+            reactor, volume_service, transfers))
+
+
+def volume_transfer_tls_options(certificate, certificate_authority):
+    """
+    Create the TLS options both ends of a volume transfer connection use.
+
+    Each end presents its node's certificate and only accepts a peer which
+    presents a certificate signed by the cluster's certificate authority.
+
+    :param FilePath certificate: A PEM file containing the node's
+        certificate and private key.
+    :param FilePath certificate_authority: A PEM file containing the
+        certificate of the cluster's certificate authority.
+
+    :return: A ``twisted.internet.ssl.CertificateOptions``.
+    """
+    node = PrivateCertificate.loadPEM(certificate.getContent())
+    authority = Certificate.loadPEM(certificate_authority.getContent())
+    return CertificateOptions(
+        privateKey=node.privateKey.original, certificate=node.original,
+        verify=True, caCerts=[authority.original], requireCertificate=True)
+
+
+class VolumeTransferService(MultiService):
+    """
+    Accept TLS connections from other nodes' volume managers and serve the
+    volume transfer protocol to them.
+    """
+    def __init__(self, reactor, volume_service, port, tls_options):
+        """
+        :param reactor: The reactor.
+        :param VolumeService volume_service: The local volume manager.
+        :param int port: The TCP port to listen on.
+        :param tls_options: The options returned by
+            ``volume_transfer_tls_options``.  Connections whose peer does
+            not present a certificate they accept are refused.
+        """
+        MultiService.__init__(self)
+        self._transfers = ThreadedTransfers(reactor)
+        StreamServerEndpointService(
+            SSL4ServerEndpoint(reactor, port, tls_options),
+            volume_transfer_factory(
+                reactor, volume_service, self._transfers)
+        ).setServiceParent(self)
+
+    def stopService(self):
+        d = MultiService.stopService(self)
+        self._transfers.stop()
+        return d
+
+
+class _VolumeTransferClientProtocol(AMP):
+    """
+    The sending side of the volume transfer protocol.
+
+    :ivar Deferred lost: Fires when the connection is lost.
+    """
+    def __init__(self, disconnected):
+        """
+        :param disconnected: A one-argument callable called with this
+            protocol when the connection is lost.
+        """
+        AMP.__init__(self)
+        self._disconnected = disconnected
+        self.lost = Deferred()
+
+    def connectionMade(self):
+        AMP.connectionMade(self)
+        _no_delay(self.transport)
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        self._disconnected(self)
+        self.lost.callback(None)
+
+
+class _ReceiveWriter(object):
+    """
+    A file-like object returned by ``AMPRemoteVolumeManager.receive`` which
+    sends what is written to it as ``ReceiveDataCommand``\ s.
+    """
+    def __init__(self, manager, transfer):
+        """
+        :param AMPRemoteVolumeManager manager: The manager to send through.
+        :param int transfer: The identifier of the transfer.
+        """
+        self._manager = manager
+        self._transfer = transfer
+
+    def write(self, data):
+        """
+        Send some data, blocking until the remote volume manager has taken
+        it.
+
+        :param data: ``bytes`` or a ``memoryview``.
+        """
+        self._manager._blocking(self._manager._send_data,
+                                self._transfer, memoryview(data))
+
+
+@implementer(IRemoteVolumeManager)
+class AMPRemoteVolumeManager(object):
+    """
+    Communicate with a remote volume manager using the volume transfer
+    protocol, over one connection that is kept open between calls.
+
+    ``receive`` blocks on the reactor so must not be used in the reactor
+    thread; ``VolumeService`` does so when given ``ThreadedTransfers``.
+    """
+    def __init__(self, reactor, endpoint):
+        """
+        :param reactor: The reactor.
+        :param endpoint: The ``IStreamClientEndpoint`` of the remote node's
+            ``VolumeTransferService``.
+        """
+        self._reactor = reactor
+        self._endpoint = endpoint
+        self._protocol = None
+        self._waiting = []
+        self._transfers = count()
+
+    def _connect(self):
+        """
+        Connect to the remote node, unless a connection already exists.
+
+        :return: ``Deferred`` that fires with the connected
+            ``_VolumeTransferClientProtocol``.
+        """
+        if self._protocol is not None:
+            return succeed(self._protocol)
+        waiting = Deferred()
+        self._waiting.append(waiting)
+        if len(self._waiting) == 1:
+            connecting = connectProtocol(
+                self._endpoint,
+                _VolumeTransferClientProtocol(self._disconnected))
+            connecting.addCallbacks(self._connected, self._connect_failed)
+        return waiting
+
+    def _connected(self, protocol):
+        self._protocol = protocol
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(protocol)
+
+    def _connect_failed(self, reason):
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.errback(reason)
+
+    def _disconnected(self, protocol):
+        if self._protocol is protocol:
+            self._protocol = None
+
+    def _call(self, command, **kwargs):
+        """
+        Send a command to the remote node.
+
+        :param command: The AMP ``Command`` to send.
+        :param kwargs: The command's arguments.
+
+        :return: ``Deferred`` that fires with the response.
+        """
+        d = self._connect()
+        d.addCallback(lambda protocol: protocol.callRemote(command, **kwargs))
+        return d
+
+    def _blocking(self, function, *args, **kwargs):
+        """
+        Call a function returning a ``Deferred`` in the reactor thread and
+        wait for its result.
+        """
+        return blockingCallFromThread(
+            self._reactor, function, *args, **kwargs)
+
+    def _send_data(self, transfer, data):
+        """
+        Send some data of a transfer, split into as many
+        ``ReceiveDataCommand``\ s as needed.
+
+        :param int transfer: The identifier of the transfer.
+        :param memoryview data: The data.
+
+        :return: ``Deferred`` that fires when all the pieces have been
+            taken by the remote node.
+        """
+        d = gatherResults([
+            self._call(ReceiveDataCommand, transfer=transfer,
+                       data=data[offset:offset + MAXIMUM_DATA_SIZE].tobytes())
+            for offset in range(0, len(data), MAXIMUM_DATA_SIZE)
+        ], consumeErrors=True)
+        d.addErrback(lambda failure: failure.value.subFailure)
+        return d
+
+    def snapshots(self, volume):
+        d = self._call(VolumeSnapshotsCommand,
+                       node_id=volume.node_id, name=volume.name.to_bytes())
+        d.addCallback(lambda response: [
+            Snapshot(name=name) for name in response["snapshots"]])
+        return d
+
+    def compressions(self):
+        d = self._call(CompressionsCommand)
+        d.addCallback(lambda response: response["compressions"])
+
+        def unknown_command(failure):
+            # Older nodes do not know the command and support no
+            # compressions.
+            failure.trap(UnhandledCommand)
+            return []
+        d.addErrback(unknown_command)
+        return d
+
+    def resume_token(self, volume):
+        d = self._call(ResumeTokenCommand,
+                       node_id=volume.node_id, name=volume.name.to_bytes())
+        d.addCallback(lambda response: response.get("token"))
+
+        def unknown_command(failure):
+            # Older nodes do not know the command and can't resume.
+            failure.trap(UnhandledCommand)
+            return None
+        d.addErrback(unknown_command)
+        return d
+
+    @contextmanager
+    def receive(self, volume, compression=None, resume=False):
+        transfer = next(self._transfers)
+        self._blocking(self._call, StartReceiveCommand, transfer=transfer,
+                       node_id=volume.node_id, name=volume.name.to_bytes(),
+                       compression=compression, resume=resume or None)
+        try:
+            yield _ReceiveWriter(self, transfer)
+        except:
+            failure = Failure()
+            try:
+                self._blocking(self._call, FinishReceiveCommand,
+                               transfer=transfer, succeeded=False)
+            except Exception:
+                # The remote side reports the abort as a failed receive;
+                # the original exception is the interesting one.
+                pass
+            failure.raiseException()
+        else:
+            self._blocking(self._call, FinishReceiveCommand,
+                           transfer=transfer, succeeded=True)
+
+    def acquire(self, volume):
+        d = self._call(AcquireVolumeCommand,
+                       node_id=volume.node_id, name=volume.name.to_bytes())
+        d.addCallback(lambda response: response["node_id"])
+        return d
+
+    def clone_to(self, parent, name):
+        d = self._call(CloneVolumeCommand, node_id=parent.node_id,
+                       parent_name=parent.name.to_bytes(),
+                       name=name.to_bytes())
+        d.addCallback(lambda _: None)
+        return d
+
+    def disconnect(self):
+        """
+        Close the connection to the remote node, if there is one.
+
+        :return: ``Deferred`` that fires when the connection has closed.
+        """
+        if self._protocol is None:
+            return succeed(None)
+        self._protocol.transport.loseConnection()
+        return self._protocol.lost
+
+
+class AMPRemoteVolumeManagers(object):
+    """
+    Keep one ``AMPRemoteVolumeManager`` per remote node.
+    """
+    def __init__(self, reactor, endpoint_for_hostname):
+        """
+        :param reactor: The reactor.
+        :param endpoint_for_hostname: A one-argument callable returning the
+            ``IStreamClientEndpoint`` of a node's ``VolumeTransferService``
+            given its hostname.
+        """
+        self._reactor = reactor
+        self._endpoint_for_hostname = endpoint_for_hostname
+        self._managers = {}
+
+    def get(self, hostname):
+        """
+        :param bytes hostname: The hostname of the remote node.
+
+        :return: The ``AMPRemoteVolumeManager`` for that node.
+        """
+        if hostname not in self._managers:
+            self._managers[hostname] = AMPRemoteVolumeManager(
+                self._reactor, self._endpoint_for_hostname(hostname))
+        return self._managers[hostname]
@@ -21,8 +21,10 @@ from twisted.internet.defer import succeed
 from twisted.python.filepath import FilePath
 
 from ..common._ipc import ProcessNode
-from .service import DEFAULT_CONFIG_PATH
+from .service import DEFAULT_CONFIG_PATH, Volume
 from .filesystems.zfs import Snapshot
+from ._compression import available_compressions
+from ._transfer import SynchronousTransfers
 
 
 # Path to SSH private key available on nodes and used to communicate
@@ -32,7 +34,7 @@ from .filesystems.zfs import Snapshot
 SSH_PRIVATE_KEY_PATH = FilePath(b"/etc/flocker/id_rsa_flocker")
 
 
-def standard_node(hostname):
+def standard_node(hostname, control_masters=None):
     """
     Create the default production ``INode`` for the given hostname.
 
@@ -40,9 +42,41 @@ def standard_node(hostname):
     and authenticates using the cluster private key.
 
     :param bytes hostname: The host to connect to.
+    :param control_masters: ``None`` or a ``SSHControlMasterService`` to
+        multiplex the SSH connections over.
     :return: A ``INode`` that can connect to the given hostname using SSH.
     """
-    return ProcessNode.using_ssh(hostname, 22, b"root", SSH_PRIVATE_KEY_PATH)
+    if control_masters is None:
+        using_ssh = ProcessNode.using_ssh
+    else:
+        using_ssh = control_masters.using_ssh
+    return using_ssh(hostname, 22, b"root", SSH_PRIVATE_KEY_PATH)
+
+
+def ssh_volume_manager(hostname, control_masters=None, transfers=None):
+    """
+    Create the default production ``IRemoteVolumeManager`` for the given
+    hostname, which runs ``flocker-volume`` on it over SSH.
+
+    :param bytes hostname: The host to connect to.
+    :param control_masters: See ``standard_node``.
+    :param transfers: See ``RemoteVolumeManager``.
+    :return: A ``RemoteVolumeManager`` for the node.
+    """
+    return RemoteVolumeManager(standard_node(hostname, control_masters),
+                               transfers=transfers)
+
+
+def _unknown_command(error):
+    """
+    Determine whether ``flocker-volume`` failed because it is an older
+    version which doesn't have the subcommand it was run with.
+
+    :param IOError error: The error raised by ``INode.get_output``.
+
+    :return: ``True`` if the subcommand is unknown, otherwise ``False``.
+    """
+    return len(error.args) == 5 and b"Unknown command" in error.args[4]
 
 
 class IRemoteVolumeManager(Interface):
@@ -60,13 +94,37 @@ class IRemoteVolumeManager(Interface):
             ordered from oldest to newest.
         """
 
-    def receive(volume):
+    def compressions():
+        """
+        Retrieve the names of the compressions the remote volume manager can
+        receive volume data compressed with.
+
+        :return: A ``Deferred`` that fires with a ``list`` of ``bytes``.
+        """
+
+    def resume_token(volume):
+        """
+        Retrieve the token identifying the interrupted stream of a push of
+        the given volume, from which the push can be resumed.
+
+        :param Volume volume: The volume which was being pushed.
+
+        :return: A ``Deferred`` that fires with the token as ``bytes``, or
+            ``None`` if there is no interrupted stream that can be resumed.
+        """
+
+    def receive(volume, compression=None, resume=False):
         """
         Context manager that returns a file-like object to which a volume's
         contents can be written.
 
         :param Volume volume: The volume which will be pushed to the
             remote volume manager.
+        :param compression: ``None`` or the name of the compression, one
+            of those returned by ``compressions``, the written data is
+            compressed with.
+        :param bool resume: ``True`` if the written data continues the
+            interrupted stream identified by ``resume_token``.
 
         :return: A file-like object that can be written to, which will
              update the volume on the remote volume manager.
@@ -79,7 +137,8 @@ class IRemoteVolumeManager(Interface):
         :param Volume volume: The volume which will be acquired by the
             remote volume manager.
 
-        :return: The node ID of the remote volume manager (as ``unicode``).
+        :return: The node ID of the remote volume manager (as ``unicode``),
+            or a ``Deferred`` that fires with it.
         """
 
     def clone_to(parent, name):
@@ -99,41 +158,102 @@ class IRemoteVolumeManager(Interface):
 class RemoteVolumeManager(object):
     """
     ``INode``\-based communication with a remote volume manager.
+
+    Running a command on the destination blocks, so the queries which
+    return ``Deferred``\ s run their commands with the given transfers,
+    e.g. in a thread pool rather than the reactor thread.
     """
 
-    def __init__(self, destination, config_path=DEFAULT_CONFIG_PATH):
+    def __init__(self, destination, config_path=DEFAULT_CONFIG_PATH,
+                 transfers=None):
         """
         :param Node destination: The node to push to.
         :param FilePath config_path: Path to configuration file for the
             remote ``flocker-volume``.
+        :param transfers: ``None`` or a ``SynchronousTransfers`` or
+            ``ThreadedTransfers`` to run queries with.  By default they are
+            run in the calling thread.
         """
         self._destination = destination
         self._config_path = config_path
+        if transfers is None:
+            transfers = SynchronousTransfers()
+        self._transfers = transfers
+
+    def _query(self, arguments, parse):
+        """
+        Run ``flocker-volume`` on the destination with the transfers.
+
+        :param list arguments: The arguments to ``flocker-volume``, after
+            ``--config``.
+        :param parse: A one-argument callable which is given the output of
+            the command and returns the result of the query.
+
+        :return: ``Deferred`` that fires with the result of ``parse``.
+        """
+        return self._transfers.run(
+            lambda: parse(self._destination.get_output(
+                [b"flocker-volume", b"--config", self._config_path.path] +
+                arguments)))
+
+    def _query_optional(self, arguments, parse, default):
+        """
+        Like ``_query``, for a sub-command older versions of
+        ``flocker-volume`` don't have.
+
+        :param default: The result of the query if the destination doesn't
+            know the sub-command.  Other failures are not hidden.
+        """
+        d = self._query(arguments, parse)
+
+        def failed(reason):
+            reason.trap(IOError)
+            if not _unknown_command(reason.value):
+                return reason
+            return default
+        d.addErrback(failed)
+        return d
 
     def snapshots(self, volume):
         """
         Run ``flocker-volume snapshots`` on the destination and parse the
         output into a ``list`` of ``Snapshot`` instances.
         """
-        data = self._destination.get_output(
-            [b"flocker-volume",
-             b"--config", self._config_path.path,
-             b"snapshots",
+        return self._query(
+            [b"snapshots",
+             volume.node_id.encode("ascii"),
+             volume.name.to_bytes()],
+            lambda data: [Snapshot(name=name) for name in data.splitlines()])
+
+    def compressions(self):
+        """
+        Run ``flocker-volume compressions`` on the destination.  Older
+        versions which do not have that command support no compressions.
+        """
+        return self._query_optional(
+            [b"compressions"], lambda data: data.splitlines(), [])
+
+    def resume_token(self, volume):
+        """
+        Run ``flocker-volume resume_token`` on the destination.  Older
+        versions which do not have that command can't resume pushes.
+        """
+        return self._query_optional(
+            [b"resume_token",
              volume.node_id.encode("ascii"),
-             volume.name.to_bytes()]
-        )
-        return succeed([
-            Snapshot(name=name)
-            for name
-            in data.splitlines()
-        ])
-
-    def receive(self, volume):
-        return self._destination.run([b"flocker-volume",
-                                      b"--config", self._config_path.path,
-                                      b"receive",
-                                      volume.node_id.encode(b"ascii"),
-                                      volume.name.to_bytes()])
+             volume.name.to_bytes()],
+            lambda data: data.strip() or None, None)
+
+    def receive(self, volume, compression=None, resume=False):
+        arguments = [b"flocker-volume",
+                     b"--config", self._config_path.path,
+                     b"receive"]
+        if compression is not None:
+            arguments.extend([b"--compression", compression])
+        if resume:
+            arguments.append(b"--resume")
+        return self._destination.run(arguments + [
+            volume.node_id.encode(b"ascii"), volume.name.to_bytes()])
 
     def acquire(self, volume):
         return self._destination.get_output(
@@ -171,12 +291,20 @@ class LocalVolumeManager(object):
         """
         return volume.get_filesystem().snapshots()
 
+    def compressions(self):
+        return succeed(available_compressions())
+
+    def resume_token(self, volume):
+        return Volume(node_id=volume.node_id, name=volume.name,
+                      service=self._service).get_filesystem().resume_token()
+
     @contextmanager
-    def receive(self, volume):
+    def receive(self, volume, compression=None, resume=False):
         input_file = BytesIO()
         yield input_file
         input_file.seek(0, 0)
-        self._service.receive(volume.node_id, volume.name, input_file)
+        self._service.receive(volume.node_id, volume.name, input_file,
+                              compression, resume)
 
     def acquire(self, volume):
         self._service.acquire(volume.node_id, volume.name)
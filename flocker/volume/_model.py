@@ -18,3 +18,18 @@ class VolumeSize(object):
         particular upper bound is required (when representing desired
         configuration) or known (when representing deployed configuration).
     """
+
+
+@attributes(["used", "available", "compression_ratio"], apply_immutable=True)
+class VolumeUsage(object):
+    """
+    How much space a data volume takes up, and how much more it can take.
+
+    :ivar int used: The number of bytes the volume (including its snapshots)
+        takes up in its storage pool.
+    :ivar int available: The number of bytes that can still be written to
+        the volume, limited by both its maximum size and the free space in
+        its storage pool.
+    :ivar float compression_ratio: The size of the volume's data divided by
+        the space it takes up on disk; ``1.0`` if it isn't compressed.
+    """
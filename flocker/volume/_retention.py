@@ -0,0 +1,120 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_retention -*-
+
+"""
+Garbage collection of the snapshots taken by volume pushes.
+
+Every push takes a new snapshot, and nothing else ever destroys them.
+Pushes record the snapshot each peer has in common with a filesystem (see
+``IFilesystem.retain_snapshot``), which is all a later incremental push
+needs, so the rest can be destroyed in the background.
+"""
+
+from __future__ import absolute_import
+
+from eliot import ActionType, Field, Logger, write_failure
+from eliot.twisted import DeferredContext
+
+from twisted.application.service import Service
+from twisted.internet.defer import succeed
+from twisted.internet.task import LoopingCall
+
+from ._transfer import VOLUME
+
+# Seconds between passes over all the volumes.
+DEFAULT_PRUNE_INTERVAL = 600.0
+
+
+PRUNED = Field(
+    u"pruned",
+    lambda snapshots: [snapshot.name for snapshot in snapshots],
+    u"The names of the snapshots which were destroyed.")
+
+PRUNE_SNAPSHOTS = ActionType(
+    u"flocker:volume:prune_snapshots",
+    [VOLUME],
+    [PRUNED],
+    u"The snapshots of a volume which are no longer needed are destroyed.")
+
+
+class SnapshotPruningService(Service):
+    """
+    Periodically prune the snapshots of all the volumes of a volume manager.
+
+    Volumes are pruned one at a time so as not to compete with pushes for
+    the disks.  Failing to prune one volume is logged and does not stop the
+    others being pruned.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, volume_service,
+                 interval=DEFAULT_PRUNE_INTERVAL):
+        """
+        :param reactor: A ``IReactorTime`` provider.
+        :param VolumeService volume_service: The volume manager whose volumes
+            to prune.
+        :param float interval: Seconds between passes over all the volumes.
+        """
+        self._reactor = reactor
+        self._volume_service = volume_service
+        self._interval = interval
+        self._loop = None
+
+    def startService(self):
+        Service.startService(self)
+        self._loop = LoopingCall(self._prune_logged)
+        self._loop.clock = self._reactor
+        self._loop.start(self._interval, now=False)
+
+    def stopService(self):
+        Service.stopService(self)
+        self._loop.stop()
+
+    def _prune_logged(self):
+        """
+        Prune, logging rather than returning failures so that the next pass
+        still happens.
+        """
+        d = self.prune()
+        d.addErrback(write_failure, self.logger,
+                     u"flocker:volume:prune_snapshots")
+        return d
+
+    def prune(self):
+        """
+        Prune the snapshots of all the volumes once.
+
+        :return: A ``Deferred`` that fires when all the volumes have been
+            pruned.
+        """
+        d = self._volume_service.enumerate()
+
+        def got_volumes(volumes):
+            pruning = succeed(None)
+            for volume in volumes:
+                pruning.addCallback(
+                    lambda _, volume=volume: self._prune_volume(volume))
+            return pruning
+        d.addCallback(got_volumes)
+        return d
+
+    def _prune_volume(self, volume):
+        """
+        Prune the snapshots of one volume.
+
+        :param Volume volume: The volume.
+
+        :return: A ``Deferred`` that fires when the volume has been pruned,
+            successfully or not.
+        """
+        action = PRUNE_SNAPSHOTS(self.logger, volume=volume)
+        with action.context():
+            d = DeferredContext(volume.get_filesystem().prune_snapshots())
+
+            def pruned(snapshots):
+                action.addSuccessFields(pruned=snapshots)
+            d.addCallback(pruned)
+            d.addActionFinish()
+        # The failure was logged as the action's result.
+        d.result.addErrback(lambda _: None)
+        return d.result
@@ -0,0 +1,391 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_transfer -*-
+
+"""
+Copying of volume data streams, e.g. the output of ``zfs send``, to other
+nodes.
+
+Filesystem readers and remote volume manager receivers are blocking
+file-like objects, so transfers are run in a dedicated thread pool rather
+than on the reactor thread.
+"""
+
+from __future__ import absolute_import
+
+import sys
+from Queue import Queue
+from threading import Thread
+from time import time
+
+from eliot import ActionType, Field, MessageType
+
+from twisted.internet.defer import DeferredSemaphore, maybeDeferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+# The number of bytes read from the source and written to the destination
+# in one go.
+CHUNK_SIZE = 1024 * 1024
+
+# The number of transfers a node will run at the same time; further
+# transfers wait for one of these to finish.  Each transfer keeps a disk
+# busy reading and a network connection busy writing so running many at
+# once just makes all of them slower.
+DEFAULT_MAXIMUM_TRANSFERS = 2
+
+# The number of writes a destination of a ``TeeWriter`` can fall behind
+# before it holds back writing to the others.
+TEE_QUEUE_SIZE = 4
+
+# Seconds between progress messages logged for a single transfer.
+PROGRESS_INTERVAL = 5.0
+
+# The number of times a push is attempted before giving up, if it keeps
+# failing with errors that might be transient, e.g. a network connection
+# dying.
+DEFAULT_PUSH_ATTEMPTS = 5
+
+# Seconds to wait before the first retry of a push; the delay doubles for
+# each further retry.
+RETRY_DELAY = 5.0
+
+
+VOLUME = Field(
+    u"volume",
+    lambda volume: u"%s/%s" % (volume.node_id,
+                               volume.name.to_bytes().decode("ascii")),
+    u"The volume being transferred.")
+
+TRANSFERRED = Field.forTypes(
+    u"transferred", [int, long],
+    u"The number of bytes transferred so far.")
+
+EXPECTED_SIZE = Field.forTypes(
+    u"expected_size", [int, long, None],
+    u"The estimated total size of the transfer in bytes, if known.")
+
+BYTES_PER_SECOND = Field.forTypes(
+    u"bytes_per_second", [float],
+    u"The average transfer rate so far.")
+
+COMPRESSION = Field.forTypes(
+    u"compression", [bytes, None],
+    u"The name of the compression used for the transfer, if any.")
+
+ETA = Field.forTypes(
+    u"eta", [float, None],
+    u"The estimated number of seconds until the transfer finishes, if the "
+    u"total size is known.")
+
+
+RESUMED = Field.forTypes(
+    u"resumed", [bool],
+    u"Whether the transfer continues an interrupted one.")
+
+ATTEMPT = Field.forTypes(
+    u"attempt", [int],
+    u"The number of the attempt which failed, starting from 1.")
+
+DELAY = Field.forTypes(
+    u"delay", [float],
+    u"Seconds until the next attempt.")
+
+REASON = Field(
+    u"reason", lambda reason: reason.getErrorMessage(),
+    u"Why the attempt failed.")
+
+
+PUSH_VOLUME = ActionType(
+    u"flocker:volume:push",
+    [VOLUME, EXPECTED_SIZE, COMPRESSION, RESUMED],
+    [TRANSFERRED],
+    u"A volume's data is being pushed to another node.")
+
+PUSH_PROGRESS = MessageType(
+    u"flocker:volume:push:progress",
+    [TRANSFERRED, BYTES_PER_SECOND, ETA],
+    u"Progress of a volume push.")
+
+PUSH_RETRY = MessageType(
+    u"flocker:volume:push:retry",
+    [VOLUME, ATTEMPT, DELAY, REASON],
+    u"A volume push failed and will be tried again, resuming the "
+    u"interrupted stream if the destination kept it.")
+
+PUSH_SEPARATELY = MessageType(
+    u"flocker:volume:push:separately",
+    [VOLUME, REASON],
+    u"A destination failed while receiving a stream shared with other "
+    u"destinations; the volume will be pushed to it on its own.")
+
+
+def copy_stream(source, destination, progress=None, chunk_size=CHUNK_SIZE):
+    """
+    Copy all the data from one file-like object to another.
+
+    A single buffer is allocated up front and, where ``source`` supports
+    ``readinto``, filled in place for every chunk.
+
+    :param source: A file-like object to read from until EOF.
+    :param destination: A file-like object to write to.
+    :param progress: ``None`` or a callable which will be called with the
+        total number of bytes copied so far after each chunk is written.
+    :param int chunk_size: The size of the buffer.
+
+    :return: The total number of bytes copied.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    readinto = getattr(source, "readinto", None)
+    total = 0
+    while True:
+        if readinto is None:
+            chunk = source.read(chunk_size)
+            count = len(chunk)
+        else:
+            count = readinto(buffer)
+            chunk = view[:count]
+        if not count:
+            return total
+        destination.write(chunk)
+        total += count
+        if progress is not None:
+            progress(total)
+
+
+class _TeeDestination(object):
+    """
+    Write to one of the destinations of a ``TeeWriter`` in a thread of its
+    own, so that it does not have to wait for the others.
+
+    :ivar exc_info: ``None``, or the ``sys.exc_info()`` of the failure of
+        the destination's ``write``.  Data queued after a failure is
+        discarded.
+    """
+    def __init__(self, destination):
+        """
+        :param destination: The file-like object to write to.
+        """
+        self._destination = destination
+        self._queue = Queue(TEE_QUEUE_SIZE)
+        self._closed = False
+        self.exc_info = None
+        self._thread = Thread(target=self._run, name=b"flocker-tee")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self.exc_info is None:
+                try:
+                    self._destination.write(data)
+                except Exception:
+                    self.exc_info = sys.exc_info()
+
+    def write(self, data):
+        """
+        Queue some data to be written, blocking if the destination is
+        ``TEE_QUEUE_SIZE`` writes behind.
+
+        :param bytes data: The data.
+        """
+        self._queue.put(data)
+
+    def close(self):
+        """
+        Wait until all the queued data has been written, or discarded.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+
+class TeeWriter(object):
+    """
+    A file-like object which writes everything written to it to several
+    others.
+
+    Each destination is written to in its own thread, so a slow destination
+    only holds the others back once it is ``TEE_QUEUE_SIZE`` writes behind
+    them.  ``close`` must be called once everything has been written.
+
+    A destination whose ``write`` raises an exception is dropped and the
+    rest continue to be written to.
+    """
+    def __init__(self, destinations, failed):
+        """
+        :param dict destinations: Map keys identifying destinations to the
+            file-like objects to write to.  Failed destinations are removed.
+        :param failed: A callable which will be called, in the thread
+            calling ``write`` or ``close``, with the key of a destination
+            which failed and the ``sys.exc_info()`` of its failure.
+        """
+        self._destinations = destinations
+        self._failed = failed
+        self._writers = dict(
+            (key, _TeeDestination(destination))
+            for key, destination in destinations.items())
+
+    def _check_failed(self):
+        """
+        Drop and report the destinations which have failed.
+
+        :raises IOError: If there are no destinations left to write to.
+        """
+        for key, writer in list(self._writers.items()):
+            if writer.exc_info is not None:
+                writer.close()
+                del self._writers[key]
+                del self._destinations[key]
+                self._failed(key, writer.exc_info)
+        if not self._writers:
+            raise IOError("Every destination failed.")
+
+    def write(self, data):
+        """
+        Write some data to all of the remaining destinations.
+
+        :param data: The data to write.  It is copied, since writing
+            finishes later.
+
+        :raises IOError: If there are no destinations left to write to.
+        """
+        data = memoryview(data).tobytes()
+        for writer in self._writers.values():
+            writer.write(data)
+        self._check_failed()
+
+    def close(self):
+        """
+        Wait until everything written has been written to each destination,
+        or it has failed.
+
+        :raises IOError: If there are no destinations left.
+        """
+        for writer in self._writers.values():
+            writer.close()
+        self._check_failed()
+
+
+class TransferProgress(object):
+    """
+    Log the progress of a transfer at most every ``PROGRESS_INTERVAL``
+    seconds.
+
+    :ivar expected_size: The total number of bytes expected or ``None`` if
+        not known.
+    """
+    def __init__(self, logger, expected_size=None, now=time):
+        """
+        :param eliot.Logger logger: The logger to write progress messages
+            to.
+        :param expected_size: See ``expected_size`` above.
+        :param now: A no-argument callable returning the current time in
+            seconds.
+        """
+        self._logger = logger
+        self.expected_size = expected_size
+        self._now = now
+        self._start = now()
+        self._last = self._start
+
+    def __call__(self, transferred):
+        """
+        Record the number of bytes transferred so far, logging a
+        ``PUSH_PROGRESS`` message if it is time to do so.
+
+        :param int transferred: The number of bytes transferred so far.
+        """
+        now = self._now()
+        if now - self._last < PROGRESS_INTERVAL:
+            return
+        self._last = now
+        rate = float(transferred) / (now - self._start)
+        eta = None
+        if self.expected_size is not None and rate:
+            eta = max(self.expected_size - transferred, 0) / rate
+        PUSH_PROGRESS(
+            transferred=transferred, bytes_per_second=rate, eta=eta,
+        ).write(self._logger)
+
+
+class SynchronousTransfers(object):
+    """
+    Run transfers immediately in the calling thread.
+
+    This is the behaviour ``VolumeService`` has if it is not given anything
+    else, which is what the command line tools and tests want.
+    """
+    def run(self, function, *args, **kwargs):
+        """
+        Run a blocking transfer.
+
+        :param function: The callable performing the transfer.
+        :param args: Positional arguments for ``function``.
+        :param kwargs: Keyword arguments for ``function``.
+
+        :return: ``Deferred`` that fires with the result of ``function``.
+        """
+        return maybeDeferred(function, *args, **kwargs)
+
+
+class ThreadedTransfers(object):
+    """
+    Run transfers in a dedicated thread pool, at most ``maximum`` of them at
+    the same time.
+
+    The pool is separate from the reactor's own thread pool so that long
+    transfers do not starve other users of ``deferToThread``, e.g.
+    ``DockerClient``.
+    """
+    def __init__(self, reactor, maximum=DEFAULT_MAXIMUM_TRANSFERS):
+        """
+        :param reactor: An ``IReactorThreads`` and ``IReactorCore``
+            provider.
+        :param int maximum: The maximum number of transfers to run at the
+            same time.
+        """
+        self._reactor = reactor
+        self._semaphore = DeferredSemaphore(maximum)
+        self._threadpool = ThreadPool(
+            minthreads=0, maxthreads=maximum, name=b"flocker-transfers")
+        self._started = False
+
+    def _start(self):
+        """
+        Start the thread pool, arranging for it to be stopped when the
+        reactor shuts down.
+        """
+        if not self._started:
+            self._started = True
+            self._threadpool.start()
+            self._reactor.addSystemEventTrigger(
+                "during", "shutdown", self.stop)
+
+    def stop(self):
+        """
+        Stop the thread pool once any running transfers have finished.
+        """
+        if self._started:
+            self._started = False
+            self._threadpool.stop()
+
+    def run(self, function, *args, **kwargs):
+        """
+        Run a blocking transfer once fewer than ``maximum`` transfers are
+        running.
+
+        :param function: The callable performing the transfer.
+        :param args: Positional arguments for ``function``.
+        :param kwargs: Keyword arguments for ``function``.
+
+        :return: ``Deferred`` that fires with the result of ``function``.
+        """
+        self._start()
+        return self._semaphore.run(
+            deferToThreadPool, self._reactor, self._threadpool,
+            function, *args, **kwargs)
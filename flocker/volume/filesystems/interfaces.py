@@ -6,6 +6,14 @@ from __future__ import absolute_import
 
 from zope.interface import Attribute, Interface
 
+from twisted.internet.interfaces import IConsumer
+
+
+# The peer under which a filesystem retains the newest snapshot it received,
+# i.e. the one it has in common with the node which sent it.  Hostnames can
+# not start with a hyphen so this can't clash with a real peer.
+SENDER = u"-sender"
+
 
 class FilesystemAlreadyExists(Exception):
     """
@@ -41,6 +49,35 @@ class IFilesystemSnapshots(Interface):
         """
 
 
+class IFilesystemReceiver(IConsumer):
+    """
+    A consumer of a data stream which populates a filesystem, as returned by
+    ``IFilesystem.receiver``.
+
+    The data written is the same as would be written to the file-like
+    object of ``IFilesystem.writer``.  Producers should be registered so
+    that they are paused while the filesystem catches up.
+    """
+    def finish():
+        """
+        Indicate that all the data has been written.
+
+        :return: A ``Deferred`` that fires with ``None`` once the filesystem
+            has been populated, or fails if the data could not be received.
+        """
+
+    def abort():
+        """
+        Indicate that the data stream was interrupted.
+
+        As with an exception raised inside ``IFilesystem.writer``, the data
+        written so far may be kept so that the stream can be resumed.
+
+        :return: A ``Deferred`` that fires with ``None`` once the data has
+            been dealt with.
+        """
+
+
 class IFilesystem(Interface):
     """
     A filesystem that is part of a pool.
@@ -52,6 +89,13 @@ class IFilesystem(Interface):
     was correct when this ``IFilesystem`` provider was created.
     """)
 
+    usage = Attribute("""
+    A ``VolumeUsage`` instance giving the space this filesystem takes up, or
+    ``None`` if that is not known.  Like ``size``, this is only as up-to-date
+    as the ``IFilesystem`` provider, and is typically only known for those
+    returned by ``IStoragePool.enumerate``.
+    """)
+
     def get_path():
         """Retrieve the filesystem's local path.
 
@@ -70,7 +114,17 @@ class IFilesystem(Interface):
             which exist of this filesystem.
         """
 
-    def reader(remote_snapshots=None):
+    def resume_token():
+        """
+        Retrieve the token identifying an interrupted data stream that was
+        being written to this filesystem, from which the stream can be
+        resumed.
+
+        :return: A ``Deferred`` that fires with the token as ``bytes``, or
+            ``None`` if there is no interrupted stream.
+        """
+
+    def reader(remote_snapshots=None, resume_token=None):
         """
         Context manager that allows reading the contents of the filesystem.
 
@@ -84,11 +138,20 @@ class IFilesystem(Interface):
             possible.  If no value is passed then a complete data stream will
             be generated.
 
+        :param resume_token: ``None`` or a token returned by the writer's
+            ``resume_token``, in which case only the rest of the interrupted
+            data stream it identifies is generated and ``remote_snapshots``
+            is ignored.
+
         :return: A file-like object from whom the filesystem's data can be
-            read as ``bytes``.
+            read as ``bytes``.  It may have an ``expected_size`` attribute
+            giving the estimated number of bytes that will be read, or
+            ``None`` if that is not known, and a ``snapshot`` attribute
+            giving the ``Snapshot`` the writer will have once it has
+            received all the data, or ``None`` if that is not known.
         """
 
-    def writer():
+    def writer(resume=False):
         """Context manager that allows writing new contents to the filesystem.
 
         This receiver is a blocking API, for now.
@@ -99,13 +162,79 @@ class IFilesystem(Interface):
         the data is the owner of the volume. As such, whatever new data is
         being received will overwrite the filesystem's existing data.
 
-        :param Volume volume: A volume that is being pushed to us.
+        If the data stream is interrupted, the data received so far may be
+        kept so that the stream can be resumed; see ``resume_token``.
+
+        Once the data has been received the newest snapshot of the
+        filesystem is retained as the one in common with the sender, under
+        the peer ``SENDER``; see ``retain_snapshot``.
+
+        :param bool resume: ``True`` if the data continues an interrupted
+            stream, as generated by ``reader`` given a resume token.
+            Otherwise any data kept from an interrupted stream is
+            discarded.
 
         :return: A file-like object which when written to with output of
             :meth:`IFilesystem.reader` will populate the volume's
             filesystem.
         """
 
+    def send(consumer, remote_snapshots=None, resume_token=None):
+        """
+        Write the contents of the filesystem to a consumer.
+
+        The non-blocking equivalent of ``reader``: the data written is the
+        same as could be read from it given the same arguments.  A producer
+        is registered with the consumer while the data is written, so a
+        consumer which can't keep up can pause it.
+
+        :param IConsumer consumer: The consumer to write the data to.
+        :param remote_snapshots: See ``reader``.
+        :param resume_token: See ``reader``.
+
+        :return: A ``Deferred`` that fires once all the data has been
+            written with the ``Snapshot`` the receiver will have once it
+            has received all the data, or ``None`` if that is not known.
+        """
+
+    def receiver(resume=False):
+        """
+        Create a consumer which writes new contents to the filesystem.
+
+        The non-blocking equivalent of ``writer``.
+
+        :param bool resume: See ``writer``.
+
+        :return: A ``Deferred`` that fires with an ``IFilesystemReceiver``
+            provider.
+        """
+
+    def retain_snapshot(peer, snapshot):
+        """
+        Record that a peer has a snapshot of this filesystem, so that
+        ``prune_snapshots`` keeps it as the basis of incremental data
+        streams to that peer.  Only the most recently retained snapshot is
+        kept for each peer.
+
+        :param unicode peer: The identity of the peer, e.g. its hostname.
+        :param Snapshot snapshot: The newest snapshot the peer has in common
+            with this filesystem.
+
+        :return: A ``Deferred`` that fires when the snapshot is recorded.
+        """
+
+    def prune_snapshots():
+        """
+        Destroy the snapshots of this filesystem which are no longer needed.
+
+        The newest snapshot and the snapshot retained for each peer are
+        kept.  Filesystems with no retained snapshots are left alone, since
+        what other nodes have in common with them is not known.
+
+        :return: A ``Deferred`` that fires with a ``list`` of the
+            ``Snapshot`` instances which were destroyed.
+        """
+
     def __eq__(other):
         """True if and only if underlying OS filesystem is the same."""
 
@@ -146,6 +275,23 @@ class IStoragePool(Interface):
             if deletion failed.
         """
 
+    def destroy_many(volumes):
+        """
+        Destroy the filesystems for some volumes.
+
+        The failure to destroy one filesystem does not stop the others being
+        destroyed.
+
+        :param volumes: An iterable of the
+            :class:`flocker.volume.service.Volume` instances whose
+            filesystems should be deleted.
+
+        :return: A ``DeferredList`` that fires, once all the filesystems
+            have been dealt with, with a ``list`` of ``(success, result)``
+            tuples in the same order as ``volumes``.  The result of a
+            failed deletion is the ``Failure``.
+        """
+
     def set_maximum_size(volume):
         """
         Set the maximum size of a filesystem for the given volume.
@@ -204,3 +350,12 @@ class IStoragePool(Interface):
         :return: A ``Deferred`` that fires with a :class:`list` of
             :class:`IFilesystem` providers.
         """
+
+    def free_space():
+        """
+        Find out how much space is free in this pool.
+
+        :return: A ``Deferred`` that fires with the number of bytes which
+            can still be written to the pool, or ``None`` if that can't be
+            determined.
+        """
@@ -4,24 +4,31 @@
 
 from __future__ import absolute_import
 
-from errno import ENOENT
+from errno import ENOENT, EPIPE
+from os import fdopen, pipe, statvfs
 from contextlib import contextmanager
+from shutil import copyfileobj
 from tarfile import TarFile
-from io import BytesIO
+from threading import Thread
 
 from zope.interface import implementer
 
 from characteristic import with_init, with_cmp, with_repr
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import DeferredList, maybeDeferred, succeed, fail
 from twisted.application.service import Service
+from twisted.protocols.basic import FileSender
+from twisted.python.failure import Failure
 
 from .interfaces import (
-    IFilesystemSnapshots, IStoragePool, IFilesystem,
-    FilesystemAlreadyExists)
-from .zfs import Snapshot
+    IFilesystemSnapshots, IStoragePool, IFilesystem, IFilesystemReceiver,
+    FilesystemAlreadyExists, SENDER)
+from .zfs import Snapshot, _SendStream, _snapshots_to_prune
 
-from .._model import VolumeSize
+from .._model import VolumeSize, VolumeUsage
+
+# The number of bytes copied between streams in one go.
+_COPY_SIZE = 64 * 1024
 
 
 @implementer(IFilesystemSnapshots)
@@ -47,8 +54,8 @@ class CannedFilesystemSnapshots(object):
 @implementer(IFilesystem)
 @with_cmp(["path"])
 @with_repr(["path", "size"])
-@with_init(["path", "size"],
-           defaults=dict(size=VolumeSize(maximum_size=None)))
+@with_init(["path", "size", "usage"],
+           defaults=dict(size=VolumeSize(maximum_size=None), usage=None))
 class DirectoryFilesystem(object):
     """
     A directory pretending to be an independent filesystem.
@@ -56,10 +63,14 @@ class DirectoryFilesystem(object):
     Snapshots are also supported in a pretend way.  A file is kept in the
     directory recording the names of snapshots which supposedly have been
     taken.  No other state related to snapshots is tracked (eg, the state of
-    the directory at the time of those snapshots is not recorded).
+    the directory at the time of those snapshots is not recorded).  Another
+    file records the snapshots retained for peers; it is not part of the
+    data that is copied to other filesystems.
 
     :ivar FilePath path: The directory where data for this "filesystem" is
         stored.
+    :ivar VolumeUsage usage: The space the files in the directory take up,
+        if known.
     """
     def get_path(self):
         return self.path
@@ -95,19 +106,133 @@ class DirectoryFilesystem(object):
         """
         Pretend to take a snapshot.  Assign it the given name.
         """
+        self._set_snapshots(self._snapshots() + [Snapshot(name=name)])
+
+    def _set_snapshots(self, snapshots):
+        """
+        Save the pretend snapshot data.
+
+        :param list snapshots: ``Snapshot`` instances.
+        """
         self.get_path().child(b".snapshots").setContent(
-            b"\n".join([
-                snapshot.name for snapshot in self._snapshots()] + [name])
-        )
+            b"\n".join(snapshot.name for snapshot in snapshots))
+
+    def _retained(self):
+        """
+        Load the pretend retained snapshots.
+
+        :return: A ``dict`` mapping peers to the ``Snapshot`` retained for
+            them.
+        """
+        peers = self.get_path().child(b".peers")
+        if not peers.exists():
+            return {}
+        retained = {}
+        for line in peers.getContent().splitlines():
+            peer, name = line.split(b" ", 1)
+            retained[peer.decode("utf-8")] = Snapshot(name=name)
+        return retained
+
+    def retain_snapshot(self, peer, snapshot):
+        """
+        Record the snapshot retained for a peer in a file.
+        """
+        retained = self._retained()
+        retained[peer] = snapshot
+        self.get_path().child(b".peers").setContent(b"".join(
+            b"%s %s\n" % (peer.encode("utf-8"), snapshot.name)
+            for peer, snapshot in sorted(retained.items())))
+        return succeed(None)
+
+    def prune_snapshots(self):
+        """
+        Forget about pretend snapshots which are no longer needed.
+        """
+        retained = self._retained()
+        if not retained:
+            return succeed([])
+        snapshots = self._snapshots()
+        pruned = _snapshots_to_prune(snapshots, retained.values())
+        if pruned:
+            self._set_snapshots(
+                [snapshot for snapshot in snapshots
+                 if snapshot not in pruned])
+        return succeed(pruned)
+
+    def _partial_path(self):
+        """
+        :return: The ``FilePath`` where the data of an interrupted write is
+            kept.  It is next to the directory since the directory might
+            not exist yet.
+        """
+        return self.path.sibling(self.path.basename() + b".partial")
+
+    def resume_token(self):
+        """
+        The pretend resume token is the number of bytes received before the
+        stream was interrupted.
+        """
+        partial = self._partial_path()
+        if partial.exists():
+            return succeed(b"%d" % (partial.getsize(),))
+        return succeed(None)
 
     @contextmanager
-    def reader(self, remote_snapshots=None):
+    def reader(self, remote_snapshots=None, resume_token=None):
         """
         Package up filesystem contents as a tarball.
+
+        The tarball is generated by a thread writing to a pipe as it is
+        read, so only a bounded amount of it is ever in memory.
+
+        If resuming, the contents had better not have changed since the
+        interrupted stream was generated.
         """
-        result = BytesIO()
-        tarball = TarFile(fileobj=result, mode="w")
+        read_fd, write_fd = pipe()
+        failures = []
+
+        def generate():
+            with fdopen(write_fd, "wb") as output:
+                try:
+                    self._write_tarball(output, remote_snapshots)
+                except IOError as e:
+                    # The reader went away without reading everything.
+                    if e.errno != EPIPE:
+                        failures.append(Failure())
+                except:
+                    failures.append(Failure())
+        generating = Thread(target=generate)
+        generating.daemon = True
+        generating.start()
+
+        contents = fdopen(read_fd, "rb")
+        try:
+            if resume_token is not None:
+                skip = int(resume_token)
+                while skip:
+                    skipped = len(contents.read(min(skip, _COPY_SIZE)))
+                    if not skipped:
+                        break
+                    skip -= skipped
+            yield _SendStream(
+                contents, None, (self._snapshots() or [None])[-1])
+        finally:
+            contents.close()
+            generating.join()
+        if failures:
+            failures[0].raiseException()
+
+    def _write_tarball(self, output, remote_snapshots):
+        """
+        Write the filesystem contents as a tarball in stream mode.
+
+        :param file output: The file to write to.
+        :param remote_snapshots: See ``reader``.
+        """
+        tarball = TarFile.open(fileobj=output, mode="w|")
         for child in self.path.children():
+            if child.basename() == b".peers":
+                continue
             tarball.add(child.path, arcname=child.basename(), recursive=True)
         tarball.close()
 
@@ -117,30 +242,109 @@ class DirectoryFilesystem(object):
         # without forcing us to implement actual incremental streams on top of
         # dumb directories.
         if remote_snapshots:
-            result.write(
+            output.write(
                 u"\nincremental stream based on\n{}".format(
                     u"\n".join(snapshot.name for snapshot in remote_snapshots)
                 ).encode("ascii")
             )
-        result.seek(0, 0)
-        yield result
 
     @contextmanager
-    def writer(self):
-        """Expect written bytes to be a tarball."""
-        result = BytesIO()
-        yield result
-        result.seek(0, 0)
+    def writer(self, resume=False):
+        """
+        Expect written bytes to be a tarball.
+
+        The bytes are written to a file next to the directory as they
+        arrive and extracted from it in stream mode once writing has
+        finished, so none of them are kept in memory.
+
+        If the writing is interrupted by an exception the bytes written so
+        far are kept, to be prepended to the bytes written when resuming.
+        """
+        partial = self._partial_path()
+        with open(partial.path, "ab" if resume else "wb") as output:
+            yield output
+        retained = {}
         try:
-            tarball = TarFile(fileobj=result, mode="r")
-            if self.path.exists():
-                self.path.remove()
-            self.path.createDirectory()
-            tarball.extractall(self.path.path)
+            with open(partial.path, "rb") as data:
+                tarball = TarFile.open(fileobj=data, mode="r|")
+                if self.path.exists():
+                    retained = self._retained()
+                    self.path.remove()
+                self.path.createDirectory()
+                tarball.extractall(self.path.path)
         except:
             # This should really be dealt with, e.g. logged:
             # https://clusterhq.atlassian.net/browse/FLOC-122
             pass
+        else:
+            snapshots = self._snapshots()
+            if snapshots:
+                retained[SENDER] = snapshots[-1]
+            for peer, snapshot in retained.items():
+                self.retain_snapshot(peer, snapshot)
+        finally:
+            partial.remove()
+
+    def send(self, consumer, remote_snapshots=None, resume_token=None):
+        """
+        Write the tarball generated by ``reader`` to the consumer.
+        """
+        reading = self.reader(remote_snapshots, resume_token)
+        contents = reading.__enter__()
+        d = FileSender().beginFileTransfer(contents, consumer)
+
+        def sent(result):
+            reading.__exit__(None, None, None)
+            return result
+        d.addBoth(sent)
+        d.addCallback(lambda _: contents.snapshot)
+        return d
+
+    def receiver(self, resume=False):
+        """
+        Write the data to ``writer`` as it arrives.
+        """
+        return succeed(_DirectoryReceiver(self.writer(resume)))
+
+
+@implementer(IFilesystemReceiver)
+class _DirectoryReceiver(object):
+    """
+    Write data to a ``DirectoryFilesystem`` through its ``writer``.
+
+    Writes never block, so non-streaming producers are simply asked for
+    data until they are unregistered.
+    """
+    def __init__(self, writer):
+        """
+        :param writer: The context manager returned by
+            ``DirectoryFilesystem.writer``, which has not been entered yet.
+        """
+        self._writer = writer
+        self._file = writer.__enter__()
+        self._producer = None
+
+    def write(self, data):
+        self._file.write(data)
+
+    def registerProducer(self, producer, streaming):
+        self._producer = producer
+        if not streaming:
+            while self._producer is producer:
+                producer.resumeProducing()
+
+    def unregisterProducer(self):
+        self._producer = None
+
+    def finish(self):
+        self._writer.__exit__(None, None, None)
+        return succeed(None)
+
+    def abort(self):
+        # Interrupt the writer the same way an exception would.
+        self._writer.__exit__(
+            IOError, IOError("The data stream was interrupted."), None)
+        return succeed(None)
 
 
 @implementer(IStoragePool)
@@ -174,6 +378,11 @@ class FilesystemStoragePool(Service):
         root.remove()
         return succeed(None)
 
+    def destroy_many(self, volumes):
+        return DeferredList(
+            [maybeDeferred(self.destroy, volume) for volume in volumes],
+            consumeErrors=True)
+
     def set_maximum_size(self, volume):
         filesystem = self.get(volume)
         root = filesystem.get_path()
@@ -194,7 +403,7 @@ class FilesystemStoragePool(Service):
         d = self.create(volume)
         with parent.reader() as reader:
             with child.writer() as writer:
-                writer.write(reader.read())
+                copyfileobj(reader, writer, _COPY_SIZE)
         return d
 
     def change_owner(self, volume, new_volume):
@@ -221,6 +430,9 @@ class FilesystemStoragePool(Service):
         filesystems = set()
         if self._root.isdir():
             for path in self._root.children():
+                if not path.isdir():
+                    # Kept data of an interrupted write.
+                    continue
                 if path.child(b".size").exists():
                     maximum_size = int(
                         path.child(b".size").getContent().decode("ascii"))
@@ -230,6 +442,36 @@ class FilesystemStoragePool(Service):
                     DirectoryFilesystem(
                         path=path,
                         size=VolumeSize(maximum_size=maximum_size),
+                        usage=self._usage(path, maximum_size),
                     )
                 )
         return succeed(filesystems)
+
+    def _usage(self, path, maximum_size):
+        """
+        Add up the space the files of a pretend filesystem take up.
+
+        :param FilePath path: The directory of the filesystem.
+        :param maximum_size: The filesystem's maximum size in bytes, or
+            ``None``.
+
+        :return VolumeUsage: The usage of the filesystem.
+        """
+        used = sum(child.getsize() for child in path.walk()
+                   if child.isfile())
+        available = self._free_space()
+        if maximum_size is not None:
+            available = min(available, max(maximum_size - used, 0))
+        return VolumeUsage(
+            used=used, available=available, compression_ratio=1.0)
+
+    def _free_space(self):
+        """
+        :return: The number of bytes free on the filesystem containing the
+            root directory, as an ``int``.
+        """
+        result = statvfs(self._root.path)
+        return result.f_bavail * result.f_frsize
+
+    def free_space(self):
+        return succeed(self._free_space())
@@ -19,20 +19,25 @@ from zope.interface import implementer
 
 from eliot import Field, MessageType, Logger
 
+from pyrsistent import pmap, pvector
+
 from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
 from twisted.internet.endpoints import ProcessEndpoint, connectProtocol
 from twisted.internet.protocol import Protocol
-from twisted.internet.defer import Deferred, succeed, gatherResults
+from twisted.internet.defer import (
+    Deferred, DeferredList, DeferredSemaphore, succeed, gatherResults,
+)
 from twisted.internet.error import ConnectionDone, ProcessTerminated
 from twisted.application.service import Service
 
 from .errors import MaximumSizeTooSmall
 from .interfaces import (
-    IFilesystemSnapshots, IStoragePool, IFilesystem,
-    FilesystemAlreadyExists)
+    IFilesystemSnapshots, IStoragePool, IFilesystem, IFilesystemReceiver,
+    FilesystemAlreadyExists, SENDER)
 
-from .._model import VolumeSize
+from .._model import VolumeSize, VolumeUsage
+from ...common import call_in_reactor_thread
 
 
 def random_name():
@@ -64,17 +69,48 @@ class _AccumulatingProtocol(Protocol):
         self._data += data
 
     def connectionLost(self, reason):
-        if reason.check(ConnectionDone):
-            self._result.callback(self._data)
-        elif reason.check(ProcessTerminated) and reason.value.exitCode == 1:
-            self._result.errback(CommandFailed())
-        elif reason.check(ProcessTerminated) and reason.value.exitCode == 2:
-            self._result.errback(BadArguments())
-        else:
-            self._result.errback(reason)
+        _command_ended(self._result, reason, self._data)
         del self._result
 
 
+def _command_ended(result, reason, value):
+    """
+    Fire a ``Deferred`` with the outcome of a ``zfs`` process.
+
+    :param Deferred result: The ``Deferred`` to fire.
+    :param Failure reason: The reason the process ended, as passed to
+        ``IProtocol.connectionLost``.
+    :param value: The result if the process exited successfully.
+    """
+    if reason.check(ConnectionDone):
+        result.callback(value)
+    elif reason.check(ProcessTerminated) and reason.value.exitCode == 1:
+        result.errback(CommandFailed())
+    elif reason.check(ProcessTerminated) and reason.value.exitCode == 2:
+        result.errback(BadArguments())
+    else:
+        result.errback(reason)
+
+
+def _connect_zfs(reactor, arguments, protocol):
+    """
+    Run the ``zfs`` command-line tool with its standard input and output
+    connected to a protocol.
+
+    :param reactor: A ``IReactorProcess`` provider.
+    :param arguments: A ``list`` of ``bytes``, command-line arguments to
+        ``zfs``.
+    :param IProtocol protocol: The protocol, whose ``connectionLost`` is
+        called with the reason the process ended.
+
+    :return: A ``Deferred`` that fires with ``protocol`` once the process
+        has been started.
+    """
+    endpoint = ProcessEndpoint(reactor, b"zfs", [b"zfs"] + arguments,
+                               os.environ)
+    return connectProtocol(endpoint, protocol)
+
+
 def zfs_command(reactor, arguments):
     """
     Asynchronously run the ``zfs`` command-line tool with the given arguments.
@@ -88,13 +124,84 @@ def zfs_command(reactor, arguments):
         exit code 0), or errbacking with :class:`CommandFailed` or
         :class:`BadArguments` depending on the exit code (1 or 2).
     """
-    endpoint = ProcessEndpoint(reactor, b"zfs", [b"zfs"] + arguments,
-                               os.environ)
-    d = connectProtocol(endpoint, _AccumulatingProtocol())
+    d = _connect_zfs(reactor, arguments, _AccumulatingProtocol())
     d.addCallback(lambda protocol: protocol._result)
     return d
 
 
+class _SendProtocol(Protocol):
+    """
+    Write the output of ``zfs send`` to a consumer.
+
+    The process is registered with the consumer as a streaming producer, so
+    that a consumer which can't keep up pauses reading from ``zfs`` rather
+    than buffering the stream in memory.
+
+    :ivar Deferred done: Fires with ``None`` once the process has exited
+        and all of its output has been written, or fails with the same
+        exceptions as ``zfs_command``.
+    """
+    def __init__(self, consumer):
+        """
+        :param IConsumer consumer: The consumer to write the stream to.
+        """
+        self._consumer = consumer
+        self.done = Deferred()
+
+    def connectionMade(self):
+        self._consumer.registerProducer(self.transport, True)
+
+    def dataReceived(self, data):
+        self._consumer.write(data)
+
+    def connectionLost(self, reason):
+        self._consumer.unregisterProducer()
+        _command_ended(self.done, reason, None)
+
+
+@implementer(IFilesystemReceiver)
+class _Receiver(Protocol):
+    """
+    Write data to the standard input of ``zfs receive``.
+
+    Producers registered with the receiver are registered with the
+    process's standard input, so they are paused while ``zfs`` catches up.
+    """
+    def __init__(self, filesystem):
+        """
+        :param Filesystem filesystem: The filesystem being received into.
+        """
+        self._filesystem = filesystem
+        self._ended = Deferred()
+
+    def connectionLost(self, reason):
+        _command_ended(self._ended, reason, None)
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def registerProducer(self, producer, streaming):
+        self.transport.registerProducer(producer, streaming)
+
+    def unregisterProducer(self):
+        self.transport.unregisterProducer()
+
+    def finish(self):
+        self.transport.closeStdin()
+        d = self._ended
+        d.addCallback(lambda _: self._filesystem._received())
+        return d
+
+    def abort(self):
+        # An incomplete stream makes ``zfs receive`` fail, keeping the data
+        # received so far if the receive is resumable.
+        self.transport.closeStdin()
+        d = self._ended
+        d.addErrback(lambda _: None)
+        d.addCallback(self._filesystem._changed)
+        return d
+
+
 _ZFS_COMMAND = Field.forTypes(
     "zfs_command", [bytes], u"The command which was run.")
 _OUTPUT = Field.forTypes(
@@ -168,6 +275,215 @@ def _latest_common_snapshot(some, others):
     return None
 
 
+def _snapshots_to_prune(snapshots, retained):
+    """
+    Pick the snapshots of a filesystem which are not needed any more.
+
+    The newest snapshot is kept since it will be the basis of the next push,
+    as are the retained snapshots which peers have in common with the
+    filesystem.  Any other snapshot would only ever be used by an
+    incremental data stream to a peer which has it as its newest common
+    snapshot, and no peer does.
+
+    :param list snapshots: ``Snapshot`` instances of the filesystem, ordered
+        from oldest to newest.
+    :param retained: An iterable of the ``Snapshot`` instances retained for
+        peers.
+
+    :return: A ``list`` of the ``Snapshot`` instances to destroy, ordered
+        from oldest to newest.
+    """
+    keep = set(retained)
+    keep.update(snapshots[-1:])
+    return [snapshot for snapshot in snapshots if snapshot not in keep]
+
+
+# Prefix of the ZFS user properties recording the snapshot retained for
+# each peer; the rest of the property name is the peer.
+_PEER_PROPERTY = b"flocker:peer:"
+
+
+def _peer_property(peer):
+    """
+    :param unicode peer: A peer.
+
+    :return: The name of the ZFS user property recording the snapshot
+        retained for the peer, as ``bytes``.
+    """
+    return _PEER_PROPERTY + peer.encode("ascii")
+
+
+def _retained_snapshots_command(filesystem):
+    """
+    Construct a ``zfs`` command which will output the user properties of the
+    given filesystem, including those recording retained snapshots.
+
+    :param Filesystem filesystem: The ZFS filesystem.
+
+    :return list: An argument list (of ``bytes``) to pass to ``zfs``.
+    """
+    return [b"get", b"-H", b"-s", b"local", b"-o", b"property,value", b"all",
+            filesystem.name]
+
+
+def _parse_retained_snapshots(data):
+    """
+    Parse the output of the command constructed by
+    ``_retained_snapshots_command``.
+
+    :param bytes data: The output.
+
+    :return: A ``dict`` mapping each peer, as ``unicode``, to the
+        ``Snapshot`` retained for it.
+    """
+    retained = {}
+    for line in data.splitlines():
+        name, value = line.split(b"\t", 1)
+        if name.startswith(_PEER_PROPERTY):
+            peer = name[len(_PEER_PROPERTY):].decode("ascii")
+            retained[peer] = Snapshot(name=value)
+    return retained
+
+
+def _estimate_send_size(identifier):
+    """
+    Ask ZFS how big a ``zfs send`` stream will be, without generating it.
+
+    :param list identifier: The snapshot arguments which will be passed to
+        ``zfs send``.
+
+    :return: The estimated size in bytes as an ``int``, or ``None`` if ZFS
+        could not provide an estimate.
+    """
+    try:
+        output = check_output(
+            [b"zfs", b"send", b"-n", b"-P"] + identifier, stderr=STDOUT)
+    except (OSError, CalledProcessError):
+        return None
+    for line in output.splitlines():
+        fields = line.split()
+        if fields[:1] == [b"size"] and len(fields) == 2:
+            try:
+                return int(fields[1])
+            except ValueError:
+                return None
+    return None
+
+
+# Pools whose ``zfs`` supports resumable receives (``zfs receive -s``),
+# by name.  Support depends on the installed ZFS version and pool features
+# so it is checked once per pool.
+_resumable_pools = {}
+
+
+def _supports_resumable_receive(pool):
+    """
+    Determine whether interrupted receives into a pool can be resumed.
+
+    :param bytes pool: The name of the pool.
+
+    :return: ``True`` if ``zfs receive -s`` and ``zfs send -t`` can be used,
+        otherwise ``False``.
+    """
+    if pool not in _resumable_pools:
+        try:
+            # Older versions of ZFS don't know the property at all.
+            check_output([b"zfs", b"get", b"-H", b"-o", b"value",
+                          b"receive_resume_token", pool], stderr=STDOUT)
+        except (OSError, CalledProcessError):
+            _resumable_pools[pool] = False
+        else:
+            _resumable_pools[pool] = True
+    return _resumable_pools[pool]
+
+
+def _check_resumable_receive(reactor, pool):
+    """
+    Asynchronous version of ``_supports_resumable_receive``.
+
+    :param reactor: A ``IReactorProcess`` provider.
+    :param bytes pool: The name of the pool.
+
+    :return: A ``Deferred`` that fires with ``True`` if ``zfs receive -s``
+        and ``zfs send -t`` can be used, otherwise ``False``.
+    """
+    if pool in _resumable_pools:
+        return succeed(_resumable_pools[pool])
+    d = zfs_command(reactor, [b"get", b"-H", b"-o", b"value",
+                              b"receive_resume_token", pool])
+
+    def failed(reason):
+        reason.trap(CommandFailed, BadArguments)
+        return False
+    d.addCallbacks(lambda _: True, failed)
+
+    def checked(supported):
+        _resumable_pools[pool] = supported
+        return supported
+    d.addCallback(checked)
+    return d
+
+
+def _resume_token_command(filesystem):
+    """
+    Construct a ``zfs`` command which will output the resume token of an
+    interrupted receive into the given filesystem.
+
+    :param Filesystem filesystem: The ZFS filesystem.
+
+    :return list: An argument list (of ``bytes``) to pass to ``zfs``.
+    """
+    return [b"get", b"-H", b"-o", b"value", b"receive_resume_token",
+            filesystem.name]
+
+
+def _parse_resume_token(data):
+    """
+    Parse the output of the command constructed by
+    ``_resume_token_command``.
+
+    :param bytes data: The output.
+
+    :return: The token as ``bytes``, or ``None`` if there isn't one.
+    """
+    token = data.strip()
+    if token in (b"", b"-"):
+        return None
+    return token
+
+
+class _SendStream(object):
+    """
+    The output of ``zfs send`` along with ZFS's estimate of its size.
+
+    :ivar expected_size: The estimated size of the stream in bytes, or
+        ``None`` if it is not known.
+    :ivar snapshot: The ``Snapshot`` being sent, or ``None`` if it is not
+        known.
+    """
+    def __init__(self, stream, expected_size, snapshot=None):
+        """
+        :param file stream: The standard output of ``zfs send``.
+        :param expected_size: See ``expected_size`` above.
+        :param snapshot: See ``snapshot`` above.
+        """
+        self._stream = stream
+        self.expected_size = expected_size
+        self.snapshot = snapshot
+
+    def read(self, *args):
+        return self._stream.read(*args)
+
+    def readinto(self, buffer):
+        return self._stream.readinto(buffer)
+
+    def fileno(self):
+        return self._stream.fileno()
+
+    def close(self):
+        self._stream.close()
+
+
 @implementer(IFilesystem)
 @with_cmp(["pool", "dataset"])
 @with_repr(["pool", "dataset"])
@@ -179,7 +495,7 @@ class Filesystem(object):
     implementation over time.
     """
     def __init__(self, pool, dataset, mountpoint=None, size=None,
-                 reactor=None):
+                 reactor=None, listing_cache=None, usage=None):
         """
         :param pool: The filesystem's pool name, e.g. ``b"hpool"``.
 
@@ -190,14 +506,56 @@ class Filesystem(object):
             filesystem is mounted.
 
         :param VolumeSize size: The capacity information for this filesystem.
+
+        :param _PoolListingCache listing_cache: The cached listing of the
+            pool shared with the ``StoragePool`` the filesystem came from,
+            or ``None`` to always ask ``zfs``.
+
+        :param VolumeUsage usage: The space the filesystem takes up, if
+            known.
         """
         self.pool = pool
         self.dataset = dataset
         self._mountpoint = mountpoint
         self.size = size
+        self.usage = usage
         if reactor is None:
             from twisted.internet import reactor
         self._reactor = reactor
+        if listing_cache is None:
+            listing_cache = _PoolListingCache()
+        self._listing_cache = listing_cache
+
+    def _listing(self):
+        """
+        :return: The cached ``_PoolListing`` which can answer questions about
+            this filesystem, or ``None`` if ``zfs`` has to be asked.
+        """
+        if self.dataset is None:
+            # The listing only covers the children of the pool.
+            return None
+        return self._listing_cache.current
+
+    def _changed(self, result=None):
+        """
+        Discard the cached listing of the pool, which this filesystem has
+        just been changed behind the back of.
+
+        :param result: Returned unchanged, so this can be used as a
+            ``Deferred`` callback.
+        """
+        self._listing_cache.invalidate()
+        return result
+
+    def _changed_in_thread(self):
+        """
+        Like ``_changed``, for the blocking methods which transfers run in
+        another thread.
+
+        The listing cache is only safe to use from the reactor thread, so
+        the cache is invalidated there.
+        """
+        call_in_reactor_thread(self._reactor, self._listing_cache.invalidate)
 
     def _exists(self):
         """
@@ -206,6 +564,9 @@ class Filesystem(object):
         :return: ``True`` if there is a filesystem with this name, ``False``
             otherwise.
         """
+        listing = self._listing()
+        if listing is not None:
+            return self.dataset in listing.datasets
         try:
             check_output([b"zfs", b"list", self.name], stderr=STDOUT)
         except CalledProcessError:
@@ -213,14 +574,41 @@ class Filesystem(object):
         return True
 
     def snapshots(self):
-        if self._exists():
-            zfs_snapshots = ZFSSnapshots(self._reactor, self)
-            d = zfs_snapshots.list()
-            d.addCallback(lambda snapshots:
-                          [Snapshot(name=name)
-                           for name in snapshots])
-            return d
-        return succeed([])
+        listing = self._listing()
+        if listing is not None:
+            return succeed([
+                Snapshot(name=name)
+                for name in listing.snapshots.get(self.dataset, [])])
+        zfs_snapshots = ZFSSnapshots(self._reactor, self)
+        d = zfs_snapshots.list()
+        d.addCallback(lambda snapshots:
+                      [Snapshot(name=name)
+                       for name in snapshots])
+
+        def failed(reason):
+            # The filesystem doesn't exist.
+            reason.trap(CommandFailed)
+            return []
+        d.addErrback(failed)
+        return d
+
+    def _check_exists(self):
+        """
+        Asynchronous version of ``_exists``.
+
+        :return: A ``Deferred`` that fires with ``True`` if there is a
+            filesystem with this name, ``False`` otherwise.
+        """
+        listing = self._listing()
+        if listing is not None:
+            return succeed(self.dataset in listing.datasets)
+        d = zfs_command(self._reactor, [b"list", self.name])
+
+        def failed(reason):
+            reason.trap(CommandFailed)
+            return False
+        d.addCallbacks(lambda _: True, failed)
+        return d
 
     @property
     def name(self):
@@ -232,8 +620,30 @@ class Filesystem(object):
     def get_path(self):
         return self._mountpoint
 
+    def resume_token(self):
+        d = zfs_command(self._reactor, _resume_token_command(self))
+        d.addCallback(_parse_resume_token)
+
+        def failed(reason):
+            # The filesystem does not exist, or ZFS is too old to support
+            # resuming.
+            reason.trap(CommandFailed, BadArguments)
+            return None
+        d.addErrback(failed)
+        return d
+
+    def _resume_token(self):
+        """
+        Synchronous version of ``resume_token``.
+        """
+        try:
+            return _parse_resume_token(check_output(
+                [b"zfs"] + _resume_token_command(self), stderr=STDOUT))
+        except CalledProcessError:
+            return None
+
     @contextmanager
-    def reader(self, remote_snapshots=None):
+    def reader(self, remote_snapshots=None, resume_token=None):
         """
         Send zfs stream of contents.
 
@@ -241,6 +651,34 @@ class Filesystem(object):
             oldest to newest, which are available on the writer.  The reader
             may generate a partial stream which relies on one of these
             snapshots in order to minimize the data to be transferred.
+
+        :param resume_token: ``None`` or the ``receive_resume_token`` of an
+            interrupted receive, to send the rest of that stream with
+            ``zfs send -t``.
+        """
+        if resume_token is not None:
+            # The snapshot is hidden inside the token.
+            snapshot = None
+            identifier = [b"-t", resume_token]
+        else:
+            snapshot, identifier = self._send_identifier(remote_snapshots)
+        expected_size = _estimate_send_size(identifier)
+        process = Popen([b"zfs", b"send"] + identifier, stdout=PIPE)
+        try:
+            yield _SendStream(process.stdout, expected_size, snapshot)
+        finally:
+            process.stdout.close()
+            process.wait()
+
+    def _send_identifier(self, remote_snapshots):
+        """
+        Take a new snapshot and determine what to send to bring a writer
+        with some snapshots up to date with it.
+
+        :param list remote_snapshots: See ``reader``.
+
+        :return: A ``tuple`` of the new ``Snapshot`` and the ``list`` of
+            snapshot arguments for ``zfs send``.
         """
         # The existing snapshot code uses Twisted, so we're not using it
         # in this iteration.  What's worse, though, is that it's not clear
@@ -248,47 +686,120 @@ class Filesystem(object):
         # moreover it violates abstraction boundaries. So as first pass
         # I'm just using UUIDs, and hopefully requirements will become
         # clearer as we iterate.
-        snapshot = b"%s@%s" % (self.name, uuid4())
-        check_call([b"zfs", b"snapshot", snapshot])
+        snapshot_name = bytes(uuid4())
+        check_call(
+            [b"zfs", b"snapshot", b"%s@%s" % (self.name, snapshot_name)])
+        self._changed_in_thread()
+        local_snapshots = _parse_snapshots(
+            check_output([b"zfs"] + _list_snapshots_command(self)), self)
+        return Snapshot(name=snapshot_name), self._send_arguments(
+            snapshot_name, local_snapshots, remote_snapshots)
+
+    def _send_arguments(self, snapshot_name, local_snapshots,
+                        remote_snapshots):
+        """
+        Determine the snapshot arguments for ``zfs send``.
+
+        :param bytes snapshot_name: The name of the snapshot to send.
+        :param list local_snapshots: The names of this filesystem's
+            snapshots as ``bytes``, oldest first.
+        :param list remote_snapshots: See ``reader``.
+
+        :return: A ``list`` of ``bytes``.
+        """
+        snapshot = b"%s@%s" % (self.name, snapshot_name)
 
         # Determine whether there is a shared snapshot which can be used as the
         # basis for an incremental send.
-        local_snapshots = list(
-            Snapshot(name=name) for name in
-            _parse_snapshots(
-                check_output([b"zfs"] + _list_snapshots_command(self)),
-                self
-            ))
-
         if remote_snapshots is None:
             remote_snapshots = []
 
         latest_common_snapshot = _latest_common_snapshot(
-            remote_snapshots, local_snapshots)
+            remote_snapshots,
+            [Snapshot(name=name) for name in local_snapshots])
 
         if latest_common_snapshot is None:
-            identifier = [snapshot]
+            return [snapshot]
+        return [
+            b"-i",
+            u"{}@{}".format(
+                self.name, latest_common_snapshot.name).encode("ascii"),
+            snapshot,
+        ]
+
+    def send(self, consumer, remote_snapshots=None, resume_token=None):
+        if resume_token is not None:
+            # The snapshot is hidden inside the token.
+            d = succeed((None, [b"-t", resume_token]))
         else:
-            identifier = [
-                b"-i",
-                u"{}@{}".format(
-                    self.name, latest_common_snapshot.name).encode("ascii"),
-                snapshot,
-            ]
-
-        process = Popen([b"zfs", b"send"] + identifier, stdout=PIPE)
-        try:
-            yield process.stdout
-        finally:
-            process.stdout.close()
-            process.wait()
+            snapshot_name = bytes(uuid4())
+            d = ZFSSnapshots(self._reactor, self).create(snapshot_name)
+            d.addCallback(lambda _: _list_snapshots(self._reactor, self))
+            d.addCallback(lambda local_snapshots: (
+                Snapshot(name=snapshot_name), self._send_arguments(
+                    snapshot_name, local_snapshots, remote_snapshots)))
+
+        def identified(result):
+            snapshot, identifier = result
+            protocol = _SendProtocol(consumer)
+            sending = _connect_zfs(
+                self._reactor, [b"send"] + identifier, protocol)
+            sending.addCallback(lambda _: protocol.done)
+            sending.addCallback(lambda _: snapshot)
+            return sending
+        d.addCallback(identified)
+        return d
 
     @contextmanager
-    def writer(self):
+    def writer(self, resume=False):
         """
         Read in zfs stream.
+
+        Where ZFS supports it the stream is received with ``-s`` so that if
+        it is interrupted, e.g. by the network connection to the sender
+        dying, the sender can resume it rather than starting again.
+        """
+        resumable = _supports_resumable_receive(self.pool)
+        if resumable and not resume and self._resume_token() is not None:
+            # A new stream can't be received while the state of an
+            # interrupted one is kept.
+            check_call([b"zfs", b"receive", b"-A", self.name])
+        cmd = [b"zfs"] + self._receive_arguments(resumable, self._exists())
+        process = Popen(cmd, stdin=PIPE)
+        succeeded = False
+        try:
+            yield process.stdin
+        finally:
+            process.stdin.close()
+            succeeded = not process.wait()
+            self._changed_in_thread()
+        if succeeded:
+            check_call([b"zfs", b"set",
+                        b"mountpoint=" + self._mountpoint.path,
+                        self.name])
+            received = _parse_snapshots(
+                check_output([b"zfs"] + _list_snapshots_command(self)), self)
+            if received:
+                check_call([b"zfs", b"set",
+                            _peer_property(SENDER) + b"=" + received[-1],
+                            self.name])
+            self._changed_in_thread()
+
+    def _receive_arguments(self, resumable, exists):
+        """
+        Determine the arguments for ``zfs receive``.
+
+        :param bool resumable: Whether the receive should be resumable if
+            interrupted.
+        :param bool exists: Whether the filesystem already exists.
+
+        :return: A ``list`` of ``bytes``.
         """
-        if self._exists():
+        if resumable:
+            options = [b"-s"]
+        else:
+            options = []
+        if exists:
             # If the filesystem already exists then this should be an
             # incremental data stream to up date it to a more recent snapshot.
             # If that's not the case then we're about to screw up - but that's
@@ -308,22 +819,127 @@ class Filesystem(object):
             # it in order to receive the stream.  To do that you have to
             # force.
             #
-            cmd = [b"zfs", b"receive", b"-F", self.name]
+            return [b"receive"] + options + [b"-F", self.name]
         else:
             # If the filesystem doesn't already exist then this is a complete
             # data stream.
-            cmd = [b"zfs", b"receive", self.name]
-        process = Popen(cmd, stdin=PIPE)
-        succeeded = False
-        try:
-            yield process.stdin
-        finally:
-            process.stdin.close()
-            succeeded = not process.wait()
-        if succeeded:
-            check_call([b"zfs", b"set",
-                        b"mountpoint=" + self._mountpoint.path,
-                        self.name])
+            return [b"receive"] + options + [self.name]
+
+    def receiver(self, resume=False):
+        d = _check_resumable_receive(self._reactor, self.pool)
+
+        def got_resumable(resumable):
+            if resumable and not resume:
+                # A new stream can't be received while the state of an
+                # interrupted one is kept.
+                discarding = self.resume_token()
+                discarding.addCallback(
+                    lambda token: None if token is None else zfs_command(
+                        self._reactor, [b"receive", b"-A", self.name]))
+            else:
+                discarding = succeed(None)
+            discarding.addCallback(lambda _: self._check_exists())
+            discarding.addCallback(
+                lambda exists: _connect_zfs(
+                    self._reactor, self._receive_arguments(resumable, exists),
+                    _Receiver(self)))
+            return discarding
+        d.addCallback(got_resumable)
+        return d
+
+    def _received(self):
+        """
+        Asynchronously finish receiving a data stream into this filesystem,
+        the way ``writer`` does once ``zfs receive`` has succeeded.
+
+        :return: A ``Deferred`` that fires with ``None`` when done.
+        """
+        d = zfs_command(self._reactor, [
+            b"set", b"mountpoint=" + self._mountpoint.path, self.name])
+        d.addCallback(lambda _: _list_snapshots(self._reactor, self))
+
+        def listed(received):
+            if received:
+                return zfs_command(self._reactor, [
+                    b"set", _peer_property(SENDER) + b"=" + received[-1],
+                    self.name])
+        d.addCallback(listed)
+        d.addBoth(self._changed)
+        d.addCallback(lambda _: None)
+        return d
+
+    def retain_snapshot(self, peer, snapshot):
+        d = zfs_command(
+            self._reactor,
+            [b"set", _peer_property(peer) + b"=" + snapshot.name, self.name])
+        d.addCallback(lambda _: None)
+        return d
+
+    def prune_snapshots(self):
+        d = gatherResults([
+            _list_snapshots(self._reactor, self),
+            zfs_command(self._reactor, _retained_snapshots_command(self)),
+        ], consumeErrors=True)
+
+        def got_snapshots(results):
+            names, retained = results
+            retained = _parse_retained_snapshots(retained)
+            if not retained:
+                return []
+            return self._destroy_snapshots(_snapshots_to_prune(
+                [Snapshot(name=name) for name in names], retained.values()))
+
+        def failed(reason):
+            # The filesystem does not exist (any more).
+            reason.value.subFailure.trap(CommandFailed)
+            return []
+        d.addCallbacks(got_snapshots, failed)
+        return d
+
+    def _destroy_snapshots(self, snapshots):
+        """
+        Destroy some snapshots of this filesystem.
+
+        The snapshots are destroyed in batches by one ``zfs destroy
+        fs@a,b,c`` each, one batch at a time, so however many there are
+        only a few processes are run.  ``zfs`` destroys none of a batch if
+        any of it can't be destroyed, e.g. because it is being sent right
+        now, so the snapshots of a failed batch are then destroyed one at a
+        time and those which fail are skipped; they will be pruned next
+        time.
+
+        :param list snapshots: The ``Snapshot`` instances to destroy.
+
+        :return: A ``Deferred`` that fires with a ``list`` of the
+            ``Snapshot`` instances which were destroyed.
+        """
+        def destroy(batch):
+            d = zfs_command(self._reactor, [
+                b"destroy", b"%s@%s" % (
+                    self.name,
+                    b",".join(snapshot.name for snapshot in batch))])
+            d.addCallback(lambda _: batch)
+
+            def failed(reason):
+                reason.trap(CommandFailed)
+                if len(batch) == 1:
+                    return []
+                return destroy_each([[snapshot] for snapshot in batch])
+            d.addErrback(failed)
+            return d
+
+        def destroy_each(batches):
+            destroyed = []
+            d = succeed(None)
+            for batch in batches:
+                d.addCallback(lambda _, batch=batch: destroy(batch))
+                d.addCallback(destroyed.extend)
+            d.addCallback(lambda _: destroyed)
+            return d
+        d = destroy_each(_snapshot_batches(
+            snapshots, MAXIMUM_DESTROY_ARGUMENT - len(self.name) - 1))
+        d.addCallback(self._changed)
+        return d
 
 
 @implementer(IFilesystemSnapshots)
@@ -337,6 +953,7 @@ class ZFSSnapshots(object):
     def create(self, name):
         encoded_name = b"%s@%s" % (self._filesystem.name, name)
         d = zfs_command(self._reactor, [b"snapshot", encoded_name])
+        d.addBoth(self._filesystem._changed)
         d.addCallback(lambda _: None)
         return d
 
@@ -420,6 +1037,41 @@ def _list_snapshots(reactor, filesystem):
     return d
 
 
+# The number of ``zfs destroy`` processes ``StoragePool.destroy_many`` runs
+# at the same time.
+MAXIMUM_CONCURRENT_DESTROYS = 4
+
+# The most bytes in the argument naming the snapshots one ``zfs destroy``
+# destroys when pruning, well below Linux's limit on the length of a single
+# argument.
+MAXIMUM_DESTROY_ARGUMENT = 64 * 1024
+
+
+def _snapshot_batches(snapshots, maximum):
+    """
+    Split snapshots into batches whose comma-separated names fit in an
+    argument of limited length.
+
+    :param list snapshots: ``Snapshot`` instances.
+    :param int maximum: The most bytes of names in a batch.
+
+    :return: A ``list`` of non-empty ``list``\ s of ``Snapshot``
+        instances.  A snapshot whose name alone is too long is put in a
+        batch of its own.
+    """
+    batches = []
+    size = 0
+    for snapshot in snapshots:
+        added = len(snapshot.name) + 1
+        if batches and size + added - 1 <= maximum:
+            batches[-1].append(snapshot)
+            size += added
+        else:
+            batches.append([snapshot])
+            size = added
+    return batches
+
+
 def volume_to_dataset(volume):
     """Convert a volume to a dataset name.
 
@@ -456,6 +1108,17 @@ class StoragePool(Service):
         self._reactor = reactor
         self._name = name
         self._mount_root = mount_root
+        self._listing = _PoolListingCache()
+
+    def _changed(self, result):
+        """
+        Discard the cached listing of the pool once an operation which
+        changes the pool has finished, successfully or not.
+
+        :param result: Returned unchanged.
+        """
+        self._listing.invalidate()
+        return result
 
     def startService(self):
         """
@@ -497,12 +1160,29 @@ class StoragePool(Service):
         # https://clusterhq.atlassian.net/browse/FLOC-992
         return Failure(MaximumSizeTooSmall())
 
-    def create(self, volume):
-        filesystem = self.get(volume)
-        mount_path = filesystem.get_path().path
-        properties = [b"-o", b"mountpoint=" + mount_path]
+    def _creation_properties(self, volume):
+        """
+        The options that give a new filesystem its mountpoint and, if it is
+        locally owned, make it writeable.
+
+        Setting these when the filesystem is created saves a ``zfs set``
+        (and a remount) for each.  Filesystems which are not locally owned
+        inherit ``readonly=on`` from the root of the pool.
+
+        :param Volume volume: The volume the filesystem is for.
+
+        :return: A ``list`` of ``bytes`` arguments for ``zfs create`` or
+            ``zfs clone``.
+        """
+        properties = [
+            b"-o", b"mountpoint=" + self.get(volume).get_path().path]
         if volume.locally_owned():
             properties.extend([b"-o", b"readonly=off"])
+        return properties
+
+    def create(self, volume):
+        filesystem = self.get(volume)
+        properties = self._creation_properties(volume)
         if volume.size.maximum_size is not None:
             properties.extend([
                 b"-o", u"refquota={0}".format(
@@ -510,26 +1190,31 @@ class StoragePool(Service):
             ])
         d = zfs_command(self._reactor,
                         [b"create"] + properties + [filesystem.name])
+        d.addBoth(self._changed)
         d.addErrback(self._check_for_out_of_space)
         d.addCallback(lambda _: filesystem)
         return d
 
     def destroy(self, volume):
         filesystem = self.get(volume)
-        d = filesystem.snapshots()
-
-        # It would be better to have snapshot destruction logic as part of
-        # IFilesystemSnapshots, but that isn't really necessary yet.
-        def got_snapshots(snapshots):
-            return gatherResults(list(zfs_command(
-                self._reactor,
-                [b"destroy", b"%s@%s" % (filesystem.name, snapshot.name)])
-                for snapshot in snapshots))
-        d.addCallback(got_snapshots)
-        d.addCallback(lambda _: zfs_command(
-            self._reactor, [b"destroy", filesystem.name]))
+        # -r destroys the snapshots along with the filesystem, so however
+        # many there are only one process is needed.
+        d = zfs_command(
+            self._reactor, [b"destroy", b"-r", filesystem.name])
+        d.addBoth(self._changed)
+        d.addCallback(lambda _: None)
         return d
 
+    def destroy_many(self, volumes):
+        """
+        Destroy the filesystems, running at most
+        ``MAXIMUM_CONCURRENT_DESTROYS`` ``zfs destroy`` processes at once.
+        """
+        semaphore = DeferredSemaphore(MAXIMUM_CONCURRENT_DESTROYS)
+        return DeferredList(
+            [semaphore.run(self.destroy, volume) for volume in volumes],
+            consumeErrors=True)
+
     def set_maximum_size(self, volume):
         filesystem = self.get(volume)
         properties = []
@@ -542,6 +1227,7 @@ class StoragePool(Service):
             properties.extend([u"refquota=none"])
         d = zfs_command(self._reactor,
                         [b"set"] + properties + [filesystem.name])
+        d.addBoth(self._changed)
         d.addErrback(self._check_for_out_of_space)
         d.addCallback(lambda _: filesystem)
         return d
@@ -552,14 +1238,15 @@ class StoragePool(Service):
         zfs_snapshots = ZFSSnapshots(self._reactor, parent_filesystem)
         snapshot_name = bytes(uuid4())
         d = zfs_snapshots.create(snapshot_name)
-        clone_command = [b"clone",
-                         # Snapshot we're cloning from:
-                         b"%s@%s" % (parent_filesystem.name, snapshot_name),
-                         # New filesystem we're cloning to:
-                         new_filesystem.name,
-                         ]
+        clone_command = [b"clone"] + self._creation_properties(volume) + [
+            # Snapshot we're cloning from:
+            b"%s@%s" % (parent_filesystem.name, snapshot_name),
+            # New filesystem we're cloning to:
+            new_filesystem.name,
+        ]
         d.addCallback(lambda _: zfs_command(self._reactor, clone_command))
-        self._created(d, volume)
+        d.addErrback(self._creation_failed)
+        d.addBoth(self._changed)
         d.addCallback(lambda _: new_filesystem)
         return d
 
@@ -579,13 +1266,28 @@ class StoragePool(Service):
         d.addCallback(lambda _: new_filesystem)
         return d
 
+    def _creation_failed(self, reason):
+        """
+        Translate the failure of a ``zfs`` command creating a filesystem into
+        ``FilesystemAlreadyExists``.
+        """
+        if reason.check(CommandFailed):
+            # This isn't the only reason the operation could fail. We
+            # should figure out why and report it appropriately.
+            # https://clusterhq.atlassian.net/browse/FLOC-199
+            raise FilesystemAlreadyExists()
+        return reason
+
     def _created(self, result, new_volume):
         """
-        Common post-processing for attempts at creating new volumes from other
+        Common post-processing for attempts at renaming volumes to new
         volumes.
 
         In particular this includes error handling and ensuring read-only
-        and mountpoint properties are set correctly.
+        and mountpoint properties are set correctly.  ``zfs rename`` can't
+        set properties, and the oldest ZFS we support only sets one
+        property per ``zfs set`` (nor can ``zfs inherit`` be combined with
+        it), so this takes two more commands.
 
         :param Deferred result: The result of the creation attempt.
 
@@ -593,15 +1295,7 @@ class StoragePool(Service):
         """
         new_filesystem = self.get(new_volume)
         new_mount_path = new_filesystem.get_path().path
-
-        def creation_failed(f):
-            if f.check(CommandFailed):
-                # This isn't the only reason the operation could fail. We
-                # should figure out why and report it appropriately.
-                # https://clusterhq.atlassian.net/browse/FLOC-199
-                raise FilesystemAlreadyExists()
-            return f
-        result.addErrback(creation_failed)
+        result.addErrback(self._creation_failed)
 
         def exists(ignored):
             if new_volume.locally_owned():
@@ -617,29 +1311,63 @@ class StoragePool(Service):
                                 new_filesystem.name]))
             return result
         result.addCallback(exists)
+        result.addBoth(self._changed)
 
     def get(self, volume):
         dataset = volume_to_dataset(volume)
         mount_path = self._mount_root.child(dataset)
         return Filesystem(
-            self._name, dataset, mount_path, volume.size)
+            self._name, dataset, mount_path, volume.size,
+            reactor=self._reactor, listing_cache=self._listing)
 
     def enumerate(self):
-        listing = _list_filesystems(self._reactor, self._name)
+        """
+        List the filesystems of the pool.
+
+        Each call starts a new discovery pass: the pool is listed with a
+        single ``zfs list`` whose result also answers ``snapshots`` and
+        existence checks for the pool's filesystems until the pool is next
+        changed.
+        """
+        generation = self._listing.generation
+        listing = _list_pool(self._reactor, self._name)
 
-        def listed(filesystems):
+        def listed(listing):
+            self._listing.update(listing, generation)
             result = set()
-            for entry in filesystems:
+            for entry in listing.datasets.values():
                 filesystem = Filesystem(
                     self._name, entry.dataset, FilePath(entry.mountpoint),
-                    VolumeSize(maximum_size=entry.refquota))
+                    VolumeSize(maximum_size=entry.refquota),
+                    reactor=self._reactor, listing_cache=self._listing,
+                    usage=VolumeUsage(
+                        used=entry.used, available=entry.available,
+                        compression_ratio=entry.compression_ratio))
                 result.add(filesystem)
             return result
 
         return listing.addCallback(listed)
 
+    def free_space(self):
+        """
+        Find the free space in the pool from the listing taken by the latest
+        ``enumerate``, only running ``zfs list`` if the pool has changed
+        since.
+        """
+        if self._listing.current is not None:
+            return succeed(self._listing.current.available)
+        generation = self._listing.generation
+        listing = _list_pool(self._reactor, self._name)
+
+        def listed(listing):
+            self._listing.update(listing, generation)
+            return listing.available
+        return listing.addCallback(listed)
+
 
-@attributes(["dataset", "mountpoint", "refquota"], apply_immutable=True)
+@attributes(["dataset", "mountpoint", "refquota", "used", "available",
+             "compression_ratio"],
+            apply_immutable=True)
 class _DatasetInfo(object):
     """
     :ivar bytes dataset: The name of the ZFS dataset to which this information
@@ -648,43 +1376,151 @@ class _DatasetInfo(object):
         (where it will be auto-mounted by ZFS).
     :ivar int refquota: The value of the dataset's ``refquota`` property (the
         maximum number of bytes the dataset is allowed to have a reference to).
+    :ivar int used: The value of the dataset's ``used`` property (the number
+        of bytes the dataset and its snapshots take up in the pool).
+    :ivar int available: The value of the dataset's ``available`` property
+        (the number of bytes which can still be written to it).
+    :ivar float compression_ratio: The value of the dataset's
+        ``compressratio`` property.
     """
 
 
-def _list_filesystems(reactor, pool):
-    """Get a listing of all filesystems on a given pool.
-
-    :param pool: A `flocker.volume.filesystems.interface.IStoragePool`
-        provider.
-    :return: A ``Deferred`` that fires with an iterator, the elements
-        of which are ``tuples`` containing the name and mountpoint of each
-        filesystem.
-    """
-    listing = zfs_command(
-        reactor,
-        [b"list",
-         # Descend the hierarchy to a depth of one (ie, list the direct
-         # children of the pool)
-         b"-d", b"1",
-         # Omit the output header
-         b"-H",
-         # Output exact, machine-parseable values (eg 65536 instead of 64K)
-         b"-p",
-         # Output each dataset's name, mountpoint and refquota
-         b"-o", b"name,mountpoint,refquota",
-         # Look at this pool
-         pool])
-
-    def listed(output, pool):
-        for line in output.splitlines():
-            name, mountpoint, refquota = line.split(b'\t')
-            name = name[len(pool) + 1:]
-            if name:
-                refquota = int(refquota.decode("ascii"))
-                if refquota == 0:
-                    refquota = None
-                yield _DatasetInfo(
-                    dataset=name, mountpoint=mountpoint, refquota=refquota)
-
-    listing.addCallback(listed, pool)
-    return listing
+@attributes(["datasets", "snapshots", "available"], apply_immutable=True)
+class _PoolListing(object):
+    """
+    The filesystems of a pool and their snapshots, as of one ``zfs list``.
+
+    :ivar available: The number of bytes free in the pool, as an ``int``, or
+        ``None`` if the pool itself was not in the listing.
+
+    :ivar datasets: A ``pmap`` mapping the name of each dataset which is a
+        direct child of the pool to its ``_DatasetInfo``.
+    :ivar snapshots: A ``pmap`` mapping the names of those datasets which
+        have snapshots to a ``pvector`` of the snapshot names, oldest
+        first.
+    """
+
+
+class _PoolListingCache(object):
+    """
+    The latest ``_PoolListing`` of a pool, shared by a ``StoragePool`` and the
+    ``Filesystem`` instances it hands out.
+
+    :ivar current: The ``_PoolListing``, or ``None`` if the pool has been
+        changed since it was last listed.
+    :ivar int generation: Incremented every time the listing is
+        invalidated, so that a listing which was being taken while the pool
+        changed is not cached.
+    """
+    def __init__(self):
+        self.current = None
+        self.generation = 0
+
+    def update(self, listing, generation):
+        """
+        Cache a new listing.
+
+        :param _PoolListing listing: The listing.
+        :param int generation: The value of ``generation`` when the listing
+            was started.
+        """
+        if generation == self.generation:
+            self.current = listing
+
+    def invalidate(self):
+        """
+        Discard the cached listing because the pool has changed.
+        """
+        self.current = None
+        self.generation += 1
+
+
+def _list_pool_command(pool):
+    """
+    Construct a ``zfs`` command which will output the filesystems of a pool
+    along with all their snapshots.
+
+    :param bytes pool: The name of the pool.
+
+    :return list: An argument list (of ``bytes``) which can be passed to
+        ``zfs``.  ``zfs`` is not included as the first element.
+    """
+    return [
+        b"list",
+        # Omit the output header.
+        b"-H",
+        # Output exact, machine-parseable values (eg 65536 instead of 64K).
+        b"-p",
+        # Recurse to datasets beneath the pool.
+        b"-r",
+        # Output both filesystems and their snapshots.
+        b"-t", b"filesystem,snapshot",
+        # Output each dataset's name, mountpoint and space accounting.
+        b"-o", b"name,mountpoint,refquota,used,available,compressratio",
+        # Sort by the creation property, giving the snapshots in the order
+        # they were taken.
+        b"-s", b"creation",
+        # Look at this pool.
+        pool,
+    ]
+
+
+def _parse_pool_listing(data, pool):
+    """
+    Parse the output of the command defined by ``_list_pool_command``.
+
+    :param bytes data: The output to parse.
+    :param bytes pool: The name of the pool which was listed.
+
+    :return _PoolListing: The filesystems which are direct children of the
+        pool, and their snapshots, along with the free space in the pool.
+        Datasets nested deeper are excluded.
+    """
+    datasets = {}
+    snapshots = {}
+    pool_available = None
+    prefix = pool + b"/"
+    for line in data.splitlines():
+        (name, mountpoint, refquota, used, available,
+         compression_ratio) = line.split(b"\t")
+        if name == pool:
+            pool_available = int(available.decode("ascii"))
+            continue
+        if not name.startswith(prefix):
+            continue
+        name = name[len(prefix):]
+        if b"@" in name:
+            dataset, snapshot = name.split(b"@", 1)
+            if b"/" not in dataset:
+                snapshots.setdefault(dataset, []).append(snapshot)
+        elif b"/" not in name:
+            refquota = int(refquota.decode("ascii"))
+            if refquota == 0:
+                refquota = None
+            datasets[name] = _DatasetInfo(
+                dataset=name, mountpoint=mountpoint, refquota=refquota,
+                used=int(used.decode("ascii")),
+                available=int(available.decode("ascii")),
+                # Some versions of ZFS append an "x" even with -p:
+                compression_ratio=float(
+                    compression_ratio.rstrip(b"x").decode("ascii")))
+    return _PoolListing(
+        datasets=pmap(datasets),
+        snapshots=pmap({dataset: pvector(names)
+                        for (dataset, names) in snapshots.items()}),
+        available=pool_available)
+
+
+def _list_pool(reactor, pool):
+    """
+    List the filesystems of a pool along with all their snapshots.
+
+    :param IReactorProcess reactor: The reactor to use to launch the ``zfs``
+        child process.
+    :param bytes pool: The name of the pool.
+
+    :return: A ``Deferred`` that fires with a ``_PoolListing``.
+    """
+    d = zfs_command(reactor, _list_pool_command(pool))
+    d.addCallback(_parse_pool_listing, pool)
+    return d
@@ -461,6 +461,30 @@ class FilesystemTests(TestCase):
     """
     ZFS-specific tests for ``Filesystem``.
     """
+    def test_reader_expected_size(self):
+        """
+        The object returned by ``Filesystem.reader`` has an ``expected_size``
+        attribute giving ZFS's estimate of the size of the stream.
+        """
+        pool = build_pool(self)
+        service = service_for_pool(self, pool)
+        volume = service.get(MY_VOLUME)
+        creating = pool.create(volume)
+
+        def created(filesystem):
+            filesystem.get_path().child(b"some-data").setContent(
+                b"hello world" * 1024)
+            with filesystem.reader() as reader:
+                expected_size = reader.expected_size
+                size = len(reader.read())
+            # It is only an estimate, so allow some slack.
+            self.assertTrue(
+                size * 0.5 < expected_size < size * 1.5,
+                "Expected size {} is not close to actual size {}".format(
+                    expected_size, size))
+        creating.addCallback(created)
+        return creating
+
     def test_snapshots(self):
         """
         The ``Deferred`` returned by ``Filesystem.snapshots`` fires with a
@@ -507,6 +531,36 @@ class FilesystemTests(TestCase):
         loading.addCallback(loaded)
         return loading
 
+    def test_prune_snapshots(self):
+        """
+        ``Filesystem.prune_snapshots`` destroys the snapshots taken by
+        ``Filesystem.reader`` except the newest and the one retained for a
+        peer.
+        """
+        pool = build_pool(self)
+        service = service_for_pool(self, pool)
+        volume = service.get(MY_VOLUME)
+        creating = pool.create(volume)
+
+        def created(filesystem):
+            self.filesystem = filesystem
+            self.sent = []
+            for i in range(3):
+                with filesystem.reader() as reader:
+                    self.sent.append(reader.snapshot)
+            return filesystem.retain_snapshot(u"node2", self.sent[0])
+        pruning = creating.addCallback(created)
+        pruning.addCallback(lambda _: self.filesystem.prune_snapshots())
+
+        def pruned(snapshots):
+            remaining = self.filesystem.snapshots()
+            remaining.addCallback(lambda remaining: self.assertEqual(
+                ([self.sent[1]], [self.sent[0], self.sent[2]]),
+                (snapshots, remaining)))
+            return remaining
+        pruning.addCallback(pruned)
+        return pruning
+
     def test_maximum_size_too_small(self):
         """
         If the maximum size specified for filesystem creation is smaller than
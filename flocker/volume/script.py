@@ -4,7 +4,7 @@
 
 import sys
 
-from twisted.python.usage import Options
+from twisted.python.usage import Options, UsageError
 from twisted.python.filepath import FilePath
 from twisted.internet.defer import succeed, maybeDeferred
 
@@ -14,6 +14,8 @@ from .service import (
     DEFAULT_CONFIG_PATH, FLOCKER_MOUNTPOINT, FLOCKER_POOL,
     Volume, VolumeScript, ICommandLineVolumeScript, VolumeName,
     )
+from ._compression import COMPRESSIONS, available_compressions
+from ._transfer import CHUNK_SIZE
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner
     )
@@ -47,12 +49,29 @@ def flocker_volume_options(cls):
          "The ZFS pool to use for volumes."],
         ["mountpoint", None, FLOCKER_MOUNTPOINT.path,
          "The path where ZFS filesystems will be mounted."],
+        ["compression", None, b"",
+         "A comma-separated list of compressions to use when pushing "
+         "volumes to other nodes, most preferred first, chosen from: %s.  "
+         "The first one the other node also supports is used.  By default "
+         "volumes are pushed uncompressed." % (
+             b", ".join(compression.name for compression in COMPRESSIONS),)],
+        ["buffer-size", None, CHUNK_SIZE,
+         "The size in bytes of the buffers used to copy volume data.", int],
     ]
 
     original_postOptions = cls.postOptions
 
     def postOptions(self):
         self["config"] = FilePath(self["config"])
+        compressions = [name for name in self["compression"].split(b",")
+                        if name]
+        known = set(compression.name for compression in COMPRESSIONS)
+        for name in compressions:
+            if name not in known:
+                raise UsageError("Unknown compression: %s" % (name,))
+        self["compression"] = compressions
+        if self["buffer-size"] <= 0:
+            raise UsageError("The buffer size must be positive.")
         original_postOptions(self)
 
     cls.postOptions = postOptions
@@ -110,6 +129,17 @@ class _ReceiveSubcommandOptions(Options):
 
     synopsis = "<owner-node-id> <name>"
 
+    optParameters = [
+        ["compression", None, None,
+         "The name of the compression the data was compressed with."],
+    ]
+
+    optFlags = [
+        ["resume", None,
+         "The data continues an interrupted receive, as identified by "
+         "``flocker-volume resume_token``."],
+    ]
+
     def parseArgs(self, node_id, name):
         self["node_id"] = node_id.decode("ascii")
         self["name"] = name
@@ -120,7 +150,65 @@ class _ReceiveSubcommandOptions(Options):
         :param VolumeService service: The volume manager service to utilize.
         """
         service.receive(self["node_id"], VolumeName.from_bytes(self["name"]),
-                        sys.stdin)
+                        sys.stdin, self["compression"], bool(self["resume"]))
+
+
+class _ResumeTokenSubcommandOptions(Options):
+    """
+    Command line options for ``flocker-volume resume_token``.
+    """
+
+    longdesc = """Output the token from which an interrupted receive of a
+    volume can be resumed, or nothing if there is none.
+
+    Parameters:
+
+    * owner-node-id: The node ID of the volume manager that owns the volume.
+
+    * name: The name of the volume.
+    """
+
+    synopsis = "<owner-node-id> <name>"
+
+    def parseArgs(self, node_id, name):
+        self["node_id"] = node_id.decode("ascii")
+        self["name"] = name
+
+    def run(self, service):
+        """
+        Run the action for this sub-command.
+
+        :param VolumeService service: The volume manager service to utilize.
+        """
+        volume = Volume(node_id=self["node_id"],
+                        name=VolumeName.from_bytes(self["name"]),
+                        service=service)
+        d = volume.get_filesystem().resume_token()
+
+        def got_token(token):
+            if token is not None:
+                sys.stdout.write(token + b"\n")
+        d.addCallback(got_token)
+        return d
+
+
+class _CompressionsSubcommandOptions(Options):
+    """
+    Command line options for ``flocker-volume compressions``.
+    """
+
+    longdesc = """List the compressions this node can receive volumes
+    compressed with, one per line.
+    """
+
+    def run(self, service):
+        """
+        Run the action for this sub-command.
+
+        :param VolumeService service: The volume manager service to utilize.
+        """
+        for name in available_compressions():
+            sys.stdout.write(name + b"\n")
 
 
 class _AcquireSubcommandOptions(Options):
@@ -217,6 +305,10 @@ class VolumeOptions(Options):
          "List snapshots for a volume."],
         ["receive", None, _ReceiveSubcommandOptions,
          "Receive a remotely pushed volume."],
+        ["compressions", None, _CompressionsSubcommandOptions,
+         "List the compressions volumes can be received with."],
+        ["resume_token", None, _ResumeTokenSubcommandOptions,
+         "Show the token to resume an interrupted receive from."],
         ["acquire", None, _AcquireSubcommandOptions,
          "Acquire a remotely owned volume."],
         ["clone_to", None, _CloneToSubcommandOptions,
@@ -10,31 +10,66 @@ from __future__ import absolute_import
 import sys
 import json
 import stat
+from errno import ECONNRESET, EPIPE
+from contextlib import contextmanager
 from uuid import UUID, uuid4
 
 from zope.interface import Interface, implementer
 
-from characteristic import attributes
+from characteristic import attributes, Attribute
 
-from twisted.internet.defer import maybeDeferred
+from twisted.internet.defer import (
+    Deferred, gatherResults, maybeDeferred, succeed,
+)
 from twisted.internet.task import deferLater
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service
 from twisted.internet.defer import fail
+from twisted.internet.error import ConnectError, ConnectionClosed
+from twisted.python.failure import Failure
+
+from eliot import Logger
 
 # We might want to make these utilities shared, rather than in zfs
 # module... but in this case the usage is temporary and should go away as
 # part of https://clusterhq.atlassian.net/browse/FLOC-64
-from .filesystems.zfs import StoragePool
+from .filesystems.zfs import StoragePool, _latest_common_snapshot
+from .filesystems.interfaces import IFilesystemReceiver
 from ._model import VolumeSize
+from ._transfer import (
+    CHUNK_SIZE, DEFAULT_PUSH_ATTEMPTS, PUSH_RETRY, PUSH_SEPARATELY,
+    PUSH_VOLUME, RETRY_DELAY, SynchronousTransfers, TeeWriter,
+    ThreadedTransfers, TransferProgress, copy_stream,
+)
+from ._compression import choose_compression, get_compression
+from ..common import call_in_reactor_thread
 from ..common.script import ICommandLineScript
 
 DEFAULT_CONFIG_PATH = FilePath(b"/etc/flocker/volume.json")
 FLOCKER_MOUNTPOINT = FilePath(b"/flocker")
 FLOCKER_POOL = b"flocker"
 
+# Errors which a push fails with that might not happen if it is tried
+# again, e.g. the connection to the destination node dying.
+_TRANSIENT_PUSH_ERRORS = (ConnectionClosed, ConnectError)
+
+# The ``errno`` of environment errors caused by the connection to the
+# destination node dying.
+_TRANSIENT_PUSH_ERRNOS = frozenset([EPIPE, ECONNRESET])
+
+# The exit status of ``ssh`` when it fails itself, rather than the remote
+# command failing.
+_SSH_FAILED = 255
+
+# Seconds between polls of the storage pool while anything is waiting for a
+# volume to appear.
 WAIT_FOR_VOLUME_INTERVAL = 0.1
 
+# Seconds after which the catalog of volumes is reconciled against the
+# storage pool before being used, in case the pool was changed other than
+# through the service.
+CATALOG_MAXIMUM_AGE = 60.0
+
 
 class CreateConfigurationError(Exception):
     """Create the configuration file failed."""
@@ -96,18 +131,49 @@ class VolumeService(Service):
     :ivar unicode node_id: A unique identifier for this particular node's
         volume manager. Only available once the service has started.
     """
+    logger = Logger()
 
-    def __init__(self, config_path, pool, reactor):
+    def __init__(self, config_path, pool, reactor, transfers=None,
+                 compressions=(), chunk_size=CHUNK_SIZE,
+                 push_attempts=DEFAULT_PUSH_ATTEMPTS):
         """
         :param FilePath config_path: Path to the volume manager config file.
         :param pool: An object that is both a
             ``flocker.volume.filesystems.interface.IStoragePool`` provider
             and a ``twisted.application.service.IService`` provider.
         :param reactor: A ``twisted.internet.interface.IReactorTime`` provider.
+        :param transfers: The object that runs the blocking part of pushes,
+            e.g. ``ThreadedTransfers``.  By default pushes run synchronously
+            in the calling thread.
+        :param compressions: The names of the compressions to use when
+            pushing, most preferred first.  By default data is pushed
+            uncompressed.
+        :param int chunk_size: The size of the buffers used to copy volume
+            data.
+        :param int push_attempts: The number of times to try a push which
+            fails with a possibly transient error.
         """
         self._config_path = config_path
         self.pool = pool
         self._reactor = reactor
+        if transfers is None:
+            transfers = SynchronousTransfers()
+        self._transfers = transfers
+        self._compressions = list(compressions)
+        self._chunk_size = chunk_size
+        self._push_attempts = push_attempts
+        # Deferreds waiting for volumes to appear, by VolumeName:
+        self._waiters = {}
+        self._polling = False
+        self._next_poll = None
+        # The _VolumeCatalog, or None if it needs reconciling with the pool:
+        self._catalog = None
+        # Incremented whenever the service changes the catalog, so that a
+        # listing of the pool taken meanwhile doesn't replace it:
+        self._catalog_generation = 0
+        # The volume each filesystem basename seen by the latest enumeration
+        # was parsed as, or None:
+        self._parsed_basenames = {}
 
     def startService(self):
         Service.startService(self)
@@ -140,6 +206,8 @@ class VolumeService(Service):
 
         def created(filesystem):
             self._make_public(filesystem)
+            self._catalog_add(volume)
+            self._volume_appeared(volume)
             return volume
         d.addCallback(created)
         return d
@@ -156,6 +224,7 @@ class VolumeService(Service):
         d = self.pool.set_maximum_size(volume)
 
         def resized(filesystem):
+            self._catalog_add(volume)
             return volume
         d.addCallback(resized)
         return d
@@ -175,10 +244,90 @@ class VolumeService(Service):
 
         def created(filesystem):
             self._make_public(filesystem)
+            self._catalog_add(volume)
+            self._volume_appeared(volume)
             return volume
         d.addCallback(created)
         return d
 
+    def destroy_many(self, volumes):
+        """
+        Destroy some volumes.
+
+        :param volumes: An iterable of ``Volume`` instances.
+
+        :return: A ``Deferred`` that fires with the results of
+            ``IStoragePool.destroy_many``.
+        """
+        volumes = list(volumes)
+        d = self.pool.destroy_many(volumes)
+
+        def destroyed(results):
+            for volume, (success, _) in zip(volumes, results):
+                if success:
+                    self._catalog_remove(volume)
+            return results
+        d.addCallback(destroyed)
+        return d
+
+    def _invalidate_catalog(self):
+        """
+        Forget the catalog, e.g. because volumes were changed in a way it
+        can't be updated for, so it is reconciled with the pool when next
+        used.
+
+        Like any change to the catalog this must happen in the reactor
+        thread; it also stops a listing of the pool which is already being
+        taken from replacing the catalog.
+        """
+        self._catalog_generation += 1
+        self._catalog = None
+
+    def _catalog_add(self, volume):
+        """
+        Record a new or changed volume in the catalog.
+
+        :param Volume volume: The volume.
+        """
+        self._catalog_generation += 1
+        if self._catalog is not None:
+            self._catalog.add(volume)
+
+    def _catalog_remove(self, volume):
+        """
+        Remove a volume which no longer exists from the catalog.
+
+        :param Volume volume: The volume.
+        """
+        self._catalog_generation += 1
+        if self._catalog is not None:
+            self._catalog.remove(volume)
+
+    def volumes_for_dataset(self, dataset_id):
+        """
+        Find the volumes of a dataset, both locally owned and copies of
+        remotely owned ones.
+
+        The volumes are looked up in a catalog the service keeps up to date
+        as it changes volumes.  The catalog is reconciled against the
+        storage pool by ``enumerate``, and before being used if that last
+        happened more than ``CATALOG_MAXIMUM_AGE`` seconds ago.
+
+        :param unicode dataset_id: The dataset ID.
+
+        :return: A ``Deferred`` that fires with a ``list`` of ``Volume``.
+        """
+        catalog = self._catalog
+        if (catalog is not None and
+                self._reactor.seconds() - catalog.updated <
+                CATALOG_MAXIMUM_AGE):
+            return succeed(catalog.get(dataset_id))
+        d = self.enumerate()
+        d.addCallback(lambda volumes: [
+            volume for volume in volumes
+            if volume.name.dataset_id == dataset_id])
+        return d
+
     def _make_public(self, filesystem):
         """
         Make a filesystem publically readable/writeable/executable.
@@ -214,77 +363,190 @@ class VolumeService(Service):
         """
         Wait for a volume by the given name, owned by thus service, to exist.
 
-        Polls the storage pool for the specified volume to appear.
+        Volumes created, cloned or acquired by this service are noticed as
+        soon as they appear.  Otherwise the storage pool is polled every
+        ``WAIT_FOR_VOLUME_INTERVAL`` seconds; all the waiters share one
+        poll and polling stops when nothing is waiting.
 
         :param VolumeName name: The name of the volume.
 
-        :return: A ``Deferred`` that fires with a :class:`Volume`.
+        :return: A ``Deferred`` that fires with a :class:`Volume`.  It can
+            be cancelled to stop waiting.
         """
-        def check_for_volume(node_id, name):
-            d = self.enumerate()
-            d.addCallback(compare_volumes_by_name_node_id, node_id, name)
-            return d
-
-        def compare_volumes_by_name_node_id(volumes, node_id, name):
-            """
-            Iterate the volumes managed by this service and compare the
-            node ID and the ``VolumeName`` to determine if we have found the
-            ``Volume`` instance requested by name.
-            """
+        if self._catalog is not None:
+            for volume in self._catalog.get(name.dataset_id):
+                if volume.node_id == self.node_id and volume.name == name:
+                    return succeed(volume)
+        waiting = Deferred(lambda waiting: self._forget_waiter(name, waiting))
+        self._waiters.setdefault(name, []).append(waiting)
+        if not self._polling and self._next_poll is None:
+            self._poll_for_volumes()
+        return waiting
+
+    def _poll_for_volumes(self):
+        """
+        Look for the volumes being waited for in the storage pool, polling
+        again later if any are still missing.
+
+        If the pool can't be enumerated all the waiters fail.
+        """
+        self._next_poll = None
+        self._polling = True
+        d = self.enumerate()
+
+        def enumerated(volumes):
             for volume in volumes:
-                if volume.node_id == node_id and volume.name == name:
-                    return volume
-            return deferLater(
-                self._reactor, WAIT_FOR_VOLUME_INTERVAL,
-                check_for_volume, node_id, name
-            )
+                self._volume_appeared(volume)
+
+        def failed(reason):
+            waiters, self._waiters = self._waiters, {}
+            for waiting in sum(waiters.values(), []):
+                waiting.errback(reason)
+        d.addCallbacks(enumerated, failed)
+
+        def polled(_):
+            self._polling = False
+            if self._waiters:
+                self._next_poll = self._reactor.callLater(
+                    WAIT_FOR_VOLUME_INTERVAL, self._poll_for_volumes)
+        d.addCallback(polled)
+
+    def _volume_appeared(self, volume):
+        """
+        Fire the waiters for a volume that now exists.
+
+        :param Volume volume: The volume.
+        """
+        if volume.node_id == self.node_id:
+            for waiting in self._waiters.pop(volume.name, []):
+                waiting.callback(volume)
+            self._stop_polling_if_idle()
+
+    def _forget_waiter(self, name, waiting):
+        """
+        Stop waiting for a volume, for a cancelled waiter.
 
-        return check_for_volume(self.node_id, name)
+        :param VolumeName name: The name of the volume.
+        :param Deferred waiting: The cancelled waiter.
+        """
+        waiters = self._waiters.get(name, [])
+        if waiting in waiters:
+            waiters.remove(waiting)
+            if not waiters:
+                del self._waiters[name]
+        self._stop_polling_if_idle()
+
+    def _stop_polling_if_idle(self):
+        """
+        Cancel the next poll for volumes if nothing is waiting any more.
+        """
+        if not self._waiters and self._next_poll is not None:
+            self._next_poll.cancel()
+            self._next_poll = None
 
     def enumerate(self):
         """Get a listing of all volumes managed by this service.
 
+        The catalog used by ``volumes_for_dataset`` is replaced with the
+        result.
+
         :return: A ``Deferred`` that fires with an iterator of :class:`Volume`.
         """
+        generation = self._catalog_generation
         enumerating = self.pool.enumerate()
 
         def enumerated(filesystems):
+            volumes = []
+            previously_parsed = self._parsed_basenames
+            self._parsed_basenames = {}
             for filesystem in filesystems:
-                # XXX It so happens that this works but it's kind of a
-                # fragile way to recover the information:
-                #    https://clusterhq.atlassian.net/browse/FLOC-78
-                basename = filesystem.get_path().basename()
-                try:
-                    node_id, name = basename.split(b".", 1)
-                    name = VolumeName.from_bytes(name)
-                    # We convert to a UUID object for validation purposes:
-                    UUID(node_id)
-                except ValueError:
-                    # ValueError may happen because:
-                    # 1. We can't split on `.`.
-                    # 2. We couldn't parse the UUID.
-                    # 3. We couldn't parse the volume name.
-                    # In any of those case it's presumably because that's
-                    # not a filesystem Flocker is managing.Perhaps a user
-                    # created it, so we just ignore it.
+                parsed = self._parse_basename(
+                    filesystem.get_path().basename(), previously_parsed)
+                if parsed is None:
                     continue
 
                 # Probably shouldn't yield this volume if the uuid doesn't
                 # match this service's uuid.
 
-                yield Volume(
-                    node_id=node_id.decode("ascii"),
+                node_id, name = parsed
+                volumes.append(Volume(
+                    node_id=node_id,
                     name=name,
                     service=self,
-                    size=filesystem.size)
+                    size=filesystem.size,
+                    usage=filesystem.usage))
+            if generation == self._catalog_generation:
+                self._catalog = _VolumeCatalog(
+                    volumes, self._reactor.seconds())
+            else:
+                # The service changed some volumes while the pool was being
+                # listed, so the listing may already be out of date.
+                self._catalog = None
+            return volumes
         enumerating.addCallback(enumerated)
         return enumerating
 
-    def push(self, volume, destination):
+    def _parse_basename(self, basename, previously_parsed):
+        """
+        Determine which volume a filesystem belongs to from the basename of
+        its path.
+
+        The result is remembered in ``_parsed_basenames``, since the same
+        filesystems are seen every time the pool is enumerated.
+
+        :param bytes basename: The basename.
+        :param dict previously_parsed: The ``_parsed_basenames`` of the
+            previous enumeration, to reuse results from.
+
+        :return: A ``tuple`` of the node ID as ``unicode`` and the
+            ``VolumeName``, or ``None`` if the filesystem isn't a volume.
+        """
+        if basename in previously_parsed:
+            parsed = previously_parsed[basename]
+            self._parsed_basenames[basename] = parsed
+            return parsed
+        # XXX It so happens that this works but it's kind of a
+        # fragile way to recover the information:
+        #    https://clusterhq.atlassian.net/browse/FLOC-78
+        try:
+            node_id, name = basename.split(b".", 1)
+            name = VolumeName.from_bytes(name)
+            # We convert to a UUID object for validation purposes:
+            UUID(node_id)
+        except ValueError:
+            # ValueError may happen because:
+            # 1. We can't split on `.`.
+            # 2. We couldn't parse the UUID.
+            # 3. We couldn't parse the volume name.
+            # In any of those case it's presumably because that's
+            # not a filesystem Flocker is managing.Perhaps a user
+            # created it, so we just ignore it.
+            parsed = None
+        else:
+            parsed = (node_id.decode("ascii"), name)
+        self._parsed_basenames[basename] = parsed
+        return parsed
+
+    def push(self, volume, destination, peer=None):
         """
         Push the latest data in the volume to a remote destination.
 
-        This is a blocking API for now.
+        The data is copied by this service's transfers object, which may
+        run it in another thread and may delay it until other pushes have
+        finished.  Progress is logged as ``PUSH_PROGRESS`` messages.
+
+        If this service was given compressions, the data is compressed with
+        the first of them that the destination supports.
+
+        A push that fails because the connection to the destination died is
+        tried again after a delay; any other failure fails it immediately.
+        If the destination kept the data of the interrupted stream the
+        retry resumes it rather than starting over.  Retries are logged as
+        ``PUSH_RETRY`` messages.
+
+        If a peer is given, the snapshot which was pushed is retained for it
+        as the basis of the next incremental push; see
+        ``IFilesystem.retain_snapshot``.
 
         Only locally owned volumes (i.e. volumes whose ``uuid`` matches
         this service's) can be pushed.
@@ -294,24 +556,365 @@ class VolumeService(Service):
         :param IRemoteVolumeManager destination: The remote volume manager
             to push to.
 
+        :param peer: ``None`` or the identity of the destination node as
+            ``unicode``, e.g. its hostname.
+
         :raises ValueError: If the uuid of the volume is different than
             our own; only locally-owned volumes can be pushed.
+
+        :return: ``Deferred`` that fires when the push has finished.
         """
         if volume.node_id != self.node_id:
             raise ValueError()
         fs = volume.get_filesystem()
-        getting_snapshots = destination.snapshots(volume)
+        # The snapshots sent by each attempt; a resumed attempt continues
+        # sending the previous one.
+        sent = []
+
+        def attempt(number, delay):
+            if number == 1:
+                getting_token = succeed(None)
+            else:
+                getting_token = destination.resume_token(volume)
+            pushing = getting_token.addCallback(
+                lambda token: self._push_stream(
+                    volume, fs, destination, token, sent))
+
+            def failed(reason):
+                if not _is_transient_push_error(reason):
+                    return reason
+                if number >= self._push_attempts:
+                    return reason
+                PUSH_RETRY(volume=volume, attempt=number, delay=delay,
+                           reason=reason).write(self.logger)
+                return deferLater(
+                    self._reactor, delay, attempt, number + 1, delay * 2)
+            pushing.addErrback(failed)
+            return pushing
+        pushing = attempt(1, RETRY_DELAY)
+
+        def pushed(_):
+            if peer is not None and sent:
+                return fs.retain_snapshot(peer, sent[-1])
+        pushing.addCallback(pushed)
+        return pushing
 
-        def got_snapshots(snapshots):
-            with destination.receive(volume) as receiver:
-                with fs.reader(snapshots) as contents:
-                    for chunk in iter(lambda: contents.read(1024 * 1024), b""):
-                        receiver.write(chunk)
+    def _push_stream(self, volume, filesystem, destination, resume_token,
+                     sent):
+        """
+        Make one attempt at pushing a volume.
+
+        :param Volume volume: The volume to push.
+        :param IFilesystem filesystem: The volume's filesystem.
+        :param IRemoteVolumeManager destination: The remote volume manager
+            to push to.
+        :param resume_token: ``None`` or the destination's token for an
+            interrupted stream to resume.
+        :param list sent: A ``list`` to append the ``Snapshot`` being sent
+            to, if it is known.
 
-        pushing = getting_snapshots.addCallback(got_snapshots)
+        :return: ``Deferred`` that fires when the push has finished.
+        """
+        if resume_token is None:
+            getting_snapshots = destination.snapshots(volume)
+        else:
+            getting_snapshots = succeed(None)
+
+        def ready(results):
+            snapshots, compression = results
+            return self._transfers.run(
+                self._push, volume, filesystem, snapshots, destination,
+                compression, resume_token, sent)
+
+        pushing = gatherResults(
+            [getting_snapshots, self._negotiate_compression(destination)],
+            consumeErrors=True)
+        pushing.addCallbacks(
+            ready, lambda failure: failure.value.subFailure)
         return pushing
 
-    def receive(self, volume_node_id, volume_name, input_file):
+    def _negotiate_compression(self, destination):
+        """
+        Choose the compression to push data to a destination with.
+
+        :param IRemoteVolumeManager destination: The remote volume manager
+            to push to.
+
+        :return: ``Deferred`` that fires with ``None`` or the name of the
+            first of this service's compressions the destination supports.
+        """
+        if not self._compressions:
+            return succeed(None)
+        negotiating = destination.compressions()
+        negotiating.addCallback(
+            lambda supported: choose_compression(
+                self._compressions, supported))
+        return negotiating
+
+    def push_many(self, volume, destinations):
+        """
+        Push the latest data in the volume to several remote destinations,
+        reading it only once for all those that need the same stream.
+
+        Destinations which have the same latest snapshot in common with the
+        volume and support the same compression are sent one stream
+        between them: the data is read from the filesystem and compressed
+        once and every chunk is written to each of them.  A destination
+        which fails part way is dropped from the shared stream without
+        interrupting the others and is then pushed to on its own with
+        ``push``, so it gets the usual retries.  Such fallbacks are logged
+        as ``PUSH_SEPARATELY`` messages.
+
+        Only locally owned volumes can be pushed.
+
+        :param Volume volume: The volume to push.
+
+        :param list destinations: ``tuple``\ s of an
+            ``IRemoteVolumeManager`` to push to and ``None`` or the
+            identity of that destination node as ``unicode``; see ``push``.
+
+        :raises ValueError: If the uuid of the volume is different than
+            our own; only locally-owned volumes can be pushed.
+
+        :return: ``Deferred`` that fires when the data has been pushed to
+            every destination, or fails with the error of the first one
+            that could not be pushed to.
+        """
+        if volume.node_id != self.node_id:
+            raise ValueError()
+        fs = volume.get_filesystem()
+
+        def prepare(destination):
+            preparing = gatherResults(
+                [destination.snapshots(volume),
+                 self._negotiate_compression(destination)],
+                consumeErrors=True)
+            # ``push`` will report the problem if it persists.
+            preparing.addErrback(lambda _: None)
+            return preparing
+
+        def prepared(results):
+            local_snapshots = results[0]
+            streams = {}
+            pushes = []
+            negotiations = zip(destinations, results[1:])
+            for (destination, peer), negotiated in negotiations:
+                if negotiated is None:
+                    pushes.append(self.push(volume, destination, peer))
+                    continue
+                remote_snapshots, compression = negotiated
+                base = _latest_common_snapshot(
+                    local_snapshots, remote_snapshots)
+                streams.setdefault((base, compression), []).append(
+                    (destination, peer))
+            for (base, compression), group in streams.items():
+                pushes.append(
+                    self._push_shared(volume, fs, base, compression, group))
+            return _gather(pushes)
+
+        preparing = _gather(
+            [fs.snapshots()] +
+            [prepare(destination) for destination, _ in destinations])
+        preparing.addCallback(prepared)
+        preparing.addCallback(lambda _: None)
+        return preparing
+
+    def _push_shared(self, volume, filesystem, base, compression, group):
+        """
+        Push a volume to several destinations with one shared stream,
+        falling back to ``push`` for those which fail to receive it.
+
+        :param Volume volume: The volume to push.
+        :param IFilesystem filesystem: The volume's filesystem.
+        :param base: ``None`` or the ``Snapshot`` all the destinations
+            already have which the stream can be based on.
+        :param compression: ``None`` or the name of the compression to use.
+        :param list group: ``(destination, peer)`` tuples; see
+            ``push_many``.
+
+        :return: ``Deferred`` that fires when the data has been pushed to
+            every destination in the group.
+        """
+        sending = self._transfers.run(
+            self._push_many, volume, filesystem, base,
+            [destination for destination, _ in group], compression)
+
+        def sent(result):
+            snapshot, failures = result
+            pushes = []
+            for (destination, peer), failure in zip(group, failures):
+                if failure is not None:
+                    PUSH_SEPARATELY(volume=volume, reason=failure).write(
+                        self.logger)
+                    pushes.append(self.push(volume, destination, peer))
+                elif peer is not None and snapshot is not None:
+                    pushes.append(filesystem.retain_snapshot(peer, snapshot))
+            return _gather(pushes)
+        sending.addCallback(sent)
+        return sending
+
+    def _push_many(self, volume, filesystem, base, destinations,
+                   compression=None):
+        """
+        Copy a volume's data to several remote destinations with one stream,
+        blocking until done.
+
+        :param Volume volume: The volume to push.
+        :param IFilesystem filesystem: The volume's filesystem.
+        :param base: ``None`` or the ``Snapshot`` to base the stream on.
+        :param list destinations: The ``IRemoteVolumeManager`` providers to
+            push to.
+        :param compression: ``None`` or the name of the compression to use.
+
+        :return: ``tuple`` of ``None`` or the ``Snapshot`` which was sent,
+            and a ``list`` with ``None`` for each destination which received
+            the data and the ``Failure`` of each one which did not.
+        """
+        receive_options = {}
+        if compression is not None:
+            receive_options["compression"] = compression
+        failures = [None] * len(destinations)
+        # Map the index of each destination still receiving to its
+        # receiver's context manager and file-like object.
+        receiving = {}
+        for index, destination in enumerate(destinations):
+            try:
+                manager = destination.receive(volume, **receive_options)
+                receiving[index] = (manager, manager.__enter__())
+            except Exception:
+                failures[index] = Failure()
+
+        def failed(index, exc_info):
+            manager, _ = receiving.pop(index)
+            failures[index] = Failure(exc_info[1], exc_info[0], exc_info[2])
+            try:
+                manager.__exit__(*exc_info)
+            except Exception:
+                pass
+
+        snapshot = None
+        if receiving:
+            tee = TeeWriter(
+                dict((index, receiver)
+                     for index, (_, receiver) in receiving.items()),
+                failed)
+            try:
+                with filesystem.reader(
+                        [] if base is None else [base]) as contents:
+                    expected_size = getattr(contents, "expected_size", None)
+                    snapshot = getattr(contents, "snapshot", None)
+                    with self._compressed(contents, compression) as stream:
+                        with PUSH_VOLUME(self.logger, volume=volume,
+                                         expected_size=expected_size,
+                                         compression=compression,
+                                         resumed=False) as action:
+                            progress = TransferProgress(
+                                self.logger,
+                                expected_size if compression is None
+                                else None)
+                            transferred = copy_stream(
+                                stream, tee, progress, self._chunk_size)
+                            tee.close()
+                            action.addSuccessFields(transferred=transferred)
+            except Exception:
+                exc_info = sys.exc_info()
+                try:
+                    # Let the destinations finish their writes before their
+                    # receives are ended.
+                    tee.close()
+                except IOError:
+                    pass
+                for index in list(receiving):
+                    failed(index, exc_info)
+        for index, (manager, _) in receiving.items():
+            try:
+                manager.__exit__(None, None, None)
+            except Exception:
+                failures[index] = Failure()
+        return snapshot, failures
+
+    def _push(self, volume, filesystem, snapshots, destination,
+              compression=None, resume_token=None, sent=None):
+        """
+        Copy a volume's data to a remote destination, blocking until done.
+
+        :param Volume volume: The volume to push.
+        :param IFilesystem filesystem: The volume's filesystem.
+        :param list snapshots: The ``Snapshot`` instances the destination
+            already has.
+        :param IRemoteVolumeManager destination: The remote volume manager
+            to push to.
+        :param compression: ``None`` or the name of the compression to use.
+        :param resume_token: ``None`` or the destination's token for an
+            interrupted stream to resume, in which case ``snapshots`` is
+            ignored.
+        :param sent: ``None`` or a ``list`` to append the ``Snapshot`` being
+            sent to, if it is known.
+        """
+        receive_options = {}
+        if compression is not None:
+            receive_options["compression"] = compression
+        if resume_token is None:
+            reading = filesystem.reader(snapshots)
+        else:
+            receive_options["resume"] = True
+            reading = filesystem.reader(resume_token=resume_token)
+        with destination.receive(volume, **receive_options) as receiver:
+            with reading as contents:
+                expected_size = getattr(contents, "expected_size", None)
+                snapshot = getattr(contents, "snapshot", None)
+                if sent is not None and snapshot is not None:
+                    sent.append(snapshot)
+                with self._compressed(contents, compression) as stream:
+                    with PUSH_VOLUME(self.logger, volume=volume,
+                                     expected_size=expected_size,
+                                     compression=compression,
+                                     resumed=resume_token is not None
+                                     ) as action:
+                        # With compression the bytes sent can not be
+                        # compared to the size of the uncompressed data.
+                        progress = TransferProgress(
+                            self.logger,
+                            expected_size if compression is None else None)
+                        transferred = copy_stream(
+                            stream, receiver, progress, self._chunk_size)
+                        action.addSuccessFields(transferred=transferred)
+
+    @contextmanager
+    def _compressed(self, source, compression):
+        """
+        Context manager that returns a file-like object from which the
+        data from another, compressed as requested, can be read.
+
+        :param source: The file-like object to compress.
+        :param compression: ``None`` or the name of the compression to use.
+        """
+        if compression is None:
+            yield source
+        else:
+            with get_compression(compression).compressed(
+                    source, self._chunk_size) as compressed:
+                yield compressed
+
+    @contextmanager
+    def _decompressed(self, source, compression):
+        """
+        Context manager that returns a file-like object from which the
+        data from another, decompressed as requested, can be read.
+
+        :param source: The file-like object to decompress.
+        :param compression: ``None`` or the name of the compression the
+            data was compressed with.
+        """
+        if compression is None:
+            yield source
+        else:
+            with get_compression(compression).decompressed(
+                    source, self._chunk_size) as decompressed:
+                yield decompressed
+
+    def receive(self, volume_node_id, volume_name, input_file,
+                compression=None, resume=False):
         """
         Process a volume's data that can be read from a file-like object.
 
@@ -324,16 +927,55 @@ class VolumeService(Service):
         :param VolumeName volume_name: The volume's name.
         :param input_file: A file-like object, typically ``sys.stdin``, from
             which to read the data.
+        :param compression: ``None`` or the name of the compression the data
+            was compressed with.
+        :param bool resume: Whether the data continues an interrupted
+            stream, as identified by the volume filesystem's
+            ``resume_token``.
 
         :raises ValueError: If the uuid of the volume matches our own;
-            remote nodes can't overwrite locally-owned volumes.
+            remote nodes can't overwrite locally-owned volumes.  Also if
+            the compression is not supported.
         """
         if volume_node_id == self.node_id:
             raise ValueError()
         volume = Volume(node_id=volume_node_id, name=volume_name, service=self)
-        with volume.get_filesystem().writer() as writer:
-            for chunk in iter(lambda: input_file.read(1024 * 1024), b""):
-                writer.write(chunk)
+        try:
+            with self._decompressed(input_file, compression) as data:
+                with volume.get_filesystem().writer(resume) as writer:
+                    copy_stream(data, writer, chunk_size=self._chunk_size)
+        finally:
+            # This may run in a transfer thread, so rather than updating the
+            # catalog just have it reconciled when next used.
+            call_in_reactor_thread(self._reactor, self._invalidate_catalog)
+
+    def receiver(self, volume_node_id, volume_name, resume=False):
+        """
+        Start receiving a volume's data without blocking.
+
+        This is the non-blocking equivalent of ``receive``, for uncompressed
+        data.
+
+        Only remotely owned volumes (i.e. volumes whose ``uuid`` do not match
+        this service's) can be received.
+
+        :param unicode volume_node_id: The volume's owner's node ID.
+        :param VolumeName volume_name: The volume's name.
+        :param bool resume: Whether the data continues an interrupted
+            stream, as identified by the volume filesystem's
+            ``resume_token``.
+
+        :return: A ``Deferred`` that fires with an ``IFilesystemReceiver``
+            to write the data to, or fails with ``ValueError`` if the uuid
+            of the volume matches our own.
+        """
+        if volume_node_id == self.node_id:
+            return fail(ValueError("Can't receive locally-owned volume"))
+        volume = Volume(node_id=volume_node_id, name=volume_name, service=self)
+        d = volume.get_filesystem().receiver(resume)
+        d.addCallback(lambda receiver: _CatalogInvalidatingReceiver(
+            receiver, self._invalidate_catalog))
+        return d
 
     def acquire(self, volume_node_id, volume_name):
         """
@@ -353,9 +995,17 @@ class VolumeService(Service):
         if volume_node_id == self.node_id:
             return fail(ValueError("Can't acquire already-owned volume"))
         volume = Volume(node_id=volume_node_id, name=volume_name, service=self)
-        return volume.change_owner(self.node_id)
+        d = volume.change_owner(self.node_id)
+
+        def acquired(new_volume):
+            self._catalog_remove(volume)
+            self._catalog_add(new_volume)
+            self._volume_appeared(new_volume)
+            return new_volume
+        d.addCallback(acquired)
+        return d
 
-    def handoff(self, volume, destination):
+    def handoff(self, volume, destination, peer=None):
         """
         Handoff a locally owned volume to a remote destination.
 
@@ -367,22 +1017,159 @@ class VolumeService(Service):
         :param Volume volume: The volume to handoff.
         :param IRemoteVolumeManager destination: The remote volume manager
             to handoff to.
+        :param peer: ``None`` or the identity of the destination node; see
+            ``push``.
 
         :return: ``Deferred`` that fires when the handoff has finished, or
             errbacks on error (specifcally with a ``ValueError`` if the
             volume is not locally owned).
         """
-        pushing = maybeDeferred(self.push, volume, destination)
+        pushing = maybeDeferred(self.push, volume, destination, peer)
 
         def pushed(ignored):
-            remote_uuid = destination.acquire(volume)
-            return volume.change_owner(remote_uuid)
-        changing_owner = pushing.addCallback(pushed)
+            return maybeDeferred(destination.acquire, volume)
+        acquiring = pushing.addCallback(pushed)
+        changing_owner = acquiring.addCallback(volume.change_owner)
+
+        def changed_owner(new_volume):
+            self._catalog_remove(volume)
+            self._catalog_add(new_volume)
+            return new_volume
+        changing_owner.addCallback(changed_owner)
         return changing_owner
 
 
-@attributes(["node_id", "name", "service", "size"],
-            defaults=dict(size=VolumeSize(maximum_size=None)))
+def _is_transient_push_error(reason):
+    """
+    Determine whether a push failed because of the connection to the
+    destination, so trying again might succeed.
+
+    Anything else, e.g. the destination rejecting the stream or a
+    compressor missing, would just fail again.
+
+    :param Failure reason: The failure of the push.
+
+    :return: ``True`` if the push should be tried again, else ``False``.
+    """
+    if reason.check(*_TRANSIENT_PUSH_ERRORS):
+        return True
+    error = reason.value
+    if not isinstance(error, EnvironmentError):
+        return False
+    if error.errno in _TRANSIENT_PUSH_ERRNOS:
+        return True
+    # ``ProcessNode`` reports ``ssh`` exiting unsuccessfully as
+    # ``IOError("Bad exit", command, status[, output, error])``.  With three
+    # arguments ``IOError`` keeps the status as its ``filename``.
+    if error.errno == "Bad exit":
+        status = error.filename
+    elif error.args[:1] == ("Bad exit",) and len(error.args) > 2:
+        status = error.args[2]
+    else:
+        return False
+    return status == _SSH_FAILED
+
+
+def _gather(deferreds):
+    """
+    Gather the results of some ``Deferred``\ s, failing with the first
+    failure among them rather than a ``FirstError``.
+
+    :param list deferreds: The ``Deferred``\ s to gather.
+
+    :return: ``Deferred`` that fires with a ``list`` of their results.
+    """
+    gathering = gatherResults(deferreds, consumeErrors=True)
+    gathering.addErrback(lambda failure: failure.value.subFailure)
+    return gathering
+
+
+@implementer(IFilesystemReceiver)
+class _CatalogInvalidatingReceiver(object):
+    """
+    Invalidate the catalog of volumes once a receive returned by
+    ``VolumeService.receiver`` has ended, however it ended.
+    """
+    def __init__(self, receiver, invalidate):
+        """
+        :param IFilesystemReceiver receiver: The filesystem's receiver.
+        :param invalidate: A no-argument callable which invalidates the
+            catalog.
+        """
+        self._receiver = receiver
+        self._invalidate = invalidate
+
+    def write(self, data):
+        self._receiver.write(data)
+
+    def registerProducer(self, producer, streaming):
+        self._receiver.registerProducer(producer, streaming)
+
+    def unregisterProducer(self):
+        self._receiver.unregisterProducer()
+
+    def _ended(self, result):
+        self._invalidate()
+        return result
+
+    def finish(self):
+        return self._receiver.finish().addBoth(self._ended)
+
+    def abort(self):
+        return self._receiver.abort().addBoth(self._ended)
+
+
+class _VolumeCatalog(object):
+    """
+    The volumes known to a ``VolumeService``, indexed by dataset ID.
+
+    :ivar float updated: When the catalog was last reconciled against the
+        storage pool, in seconds according to the service's reactor.
+    """
+    def __init__(self, volumes, updated):
+        """
+        :param volumes: An iterable of the ``Volume`` instances in the
+            storage pool.
+        :param float updated: See ``updated`` above.
+        """
+        self.updated = updated
+        # dataset_id -> {(node_id, VolumeName): Volume}
+        self._datasets = {}
+        for volume in volumes:
+            self.add(volume)
+
+    def add(self, volume):
+        """
+        Add a volume, replacing any volume with the same owner and name.
+
+        :param Volume volume: The volume.
+        """
+        self._datasets.setdefault(volume.name.dataset_id, {})[
+            (volume.node_id, volume.name)] = volume
+
+    def remove(self, volume):
+        """
+        Remove a volume, if it is in the catalog.
+
+        :param Volume volume: The volume.
+        """
+        volumes = self._datasets.get(volume.name.dataset_id, {})
+        volumes.pop((volume.node_id, volume.name), None)
+        if not volumes:
+            self._datasets.pop(volume.name.dataset_id, None)
+
+    def get(self, dataset_id):
+        """
+        :param unicode dataset_id: The dataset ID.
+
+        :return: A ``list`` of the ``Volume`` instances of the dataset.
+        """
+        return list(self._datasets.get(dataset_id, {}).values())
+
+
+@attributes(["node_id", "name", "service",
+             Attribute("size", default_value=VolumeSize(maximum_size=None)),
+             Attribute("usage", default_value=None, exclude_from_cmp=True)])
 class Volume(object):
     """
     A data volume's identifier.
@@ -392,6 +1179,9 @@ class Volume(object):
     :ivar VolumeName name: The name of the volume.
     :ivar VolumeSize size: The storage capacity of the volume.
     :ivar VolumeService service: The service that stores this volume.
+    :ivar VolumeUsage usage: The space the volume took up when it was
+        enumerated, or ``None`` if not known.  It is not part of the
+        volume's identity, so is ignored when comparing volumes.
     """
     def locally_owned(self):
         """
@@ -450,7 +1240,10 @@ class VolumeScript(object):
         pool = StoragePool(reactor, options["pool"],
                            FilePath(options["mountpoint"]))
         service = cls._service_factory(
-            config_path=options["config"], pool=pool, reactor=reactor)
+            config_path=options["config"], pool=pool, reactor=reactor,
+            transfers=ThreadedTransfers(reactor),
+            compressions=options["compression"],
+            chunk_size=options["buffer-size"])
         try:
             service.startService()
         except CreateConfigurationError as e:
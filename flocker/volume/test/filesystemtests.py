@@ -12,7 +12,7 @@ from __future__ import absolute_import
 from characteristic import attributes
 from zope.interface.verify import verifyObject
 
-from twisted.trial.unittest import TestCase
+from twisted.trial.unittest import SkipTest, TestCase
 from twisted.internet.defer import gatherResults
 from twisted.application.service import IService
 
@@ -22,12 +22,12 @@ from ...testtools import (
 from ..testtools import service_for_pool
 
 from ..filesystems.interfaces import (
-    IFilesystemSnapshots, IStoragePool, IFilesystem,
+    IFilesystemSnapshots, IStoragePool, IFilesystem, IFilesystemReceiver,
     FilesystemAlreadyExists,
     )
 from ..filesystems.errors import MaximumSizeTooSmall
 from ..service import Volume, VolumeName
-from .._model import VolumeSize
+from .._model import VolumeSize, VolumeUsage
 
 
 def make_ifilesystemsnapshots_tests(fixture):
@@ -83,6 +83,38 @@ def copy(from_volume, to_volume):
     return getting_snapshots
 
 
+def stream(from_volume, to_volume):
+    """Copy contents of one volume to another without blocking, using
+    ``IFilesystem.send`` and ``IFilesystem.receiver``.
+
+    :param Volume from_volume: Volume to read from.
+    :param Volume to_volume: Volume to write to.
+
+    :return: ``Deferred`` that fires with the result of ``send`` once the
+        data has been received.
+    """
+    from_filesystem = from_volume.get_filesystem()
+    to_filesystem = to_volume.get_filesystem()
+    getting_snapshots = to_filesystem.snapshots()
+
+    def got_snapshots(snapshots):
+        receiving = to_filesystem.receiver()
+
+        def got_receiver(receiver):
+            sending = from_filesystem.send(receiver, snapshots)
+
+            def sent(snapshot):
+                finishing = receiver.finish()
+                finishing.addCallback(lambda _: snapshot)
+                return finishing
+            sending.addCallback(sent)
+            return sending
+        receiving.addCallback(got_receiver)
+        return receiving
+    getting_snapshots.addCallback(got_snapshots)
+    return getting_snapshots
+
+
 @attributes(["from_volume", "to_volume"])
 class CopyVolumes(object):
     """A pair of volumes that had data copied from one to the other.
@@ -528,6 +560,62 @@ def make_istoragepool_tests(fixture, snapshot_factory):
             d.addCallback(got_volumes)
             return d
 
+        def test_no_resume_token(self):
+            """
+            A filesystem that has not had a write interrupted has no resume
+            token.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            d = pool.create(service.get(MY_VOLUME))
+            d.addCallback(lambda filesystem: filesystem.resume_token())
+            d.addCallback(self.assertIs, None)
+            return d
+
+        def test_resume_interrupted_write(self):
+            """
+            If writing a new filesystem is interrupted by an exception, the
+            writer's ``resume_token`` can be passed to the reader to get the
+            rest of the data, which can be written with ``resume=True`` to
+            complete the filesystem.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            pool2 = fixture(self)
+            service2 = service_for_pool(self, pool2)
+            volume2 = Volume(node_id=service.node_id, name=MY_VOLUME,
+                             service=service2)
+            d = pool.create(volume)
+
+            def created_filesystem(filesystem):
+                filesystem.get_path().child(b"file").setContent(
+                    b"some bytes" * 100000)
+                with filesystem.reader() as reader:
+                    data = reader.read()
+                try:
+                    with volume2.get_filesystem().writer() as writer:
+                        writer.write(data[:len(data) // 2])
+                        raise RuntimeError("Connection lost")
+                except RuntimeError:
+                    pass
+                return volume2.get_filesystem().resume_token()
+            d.addCallback(created_filesystem)
+
+            def got_token(token):
+                if token is None:
+                    raise SkipTest("Resuming writes is not supported.")
+                with volume.get_filesystem().reader(
+                        resume_token=token) as reader:
+                    with volume2.get_filesystem().writer(
+                            resume=True) as writer:
+                        writer.write(reader.read())
+                assertVolumesEqual(self, volume, volume2)
+                return volume2.get_filesystem().resume_token()
+            d.addCallback(got_token)
+            d.addCallback(self.assertIs, None)
+            return d
+
         def test_exception_passes_through_read(self):
             """
             If an exception is raised in the context of the reader, it is not
@@ -643,6 +731,114 @@ def make_istoragepool_tests(fixture, snapshot_factory):
             d.addCallback(got_volumes)
             return d
 
+        def test_receiver_interface(self):
+            """
+            ``IFilesystem.receiver`` returns a ``Deferred`` that fires with
+            an ``IFilesystemReceiver`` provider.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            d = volume.get_filesystem().receiver()
+
+            def got_receiver(receiver):
+                self.assertTrue(verifyObject(IFilesystemReceiver, receiver))
+                return receiver.abort()
+            d.addCallback(got_receiver)
+            return d
+
+        def test_send_new_filesystem(self):
+            """
+            Sending the contents of one pool's filesystem to a receiver of
+            another pool's filesystem creates that filesystem with the given
+            contents.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            pool2 = fixture(self)
+            service2 = service_for_pool(self, pool2)
+            volume2 = Volume(node_id=service.node_id, name=MY_VOLUME,
+                             service=service2)
+            d = pool.create(volume)
+
+            def created_filesystem(filesystem):
+                path = filesystem.get_path()
+                path.child(b"file").setContent(b"some bytes" * 100000)
+                path.child(b"directory").makedirs()
+                return stream(volume, volume2)
+            d.addCallback(created_filesystem)
+            d.addCallback(lambda _: assertVolumesEqual(self, volume, volume2))
+            return d
+
+        def test_send_update(self):
+            """
+            Sending an update of the contents of one pool's filesystem to a
+            receiver of another pool's filesystem that was previously
+            created from it updates its contents.
+            """
+            d = create_and_copy(self, fixture)
+
+            def got_volumes(copied):
+                volume, volume2 = copied.from_volume, copied.to_volume
+                path = volume.get_filesystem().get_path()
+                path.child(b"anotherfile").setContent(b"hello")
+                path.child(b"file").remove()
+                streaming = stream(volume, volume2)
+                streaming.addCallback(
+                    lambda _: assertVolumesEqual(self, volume, volume2))
+                return streaming
+            d.addCallback(got_volumes)
+            return d
+
+        def test_send_snapshot(self):
+            """
+            The snapshot ``send`` results in, if known, is the newest
+            snapshot of the filesystem which received the data.
+            """
+            d = create_and_copy(self, fixture)
+
+            def got_volumes(copied):
+                streaming = stream(copied.from_volume, copied.to_volume)
+
+                def sent(snapshot):
+                    listing = copied.to_volume.get_filesystem().snapshots()
+                    listing.addCallback(
+                        lambda snapshots: self.assertIn(
+                            snapshot, [None] + snapshots[-1:]))
+                    return listing
+                streaming.addCallback(sent)
+                return streaming
+            d.addCallback(got_volumes)
+            return d
+
+        def test_abort_receive(self):
+            """
+            If a receiver is aborted no changes are made to the filesystem.
+            """
+            d = create_and_copy(self, fixture)
+
+            def got_volumes(copied):
+                volume, volume2 = copied.from_volume, copied.to_volume
+                from_filesystem = volume.get_filesystem()
+                from_filesystem.get_path().child(b"anotherfile").setContent(
+                    b"hello")
+                with from_filesystem.reader() as reader:
+                    data = reader.read()
+                receiving = volume2.get_filesystem().receiver()
+
+                def got_receiver(receiver):
+                    receiver.write(data[:len(data) // 2])
+                    return receiver.abort()
+                receiving.addCallback(got_receiver)
+                receiving.addCallback(
+                    lambda _: self.assertFalse(
+                        volume2.get_filesystem().get_path().child(
+                            b"anotherfile").exists()))
+                return receiving
+            d.addCallback(got_volumes)
+            return d
+
         def test_enumerate_no_filesystems(self):
             """
             Lacking any filesystems, ``enumerate()`` returns an empty result.
@@ -719,6 +915,42 @@ def make_istoragepool_tests(fixture, snapshot_factory):
             enumerating.addCallback(enumerated)
             return enumerating
 
+        def test_enumerate_provides_usage(self):
+            """
+            The ``IStoragePool.enumerate`` implementation produces
+            ``IFilesystem`` results which report how much space they take
+            up and how much more they can take.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            creating = pool.create(volume)
+
+            def created(ignored):
+                return pool.enumerate()
+            enumerating = creating.addCallback(created)
+
+            def enumerated(result):
+                [filesystem] = result
+                usage = filesystem.usage
+                self.assertEqual(
+                    (True, True, True),
+                    (isinstance(usage, VolumeUsage), usage.available > 0,
+                     usage.compression_ratio >= 1.0))
+            enumerating.addCallback(enumerated)
+            return enumerating
+
+        def test_free_space(self):
+            """
+            The ``IStoragePool.free_space`` implementation returns a
+            ``Deferred`` that fires with a positive number of bytes.
+            """
+            pool = fixture(self)
+            service_for_pool(self, pool)
+            d = pool.free_space()
+            d.addCallback(lambda free: self.assertTrue(free > 0))
+            return d
+
         def test_enumerate_spaces(self):
             """
             The ``IStoragePool.enumerate`` implementation doesn't return
@@ -1003,4 +1235,50 @@ def make_istoragepool_tests(fixture, snapshot_factory):
             d.addCallback(lambda result: self.assertEqual(list(result), []))
             return d
 
+        def test_destroy_many(self):
+            """
+            ``IStoragePool.destroy_many`` destroys the filesystems of all the
+            given volumes, and only those.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volumes = [service.get(VolumeName(namespace=u"myns",
+                                              dataset_id=u"vol%d" % (i,)))
+                       for i in range(3)]
+            d = gatherResults([pool.create(volume) for volume in volumes])
+            d.addCallback(lambda _: pool.destroy_many(volumes[:2]))
+
+            def destroyed(results):
+                enumerating = pool.enumerate()
+                enumerating.addCallback(lambda filesystems: self.assertEqual(
+                    ([(True, None), (True, None)],
+                     [volumes[2].get_filesystem()]),
+                    (results, list(filesystems))))
+                return enumerating
+            d.addCallback(destroyed)
+            return d
+
+        def test_destroy_many_failure(self):
+            """
+            If one filesystem can't be destroyed by
+            ``IStoragePool.destroy_many`` its failure is in the results and
+            the other filesystems are still destroyed.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            missing = service.get(MY_VOLUME2)
+            d = pool.create(volume)
+            d.addCallback(lambda _: pool.destroy_many([missing, volume]))
+
+            def destroyed(results):
+                [(missing_success, _), volume_result] = results
+                enumerating = pool.enumerate()
+                enumerating.addCallback(lambda filesystems: self.assertEqual(
+                    (False, (True, None), []),
+                    (missing_success, volume_result, list(filesystems))))
+                return enumerating
+            d.addCallback(destroyed)
+            return d
+
     return IStoragePoolTests
@@ -0,0 +1,597 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.volume._amp``.
+"""
+
+from __future__ import absolute_import
+
+from os import urandom
+
+from zope.interface.verify import verifyObject
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.endpoints import (
+    SSL4ClientEndpoint, SSL4ServerEndpoint, TCP4ClientEndpoint,
+)
+from twisted.internet.task import Clock
+from twisted.internet.threads import deferToThread
+from twisted.python.filepath import FilePath
+from twisted.test.proto_helpers import MemoryReactor
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from ..service import VolumeService, Volume, VolumeName
+from ..filesystems.memory import FilesystemStoragePool
+from .._ipc import IRemoteVolumeManager
+from .._compression import available_compressions
+from .._transfer import ThreadedTransfers
+from .._amp import (
+    AMPRemoteVolumeManager, AMPRemoteVolumeManagers, MAXIMUM_DATA_SIZE,
+    VolumeTransferService, _ReceiveStream, _ReceiverFeed,
+    volume_transfer_factory,
+    volume_transfer_tls_options,
+)
+from ..testtools import (
+    create_volume_service, make_volume_transfer_certificates,
+)
+
+
+MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
+MY_VOLUME2 = VolumeName(namespace=u"myns", dataset_id=u"myvol2")
+
+
+class ImmediateReactor(object):
+    """
+    A reactor whose ``callFromThread`` calls the function immediately.
+    """
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+class ReceiveStreamTests(SynchronousTestCase):
+    """
+    Tests for ``_ReceiveStream``.
+    """
+    def setUp(self):
+        self.stream = _ReceiveStream(ImmediateReactor())
+
+    def test_read(self):
+        """
+        Fed data is returned by ``read`` in pieces no bigger than requested,
+        followed by ``b""`` once the stream is finished.
+        """
+        self.stream.feed(b"hello ")
+        self.stream.feed(b"world")
+        self.stream.finish()
+        self.assertEqual(
+            [b"hel", b"lo ", b"wor", b"ld", b""],
+            [self.stream.read(3) for i in range(5)])
+
+    def test_read_all(self):
+        """
+        ``read`` with no size returns all the data until the end of the
+        stream.
+        """
+        self.stream.feed(b"hello ")
+        self.stream.feed(b"world")
+        self.stream.finish()
+        self.assertEqual(b"hello world", self.stream.read())
+
+    def test_consumed(self):
+        """
+        The ``Deferred`` returned by ``feed`` fires once the data has been
+        taken by a reader.
+        """
+        consumed = self.stream.feed(b"hello")
+        self.assertNoResult(consumed)
+        self.stream.read(1)
+        self.successResultOf(consumed)
+
+    def test_abort(self):
+        """
+        After ``abort`` reading raises ``IOError``.
+        """
+        self.stream.abort()
+        self.assertRaises(IOError, self.stream.read, 1)
+
+    def test_closed(self):
+        """
+        Once the receive reading the stream has finished, data that was
+        not read and data fed later fail with ``IOError``.
+        """
+        unread = self.stream.feed(b"hello")
+        self.stream.closed(None)
+        self.failureResultOf(unread, IOError)
+        self.failureResultOf(self.stream.feed(b"world"), IOError)
+
+
+class FakeReceiver(object):
+    """
+    An ``IFilesystemReceiver`` which records what is done to it.
+
+    :ivar list written: The data written.
+    :ivar producer: The registered producer, or ``None``.
+    :ivar ended: ``None``, or ``"finish"`` or ``"abort"`` depending on how
+        the receive was ended.
+    :ivar Deferred result: Returned by ``finish`` and ``abort``.
+    """
+    def __init__(self):
+        self.written = []
+        self.producer = None
+        self.ended = None
+        self.result = Deferred()
+
+    def write(self, data):
+        self.written.append(data)
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def finish(self):
+        self.ended = "finish"
+        return self.result
+
+    def abort(self):
+        self.ended = "abort"
+        return self.result
+
+
+class ReceiverFeedTests(SynchronousTestCase):
+    """
+    Tests for ``_ReceiverFeed``.
+    """
+    def setUp(self):
+        self.feed = _ReceiverFeed()
+        self.receiver = FakeReceiver()
+
+    def start(self):
+        """
+        Start the feed with ``self.receiver``.
+        """
+        self.successResultOf(self.feed.start(succeed(self.receiver)))
+
+    def test_write(self):
+        """
+        Fed data is written to the receiver, and the ``Deferred`` returned by
+        ``feed`` fires straight away.
+        """
+        self.start()
+        self.successResultOf(self.feed.feed(b"hello"))
+        self.assertEqual(
+            ([b"hello"], self.feed), (self.receiver.written,
+                                      self.receiver.producer))
+
+    def test_paused(self):
+        """
+        While the receiver has the feed paused, the ``Deferred`` returned by
+        ``feed`` does not fire until it is resumed.
+        """
+        self.start()
+        self.feed.pauseProducing()
+        fed = self.feed.feed(b"hello")
+        self.assertNoResult(fed)
+        self.feed.resumeProducing()
+        self.successResultOf(fed)
+
+    def test_finish(self):
+        """
+        ``finish`` unregisters the feed and finishes the receiver, whose
+        result ``receiving`` fires with.
+        """
+        self.start()
+        self.feed.finish()
+        self.receiver.result.callback(None)
+        self.successResultOf(self.feed.receiving)
+        self.assertEqual(("finish", None),
+                         (self.receiver.ended, self.receiver.producer))
+
+    def test_abort(self):
+        """
+        ``abort`` aborts the receiver and fails data waiting for it to
+        resume.
+        """
+        self.start()
+        self.feed.pauseProducing()
+        fed = self.feed.feed(b"hello")
+        self.feed.abort()
+        self.failureResultOf(fed, IOError)
+        self.assertEqual("abort", self.receiver.ended)
+
+    def test_stopped(self):
+        """
+        Once the receiver stops the feed, data waiting for it and data fed
+        later fail with ``IOError``, but the receive can still be ended.
+        """
+        self.start()
+        self.feed.pauseProducing()
+        fed = self.feed.feed(b"hello")
+        self.feed.stopProducing()
+        self.failureResultOf(fed, IOError)
+        self.failureResultOf(self.feed.feed(b"world"), IOError)
+        self.feed.finish()
+        self.receiver.result.errback(IOError())
+        self.failureResultOf(self.feed.receiving, IOError)
+
+    def test_start_failed(self):
+        """
+        If the receiver can't be created, fed data fails with ``IOError``
+        and ``receiving`` fails with the reason.
+        """
+        self.successResultOf(self.feed.start(fail(ValueError())))
+        self.failureResultOf(self.feed.feed(b"hello"), IOError)
+        self.feed.finish()
+        self.failureResultOf(self.feed.receiving, ValueError)
+
+    def test_ended_before_started(self):
+        """
+        If the receive is ended before the receiver has been created, it is
+        aborted once it has been.
+        """
+        receiver = Deferred()
+        self.feed.start(receiver)
+        self.feed.finish()
+        receiver.callback(self.receiver)
+        self.receiver.result.callback(None)
+        self.successResultOf(self.feed.receiving)
+        self.assertEqual("abort", self.receiver.ended)
+
+
+class AMPRemoteVolumeManagerTests(TestCase):
+    """
+    Tests for ``AMPRemoteVolumeManager`` talking to the volume transfer
+    protocol server over a real TCP connection.
+    """
+    def create_service(self, transfers=None, compressions=()):
+        """
+        Create a started ``VolumeService`` using a directory pool.
+        """
+        path = FilePath(self.mktemp())
+        path.createDirectory()
+        service = VolumeService(
+            FilePath(self.mktemp()), FilesystemStoragePool(path),
+            reactor=Clock(), transfers=transfers, compressions=compressions)
+        service.startService()
+        self.addCleanup(service.stopService)
+        return service
+
+    def setUp(self):
+        self.sending = ThreadedTransfers(reactor)
+        self.addCleanup(self.sending.stop)
+        receiving = ThreadedTransfers(reactor)
+        self.addCleanup(receiving.stop)
+
+        self.from_service = self.create_service(self.sending)
+        self.to_service = self.create_service()
+
+        self.connections = []
+        factory = volume_transfer_factory(
+            reactor, self.to_service, receiving)
+        build_protocol = factory.buildProtocol
+
+        def counting_build_protocol(address):
+            protocol = build_protocol(address)
+            self.connections.append(protocol)
+            return protocol
+        factory.buildProtocol = counting_build_protocol
+
+        port = reactor.listenTCP(0, factory, interface=b"127.0.0.1")
+        self.addCleanup(port.stopListening)
+        self.remote = AMPRemoteVolumeManager(
+            reactor, TCP4ClientEndpoint(
+                reactor, b"127.0.0.1", port.getHost().port))
+        self.addCleanup(self.remote.disconnect)
+
+    def push(self, content=b"hello"):
+        """
+        Create ``MY_VOLUME`` with a file in it and push it to the remote
+        volume manager.
+
+        :param bytes content: The content of the file.
+
+        :return: ``Deferred`` that fires with the pushed ``Volume``.
+        """
+        d = self.from_service.create(self.from_service.get(MY_VOLUME))
+
+        def created(volume):
+            volume.get_filesystem().get_path().child(b"file").setContent(
+                content)
+            pushing = self.from_service.push(volume, self.remote)
+            pushing.addCallback(lambda _: volume)
+            return pushing
+        d.addCallback(created)
+        return d
+
+    def remote_file(self, node_id, name=MY_VOLUME):
+        """
+        :return: The ``FilePath`` of the file written by ``push`` in the
+            remote volume manager's copy of a volume.
+        """
+        volume = Volume(node_id=node_id, name=name, service=self.to_service)
+        return volume.get_filesystem().get_path().child(b"file")
+
+    def test_interface(self):
+        """
+        ``AMPRemoteVolumeManager`` provides ``IRemoteVolumeManager``.
+        """
+        self.assertTrue(verifyObject(IRemoteVolumeManager, self.remote))
+
+    def test_snapshots(self):
+        """
+        ``AMPRemoteVolumeManager.snapshots`` returns a ``Deferred`` that fires
+        with the remote volume's snapshots, ``[]`` for ``DirectoryFilesystem``.
+        """
+        d = self.from_service.create(self.from_service.get(MY_VOLUME))
+        d.addCallback(self.remote.snapshots)
+        d.addCallback(self.assertEqual, [])
+        return d
+
+    def test_push(self):
+        """
+        Volume data larger than a single AMP value can be pushed to the
+        remote volume manager.
+        """
+        content = urandom(MAXIMUM_DATA_SIZE * 5)
+        d = self.push(content)
+        d.addCallback(lambda volume: self.assertEqual(
+            content, self.remote_file(volume.node_id).getContent()))
+        return d
+
+    def test_receive_exception(self):
+        """
+        An exception raised in the ``receive`` context manager is raised
+        by it, and the remote volume manager discards the data.
+        """
+        d = self.from_service.create(self.from_service.get(MY_VOLUME))
+
+        def created(volume):
+            self.volume = volume
+
+            def receive():
+                with self.remote.receive(volume) as receiver:
+                    receiver.write(b"some data")
+                    raise RuntimeError()
+            return deferToThread(receive)
+        d.addCallback(created)
+        d = self.assertFailure(d, RuntimeError)
+        d.addCallback(lambda _: self.to_service.enumerate())
+        d.addCallback(lambda volumes: self.assertEqual([], list(volumes)))
+        return d
+
+    def test_resume_token(self):
+        """
+        ``AMPRemoteVolumeManager.resume_token`` returns a ``Deferred`` that
+        fires with the token of a receive that was interrupted.
+        """
+        d = self.from_service.create(self.from_service.get(MY_VOLUME))
+
+        def created(volume):
+            self.volume = volume
+
+            def receive():
+                with self.remote.receive(volume) as receiver:
+                    receiver.write(b"some data")
+                    raise RuntimeError()
+            return deferToThread(receive)
+        d.addCallback(created)
+        d = self.assertFailure(d, RuntimeError)
+        d.addCallback(lambda _: self.remote.resume_token(self.volume))
+        d.addCallback(self.assertEqual, b"9")
+        return d
+
+    def test_acquire(self):
+        """
+        ``AMPRemoteVolumeManager.acquire`` makes the remote volume manager
+        the owner of the volume and returns a ``Deferred`` that fires with
+        the remote node ID.
+        """
+        d = self.push()
+        d.addCallback(self.remote.acquire)
+
+        def acquired(node_id):
+            self.assertEqual(
+                (self.to_service.node_id, b"hello"),
+                (node_id, self.remote_file(node_id).getContent()))
+        d.addCallback(acquired)
+        return d
+
+    def test_acquire_local(self):
+        """
+        ``AMPRemoteVolumeManager.acquire`` of a volume the remote volume
+        manager already owns fails with ``ValueError``.
+        """
+        volume = self.to_service.get(MY_VOLUME)
+        return self.assertFailure(self.remote.acquire(volume), ValueError)
+
+    def test_clone_to(self):
+        """
+        ``AMPRemoteVolumeManager.clone_to`` clones a remote volume.
+        """
+        d = self.to_service.create(self.to_service.get(MY_VOLUME))
+
+        def created(parent):
+            parent.get_filesystem().get_path().child(b"file").setContent(
+                b"parent")
+            return self.remote.clone_to(parent, MY_VOLUME2)
+        d.addCallback(created)
+        d.addCallback(lambda _: self.assertEqual(
+            b"parent", self.remote_file(
+                self.to_service.node_id, MY_VOLUME2).getContent()))
+        return d
+
+    def test_compressions(self):
+        """
+        ``AMPRemoteVolumeManager.compressions`` returns a ``Deferred`` that
+        fires with the compressions the remote node has installed.
+        """
+        d = self.remote.compressions()
+        d.addCallback(self.assertEqual, available_compressions())
+        return d
+
+    def test_push_uses_receiver(self):
+        """
+        Uncompressed volume data is written to the remote volume manager's
+        filesystem with ``VolumeService.receiver`` rather than in a transfer
+        thread.
+        """
+        def receive(*args, **kwargs):
+            raise RuntimeError("Should not be used.")
+        self.patch(self.to_service, "receive", receive)
+        content = urandom(MAXIMUM_DATA_SIZE * 2)
+        d = self.push(content)
+        d.addCallback(lambda volume: self.assertEqual(
+            content, self.remote_file(volume.node_id).getContent()))
+        return d
+
+    def test_push_compressed(self):
+        """
+        Volume data can be pushed compressed.
+        """
+        if b"gzip" not in available_compressions():
+            raise self.skipTest("gzip is not installed.")
+        self.from_service = self.create_service(
+            self.sending, compressions=[b"gzip"])
+        content = b"hello" * MAXIMUM_DATA_SIZE
+        d = self.push(content)
+        d.addCallback(lambda volume: self.assertEqual(
+            content, self.remote_file(volume.node_id).getContent()))
+        return d
+
+    def test_one_connection(self):
+        """
+        All operations share one connection to the remote node.
+        """
+        d = self.push()
+
+        def pushed(volume):
+            return self.from_service.push(volume, self.remote)
+        d.addCallback(pushed)
+        d.addCallback(lambda _: self.assertEqual(1, len(self.connections)))
+        return d
+
+    def test_no_delay(self):
+        """
+        Nagle's algorithm is disabled on both ends of the connection, so that
+        the many small commands carrying volume data are not delayed.
+        """
+        volume = self.from_service.get(MY_VOLUME)
+        d = self.remote.snapshots(volume)
+        d.addCallback(lambda _: self.assertEqual(
+            [True, True],
+            [bool(self.remote._protocol.transport.getTcpNoDelay()),
+             bool(self.connections[0].transport.getTcpNoDelay())]))
+        return d
+
+    def test_reconnect(self):
+        """
+        If the connection is lost a new one is made for the next operation.
+        """
+        volume = self.from_service.get(MY_VOLUME)
+        d = self.remote.snapshots(volume)
+
+        d.addCallback(lambda _: self.remote.disconnect())
+        d.addCallback(lambda _: self.remote.snapshots(volume))
+        d.addCallback(lambda _: self.assertEqual(2, len(self.connections)))
+        return d
+
+
+class AMPRemoteVolumeManagersTests(SynchronousTestCase):
+    """
+    Tests for ``AMPRemoteVolumeManagers``.
+    """
+    def test_per_host(self):
+        """
+        ``AMPRemoteVolumeManagers.get`` returns the same manager for the same
+        hostname and different ones for different hostnames.
+        """
+        managers = AMPRemoteVolumeManagers(
+            Clock(), lambda hostname: TCP4ClientEndpoint(
+                Clock(), hostname, 4525))
+        self.assertEqual(
+            [True, False],
+            [managers.get(b"a") is managers.get(b"a"),
+             managers.get(b"a") is managers.get(b"b")])
+
+
+class VolumeTransferTLSTests(TestCase):
+    """
+    Tests for ``volume_transfer_tls_options`` and
+    ``VolumeTransferService``.
+    """
+    def setUp(self):
+        self.certificates = make_volume_transfer_certificates(self)
+        self.tls_options = volume_transfer_tls_options(
+            self.certificates.certificate,
+            self.certificates.certificate_authority)
+        transfers = ThreadedTransfers(reactor)
+        self.addCleanup(transfers.stop)
+        factory = volume_transfer_factory(
+            reactor, create_volume_service(self), transfers)
+        listening = SSL4ServerEndpoint(
+            reactor, 0, self.tls_options, interface=b"127.0.0.1").listen(
+                factory)
+
+        def listened(port):
+            self.addCleanup(port.stopListening)
+            self.port = port.getHost().port
+        return listening.addCallback(listened)
+
+    def compressions(self, tls_options):
+        """
+        Ask the server for its compressions over a connection made with some
+        TLS options.
+
+        :return: ``Deferred`` that fires with the result.
+        """
+        remote = AMPRemoteVolumeManager(
+            reactor, SSL4ClientEndpoint(
+                reactor, b"127.0.0.1", self.port, tls_options))
+        self.addCleanup(remote.disconnect)
+        return remote.compressions()
+
+    def test_trusted_peer(self):
+        """
+        A peer presenting a certificate signed by the cluster's certificate
+        authority can use the volume transfer protocol.
+        """
+        d = self.compressions(self.tls_options)
+        d.addCallback(self.assertEqual, available_compressions())
+        return d
+
+    def test_no_certificate(self):
+        """
+        A peer which presents no certificate is refused.
+        """
+        from twisted.internet.ssl import CertificateOptions
+        return self.assertFailure(
+            self.compressions(CertificateOptions()), Exception)
+
+    def test_untrusted_certificate(self):
+        """
+        A peer presenting a certificate signed by some other certificate
+        authority is refused.
+        """
+        return self.assertFailure(
+            self.compressions(volume_transfer_tls_options(
+                self.certificates.stranger,
+                self.certificates.certificate_authority)),
+            Exception)
+
+    def test_service_listens_with_tls(self):
+        """
+        ``VolumeTransferService`` listens on the given port with the given
+        TLS options.
+        """
+        memory_reactor = MemoryReactor()
+        service = VolumeTransferService(
+            memory_reactor, create_volume_service(self), 4525,
+            self.tls_options)
+        service.startService()
+        self.addCleanup(service.stopService)
+        [(port, factory, context_factory, backlog, interface)] = (
+            memory_reactor.sslServers)
+        self.assertEqual(
+            (4525, self.tls_options), (port, context_factory))
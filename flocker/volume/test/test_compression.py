@@ -0,0 +1,159 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.volume._compression``.
+"""
+
+from __future__ import absolute_import
+
+from io import BytesIO
+from os import urandom
+
+from twisted.python.filepath import FilePath
+from twisted.python.procutils import which
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._compression import (
+    SubprocessCompression, available_compressions, choose_compression,
+    get_compression,
+)
+
+GZIP = SubprocessCompression(
+    name=b"gzip",
+    compress_command=(b"gzip", b"-c"),
+    decompress_command=(b"gzip", b"-d", b"-c"))
+
+if which(b"gzip"):
+    _no_gzip = None
+else:
+    _no_gzip = "gzip is not installed."
+
+
+class BrokenFile(object):
+    """
+    A file-like object which can not be read.
+    """
+    def read(self, size=-1):
+        raise IOError("Oops")
+
+
+class SubprocessCompressionTests(SynchronousTestCase):
+    """
+    Tests for ``SubprocessCompression``.
+    """
+    skip = _no_gzip
+
+    def roundtrip(self, source, expected):
+        """
+        Compress and decompress ``source`` and assert the result is
+        ``expected``.
+        """
+        with GZIP.compressed(source) as compressed:
+            with GZIP.decompressed(compressed) as decompressed:
+                result = decompressed.read()
+        self.assertEqual(expected, result)
+
+    def test_roundtrip(self):
+        """
+        Data compressed by ``compressed`` is restored by ``decompressed``.
+        """
+        data = urandom(1024 * 1024) + b"x" * 1024 * 1024
+        self.roundtrip(BytesIO(data), data)
+
+    def test_roundtrip_file(self):
+        """
+        Data can be compressed from an object with a file descriptor, which
+        the compression program reads directly.
+        """
+        data = b"hello world" * 10000
+        path = FilePath(self.mktemp())
+        path.setContent(data)
+        with path.open() as source:
+            self.roundtrip(source, data)
+
+    def test_compresses(self):
+        """
+        Compressible data is made smaller by ``compressed``.
+        """
+        with GZIP.compressed(BytesIO(b"x" * 100000)) as compressed:
+            self.assertLess(len(compressed.read()), 1000)
+
+    def test_program_fails(self):
+        """
+        If the program exits with an error, ``IOError`` is raised.
+        """
+        with self.assertRaises(IOError):
+            with GZIP.decompressed(BytesIO(b"not gzip data")) as data:
+                data.read()
+
+    def test_source_fails(self):
+        """
+        If reading the source fails, ``IOError`` is raised.
+        """
+        with self.assertRaises(IOError):
+            with GZIP.compressed(BrokenFile()) as data:
+                data.read()
+
+    def test_exceptions_pass_through(self):
+        """
+        Exceptions raised in the context manager are not swallowed, even if
+        not all the output was read.
+        """
+        with self.assertRaises(RuntimeError):
+            with GZIP.compressed(BytesIO(urandom(1024 * 1024))):
+                raise RuntimeError()
+
+    def test_available(self):
+        """
+        ``available`` returns ``True`` if the programs are installed.
+        """
+        self.assertTrue(GZIP.available())
+
+    def test_not_available(self):
+        """
+        ``available`` returns ``False`` if a program is not installed.
+        """
+        compression = SubprocessCompression(
+            name=b"missing", compress_command=(b"gzip",),
+            decompress_command=(b"flocker-no-such-program",))
+        self.assertFalse(compression.available())
+
+
+class LookupTests(SynchronousTestCase):
+    """
+    Tests for ``available_compressions``, ``get_compression`` and
+    ``choose_compression``.
+    """
+    def test_get_compression(self):
+        """
+        ``get_compression`` returns the available compression with the given
+        name.
+        """
+        for name in available_compressions():
+            self.assertEqual(name, get_compression(name).name)
+
+    def test_get_unknown_compression(self):
+        """
+        ``get_compression`` raises ``ValueError`` for an unknown compression.
+        """
+        self.assertRaises(ValueError, get_compression, b"nope")
+
+    def test_choose_first_preferred(self):
+        """
+        ``choose_compression`` picks the first preferred compression that
+        is also supported by the other node.
+        """
+        local = available_compressions()
+        if not local:
+            raise self.skipTest("No compression programs are installed.")
+        self.assertEqual(
+            local[-1],
+            choose_compression([b"nope"] + local[::-1], local))
+
+    def test_choose_none(self):
+        """
+        ``choose_compression`` returns ``None`` if there is no compression
+        both nodes support.
+        """
+        self.assertEqual(
+            None, choose_compression(available_compressions(), [b"nope"]))
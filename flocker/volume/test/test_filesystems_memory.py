@@ -11,12 +11,15 @@ from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.filepath import FilePath
 
 from .filesystemtests import (
-    make_ifilesystemsnapshots_tests, make_istoragepool_tests,
+    MY_VOLUME, make_ifilesystemsnapshots_tests, make_istoragepool_tests,
 )
+from ..testtools import service_for_pool
 from ..filesystems.memory import (
     CannedFilesystemSnapshots, FilesystemStoragePool,
     DirectoryFilesystem,
 )
+from ..filesystems.interfaces import SENDER
+from ..filesystems.zfs import Snapshot
 from ...testtools import (
     assert_equal_comparison, assert_not_equal_comparison
 )
@@ -95,3 +98,187 @@ class DirectoryFilesystemTests(SynchronousTestCase):
             repr(DirectoryFilesystem(
                 path=FilePath(b"/foo/bar"), size=123))
         )
+
+
+class DirectoryFilesystemRetentionTests(SynchronousTestCase):
+    """
+    Tests for the pretend snapshot retention of ``DirectoryFilesystem``.
+    """
+    def filesystem(self, *snapshots):
+        """
+        Create a ``DirectoryFilesystem`` with some pretend snapshots.
+
+        :param snapshots: The names of the snapshots, oldest first.
+        """
+        path = FilePath(self.mktemp())
+        path.createDirectory()
+        filesystem = DirectoryFilesystem(path=path)
+        for name in snapshots:
+            filesystem.snapshot(name)
+        return filesystem
+
+    def test_reader_snapshot(self):
+        """
+        The stream returned by ``reader`` has the newest snapshot as its
+        ``snapshot``.
+        """
+        with self.filesystem(b"a", b"b").reader() as reader:
+            self.assertEqual(Snapshot(name=b"b"), reader.snapshot)
+
+    def test_reader_no_snapshot(self):
+        """
+        If there are no snapshots the stream's ``snapshot`` is ``None``.
+        """
+        with self.filesystem().reader() as reader:
+            self.assertIs(None, reader.snapshot)
+
+    def test_prune(self):
+        """
+        ``prune_snapshots`` forgets all the snapshots but the newest and the
+        retained ones, and returns those it forgot.
+        """
+        filesystem = self.filesystem(b"a", b"b", b"c", b"d")
+        filesystem.retain_snapshot(u"node2", Snapshot(name=b"b"))
+        self.assertEqual(
+            ([Snapshot(name=b"a"), Snapshot(name=b"c")],
+             [Snapshot(name=b"b"), Snapshot(name=b"d")]),
+            (self.successResultOf(filesystem.prune_snapshots()),
+             self.successResultOf(filesystem.snapshots())))
+
+    def test_prune_latest_retained(self):
+        """
+        Only the most recently retained snapshot of a peer is kept.
+        """
+        filesystem = self.filesystem(b"a", b"b", b"c")
+        filesystem.retain_snapshot(u"node2", Snapshot(name=b"a"))
+        filesystem.retain_snapshot(u"node2", Snapshot(name=b"b"))
+        self.assertEqual(
+            [Snapshot(name=b"a")],
+            self.successResultOf(filesystem.prune_snapshots()))
+
+    def test_prune_nothing_retained(self):
+        """
+        ``prune_snapshots`` leaves a filesystem with no retained snapshots
+        alone.
+        """
+        filesystem = self.filesystem(b"a", b"b")
+        self.assertEqual(
+            ([], [Snapshot(name=b"a"), Snapshot(name=b"b")]),
+            (self.successResultOf(filesystem.prune_snapshots()),
+             self.successResultOf(filesystem.snapshots())))
+
+    def test_writer_retains_sender_snapshot(self):
+        """
+        Once written to, the filesystem retains the newest snapshot it
+        received for the sender, and keeps the snapshots it retained for
+        other peers.
+        """
+        source = self.filesystem(b"a", b"b")
+        source.retain_snapshot(u"node2", Snapshot(name=b"a"))
+        target = self.filesystem(b"z")
+        target.retain_snapshot(u"node3", Snapshot(name=b"z"))
+        with source.reader() as reader:
+            with target.writer() as writer:
+                writer.write(reader.read())
+        target.snapshot(b"c")
+        self.assertEqual(
+            ([Snapshot(name=b"a")], {u"node3": Snapshot(name=b"z"),
+                                     SENDER: Snapshot(name=b"b")}),
+            (self.successResultOf(target.prune_snapshots()),
+             target._retained()))
+
+
+class DirectoryFilesystemStreamingTests(SynchronousTestCase):
+    """
+    Tests for the streaming of ``DirectoryFilesystem`` data.
+    """
+    def filesystem(self):
+        """
+        Create a ``DirectoryFilesystem`` containing a file larger than a
+        pipe's buffer.
+        """
+        path = FilePath(self.mktemp())
+        path.createDirectory()
+        path.child(b"file").setContent(b"x" * (1024 * 1024))
+        return DirectoryFilesystem(path=path)
+
+    def test_reader_abandoned(self):
+        """
+        A reader which is only read part of the way through can be closed
+        without error.
+        """
+        with self.filesystem().reader() as reader:
+            self.assertEqual(10, len(reader.read(10)))
+
+    def test_reader_failure(self):
+        """
+        If generating the tarball fails, leaving the reader raises the
+        error.
+        """
+        filesystem = self.filesystem()
+
+        def broken(output, remote_snapshots):
+            raise RuntimeError()
+        self.patch(filesystem, "_write_tarball", broken)
+
+        def read():
+            with filesystem.reader() as reader:
+                reader.read()
+        self.assertRaises(RuntimeError, read)
+
+    def test_writer_to_disk(self):
+        """
+        The bytes written to a writer are written to a file rather than
+        kept in memory until writing has finished.
+        """
+        filesystem = self.filesystem()
+        with filesystem.writer() as writer:
+            writer.write(b"some data")
+            writer.flush()
+            self.assertEqual(
+                b"some data", filesystem._partial_path().getContent())
+
+    def test_large_copy(self):
+        """
+        Data larger than a pipe's buffer is copied intact from a reader to a
+        writer, and nothing is left behind next to the written filesystem.
+        """
+        source = self.filesystem()
+        path = FilePath(self.mktemp())
+        target = DirectoryFilesystem(path=path)
+        with source.reader() as reader:
+            with target.writer() as writer:
+                while True:
+                    data = reader.read(64 * 1024)
+                    if not data:
+                        break
+                    writer.write(data)
+        self.assertEqual(
+            (b"x" * (1024 * 1024), False),
+            (path.child(b"file").getContent(),
+             target._partial_path().exists()))
+
+
+class FilesystemStoragePoolTests(SynchronousTestCase):
+    """
+    Additional tests for ``FilesystemStoragePool``.
+    """
+    def test_enumerate_ignores_partial_writes(self):
+        """
+        The data kept from an interrupted write is not enumerated as a
+        filesystem.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = service_for_pool(self, pool)
+        volume = service.get(MY_VOLUME)
+        filesystem = volume.get_filesystem()
+        try:
+            with filesystem.writer() as writer:
+                writer.write(b"partial data")
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(
+            (b"12", set()),
+            (self.successResultOf(filesystem.resume_token()),
+             set(self.successResultOf(pool.enumerate()))))
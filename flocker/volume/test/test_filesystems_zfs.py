@@ -7,11 +7,13 @@ Further coverage is provided in
 """
 
 import os
+from threading import Thread
 
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.internet.error import ProcessDone, ProcessTerminated
 from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
+from twisted.test.proto_helpers import StringTransport
 
 from eliot import Logger
 from eliot.testing import (
@@ -22,12 +24,32 @@ from ...testtools import (
     FakeProcessReactor, assert_equal_comparison, assert_not_equal_comparison
 )
 
+from ..filesystems import zfs
 from ..filesystems.zfs import (
     _DatasetInfo,
     zfs_command, CommandFailed, BadArguments, Filesystem, ZFSSnapshots,
     _sync_command_error_squashed, _latest_common_snapshot, ZFS_ERROR,
-    Snapshot,
+    Snapshot, _snapshots_to_prune, StoragePool, volume_to_dataset,
+    _parse_pool_listing, MAXIMUM_CONCURRENT_DESTROYS,
 )
+from ..service import Volume, VolumeName
+from .._model import VolumeUsage
+
+
+def finish_process(process, output=b"", exit_code=0):
+    """
+    Make a fake ``zfs`` process output some data and exit.
+
+    :param SpawnProcessArguments process: The process.
+    :param bytes output: The data it writes to its standard output.
+    :param int exit_code: Its exit code.
+    """
+    process.processProtocol.childDataReceived(1, output)
+    if exit_code:
+        reason = ProcessTerminated(exit_code)
+    else:
+        reason = ProcessDone(0)
+    process.processProtocol.processEnded(Failure(reason))
 
 
 class FilesystemTests(SynchronousTestCase):
@@ -224,6 +246,61 @@ class SyncCommandTests(SynchronousTestCase):
         self.assertIs(None, result)
 
 
+class ResumeTokenTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.resume_token``.
+    """
+    def resume_token(self, output, exit_code=0):
+        """
+        Get the resume token of a filesystem from a fake ``zfs get``.
+
+        :param bytes output: The output of the command.
+        :param int exit_code: The command's exit code.
+
+        :return: ``tuple`` of the command's arguments and the ``Deferred``
+            result of ``resume_token``.
+        """
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        d = filesystem.resume_token()
+        process = reactor.processes[0]
+        process.processProtocol.childDataReceived(1, output)
+        if exit_code:
+            reason = ProcessTerminated(exit_code)
+        else:
+            reason = ProcessDone(0)
+        process.processProtocol.processEnded(Failure(reason))
+        return process.args, d
+
+    def test_token(self):
+        """
+        ``Filesystem.resume_token`` runs ``zfs get receive_resume_token`` and
+        returns the token it outputs.
+        """
+        args, d = self.resume_token(b"1-e604ea4bf-e0\n")
+        self.assertEqual(
+            ([b"zfs", b"get", b"-H", b"-o", b"value",
+              b"receive_resume_token", b"mypool/myfs"], b"1-e604ea4bf-e0"),
+            (args, self.successResultOf(d)))
+
+    def test_no_token(self):
+        """
+        ``Filesystem.resume_token`` returns ``None`` if ZFS reports no value
+        for the property.
+        """
+        args, d = self.resume_token(b"-\n")
+        self.assertIs(None, self.successResultOf(d))
+
+    def test_unsupported(self):
+        """
+        ``Filesystem.resume_token`` returns ``None`` if the command fails,
+        e.g. because the filesystem does not exist or ZFS is too old to
+        know the property.
+        """
+        args, d = self.resume_token(b"", exit_code=1)
+        self.assertIs(None, self.successResultOf(d))
+
+
 class ZFSSnapshotsTests(SynchronousTestCase):
     """Unit tests for ``ZFSSnapshotsTests``."""
 
@@ -381,6 +458,169 @@ class LatestCommonSnapshotTests(SynchronousTestCase):
             b, _latest_common_snapshot([a, b], [a, b]))
 
 
+class SnapshotsToPruneTests(SynchronousTestCase):
+    """
+    Tests for ``_snapshots_to_prune``.
+    """
+    def test_keeps_newest(self):
+        """
+        The newest snapshot is not pruned, even if it is not retained.
+        """
+        self.assertEqual(
+            [Snapshot(name=b"a"), Snapshot(name=b"b")],
+            _snapshots_to_prune(
+                [Snapshot(name=b"a"), Snapshot(name=b"b"),
+                 Snapshot(name=b"c")], []))
+
+    def test_keeps_retained(self):
+        """
+        Retained snapshots are not pruned.
+        """
+        self.assertEqual(
+            [Snapshot(name=b"b")],
+            _snapshots_to_prune(
+                [Snapshot(name=b"a"), Snapshot(name=b"b"),
+                 Snapshot(name=b"c")],
+                [Snapshot(name=b"a"), Snapshot(name=b"gone")]))
+
+    def test_no_snapshots(self):
+        """
+        If there are no snapshots nothing is pruned.
+        """
+        self.assertEqual([], _snapshots_to_prune([], [Snapshot(name=b"a")]))
+
+
+class RetainedSnapshotsTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.retain_snapshot`` and
+    ``Filesystem.prune_snapshots``.
+    """
+    def finish(self, process, output=b"", exit_code=0):
+        """
+        Make a fake ``zfs`` process output some data and exit.
+        """
+        process.processProtocol.childDataReceived(1, output)
+        if exit_code:
+            reason = ProcessTerminated(exit_code)
+        else:
+            reason = ProcessDone(0)
+        process.processProtocol.processEnded(Failure(reason))
+
+    def test_retain(self):
+        """
+        ``Filesystem.retain_snapshot`` records the snapshot in a user property
+        named after the peer.
+        """
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        d = filesystem.retain_snapshot(u"node2", Snapshot(name=b"snap"))
+        self.finish(reactor.processes[0])
+        self.assertEqual(
+            ([b"zfs", b"set", b"flocker:peer:node2=snap", b"mypool/myfs"],
+             None),
+            (reactor.processes[0].args, self.successResultOf(d)))
+
+    def test_prune(self):
+        """
+        ``Filesystem.prune_snapshots`` destroys the snapshots which are
+        neither the newest nor retained for a peer and returns them.
+        """
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        d = filesystem.prune_snapshots()
+        listing, getting = reactor.processes
+        self.finish(listing, b"mypool/myfs@a\nmypool/myfs@b\n"
+                             b"mypool/myfs@c\nmypool/myfs@d\n")
+        self.finish(getting, b"flocker:peer:node2\tb\n"
+                             b"readonly\toff\n")
+        destroying = reactor.processes[2:]
+        self.finish(destroying[0])
+        self.assertEqual(
+            ([b"zfs", b"get", b"-H", b"-s", b"local", b"-o",
+              b"property,value", b"all", b"mypool/myfs"],
+             [[b"zfs", b"destroy", b"mypool/myfs@a,c"]],
+             [Snapshot(name=b"a"), Snapshot(name=b"c")]),
+            (getting.args, [process.args for process in destroying],
+             self.successResultOf(d)))
+
+    def test_prune_batches(self):
+        """
+        The snapshots are destroyed in batches whose names fit in
+        ``MAXIMUM_DESTROY_ARGUMENT`` bytes, one batch at a time.
+        """
+        self.patch(zfs, "MAXIMUM_DESTROY_ARGUMENT",
+                   len(b"mypool/myfs@") + len(b"a,b"))
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        d = filesystem.prune_snapshots()
+        listing, getting = reactor.processes
+        self.finish(listing, b"".join(
+            b"mypool/myfs@%s\n" % (name,)
+            for name in [b"a", b"b", b"c", b"d", b"e", b"f"]))
+        self.finish(getting, b"flocker:peer:node2\tf\n")
+        self.finish(reactor.processes[2])
+        started = len(reactor.processes)
+        self.finish(reactor.processes[3])
+        self.finish(reactor.processes[4])
+        self.assertEqual(
+            ([[b"zfs", b"destroy", b"mypool/myfs@a,b"],
+              [b"zfs", b"destroy", b"mypool/myfs@c,d"],
+              [b"zfs", b"destroy", b"mypool/myfs@e"]],
+             4, [Snapshot(name=name) for name in b"abcde"]),
+            ([process.args for process in reactor.processes[2:]],
+             started, self.successResultOf(d)))
+
+    def test_prune_busy(self):
+        """
+        A snapshot which can't be destroyed, e.g. because it is being sent,
+        is skipped: if destroying a batch fails its snapshots are destroyed
+        one at a time.
+        """
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        d = filesystem.prune_snapshots()
+        listing, getting = reactor.processes
+        self.finish(listing, b"mypool/myfs@a\nmypool/myfs@b\n"
+                             b"mypool/myfs@c\n")
+        self.finish(getting, b"flocker:peer:node2\tc\n")
+        self.finish(reactor.processes[2], exit_code=1)
+        self.finish(reactor.processes[3], exit_code=1)
+        self.finish(reactor.processes[4])
+        self.assertEqual(
+            ([[b"zfs", b"destroy", b"mypool/myfs@a,b"],
+              [b"zfs", b"destroy", b"mypool/myfs@a"],
+              [b"zfs", b"destroy", b"mypool/myfs@b"]],
+             [Snapshot(name=b"b")]),
+            ([process.args for process in reactor.processes[2:]],
+             self.successResultOf(d)))
+
+    def test_prune_nothing_retained(self):
+        """
+        The snapshots of a filesystem with no retained snapshots are left
+        alone.
+        """
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        d = filesystem.prune_snapshots()
+        listing, getting = reactor.processes
+        self.finish(listing, b"mypool/myfs@a\nmypool/myfs@b\n")
+        self.finish(getting, b"readonly\toff\n")
+        self.assertEqual(
+            ([], 2), (self.successResultOf(d), len(reactor.processes)))
+
+    def test_prune_no_filesystem(self):
+        """
+        Pruning a filesystem that does not exist does nothing.
+        """
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        d = filesystem.prune_snapshots()
+        listing, getting = reactor.processes
+        self.finish(listing, exit_code=1)
+        self.finish(getting, exit_code=1)
+        self.assertEqual([], self.successResultOf(d))
+
+
 class DatasetInfoTests(SynchronousTestCase):
     """
     Tests for ``_DatasetInfo``.
@@ -390,6 +630,9 @@ class DatasetInfoTests(SynchronousTestCase):
             dataset=b"foo",
             mountpoint=b"bar",
             refquota=1234,
+            used=5678,
+            available=910,
+            compression_ratio=1.5,
         )
 
     def test_immutable_dataset(self):
@@ -412,3 +655,736 @@ class DatasetInfoTests(SynchronousTestCase):
         """
         self.assertRaises(
             AttributeError, setattr, self.info, "refquota", 321)
+
+    def test_immutable_used(self):
+        """
+        :class:`_DatasetInfo.used` cannot be rebound.
+        """
+        self.assertRaises(
+            AttributeError, setattr, self.info, "used", 321)
+
+    def test_immutable_available(self):
+        """
+        :class:`_DatasetInfo.available` cannot be rebound.
+        """
+        self.assertRaises(
+            AttributeError, setattr, self.info, "available", 321)
+
+
+POOL_LISTING = b"".join([
+    b"mypool\tnone\t0\t300\t5000\t1.00x\n",
+    b"mypool@root\t-\t-\t0\t-\t1.00x\n",
+    b"mypool/first\t/flocker/first\t0\t100\t5000\t1.00x\n",
+    b"mypool/first@a\t-\t-\t10\t-\t1.00x\n",
+    b"mypool/second\t/flocker/second\t1000\t200\t800\t2.50\n",
+    b"mypool/first@b\t-\t-\t20\t-\t1.00x\n",
+    b"mypool/second/nested\t/nested\t0\t50\t5000\t1.00x\n",
+    b"mypool/second/nested@c\t-\t-\t5\t-\t1.00x\n",
+])
+
+
+class ParsePoolListingTests(SynchronousTestCase):
+    """
+    Tests for ``_parse_pool_listing``.
+    """
+    def setUp(self):
+        self.listing = _parse_pool_listing(POOL_LISTING, b"mypool")
+
+    def test_datasets(self):
+        """
+        The direct children of the pool are indexed by dataset name, with a
+        ``refquota`` of ``0`` parsed as ``None`` and the compression ratio
+        parsed with or without a trailing ``x``.
+        """
+        self.assertEqual(
+            {b"first": _DatasetInfo(
+                dataset=b"first", mountpoint=b"/flocker/first",
+                refquota=None, used=100, available=5000,
+                compression_ratio=1.0),
+             b"second": _DatasetInfo(
+                 dataset=b"second", mountpoint=b"/flocker/second",
+                 refquota=1000, used=200, available=800,
+                 compression_ratio=2.5)},
+            dict(self.listing.datasets))
+
+    def test_available(self):
+        """
+        The free space in the pool is the ``available`` property of the
+        pool itself.
+        """
+        self.assertEqual(5000, self.listing.available)
+
+    def test_pool_missing(self):
+        """
+        If the pool itself is not in the output the free space is not
+        known.
+        """
+        listing = _parse_pool_listing(
+            b"mypool/first\t/flocker/first\t0\t100\t5000\t1.00x\n",
+            b"mypool")
+        self.assertEqual(None, listing.available)
+
+    def test_snapshots(self):
+        """
+        The snapshots of the direct children of the pool are indexed by
+        dataset name, in the order they were listed.
+        """
+        self.assertEqual(
+            {b"first": [b"a", b"b"]},
+            {dataset: list(names)
+             for (dataset, names) in self.listing.snapshots.items()})
+
+    def test_immutable(self):
+        """
+        The listing can not be changed.
+        """
+        self.assertRaises(
+            AttributeError, setattr, self.listing, "datasets", None)
+
+
+MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
+MY_VOLUME2 = VolumeName(namespace=u"myns", dataset_id=u"myvol2")
+
+
+class _RunningReactor(FakeProcessReactor):
+    """
+    A ``FakeProcessReactor`` which claims to be running and records the
+    functions passed to ``callFromThread``.
+    """
+    running = True
+
+    def __init__(self):
+        FakeProcessReactor.__init__(self)
+        self.from_thread = []
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.from_thread.append((f, args, kwargs))
+
+
+class ChangedInThreadTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem._changed_in_thread``.
+    """
+    def filesystem(self, reactor):
+        """
+        :return: A ``Filesystem`` with a cached listing of its pool.
+        """
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        filesystem._listing_cache.update(object(), 0)
+        return filesystem
+
+    def changed_in_thread(self, filesystem):
+        """
+        Call ``_changed_in_thread`` in another thread and wait for it.
+        """
+        thread = Thread(target=filesystem._changed_in_thread)
+        thread.start()
+        thread.join()
+
+    def test_other_thread(self):
+        """
+        Called from another thread while the reactor is running, the
+        listing cache is invalidated in the reactor thread.
+        """
+        reactor = _RunningReactor()
+        filesystem = self.filesystem(reactor)
+        self.changed_in_thread(filesystem)
+        cache = filesystem._listing_cache
+        before = (cache.current is not None, cache.generation)
+        [(f, args, kwargs)] = reactor.from_thread
+        f(*args, **kwargs)
+        self.assertEqual(
+            ((True, 0), (None, 1)),
+            (before, (cache.current, cache.generation)))
+
+    def test_reactor_not_running(self):
+        """
+        If the reactor is not running the listing cache is invalidated
+        immediately.
+        """
+        filesystem = self.filesystem(FakeProcessReactor())
+        self.changed_in_thread(filesystem)
+        self.assertEqual(
+            (None, 1),
+            (filesystem._listing_cache.current,
+             filesystem._listing_cache.generation))
+
+
+class FakeVolumeService(object):
+    """
+    Just enough of a ``VolumeService`` for the ``Volume`` instances given to
+    a ``StoragePool``.
+    """
+    node_id = u"node"
+
+
+class StoragePoolListingTests(SynchronousTestCase):
+    """
+    Tests for the listing of the pool which ``StoragePool.enumerate`` takes
+    and then uses to answer questions about its filesystems.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(
+            self.reactor, b"mypool", FilePath(b"/flocker"))
+        self.volume = Volume(
+            node_id=u"node", name=MY_VOLUME, service=FakeVolumeService())
+        self.dataset = volume_to_dataset(self.volume)
+        self.finish = finish_process
+
+    def enumerate(self):
+        """
+        Enumerate the pool, which has one filesystem for ``self.volume`` with
+        two snapshots.
+
+        :return: The result of ``enumerate``.
+        """
+        d = self.pool.enumerate()
+        name = b"mypool/" + self.dataset
+        self.finish(self.reactor.processes[-1], b"".join([
+            b"mypool\tnone\t0\t200\t1000\t1.00x\n",
+            name + b"\t/flocker/" + self.dataset + b"\t0\t100\t900\t1.50x\n",
+            name + b"@a\t-\t-\t10\t-\t1.00x\n",
+            name + b"@b\t-\t-\t10\t-\t1.00x\n",
+        ]))
+        return self.successResultOf(d)
+
+    def test_one_command(self):
+        """
+        ``StoragePool.enumerate`` lists the filesystems and their snapshots
+        with a single ``zfs list``.
+        """
+        self.enumerate()
+        self.assertEqual(
+            [[b"zfs", b"list", b"-H", b"-p", b"-r",
+              b"-t", b"filesystem,snapshot",
+              b"-o", b"name,mountpoint,refquota,used,available,compressratio",
+              b"-s", b"creation", b"mypool"]],
+            [process.args for process in self.reactor.processes])
+
+    def test_enumerate(self):
+        """
+        ``StoragePool.enumerate`` returns the filesystems in the listing.
+        """
+        [filesystem] = self.enumerate()
+        self.assertEqual(
+            (self.dataset, FilePath(b"/flocker/" + self.dataset), None,
+             VolumeUsage(used=100, available=900, compression_ratio=1.5)),
+            (filesystem.dataset, filesystem.get_path(),
+             filesystem.size.maximum_size, filesystem.usage))
+
+    def test_free_space_from_listing(self):
+        """
+        After ``enumerate``, ``free_space`` is answered from the listing
+        without running ``zfs`` again.
+        """
+        self.enumerate()
+        self.assertEqual(
+            (1000, 1),
+            (self.successResultOf(self.pool.free_space()),
+             len(self.reactor.processes)))
+
+    def test_free_space_lists(self):
+        """
+        If there is no current listing, ``free_space`` lists the pool.
+        """
+        d = self.pool.free_space()
+        finish_process(self.reactor.processes[-1],
+                       b"mypool\tnone\t0\t200\t1000\t1.00x\n")
+        self.assertEqual(1000, self.successResultOf(d))
+
+    def test_snapshots_from_listing(self):
+        """
+        After ``enumerate``, ``snapshots`` of a filesystem is answered from
+        the listing without running ``zfs`` again.
+        """
+        [enumerated] = self.enumerate()
+        self.assertEqual(
+            [[Snapshot(name=b"a"), Snapshot(name=b"b")]] * 2 + [1],
+            [self.successResultOf(enumerated.snapshots()),
+             self.successResultOf(self.pool.get(self.volume).snapshots()),
+             len(self.reactor.processes)])
+
+    def test_missing_from_listing(self):
+        """
+        After ``enumerate``, a filesystem which is not in the listing does
+        not exist and has no snapshots, without running ``zfs`` again.
+        """
+        self.enumerate()
+        filesystem = self.pool.get(Volume(
+            node_id=u"node", name=VolumeName(namespace=u"myns",
+                                             dataset_id=u"other"),
+            service=FakeVolumeService()))
+        self.assertEqual(
+            (False, [], 1),
+            (filesystem._exists(),
+             self.successResultOf(filesystem.snapshots()),
+             len(self.reactor.processes)))
+
+    def test_create_invalidates(self):
+        """
+        ``StoragePool.create`` discards the listing.
+        """
+        self.enumerate()
+        d = self.pool.create(self.volume)
+        self.finish(self.reactor.processes[-1], exit_code=1)
+        self.failureResultOf(d)
+        self.assertIs(None, self.pool._listing.current)
+
+    def test_set_maximum_size_invalidates(self):
+        """
+        ``StoragePool.set_maximum_size`` discards the listing.
+        """
+        self.enumerate()
+        d = self.pool.set_maximum_size(self.volume)
+        self.finish(self.reactor.processes[-1])
+        self.successResultOf(d)
+        self.assertIs(None, self.pool._listing.current)
+
+    def test_destroy_invalidates(self):
+        """
+        ``StoragePool.destroy`` discards the listing once the filesystem has
+        been destroyed.
+        """
+        self.enumerate()
+        d = self.pool.destroy(self.volume)
+        self.finish(self.reactor.processes[-1])
+        self.successResultOf(d)
+        self.assertIs(None, self.pool._listing.current)
+
+    def test_snapshot_invalidates(self):
+        """
+        Creating a snapshot of a filesystem discards the listing.
+        """
+        [filesystem] = self.enumerate()
+        d = ZFSSnapshots(self.reactor, filesystem).create(b"c")
+        self.finish(self.reactor.processes[-1])
+        self.successResultOf(d)
+        self.assertIs(None, self.pool._listing.current)
+
+    def test_stale_listing_not_cached(self):
+        """
+        A listing which was taken while the pool was being changed is not
+        cached.
+        """
+        listing = self.pool.enumerate()
+        d = self.pool.set_maximum_size(self.volume)
+        self.finish(self.reactor.processes[1])
+        self.successResultOf(d)
+        self.finish(self.reactor.processes[0])
+        self.successResultOf(listing)
+        self.assertIs(None, self.pool._listing.current)
+
+
+class SnapshotsTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.snapshots`` when the pool's listing is not
+    cached.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.filesystem = Filesystem(
+            b"mypool", b"myfs", reactor=self.reactor)
+
+    def test_snapshots(self):
+        """
+        ``Filesystem.snapshots`` lists the snapshots with ``zfs list``.
+        """
+        d = self.filesystem.snapshots()
+        finish_process(
+            self.reactor.processes[0], b"mypool/myfs@a\nmypool/myfs@b\n")
+        self.assertEqual(
+            [Snapshot(name=b"a"), Snapshot(name=b"b")],
+            self.successResultOf(d))
+
+    def test_missing(self):
+        """
+        ``Filesystem.snapshots`` of a filesystem which does not exist
+        returns no snapshots.
+        """
+        d = self.filesystem.snapshots()
+        finish_process(self.reactor.processes[0], exit_code=1)
+        self.assertEqual([], self.successResultOf(d))
+
+
+class SendTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.send``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.filesystem = Filesystem(
+            b"mypool", b"myfs", reactor=self.reactor)
+        self.consumer = StringTransport()
+
+    def send(self, remote_snapshots=None):
+        """
+        Start sending, letting the snapshot and listing commands succeed.
+
+        :param remote_snapshots: Passed to ``send``.
+
+        :return: ``tuple`` of the ``Deferred`` result of ``send``, the name
+            of the new snapshot and the ``zfs send`` process.
+        """
+        d = self.filesystem.send(self.consumer, remote_snapshots)
+        [snapshotting] = self.reactor.processes
+        name = snapshotting.args[2].split(b"@")[1]
+        finish_process(snapshotting)
+        finish_process(
+            self.reactor.processes[1],
+            b"mypool/myfs@old\nmypool/myfs@" + name + b"\n")
+        return d, name, self.reactor.processes[2]
+
+    def test_full(self):
+        """
+        Without remote snapshots, a new snapshot is taken and sent in full.
+        """
+        d, name, sending = self.send()
+        self.assertEqual(
+            [[b"zfs", b"snapshot", b"mypool/myfs@" + name],
+             [b"zfs", b"list", b"-H", b"-r", b"-t", b"snapshot", b"-o",
+              b"name", b"-s", b"creation", b"mypool/myfs"],
+             [b"zfs", b"send", b"mypool/myfs@" + name]],
+            [process.args for process in self.reactor.processes])
+
+    def test_incremental(self):
+        """
+        Given remote snapshots, the new snapshot is sent incrementally from
+        the latest snapshot in common.
+        """
+        d, name, sending = self.send([Snapshot(name=b"old")])
+        self.assertEqual(
+            [b"zfs", b"send", b"-i", b"mypool/myfs@old",
+             b"mypool/myfs@" + name],
+            sending.args)
+
+    def test_data(self):
+        """
+        The output of ``zfs send`` is written to the consumer, and the
+        result fires with the new snapshot once the process has exited.
+        """
+        d, name, sending = self.send()
+        sending.processProtocol.childDataReceived(1, b"hello")
+        self.assertNoResult(d)
+        finish_process(sending, b" world")
+        self.assertEqual(
+            (b"hello world", Snapshot(name=name)),
+            (self.consumer.value(), self.successResultOf(d)))
+
+    def test_producer(self):
+        """
+        The process is registered with the consumer as a streaming
+        producer, so the consumer can pause reading from ``zfs``, until the
+        process exits.
+        """
+        d, name, sending = self.send()
+        self.consumer.producer.pauseProducing()
+        registered = (self.consumer.streaming, sending.transport.paused)
+        finish_process(sending)
+        self.assertEqual(
+            ((True, True), None), (registered, self.consumer.producer))
+
+    def test_resume_token(self):
+        """
+        Given a resume token, the rest of the interrupted stream is sent
+        without taking a snapshot, and the result is ``None``.
+        """
+        d = self.filesystem.send(self.consumer, resume_token=b"1-abc")
+        [sending] = self.reactor.processes
+        finish_process(sending, b"rest")
+        self.assertEqual(
+            ([b"zfs", b"send", b"-t", b"1-abc"], b"rest", None),
+            (sending.args, self.consumer.value(), self.successResultOf(d)))
+
+    def test_failure(self):
+        """
+        If ``zfs send`` fails the result fails with ``CommandFailed`` and
+        the producer is unregistered.
+        """
+        d, name, sending = self.send()
+        finish_process(sending, exit_code=1)
+        self.failureResultOf(d, CommandFailed)
+        self.assertIs(None, self.consumer.producer)
+
+
+class ReceiverTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.receiver``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.filesystem = Filesystem(
+            b"mypool", b"myfs", FilePath(b"/flocker/myfs"),
+            reactor=self.reactor)
+        self.patch(zfs, "_resumable_pools", {b"mypool": False})
+
+    def receiver(self, exists=True):
+        """
+        Create a receiver for a pool which doesn't support resuming.
+
+        :param bool exists: Whether the filesystem exists already.
+
+        :return: The receiver.
+        """
+        d = self.filesystem.receiver()
+        finish_process(self.reactor.processes[0], exit_code=int(not exists))
+        return self.successResultOf(d)
+
+    def test_new(self):
+        """
+        A filesystem which doesn't exist yet receives a complete stream.
+        """
+        self.receiver(exists=False)
+        self.assertEqual(
+            [[b"zfs", b"list", b"mypool/myfs"],
+             [b"zfs", b"receive", b"mypool/myfs"]],
+            [process.args for process in self.reactor.processes])
+
+    def test_existing(self):
+        """
+        A filesystem which exists receives with ``-F``.
+        """
+        self.receiver()
+        self.assertEqual(
+            [b"zfs", b"receive", b"-F", b"mypool/myfs"],
+            self.reactor.processes[1].args)
+
+    def test_resumable(self):
+        """
+        If the pool supports resuming, any kept state of an interrupted
+        stream is discarded and the stream is received with ``-s``.
+        """
+        self.patch(zfs, "_resumable_pools", {b"mypool": True})
+        d = self.filesystem.receiver()
+        finish_process(self.reactor.processes[0], b"1-abc\n")
+        finish_process(self.reactor.processes[1])
+        finish_process(self.reactor.processes[2])
+        self.successResultOf(d)
+        self.assertEqual(
+            [[b"zfs", b"get", b"-H", b"-o", b"value",
+              b"receive_resume_token", b"mypool/myfs"],
+             [b"zfs", b"receive", b"-A", b"mypool/myfs"],
+             [b"zfs", b"list", b"mypool/myfs"],
+             [b"zfs", b"receive", b"-s", b"-F", b"mypool/myfs"]],
+            [process.args for process in self.reactor.processes])
+
+    def test_resume(self):
+        """
+        A receiver resuming an interrupted stream keeps its state.
+        """
+        self.patch(zfs, "_resumable_pools", {b"mypool": True})
+        d = self.filesystem.receiver(resume=True)
+        finish_process(self.reactor.processes[0])
+        self.successResultOf(d)
+        self.assertEqual(
+            [[b"zfs", b"list", b"mypool/myfs"],
+             [b"zfs", b"receive", b"-s", b"-F", b"mypool/myfs"]],
+            [process.args for process in self.reactor.processes])
+
+    def test_write(self):
+        """
+        Data written to the receiver is written to ``zfs receive``, and
+        producers are registered with the process.
+        """
+        receiver = self.receiver()
+        producer = object()
+        receiver.registerProducer(producer, True)
+        receiver.write(b"data")
+        transport = self.reactor.processes[1].transport
+        self.assertEqual((producer, b"data"),
+                         (transport.producer, transport.data))
+
+    def test_finish(self):
+        """
+        ``finish`` closes the standard input of ``zfs receive`` and once it
+        has succeeded sets the mountpoint and retains the newest snapshot
+        for ``SENDER``.
+        """
+        receiver = self.receiver()
+        d = receiver.finish()
+        receiving = self.reactor.processes[1]
+        closed = receiving.transport.stdin_closed
+        finish_process(receiving)
+        finish_process(self.reactor.processes[2])
+        finish_process(self.reactor.processes[3],
+                       b"mypool/myfs@a\nmypool/myfs@b\n")
+        finish_process(self.reactor.processes[4])
+        self.assertEqual(
+            (True, None,
+             [[b"zfs", b"set", b"mountpoint=/flocker/myfs", b"mypool/myfs"],
+              [b"zfs", b"list", b"-H", b"-r", b"-t", b"snapshot", b"-o",
+               b"name", b"-s", b"creation", b"mypool/myfs"],
+              [b"zfs", b"set", b"flocker:peer:-sender=b", b"mypool/myfs"]]),
+            (closed, self.successResultOf(d),
+             [process.args for process in self.reactor.processes[2:]]))
+
+    def test_finish_failure(self):
+        """
+        If ``zfs receive`` fails, ``finish`` fails with ``CommandFailed``.
+        """
+        receiver = self.receiver()
+        d = receiver.finish()
+        finish_process(self.reactor.processes[1], exit_code=1)
+        self.failureResultOf(d, CommandFailed)
+
+    def test_abort(self):
+        """
+        ``abort`` closes the standard input of ``zfs receive`` and succeeds
+        once the receive has failed.
+        """
+        receiver = self.receiver()
+        d = receiver.abort()
+        receiving = self.reactor.processes[1]
+        closed = receiving.transport.stdin_closed
+        finish_process(receiving, exit_code=1)
+        self.assertEqual(
+            (True, None, 2),
+            (closed, self.successResultOf(d), len(self.reactor.processes)))
+
+
+class DestroyTests(SynchronousTestCase):
+    """
+    Tests for ``StoragePool.destroy`` and ``StoragePool.destroy_many``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(
+            self.reactor, b"mypool", FilePath(b"/flocker"))
+
+    def volume(self, dataset_id=u"myvol"):
+        """
+        :return: A ``Volume`` with the given dataset ID.
+        """
+        return Volume(
+            node_id=u"node",
+            name=VolumeName(namespace=u"myns", dataset_id=dataset_id),
+            service=FakeVolumeService())
+
+    def test_destroy(self):
+        """
+        ``StoragePool.destroy`` destroys the filesystem and its snapshots
+        with a single ``zfs destroy -r``.
+        """
+        volume = self.volume()
+        d = self.pool.destroy(volume)
+        [destroying] = self.reactor.processes
+        finish_process(destroying)
+        self.assertEqual(
+            ([b"zfs", b"destroy", b"-r",
+              b"mypool/" + volume_to_dataset(volume)], None),
+            (destroying.args, self.successResultOf(d)))
+
+    def test_destroy_many_bounded(self):
+        """
+        ``StoragePool.destroy_many`` runs at most
+        ``MAXIMUM_CONCURRENT_DESTROYS`` processes at once, starting another
+        as each finishes.
+        """
+        volumes = [self.volume(u"vol%d" % (i,))
+                   for i in range(MAXIMUM_CONCURRENT_DESTROYS + 2)]
+        d = self.pool.destroy_many(volumes)
+        started = len(self.reactor.processes)
+        finish_process(self.reactor.processes[0])
+        self.assertEqual(
+            (MAXIMUM_CONCURRENT_DESTROYS, MAXIMUM_CONCURRENT_DESTROYS + 1),
+            (started, len(self.reactor.processes)))
+        self.assertNoResult(d)
+
+    def test_destroy_many_results(self):
+        """
+        ``StoragePool.destroy_many`` fires with the result of each
+        destruction, in order, once all have finished.
+        """
+        d = self.pool.destroy_many([self.volume(u"a"), self.volume(u"b")])
+        finish_process(self.reactor.processes[0], exit_code=1)
+        finish_process(self.reactor.processes[1])
+        [(first_success, first), second] = self.successResultOf(d)
+        self.assertEqual(
+            (False, True, (True, None)),
+            (first_success, first.check(CommandFailed) is not None, second))
+
+
+class OwnershipPropertiesTests(SynchronousTestCase):
+    """
+    Tests for the ``zfs`` commands ``StoragePool.clone_to`` and
+    ``StoragePool.change_owner`` run to give the new filesystem its
+    properties.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(
+            self.reactor, b"mypool", FilePath(b"/flocker"))
+        self.local = self.volume(u"node", MY_VOLUME)
+
+    def volume(self, node_id, name):
+        """
+        :return: A ``Volume`` with the given owner and name.
+        """
+        return Volume(node_id=node_id, name=name, service=FakeVolumeService())
+
+    def run_all(self, d):
+        """
+        Finish the processes started by an operation, and any they lead to,
+        successfully.
+
+        :return: The arguments of each process.
+        """
+        finished = 0
+        while finished < len(self.reactor.processes):
+            finish_process(self.reactor.processes[finished])
+            finished += 1
+        self.successResultOf(d)
+        return [process.args[1:] for process in self.reactor.processes]
+
+    def name(self, volume):
+        """
+        :return: The name of a volume's filesystem.
+        """
+        return self.pool.get(volume).name
+
+    def mountpoint(self, volume):
+        """
+        :return: The ``mountpoint`` property of a volume's filesystem.
+        """
+        return b"mountpoint=" + self.pool.get(volume).get_path().path
+
+    def test_clone_local(self):
+        """
+        A locally owned clone is made writeable and given its mountpoint by
+        ``zfs clone`` itself.
+        """
+        clone = self.volume(u"node", MY_VOLUME2)
+        [snapshot, cloning] = self.run_all(
+            self.pool.clone_to(self.local, clone))
+        self.assertEqual(
+            [b"clone", b"-o", self.mountpoint(clone), b"-o", b"readonly=off",
+             self.name(self.local) + b"@" + snapshot[1].split(b"@")[1],
+             self.name(clone)],
+            cloning)
+
+    def test_clone_remote(self):
+        """
+        A remotely owned clone is given its mountpoint by ``zfs clone`` and
+        inherits ``readonly``.
+        """
+        remote = self.volume(u"other", MY_VOLUME)
+        clone = self.volume(u"other", MY_VOLUME2)
+        [snapshot, cloning] = self.run_all(self.pool.clone_to(remote, clone))
+        self.assertEqual(
+            [b"clone", b"-o", self.mountpoint(clone),
+             self.name(remote) + b"@" + snapshot[1].split(b"@")[1],
+             self.name(clone)],
+            cloning)
+
+    def test_change_owner(self):
+        """
+        ``change_owner`` renames the filesystem and then sets ``readonly``
+        and ``mountpoint`` for its new owner.
+        """
+        remote = self.volume(u"other", MY_VOLUME)
+        self.patch(zfs.os, "rmdir", lambda path: None)
+        self.assertEqual(
+            [[b"rename", self.name(self.local), self.name(remote)],
+             [b"inherit", b"readonly", self.name(remote)],
+             [b"set", self.mountpoint(remote), self.name(remote)]],
+            self.run_all(self.pool.change_owner(self.local, remote)))
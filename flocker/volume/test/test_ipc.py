@@ -18,6 +18,8 @@ from ..filesystems.memory import FilesystemStoragePool
 from .._ipc import (
     IRemoteVolumeManager, RemoteVolumeManager, LocalVolumeManager,
     standard_node, SSH_PRIVATE_KEY_PATH)
+from .._compression import available_compressions
+from .._transfer import SynchronousTransfers
 from ..testtools import ServicePair
 from ...common import FakeNode
 from ...common._ipc import ProcessNode
@@ -26,6 +28,23 @@ from ...common._ipc import ProcessNode
 MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
 MY_VOLUME2 = VolumeName(namespace=u"myns", dataset_id=u"myvol2")
 
+# The error ``ProcessNode.get_output`` raises if SSH can't connect.
+SSH_FAILED = IOError("Bad exit", [b"flocker-volume"], 255, b"",
+                     b"ssh: connect to host example.com port 22: "
+                     b"Connection refused\n")
+
+
+def unknown_command(subcommand):
+    """
+    :param bytes subcommand: A ``flocker-volume`` sub-command.
+
+    :return: The error ``ProcessNode.get_output`` raises if
+        ``flocker-volume`` doesn't know the sub-command.
+    """
+    return IOError("Bad exit", [b"flocker-volume", subcommand], 1, b"",
+                   b"Usage: flocker-volume [options]\n"
+                   b"ERROR: Unknown command: " + subcommand + b"\n")
+
 
 def make_iremote_volume_manager(fixture):
     """
@@ -64,6 +83,27 @@ def make_iremote_volume_manager(fixture):
             getting_snapshots.addCallback(got_snapshots)
             return getting_snapshots
 
+        def test_compressions(self):
+            """
+            ``compressions`` returns a ``Deferred`` that fires with the
+            compressions the remote node has installed.
+            """
+            pair = fixture(self)
+            d = pair.remote.compressions()
+            d.addCallback(self.assertEqual, available_compressions())
+            return d
+
+        def test_no_resume_token(self):
+            """
+            ``resume_token`` returns a ``Deferred`` that fires with ``None``
+            if no push of the volume was interrupted.
+            """
+            pair = fixture(self)
+            d = pair.from_service.create(pair.from_service.get(MY_VOLUME))
+            d.addCallback(pair.remote.resume_token)
+            d.addCallback(self.assertIs, None)
+            return d
+
         def test_receive_exceptions_pass_through(self):
             """
             Exceptions raised in the ``receive()`` context manager are not
@@ -355,6 +395,146 @@ class RemoteVolumeManagerTests(TestCase):
                           b"receive", self.volume.node_id.encode("ascii"),
                           b"myns.myvol"])
 
+    def test_receive_compression(self):
+        """
+        Receiving compressed data passes the compression to ``flocker-volume
+        receive``.
+        """
+        node = FakeNode()
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        with remote.receive(self.volume, b"lz4"):
+            pass
+        self.assertEqual(node.remote_command,
+                         [b"flocker-volume", b"--config", b"/path/to/json",
+                          b"receive", b"--compression", b"lz4",
+                          self.volume.node_id.encode("ascii"),
+                          b"myns.myvol"])
+
+    def test_compressions_destination_run(self):
+        """
+        ``RemoteVolumeManager.compressions`` calls ``flocker-volume``
+        remotely with the ``compressions`` sub-command and returns the names
+        it outputs.
+        """
+        node = FakeNode([b"lz4\ngzip\n"])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        compressions = self.successResultOf(remote.compressions())
+        self.assertEqual(
+            ([b"flocker-volume", b"--config", b"/path/to/json",
+              b"compressions"], [b"lz4", b"gzip"]),
+            (node.remote_command, compressions))
+
+    def test_compressions_unsupported(self):
+        """
+        If the remote node has an older version of ``flocker-volume`` which
+        doesn't know the ``compressions`` sub-command,
+        ``RemoteVolumeManager.compressions`` returns no compressions.
+        """
+        node = FakeNode([unknown_command(b"compressions")])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        self.assertEqual([], self.successResultOf(remote.compressions()))
+
+    def test_compressions_failed(self):
+        """
+        If ``flocker-volume compressions`` fails for any other reason, e.g.
+        because the SSH connection failed, the ``Deferred`` returned by
+        ``RemoteVolumeManager.compressions`` fails with the error.
+        """
+        node = FakeNode([SSH_FAILED])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        self.assertIs(
+            SSH_FAILED,
+            self.failureResultOf(remote.compressions(), IOError).value)
+
+    def test_queries_use_transfers(self):
+        """
+        ``RemoteVolumeManager`` runs the commands of queries with the
+        transfers it was given.
+        """
+        class RecordingTransfers(SynchronousTransfers):
+            def __init__(self):
+                self.runs = 0
+
+            def run(self, function, *args, **kwargs):
+                self.runs += 1
+                return SynchronousTransfers.run(
+                    self, function, *args, **kwargs)
+
+        transfers = RecordingTransfers()
+        remote = RemoteVolumeManager(
+            FakeNode([b"", b"", b""]), FilePath(b"/path/to/json"), transfers)
+        self.successResultOf(remote.snapshots(self.volume))
+        self.successResultOf(remote.compressions())
+        self.successResultOf(remote.resume_token(self.volume))
+        self.assertEqual(3, transfers.runs)
+
+    def test_receive_resume(self):
+        """
+        Receiving data that continues an interrupted stream passes
+        ``--resume`` to ``flocker-volume receive``.
+        """
+        node = FakeNode()
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        with remote.receive(self.volume, resume=True):
+            pass
+        self.assertEqual(node.remote_command,
+                         [b"flocker-volume", b"--config", b"/path/to/json",
+                          b"receive", b"--resume",
+                          self.volume.node_id.encode("ascii"),
+                          b"myns.myvol"])
+
+    def test_resume_token_destination_run(self):
+        """
+        ``RemoteVolumeManager.resume_token`` calls ``flocker-volume``
+        remotely with the ``resume_token`` sub-command and returns the token
+        it outputs.
+        """
+        node = FakeNode([b"1-abcdef\n"])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        token = self.successResultOf(remote.resume_token(self.volume))
+        self.assertEqual(
+            ([b"flocker-volume", b"--config", b"/path/to/json",
+              b"resume_token", self.volume.node_id.encode("ascii"),
+              b"myns.myvol"], b"1-abcdef"),
+            (node.remote_command, token))
+
+    def test_no_resume_token_destination_run(self):
+        """
+        If ``flocker-volume resume_token`` outputs nothing there is no
+        token.
+        """
+        remote = RemoteVolumeManager(FakeNode([b""]))
+        self.assertIs(None, self.successResultOf(
+            remote.resume_token(self.volume)))
+
+    def test_resume_token_unsupported(self):
+        """
+        If the remote node has an older version of ``flocker-volume`` which
+        doesn't know the ``resume_token`` sub-command there is no token.
+        """
+        remote = RemoteVolumeManager(
+            FakeNode([unknown_command(b"resume_token")]))
+        self.assertIs(None, self.successResultOf(
+            remote.resume_token(self.volume)))
+
+    def test_resume_token_failed(self):
+        """
+        If ``flocker-volume resume_token`` fails for any other reason the
+        ``Deferred`` returned by ``RemoteVolumeManager.resume_token`` fails
+        with the error.
+        """
+        remote = RemoteVolumeManager(FakeNode([SSH_FAILED]))
+        self.assertIs(
+            SSH_FAILED,
+            self.failureResultOf(
+                remote.resume_token(self.volume), IOError).value)
+
     def test_acquire_destination_run(self):
         """
         ``RemoteVolumeManager.acquire()`` calls ``flocker-volume`` remotely
@@ -383,3 +563,16 @@ class StandardNodeTests(TestCase):
         node = standard_node(b'example.com')
         self.assertEqual(node, ProcessNode.using_ssh(
             b'example.com', 22, b'root', SSH_PRIVATE_KEY_PATH))
+
+    def test_control_masters(self):
+        """
+        If given a ``SSHControlMasterService`` ``standard_node`` uses it to
+        create the node.
+        """
+        class FakeControlMasters(object):
+            def using_ssh(self, *args):
+                return args
+
+        self.assertEqual(
+            (b'example.com', 22, b'root', SSH_PRIVATE_KEY_PATH),
+            standard_node(b'example.com', FakeControlMasters()))
@@ -0,0 +1,164 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.volume._retention``.
+"""
+
+from __future__ import absolute_import
+
+from eliot.testing import LoggedAction, validate_logging, assertHasAction
+
+from twisted.internet.defer import fail, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from ..filesystems.memory import DirectoryFilesystem
+from ..filesystems.zfs import Snapshot
+from ..service import VolumeName
+from ..testtools import create_volume_service
+from .._retention import (
+    DEFAULT_PRUNE_INTERVAL, PRUNE_SNAPSHOTS, SnapshotPruningService,
+)
+
+MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
+MY_VOLUME2 = VolumeName(namespace=u"myns", dataset_id=u"myvol2")
+
+
+class SnapshotPruningServiceTests(SynchronousTestCase):
+    """
+    Tests for ``SnapshotPruningService``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.volume_service = create_volume_service(self)
+        self.pruning = SnapshotPruningService(self.clock, self.volume_service)
+
+    def create(self, name, retained=b"a"):
+        """
+        Create a volume with pretend snapshots ``a``, ``b`` and ``c``, one of
+        which is retained for a peer.
+
+        :param VolumeName name: The name of the volume.
+        :param bytes retained: The name of the retained snapshot.
+
+        :return: The volume's filesystem.
+        """
+        volume = self.successResultOf(
+            self.volume_service.create(self.volume_service.get(name)))
+        filesystem = volume.get_filesystem()
+        for snapshot in (b"a", b"b", b"c"):
+            filesystem.snapshot(snapshot)
+        filesystem.retain_snapshot(u"node2", Snapshot(name=retained))
+        return filesystem
+
+    def snapshots(self, filesystem):
+        """
+        :return: The names of the snapshots of a filesystem.
+        """
+        return [snapshot.name for snapshot in
+                self.successResultOf(filesystem.snapshots())]
+
+    def test_prune(self):
+        """
+        ``prune`` prunes the snapshots of all the volumes.
+        """
+        first = self.create(MY_VOLUME)
+        second = self.create(MY_VOLUME2, retained=b"b")
+        self.successResultOf(self.pruning.prune())
+        self.assertEqual(
+            ([b"a", b"c"], [b"b", b"c"]),
+            (self.snapshots(first), self.snapshots(second)))
+
+    def verify_prune_logging(self, logger):
+        """
+        A ``PRUNE_SNAPSHOTS`` action is logged with the pruned snapshots.
+        """
+        action = assertHasAction(self, logger, PRUNE_SNAPSHOTS, True)
+        self.assertEqual(
+            [Snapshot(name=b"b")], action.endMessage["pruned"])
+
+    @validate_logging(verify_prune_logging)
+    def test_prune_logging(self, logger):
+        """
+        Pruning a volume logs a ``PRUNE_SNAPSHOTS`` action.
+        """
+        self.patch(self.pruning, "logger", logger)
+        self.create(MY_VOLUME)
+        self.successResultOf(self.pruning.prune())
+
+    def verify_prune_failure_logging(self, logger):
+        """
+        The failure to prune a volume is logged as the failure of its
+        ``PRUNE_SNAPSHOTS`` action.
+        """
+        actions = LoggedAction.ofType(logger.messages, PRUNE_SNAPSHOTS)
+        [failed] = [action for action in actions if not action.succeeded]
+        self.assertEqual(
+            (2, u"exceptions.OSError"),
+            (len(actions), failed.endMessage[u"exception"]))
+
+    @validate_logging(verify_prune_failure_logging)
+    def test_prune_failure(self, logger):
+        """
+        If pruning one volume fails the other volumes are still pruned.
+        """
+        self.patch(self.pruning, "logger", logger)
+        first = self.create(MY_VOLUME)
+        second = self.create(MY_VOLUME2)
+        prune_snapshots = DirectoryFilesystem.prune_snapshots
+
+        def prune_one(filesystem):
+            if filesystem == first:
+                return fail(OSError())
+            return prune_snapshots(filesystem)
+        self.patch(DirectoryFilesystem, "prune_snapshots", prune_one)
+        self.successResultOf(self.pruning.prune())
+        self.assertEqual(
+            ([b"a", b"b", b"c"], [b"a", b"c"]),
+            (self.snapshots(first), self.snapshots(second)))
+
+    def test_periodic(self):
+        """
+        Once started, the service prunes the volumes every interval.
+        """
+        filesystem = self.create(MY_VOLUME)
+        self.pruning.startService()
+        self.addCleanup(self.pruning.stopService)
+        self.clock.advance(DEFAULT_PRUNE_INTERVAL - 1)
+        before = self.snapshots(filesystem)
+        self.clock.advance(1)
+        self.assertEqual(
+            ([b"a", b"b", b"c"], [b"a", b"c"]),
+            (before, self.snapshots(filesystem)))
+
+    @validate_logging(None)
+    def test_periodic_failure(self, logger):
+        """
+        If a pass fails the failure is logged and the next pass still
+        happens.
+        """
+        self.patch(self.pruning, "logger", logger)
+        calls = []
+
+        def enumerate():
+            calls.append(None)
+            return fail(OSError())
+        self.patch(self.volume_service, "enumerate", enumerate)
+        self.pruning.startService()
+        self.addCleanup(self.pruning.stopService)
+        self.clock.advance(DEFAULT_PRUNE_INTERVAL)
+        self.clock.advance(DEFAULT_PRUNE_INTERVAL)
+        self.assertEqual(
+            (2, 2), (len(calls), len(logger.flushTracebacks(OSError))))
+
+    def test_stop(self):
+        """
+        Once stopped, the service no longer prunes the volumes.
+        """
+        calls = []
+        self.patch(self.volume_service, "enumerate",
+                   lambda: calls.append(None) or succeed([]))
+        self.pruning.startService()
+        self.pruning.stopService()
+        self.clock.advance(DEFAULT_PRUNE_INTERVAL)
+        self.assertEqual([], calls)
@@ -61,3 +61,48 @@ class StandardVolumeOptionsTests(make_volume_options_tests(VolumeOptions)):
     """
     Tests for ``VolumeService`` specific arguments of ``VolumeOptions``.
     """
+
+
+class ReceiveSubcommandTests(SynchronousTestCase):
+    """
+    Tests for ``flocker-volume receive``.
+    """
+    def receive(self, arguments):
+        """
+        Run ``flocker-volume receive`` with a fake ``VolumeService``.
+
+        :return: The arguments passed to ``VolumeService.receive``.
+        """
+        class FakeVolumeService(object):
+            def receive(self, *args):
+                self.args = args
+
+        service = FakeVolumeService()
+        options = VolumeOptions()
+        options.parseOptions([b"receive"] + arguments + [b"node", b"ns.name"])
+        options.subOptions.run(service)
+        return service.args
+
+    def test_uncompressed(self):
+        """
+        Without ``--compression`` the data is received uncompressed.
+        """
+        self.assertEqual(None, self.receive([])[3])
+
+    def test_compression(self):
+        """
+        ``--compression`` gives the compression the data is received with.
+        """
+        self.assertEqual(b"gzip", self.receive([b"--compression", b"gzip"])[3])
+
+    def test_not_resumed(self):
+        """
+        Without ``--resume`` the data is received as a new stream.
+        """
+        self.assertEqual(False, self.receive([])[4])
+
+    def test_resume(self):
+        """
+        ``--resume`` receives the data as the rest of an interrupted stream.
+        """
+        self.assertEqual(True, self.receive([b"--resume"])[4])
@@ -4,6 +4,7 @@
 
 from __future__ import absolute_import
 
+from errno import ECONNRESET, EPIPE
 from io import BytesIO
 import sys
 import json
@@ -15,21 +16,34 @@ from StringIO import StringIO
 from zope.interface import implementer
 from zope.interface.verify import verifyObject
 
+from eliot.testing import (
+    LoggedMessage, validate_logging, assertHasAction, assertHasMessage,
+)
+
 from twisted.application.service import IService, Service
+from twisted.internet.defer import CancelledError, Deferred, fail, succeed
+from twisted.internet.error import ConnectionLost, ConnectionRefusedError
 from twisted.internet.task import Clock
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath, Permissions
+from twisted.python.procutils import which
 from twisted.trial.unittest import SynchronousTestCase, TestCase
 
 from ..service import (
-    VolumeService, CreateConfigurationError, Volume, VolumeName,
+    _is_transient_push_error, VolumeService, CreateConfigurationError,
+    Volume, VolumeName,
     WAIT_FOR_VOLUME_INTERVAL, VolumeScript, ICommandLineVolumeScript,
-    VolumeSize,
+    VolumeSize, CATALOG_MAXIMUM_AGE,
     )
+from .._model import VolumeUsage
 from ..script import VolumeOptions
 
 from ..filesystems.memory import FilesystemStoragePool
-from ..filesystems.zfs import StoragePool
+from ..filesystems.zfs import Snapshot, StoragePool
 from .._ipc import RemoteVolumeManager, LocalVolumeManager
+from .._transfer import (
+    PUSH_RETRY, PUSH_SEPARATELY, PUSH_VOLUME, RETRY_DELAY, ThreadedTransfers,
+)
 from ..testtools import create_volume_service
 from ...common import FakeNode
 from ...testtools import (
@@ -38,6 +52,115 @@ from ...testtools import (
     )
 
 
+class _InterruptedStream(object):
+    """
+    A file-like object that raises ``IOError`` with ``ECONNRESET`` once its
+    data has been read, as if the connection it was coming over died.
+    """
+    def __init__(self, data):
+        self._data = BytesIO(data)
+
+    def read(self, size=-1):
+        result = self._data.read(size)
+        if not result:
+            raise IOError(ECONNRESET, "Connection reset by peer")
+        return result
+
+
+class InterruptingVolumeManager(LocalVolumeManager):
+    """
+    A ``LocalVolumeManager`` that only receives half of the data of a number
+    of streams before they fail with ``IOError``.
+
+    :ivar list resumes: The ``resume`` argument of each ``receive``.
+    """
+    def __init__(self, service, interruptions):
+        """
+        :param VolumeService service: The service to communicate with.
+        :param int interruptions: The number of streams to interrupt.
+        """
+        LocalVolumeManager.__init__(self, service)
+        self._interruptions = interruptions
+        self.resumes = []
+
+    @contextmanager
+    def receive(self, volume, compression=None, resume=False):
+        self.resumes.append(resume)
+        received = BytesIO()
+        yield received
+        data = received.getvalue()
+        if self._interruptions:
+            self._interruptions -= 1
+            input_file = _InterruptedStream(data[:len(data) // 2])
+        else:
+            input_file = BytesIO(data)
+        self._service.receive(volume.node_id, volume.name, input_file,
+                              compression, resume)
+
+
+class TransientPushErrorTests(SynchronousTestCase):
+    """
+    Tests for ``_is_transient_push_error``.
+    """
+    def assert_transient(self, expected, error):
+        """
+        Assert whether a push failing with an error would be tried again.
+
+        :param bool expected: Whether it should be.
+        :param Exception error: The error.
+        """
+        self.assertEqual(expected, _is_transient_push_error(Failure(error)))
+
+    def test_connection_closed(self):
+        """
+        The connection to the destination being lost is transient.
+        """
+        self.assert_transient(True, ConnectionLost())
+
+    def test_connect_error(self):
+        """
+        Failing to connect to the destination is transient.
+        """
+        self.assert_transient(True, ConnectionRefusedError())
+
+    def test_broken_pipe(self):
+        """
+        A broken pipe or a reset connection is transient.
+        """
+        self.assert_transient(True, IOError(EPIPE, "Broken pipe"))
+        self.assert_transient(True, IOError(ECONNRESET, "Reset"))
+
+    def test_ssh_failed(self):
+        """
+        ``ssh`` itself failing, which it reports with exit status 255, is
+        transient.
+        """
+        self.assert_transient(True, IOError("Bad exit", [b"receive"], 255))
+        self.assert_transient(
+            True, IOError("Bad exit", [b"snapshots"], 255, b""))
+
+    def test_remote_command_failed(self):
+        """
+        The remote command exiting unsuccessfully is not transient.
+        """
+        self.assert_transient(False, IOError("Bad exit", [b"receive"], 1))
+        self.assert_transient(
+            False, IOError("Bad exit", [b"snapshots"], 1, b""))
+
+    def test_other_environment_error(self):
+        """
+        Other environment errors, e.g. a missing compressor, are not
+        transient.
+        """
+        self.assert_transient(False, OSError(2, "No such file"))
+
+    def test_other_error(self):
+        """
+        Errors which are not environment errors are not transient.
+        """
+        self.assert_transient(False, ValueError())
+
+
 class VolumeNameInitializationTests(make_with_init_tests(
         VolumeName, {"namespace": u"x", "dataset_id": u"y"})):
     """
@@ -447,6 +570,61 @@ class VolumeServiceAPITests(TestCase):
 
         self.assertEqual(node.stdin.read(), data)
 
+    def test_push_uses_transfers(self):
+        """
+        The data is copied using the ``run`` method of the ``transfers``
+        object given to ``VolumeService`` and the result of ``push`` fires
+        only once that has finished.
+        """
+        class FakeTransfers(object):
+            def __init__(self):
+                self.calls = []
+
+            def run(self, function, *args, **kwargs):
+                d = Deferred()
+                self.calls.append((d, function, args, kwargs))
+                return d
+
+        transfers = FakeTransfers()
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool,
+                                reactor=Clock(), transfers=transfers)
+        service.startService()
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        node = FakeNode([b""])
+
+        pushing = service.push(volume, RemoteVolumeManager(node))
+        self.assertNoResult(pushing)
+        [(d, function, args, kwargs)] = transfers.calls
+        d.callback(function(*args, **kwargs))
+        self.successResultOf(pushing)
+
+    def verify_push_logging(self, logger):
+        """
+        A successful ``PUSH_VOLUME`` action is logged with the number of bytes
+        that were transferred.
+        """
+        action = assertHasAction(self, logger, PUSH_VOLUME, True)
+        self.assertEqual(
+            len(self.written.getvalue()),
+            action.endMessage["transferred"])
+
+    @validate_logging(verify_push_logging)
+    def test_push_logging(self, logger):
+        """
+        Pushing a volume logs a ``PUSH_VOLUME`` action.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        self.patch(service, "logger", logger)
+        service.startService()
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        volume.get_filesystem().get_path().child(b"foo").setContent(b"blah")
+        node = FakeNode([b""])
+
+        self.successResultOf(service.push(volume, RemoteVolumeManager(node)))
+        self.written = node.stdin
+
     def test_push_with_snapshots(self):
         """
         Pushing a locally-owned volume to a remote volume manager which has a
@@ -483,6 +661,435 @@ class VolumeServiceAPITests(TestCase):
             [b"incremental stream based on", b"stuff"],
             writer.getvalue().splitlines()[-2:])
 
+    def push_snapshots(self, peer):
+        """
+        Push a volume with two pretend snapshots, then take another.
+
+        :param peer: The peer to pass to ``push``.
+
+        :return: The pushed ``Volume``.
+        """
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        filesystem.snapshot(b"a")
+        filesystem.snapshot(b"b")
+        remote = LocalVolumeManager(create_volume_service(self))
+        self.successResultOf(service.push(volume, remote, peer))
+        filesystem.snapshot(b"c")
+        return volume
+
+    def test_push_retains_snapshot(self):
+        """
+        If a peer is given, pushing retains the snapshot the peer now has in
+        common with the volume, so pruning keeps it.
+        """
+        volume = self.push_snapshots(u"node2")
+        self.assertEqual(
+            [Snapshot(name=b"a")],
+            self.successResultOf(volume.get_filesystem().prune_snapshots()))
+
+    def test_push_without_peer(self):
+        """
+        If no peer is given pushing retains no snapshot.
+        """
+        volume = self.push_snapshots(None)
+        self.assertEqual(
+            [],
+            self.successResultOf(volume.get_filesystem().prune_snapshots()))
+
+    def compressed_push(self, remote_compressions):
+        """
+        Push a volume from a service which prefers ``gzip`` compression to a
+        destination supporting some compressions.
+
+        :param list remote_compressions: The compressions the destination
+            supports.
+
+        :return: ``tuple`` of the compressions passed to the destination's
+            ``receive`` and the pushed volume.
+        """
+        if not which(b"gzip"):
+            raise self.skipTest("gzip is not installed.")
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock(),
+                                compressions=[b"lz4", b"gzip"])
+        service.startService()
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        volume.get_filesystem().get_path().child(b"file").setContent(
+            b"hello" * 10000)
+
+        to_service = create_volume_service(self)
+        remote = LocalVolumeManager(to_service)
+        compressions = []
+        receive = remote.receive
+
+        def recording_receive(volume, compression=None):
+            compressions.append(compression)
+            return receive(volume, compression)
+        remote.receive = recording_receive
+        remote.compressions = lambda: succeed(remote_compressions)
+
+        self.successResultOf(service.push(volume, remote))
+        pushed = Volume(node_id=service.node_id, name=MY_VOLUME,
+                        service=to_service)
+        return compressions, pushed
+
+    def test_push_compressed(self):
+        """
+        Pushing uses the first preferred compression the destination
+        supports, and the data arrives intact.
+        """
+        compressions, pushed = self.compressed_push([b"gzip"])
+        self.assertEqual(
+            ([b"gzip"], b"hello" * 10000),
+            (compressions, pushed.get_filesystem().get_path().child(
+                b"file").getContent()))
+
+    def test_push_no_common_compression(self):
+        """
+        If the destination supports none of the preferred compressions the
+        data is pushed uncompressed.
+        """
+        compressions, pushed = self.compressed_push([b"bzip9"])
+        self.assertEqual(
+            ([None], b"hello" * 10000),
+            (compressions, pushed.get_filesystem().get_path().child(
+                b"file").getContent()))
+
+    def interrupted_push(self, interruptions, push_attempts=3):
+        """
+        Start pushing a volume to a destination whose streams are interrupted
+        part way through a number of times.
+
+        :param int interruptions: The number of streams to interrupt.
+        :param int push_attempts: The number of attempts the pushing service
+            makes.
+
+        :return: ``tuple`` of the ``Clock`` used by the pushing service, the
+            ``Deferred`` result of ``push``, the destination and the volume
+            as the destination sees it.
+        """
+        clock = Clock()
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=clock,
+                                push_attempts=push_attempts)
+        service.startService()
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        volume.get_filesystem().get_path().child(b"file").setContent(
+            b"hello" * 10000)
+        to_service = create_volume_service(self)
+        remote = InterruptingVolumeManager(to_service, interruptions)
+        pushing = service.push(volume, remote)
+        pushed = Volume(node_id=service.node_id, name=MY_VOLUME,
+                        service=to_service)
+        return clock, pushing, remote, pushed
+
+    def test_push_retry_resumes(self):
+        """
+        If a push is interrupted it is tried again after a delay, resuming
+        the interrupted stream.
+        """
+        clock, pushing, remote, pushed = self.interrupted_push(1)
+        self.assertNoResult(pushing)
+        clock.advance(RETRY_DELAY)
+        self.successResultOf(pushing)
+        self.assertEqual(
+            ([False, True], b"hello" * 10000),
+            (remote.resumes, pushed.get_filesystem().get_path().child(
+                b"file").getContent()))
+
+    def test_push_retry_backoff(self):
+        """
+        The delay before each further retry of a push is twice the previous
+        one.
+        """
+        clock, pushing, remote, pushed = self.interrupted_push(2)
+        clock.advance(RETRY_DELAY)
+        clock.advance(RETRY_DELAY * 2 - 0.1)
+        self.assertNoResult(pushing)
+        clock.advance(0.1)
+        self.successResultOf(pushing)
+        self.assertEqual([False, True, True], remote.resumes)
+
+    def verify_push_retry_logging(self, logger):
+        """
+        A ``PUSH_RETRY`` message is logged for the interrupted attempt.
+        """
+        message = assertHasMessage(self, logger, PUSH_RETRY, dict(
+            attempt=1, delay=RETRY_DELAY))
+        self.assertTrue(message.message["reason"].check(IOError))
+
+    @validate_logging(verify_push_retry_logging)
+    def test_push_retry_logging(self, logger):
+        """
+        Retrying a push logs a ``PUSH_RETRY`` message.
+        """
+        self.patch(VolumeService, "logger", logger)
+        clock, pushing, remote, pushed = self.interrupted_push(1)
+        clock.advance(RETRY_DELAY)
+        self.successResultOf(pushing)
+
+    def test_push_retry_resume_token_failed(self):
+        """
+        If getting the destination's resume token fails because of the
+        connection the attempt is tried again.
+        """
+        clock, pushing, remote, pushed = self.interrupted_push(1)
+        failures = [IOError("Bad exit", [b"flocker-volume"], 255, b"",
+                            b"ssh: connect to host example.com port 22: "
+                            b"Connection refused\n")]
+        resume_token = remote.resume_token
+
+        def failing_resume_token(volume):
+            if failures:
+                return fail(failures.pop())
+            return resume_token(volume)
+        remote.resume_token = failing_resume_token
+        clock.advance(RETRY_DELAY)
+        self.assertNoResult(pushing)
+        clock.advance(RETRY_DELAY * 2)
+        self.successResultOf(pushing)
+        self.assertEqual([False, True], remote.resumes)
+
+    def test_push_gives_up(self):
+        """
+        If every attempt at a push is interrupted the result of ``push``
+        fails with the error of the last one.
+        """
+        clock, pushing, remote, pushed = self.interrupted_push(
+            3, push_attempts=2)
+        clock.advance(RETRY_DELAY)
+        self.failureResultOf(pushing, IOError)
+        self.assertEqual([False, True], remote.resumes)
+
+    def test_push_no_retry_on_other_errors(self):
+        """
+        A push failing with an error that is not caused by the connection or
+        the environment is not tried again.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        service.startService()
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        remote = LocalVolumeManager(create_volume_service(self))
+        receives = []
+
+        @contextmanager
+        def receive(volume, **kwargs):
+            receives.append(kwargs)
+            raise ValueError()
+            yield
+        remote.receive = receive
+
+        self.failureResultOf(service.push(volume, remote), ValueError)
+        self.assertEqual(1, len(receives))
+
+    def test_push_no_retry_on_remote_failure(self):
+        """
+        A push failing because the remote command exited unsuccessfully is
+        not tried again.
+        """
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        remote = LocalVolumeManager(create_volume_service(self))
+        receives = []
+
+        @contextmanager
+        def receive(volume, **kwargs):
+            receives.append(kwargs)
+            yield BytesIO()
+            raise IOError("Bad exit", [b"flocker-volume", b"receive"], 1)
+        remote.receive = receive
+
+        self.failureResultOf(service.push(volume, remote), IOError)
+        self.assertEqual(1, len(receives))
+
+    def push_many(self, destinations, snapshots=()):
+        """
+        Push a volume with a file in it to several destinations, counting
+        how many times its data is read.
+
+        :param list destinations: Functions which will be called with a
+            ``VolumeService`` to receive the volume and return
+            ``(destination, peer)`` for ``push_many``.
+        :param snapshots: The names of pretend snapshots to take of the
+            volume before pushing it.
+
+        :return: ``tuple`` of the result of ``push_many``, the pushed
+            ``Volume``, the ``list`` of ``remote_snapshots`` the data was
+            read with each time and the volume as each receiving service
+            sees it.
+        """
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        filesystem.get_path().child(b"file").setContent(b"hello" * 10000)
+        for name in snapshots:
+            filesystem.snapshot(name)
+        reads = []
+        reader = filesystem.reader
+
+        def counting_reader(remote_snapshots=None, **kwargs):
+            reads.append(remote_snapshots)
+            return reader(remote_snapshots, **kwargs)
+        self.patch(volume, "get_filesystem", lambda: filesystem)
+        filesystem.reader = counting_reader
+
+        to_services = [create_volume_service(self) for _ in destinations]
+        pushing = service.push_many(volume, [
+            make(to_service)
+            for make, to_service in zip(destinations, to_services)])
+        pushed = [Volume(node_id=service.node_id, name=MY_VOLUME,
+                         service=to_service) for to_service in to_services]
+        return pushing, volume, reads, pushed
+
+    def assert_pushed(self, pushed):
+        """
+        Assert that the data of the volume pushed by ``push_many`` reached
+        each of the given volumes.
+
+        :param list pushed: ``Volume`` instances on the destinations.
+        """
+        self.assertEqual(
+            [b"hello" * 10000] * len(pushed),
+            [volume.get_filesystem().get_path().child(b"file").getContent()
+             for volume in pushed])
+
+    def test_push_many_different_node_id(self):
+        """
+        Pushing a remotely-owned volume to many destinations results in a
+        ``ValueError``.
+        """
+        service = create_volume_service(self)
+        volume = Volume(node_id=u"wronguuid", name=MY_VOLUME, service=service)
+        self.assertRaises(
+            ValueError, service.push_many, volume,
+            [(LocalVolumeManager(create_volume_service(self)), None)])
+
+    def test_push_many_reads_once(self):
+        """
+        Destinations which need the same stream are all sent the data of one
+        read of the filesystem.
+        """
+        pushing, volume, reads, pushed = self.push_many([
+            lambda to_service: (LocalVolumeManager(to_service), None),
+            lambda to_service: (LocalVolumeManager(to_service), None),
+            lambda to_service: (LocalVolumeManager(to_service), None),
+        ])
+        self.successResultOf(pushing)
+        self.assertEqual([[]], reads)
+        self.assert_pushed(pushed)
+
+    def test_push_many_groups_by_snapshot(self):
+        """
+        Destinations which have different snapshots in common with the
+        volume are sent different streams, each based on the latest
+        snapshot in common.
+        """
+        def without_snapshots(to_service):
+            destination = LocalVolumeManager(to_service)
+            destination.snapshots = lambda volume: succeed([])
+            return destination, None
+        pushing, volume, reads, pushed = self.push_many([
+            lambda to_service: (LocalVolumeManager(to_service), None),
+            without_snapshots,
+            lambda to_service: (LocalVolumeManager(to_service), None),
+        ], snapshots=[b"stuff"])
+        self.successResultOf(pushing)
+        self.assertEqual(
+            sorted([[], [Snapshot(name=b"stuff")]]), sorted(reads))
+
+    def test_push_many_failed_destination(self):
+        """
+        If one destination fails to receive the shared stream the others
+        still receive it, and the failed one is pushed to on its own.
+        """
+        interrupting = []
+
+        def interrupted(to_service):
+            interrupting.append(InterruptingVolumeManager(to_service, 1))
+            return interrupting[-1], None
+        pushing, volume, reads, pushed = self.push_many([
+            lambda to_service: (LocalVolumeManager(to_service), None),
+            interrupted,
+        ])
+        self.successResultOf(pushing)
+        self.assertEqual(
+            ([[], []], [False, False]),
+            (reads, interrupting[0].resumes))
+        self.assert_pushed(pushed)
+
+    def verify_push_separately_logging(self, logger):
+        """
+        A ``PUSH_SEPARATELY`` message is logged with the error the failed
+        destination received the shared stream with.
+        """
+        [message] = LoggedMessage.ofType(logger.messages, PUSH_SEPARATELY)
+        self.assertTrue(message.message["reason"].check(IOError))
+
+    @validate_logging(verify_push_separately_logging)
+    def test_push_many_failed_destination_logging(self, logger):
+        """
+        Falling back to pushing to a destination on its own logs a
+        ``PUSH_SEPARATELY`` message.
+        """
+        self.patch(VolumeService, "logger", logger)
+        pushing, volume, reads, pushed = self.push_many([
+            lambda to_service: (LocalVolumeManager(to_service), None),
+            lambda to_service: (
+                InterruptingVolumeManager(to_service, 1), None),
+        ])
+        self.successResultOf(pushing)
+
+    def test_push_many_failure(self):
+        """
+        If pushing to a destination on its own fails too, the result of
+        ``push_many`` fails with that error once the other destinations
+        have been pushed to.
+        """
+        def broken(to_service):
+            destination = LocalVolumeManager(to_service)
+
+            @contextmanager
+            def receive(volume, **kwargs):
+                raise ValueError()
+                yield
+            destination.receive = receive
+            return destination, None
+        pushing, volume, reads, pushed = self.push_many([
+            lambda to_service: (LocalVolumeManager(to_service), None),
+            broken,
+        ])
+        self.failureResultOf(pushing, ValueError)
+        self.assert_pushed(pushed[:1])
+
+    def test_push_many_retains_snapshot(self):
+        """
+        The snapshot sent by the shared stream is retained for each
+        destination's peer.
+        """
+        pushing, volume, reads, pushed = self.push_many([
+            lambda to_service: (LocalVolumeManager(to_service), u"node2"),
+            lambda to_service: (LocalVolumeManager(to_service), u"node3"),
+        ], snapshots=[b"stuff"])
+        self.successResultOf(pushing)
+        filesystem = volume.get_filesystem()
+        filesystem.snapshot(b"newer")
+        filesystem.snapshot(b"newest")
+        self.assertEqual(
+            [Snapshot(name=b"newer")],
+            self.successResultOf(filesystem.prune_snapshots()))
+
+    def test_receive_unknown_compression(self):
+        """
+        Receiving data compressed with an unsupported compression raises
+        ``ValueError``.
+        """
+        service = create_volume_service(self)
+        self.assertRaises(ValueError, service.receive, u"other",
+                          MY_VOLUME, BytesIO(), b"nope")
+
     def test_receive_local_node_id(self):
         """
         If a volume with the same node ID as the service is received,
@@ -540,6 +1147,37 @@ class VolumeServiceAPITests(TestCase):
         root = new_volume.get_filesystem().get_path()
         self.assertTrue(root.child(b"afile").getContent(), b"lalala")
 
+    def test_receiver_local_node_id(self):
+        """
+        If a volume with the same node ID as the service is to be received,
+        ``receiver`` returns a ``Deferred`` that fails with ``ValueError``.
+        """
+        service = create_volume_service(self)
+        self.failureResultOf(
+            service.receiver(service.node_id, MY_VOLUME), ValueError)
+
+    def test_receiver_creates_files(self):
+        """
+        Data written to the receiver returned by ``receiver`` populates the
+        volume's filesystem once it is finished.
+        """
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        filesystem.get_path().child(b"afile").setContent(b"lalala")
+
+        manager_node_id = unicode(uuid4())
+        receiver = self.successResultOf(
+            service.receiver(manager_node_id, MY_VOLUME))
+        with filesystem.reader() as reader:
+            receiver.write(reader.read())
+        self.successResultOf(receiver.finish())
+
+        new_volume = Volume(node_id=manager_node_id, name=MY_VOLUME,
+                            service=service)
+        root = new_volume.get_filesystem().get_path()
+        self.assertEqual(b"lalala", root.child(b"afile").getContent())
+
     def test_enumerate_no_volumes(self):
         """``enumerate()`` returns no volumes when there are no volumes."""
         pool = FilesystemStoragePool(FilePath(self.mktemp()))
@@ -571,6 +1209,21 @@ class VolumeServiceAPITests(TestCase):
                 (volume.node_id, volume.size, volume.name) for volume in actual
             ))
 
+    def test_enumerate_with_usage(self):
+        """
+        ``enumerate()`` includes the ``VolumeUsage`` of each filesystem in
+        the usage attribute of the volumes.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        service.startService()
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        volume.get_filesystem().get_path().child(b"file").setContent(b"x" * 7)
+        [filesystem] = self.successResultOf(pool.enumerate())
+        [enumerated] = self.successResultOf(service.enumerate())
+        self.assertEqual(
+            (7, filesystem.usage), (enumerated.usage.used, enumerated.usage))
+
     def test_enumerate_some_volumes(self):
         """``enumerate()`` returns all volumes previously ``create()``ed."""
         pool = FilesystemStoragePool(FilePath(self.mktemp()))
@@ -680,6 +1333,46 @@ class VolumeServiceAPITests(TestCase):
         created.addCallback(handed_off)
         return created
 
+    def test_handoff_deferred_acquire(self):
+        """
+        ``VolumeService.handoff()`` waits for the result of the
+        destination's ``acquire`` if it returns a ``Deferred``.
+        """
+        origin_service = create_volume_service(self)
+        destination_service = create_volume_service(self)
+        destination = LocalVolumeManager(destination_service)
+        acquiring = Deferred()
+        self.patch(destination, "acquire", lambda volume: acquiring)
+
+        volume = self.successResultOf(
+            origin_service.create(origin_service.get(MY_VOLUME)))
+        handing_off = origin_service.handoff(volume, destination)
+        self.assertNoResult(handing_off)
+        acquiring.callback(destination_service.node_id)
+        self.assertEqual(
+            destination_service.node_id,
+            self.successResultOf(handing_off).node_id)
+
+    def test_handoff_retains_snapshot(self):
+        """
+        ``VolumeService.handoff()`` passes the peer to ``push``, so the
+        snapshot the new owner has in common with the volume is retained.
+        """
+        origin_service = create_volume_service(self)
+        destination_service = create_volume_service(self)
+        volume = self.successResultOf(
+            origin_service.create(origin_service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        filesystem.snapshot(b"a")
+        filesystem.snapshot(b"b")
+        handed_off = self.successResultOf(origin_service.handoff(
+            volume, LocalVolumeManager(destination_service), u"node2"))
+        filesystem = handed_off.get_filesystem()
+        filesystem.snapshot(b"c")
+        self.assertEqual(
+            [Snapshot(name=b"a")],
+            self.successResultOf(filesystem.prune_snapshots()))
+
     def test_handoff_changes_node_id(self):
         """
         ```VolumeService.handoff()`` changes the owner node ID of the local
@@ -766,6 +1459,18 @@ class VolumeTests(TestCase):
             node_id=u"123", name=MY_VOLUME, service=service, size=self.size)
         assert_equal_comparison(self, v1, v2)
 
+    def test_equality_ignores_usage(self):
+        """
+        Volumes which differ only in their usage are equal.
+        """
+        service = object()
+        v1 = Volume(
+            node_id=u"123", name=MY_VOLUME, service=service, size=self.size,
+            usage=VolumeUsage(used=1, available=2, compression_ratio=1.0))
+        v2 = Volume(
+            node_id=u"123", name=MY_VOLUME, service=service, size=self.size)
+        assert_equal_comparison(self, v1, v2)
+
     def test_inequality_node_id(self):
         """
         Volumes are unequal if they have different node_ids.
@@ -982,6 +1687,289 @@ class WaitForVolumeTests(TestCase):
 
         self.assertNoResult(self.service.wait_for_volume(MY_VOLUME))
 
+    def count_enumerations(self):
+        """
+        Count the calls to the pool's ``enumerate``.
+
+        :return: A ``list`` to which ``None`` is appended for every call.
+        """
+        calls = []
+        enumerate = self.pool.enumerate
+
+        def counting_enumerate():
+            calls.append(None)
+            return enumerate()
+        self.patch(self.pool, "enumerate", counting_enumerate)
+        return calls
+
+    def test_shared_poll(self):
+        """
+        All the waiters share one poll of the storage pool per
+        ``WAIT_FOR_VOLUME_INTERVAL``.
+        """
+        calls = self.count_enumerations()
+        waits = [self.service.wait_for_volume(MY_VOLUME),
+                 self.service.wait_for_volume(MY_VOLUME2),
+                 self.service.wait_for_volume(MY_VOLUME2)]
+        self.clock.advance(WAIT_FOR_VOLUME_INTERVAL)
+        for wait in waits:
+            self.assertNoResult(wait)
+        self.assertEqual(2, len(calls))
+
+    def test_created_notifies(self):
+        """
+        A volume created by the service is noticed immediately, without
+        waiting for the next poll.
+        """
+        wait = self.service.wait_for_volume(MY_VOLUME)
+        volume = self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        self.assertEqual(volume, self.successResultOf(wait))
+
+    def test_cloned_notifies(self):
+        """
+        A volume cloned by the service is noticed immediately.
+        """
+        parent = self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        wait = self.service.wait_for_volume(MY_VOLUME2)
+        volume = self.successResultOf(
+            self.service.clone_to(parent, MY_VOLUME2))
+        self.assertEqual(volume, self.successResultOf(wait))
+
+    def test_acquired_notifies(self):
+        """
+        A volume acquired by the service is noticed immediately.
+        """
+        remote_volume = Volume(node_id=unicode(uuid4()), name=MY_VOLUME,
+                               service=self.service)
+        self.successResultOf(self.pool.create(remote_volume))
+        wait = self.service.wait_for_volume(MY_VOLUME)
+        self.successResultOf(
+            self.service.acquire(remote_volume.node_id, MY_VOLUME))
+        self.assertEqual(self.service.get(MY_VOLUME),
+                         self.successResultOf(wait))
+
+    def test_polling_stops(self):
+        """
+        Once nothing is waiting for a volume the storage pool is no longer
+        polled.
+        """
+        self.service.wait_for_volume(MY_VOLUME)
+        self.successResultOf(self.service.create(self.service.get(MY_VOLUME)))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_cancel(self):
+        """
+        Cancelling the ``Deferred`` returned by
+        ``VolumeService.wait_for_volume`` stops the wait, and the polling if
+        nothing else is waiting.
+        """
+        wait = self.service.wait_for_volume(MY_VOLUME)
+        wait.cancel()
+        self.failureResultOf(wait, CancelledError)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_enumerate_failure(self):
+        """
+        If the storage pool can't be enumerated, the waiters fail.
+        """
+        self.patch(self.pool, "enumerate", lambda: fail(ZeroDivisionError()))
+        waits = [self.service.wait_for_volume(MY_VOLUME),
+                 self.service.wait_for_volume(MY_VOLUME2)]
+        for wait in waits:
+            self.failureResultOf(wait, ZeroDivisionError)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
+class VolumesForDatasetTests(TestCase):
+    """
+    Tests for ``VolumeService.volumes_for_dataset`` and the catalog of
+    volumes it uses.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        self.service = VolumeService(FilePath(self.mktemp()), self.pool,
+                                     reactor=self.clock)
+        self.service.startService()
+        self.enumerations = []
+        enumerate = self.pool.enumerate
+
+        def counting_enumerate():
+            self.enumerations.append(None)
+            return enumerate()
+        self.patch(self.pool, "enumerate", counting_enumerate)
+
+    def volumes(self, dataset_id=MY_VOLUME.dataset_id):
+        """
+        :return: The volumes of a dataset according to
+            ``volumes_for_dataset``.
+        """
+        return self.successResultOf(
+            self.service.volumes_for_dataset(dataset_id))
+
+    def test_enumerates_first(self):
+        """
+        The first lookup enumerates the storage pool and returns only the
+        volumes of the dataset.
+        """
+        volume = self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME2)))
+        self.assertEqual(([volume], 1), (self.volumes(),
+                                         len(self.enumerations)))
+
+    def test_cached(self):
+        """
+        Later lookups are answered without enumerating the storage pool.
+        """
+        self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        self.volumes()
+        self.volumes()
+        self.volumes(MY_VOLUME2.dataset_id)
+        self.assertEqual(1, len(self.enumerations))
+
+    def test_created(self):
+        """
+        Volumes created and cloned by the service are added to the catalog.
+        """
+        self.volumes()
+        volume = self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        clone = self.successResultOf(self.service.clone_to(volume, MY_VOLUME2))
+        self.assertEqual(
+            ([volume], [clone], 1),
+            (self.volumes(), self.volumes(MY_VOLUME2.dataset_id),
+             len(self.enumerations)))
+
+    def test_destroyed(self):
+        """
+        Volumes destroyed with ``VolumeService.destroy_many`` are removed
+        from the catalog.
+        """
+        volume = self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        self.volumes()
+        self.successResultOf(self.service.destroy_many([volume]))
+        self.assertEqual(([], 1), (self.volumes(), len(self.enumerations)))
+
+    def test_acquired(self):
+        """
+        When a volume is acquired the catalog has the new owner's volume
+        instead of the old one.
+        """
+        remote = Volume(node_id=u"other", name=MY_VOLUME,
+                        service=self.service)
+        self.successResultOf(self.pool.create(remote))
+        self.volumes()
+        self.successResultOf(self.service.acquire(u"other", MY_VOLUME))
+        self.assertEqual(
+            ([self.service.get(MY_VOLUME)], 1),
+            (self.volumes(), len(self.enumerations)))
+
+    def test_reconciled(self):
+        """
+        Once the catalog is older than ``CATALOG_MAXIMUM_AGE`` the next
+        lookup enumerates the storage pool again, finding volumes created
+        other than through the service.
+        """
+        self.volumes()
+        volume = self.service.get(MY_VOLUME)
+        self.successResultOf(self.pool.create(volume))
+        self.clock.advance(CATALOG_MAXIMUM_AGE)
+        self.assertEqual(([volume], 2), (self.volumes(),
+                                         len(self.enumerations)))
+
+    def test_received(self):
+        """
+        Receiving a volume causes the next lookup to enumerate the storage
+        pool.
+        """
+        volume = self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        data = BytesIO()
+        with volume.get_filesystem().reader() as reader:
+            data.write(reader.read())
+        data.seek(0)
+        self.volumes()
+        self.service.receive(u"other", MY_VOLUME, data)
+        self.volumes()
+        self.assertEqual(2, len(self.enumerations))
+
+    def test_changed_while_enumerating(self):
+        """
+        If the service changes a volume while the storage pool is being
+        enumerated, the result of that enumeration isn't used as the
+        catalog.
+        """
+        enumerating = Deferred()
+        self.patch(self.pool, "enumerate", lambda: enumerating)
+        d = self.service.enumerate()
+        self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        enumerating.callback([])
+        self.successResultOf(d)
+        self.patch(self.pool, "enumerate", lambda: succeed(
+            [self.service.get(MY_VOLUME).get_filesystem()]))
+        self.assertEqual([self.service.get(MY_VOLUME)], self.volumes())
+
+    def test_received_with_receiver(self):
+        """
+        Finishing or aborting a receive started with ``receiver`` causes the
+        next lookup to enumerate the storage pool.
+        """
+        self.volumes()
+        for end in ["finish", "abort"]:
+            receiver = self.successResultOf(
+                self.service.receiver(unicode(uuid4()), MY_VOLUME))
+            self.successResultOf(getattr(receiver, end)())
+            self.volumes()
+        self.assertEqual(3, len(self.enumerations))
+
+    def test_received_while_enumerating(self):
+        """
+        If a volume is received while the storage pool is being enumerated,
+        the result of that enumeration isn't used as the catalog.
+        """
+        other = unicode(uuid4())
+        volume = self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        data = BytesIO()
+        with volume.get_filesystem().reader() as reader:
+            data.write(reader.read())
+        data.seek(0)
+        enumerate = self.pool.enumerate
+        enumerating = Deferred()
+        self.patch(self.pool, "enumerate", lambda: enumerating)
+        d = self.service.enumerate()
+        self.service.receive(other, MY_VOLUME, data)
+        enumerating.callback([volume.get_filesystem()])
+        self.successResultOf(d)
+        self.patch(self.pool, "enumerate", enumerate)
+        self.assertItemsEqual(
+            [(self.service.node_id, MY_VOLUME), (other, MY_VOLUME)],
+            [(found.node_id, found.name) for found in self.volumes()])
+
+    def test_parsed_basenames_pruned(self):
+        """
+        Enumerating the storage pool only remembers how the basenames of the
+        filesystems currently in it were parsed.
+        """
+        volume = self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME)))
+        self.successResultOf(
+            self.service.create(self.service.get(MY_VOLUME2)))
+        self.successResultOf(self.service.enumerate())
+        self.successResultOf(self.service.destroy_many([volume]))
+        self.successResultOf(self.service.enumerate())
+        self.assertEqual(
+            [self.service.get(MY_VOLUME2).get_filesystem().get_path(
+            ).basename()],
+            self.service._parsed_basenames.keys())
+
 
 class VolumeScriptCreateVolumeServiceTests(SynchronousTestCase):
     """
@@ -1072,7 +2060,9 @@ class VolumeScriptCreateVolumeServiceTests(SynchronousTestCase):
         script = VolumeScript(object())
         self.patch(
             VolumeScript, "_service_factory",
-            staticmethod(lambda config_path, pool, reactor: expected))
+            staticmethod(
+                lambda config_path, pool, reactor, transfers, compressions,
+                chunk_size: expected))
 
         options = VolumeOptions()
         options.parseOptions([])
@@ -1080,6 +2070,42 @@ class VolumeScriptCreateVolumeServiceTests(SynchronousTestCase):
             object(), object(), options)
         self.assertIs(expected, service)
 
+    def test_threaded_transfers(self):
+        """
+        ``VolumeScript._create_volume_service`` gives the ``VolumeService`` a
+        ``ThreadedTransfers`` so that pushes do not block the reactor.
+        """
+        created = []
+        script = VolumeScript(object())
+        self.patch(
+            VolumeScript, "_service_factory",
+            staticmethod(lambda config_path, pool, reactor, transfers,
+                         **kwargs: created.append(transfers) or Service()))
+
+        options = VolumeOptions()
+        options.parseOptions([])
+        script._create_volume_service(object(), object(), options)
+        self.assertIsInstance(created[0], ThreadedTransfers)
+
+    def test_compression_options(self):
+        """
+        ``VolumeScript._create_volume_service`` passes the ``--compression``
+        and ``--buffer-size`` options to the ``VolumeService``.
+        """
+        created = []
+        script = VolumeScript(object())
+        self.patch(
+            VolumeScript, "_service_factory",
+            staticmethod(lambda compressions, chunk_size, **kwargs:
+                         created.append((compressions, chunk_size))
+                         or Service()))
+
+        options = VolumeOptions()
+        options.parseOptions([b"--compression", b"lz4,gzip",
+                              b"--buffer-size", b"65536"])
+        script._create_volume_service(object(), object(), options)
+        self.assertEqual([([b"lz4", b"gzip"], 65536)], created)
+
 
 class VolumeScriptMainTests(SynchronousTestCase):
     """
@@ -0,0 +1,286 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.volume._transfer``.
+"""
+
+from io import BytesIO
+from threading import Event, current_thread
+
+from eliot.testing import validate_logging, assertHasMessage
+
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults
+from twisted.internet.task import deferLater
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from .._transfer import (
+    PROGRESS_INTERVAL, PUSH_PROGRESS, SynchronousTransfers, TeeWriter,
+    ThreadedTransfers, TransferProgress, copy_stream,
+)
+
+
+class CopyStreamTests(SynchronousTestCase):
+    """
+    Tests for ``copy_stream``.
+    """
+    def test_copy(self):
+        """
+        All the data from the source is written to the destination and the
+        number of bytes copied is returned.
+        """
+        data = b"0123456789" * 100
+        destination = BytesIO()
+        copied = copy_stream(BytesIO(data), destination, chunk_size=64)
+        self.assertEqual((data, len(data)), (destination.getvalue(), copied))
+
+    def test_read_only(self):
+        """
+        Sources which do not support ``readinto`` are copied using ``read``.
+        """
+        class Source(object):
+            def __init__(self, data):
+                self._data = BytesIO(data)
+
+            def read(self, size):
+                return self._data.read(size)
+
+        destination = BytesIO()
+        copy_stream(Source(b"hello world"), destination, chunk_size=4)
+        self.assertEqual(b"hello world", destination.getvalue())
+
+    def test_progress(self):
+        """
+        The progress callable is called with the total number of bytes
+        copied after each chunk.
+        """
+        progress = []
+        copy_stream(BytesIO(b"x" * 10), BytesIO(), progress.append,
+                    chunk_size=4)
+        self.assertEqual([4, 8, 10], progress)
+
+
+class _BrokenWriter(object):
+    """
+    A file-like object whose ``write`` always fails.
+    """
+    def write(self, data):
+        raise IOError("Connection lost")
+
+
+class _BlockedWriter(object):
+    """
+    A file-like object whose ``write`` blocks until it is unblocked, or
+    for at most ten seconds.
+
+    :ivar Event unblocked: Set to let writes finish.
+    """
+    def __init__(self):
+        self.unblocked = Event()
+        self.written = BytesIO()
+
+    def write(self, data):
+        self.unblocked.wait(10)
+        self.written.write(data)
+
+
+class _NotifyingWriter(object):
+    """
+    A file-like object which sets an ``Event`` once some data has been
+    written to it.
+    """
+    def __init__(self):
+        self.wrote = Event()
+        self.written = BytesIO()
+
+    def write(self, data):
+        self.written.write(data)
+        self.wrote.set()
+
+
+class TeeWriterTests(SynchronousTestCase):
+    """
+    Tests for ``TeeWriter``.
+    """
+    def test_write(self):
+        """
+        Data written is written to every destination by the time ``close``
+        returns.
+        """
+        first, second = BytesIO(), BytesIO()
+        tee = TeeWriter({1: first, 2: second}, lambda *args: None)
+        tee.write(b"abc")
+        tee.write(b"def")
+        tee.close()
+        self.assertEqual(
+            (b"abcdef", b"abcdef"), (first.getvalue(), second.getvalue()))
+
+    def test_copied(self):
+        """
+        The data is copied, so a buffer which is reused once ``write``
+        returns is written as it was.
+        """
+        destination = BytesIO()
+        tee = TeeWriter({1: destination}, lambda *args: None)
+        buffer = bytearray(b"abc")
+        tee.write(memoryview(buffer))
+        buffer[:] = b"def"
+        tee.close()
+        self.assertEqual(b"abc", destination.getvalue())
+
+    def test_concurrent(self):
+        """
+        A destination whose ``write`` blocks does not stop the others being
+        written to.
+        """
+        blocked, working = _BlockedWriter(), _NotifyingWriter()
+        tee = TeeWriter({1: blocked, 2: working}, lambda *args: None)
+        tee.write(b"abc")
+        working.wrote.wait(10)
+        blocked_written = blocked.written.getvalue()
+        blocked.unblocked.set()
+        tee.close()
+        self.assertEqual(
+            (b"", b"abc", b"abc"),
+            (blocked_written, working.written.getvalue(),
+             blocked.written.getvalue()))
+
+    def test_failed_destination(self):
+        """
+        A destination whose ``write`` fails is dropped and reported with
+        its error, and the others continue to be written to.
+        """
+        working = BytesIO()
+        failures = []
+        destinations = {1: working, 2: _BrokenWriter()}
+        tee = TeeWriter(
+            destinations,
+            lambda key, exc_info: failures.append((key, exc_info[0])))
+        tee.write(b"abc")
+        tee.write(b"def")
+        tee.close()
+        self.assertEqual(
+            (b"abcdef", [(2, IOError)], [1]),
+            (working.getvalue(), failures, destinations.keys()))
+
+    def test_all_failed(self):
+        """
+        Once every destination has failed ``close``, or a ``write`` which
+        finds out, raises ``IOError``.
+        """
+        tee = TeeWriter({1: _BrokenWriter()}, lambda *args: None)
+        try:
+            # The destination fails in its own thread, so this may or may
+            # not have found out yet.
+            tee.write(b"abc")
+        except IOError:
+            pass
+        self.assertRaises(IOError, tee.close)
+
+
+class TransferProgressTests(SynchronousTestCase):
+    """
+    Tests for ``TransferProgress``.
+    """
+    def setUp(self):
+        self.now = 1000.0
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def verify_too_soon(self, logger):
+        self.assertEqual([], logger.messages)
+
+    @validate_logging(verify_too_soon)
+    def test_too_soon(self, logger):
+        """
+        Nothing is logged if less than ``PROGRESS_INTERVAL`` has passed since
+        the transfer started.
+        """
+        progress = TransferProgress(logger, now=lambda: self.now)
+        self.advance(PROGRESS_INTERVAL - 1)
+        progress(100)
+
+    def verify_rate_and_eta(self, logger):
+        assertHasMessage(self, logger, PUSH_PROGRESS, dict(
+            transferred=1000, bytes_per_second=100.0, eta=30.0))
+
+    @validate_logging(verify_rate_and_eta)
+    def test_rate_and_eta(self, logger):
+        """
+        Once ``PROGRESS_INTERVAL`` has passed a ``PUSH_PROGRESS`` message is
+        logged with the average rate and, if the expected size is known, the
+        estimated time remaining.
+        """
+        progress = TransferProgress(
+            logger, expected_size=4000, now=lambda: self.now)
+        self.advance(10)
+        progress(1000)
+
+    def verify_unknown_size(self, logger):
+        assertHasMessage(self, logger, PUSH_PROGRESS, dict(eta=None))
+
+    @validate_logging(verify_unknown_size)
+    def test_unknown_size(self, logger):
+        """
+        If the expected size is not known the ETA is logged as ``None``.
+        """
+        progress = TransferProgress(logger, now=lambda: self.now)
+        self.advance(PROGRESS_INTERVAL)
+        progress(1000)
+
+
+class SynchronousTransfersTests(SynchronousTestCase):
+    """
+    Tests for ``SynchronousTransfers``.
+    """
+    def test_run(self):
+        """
+        ``SynchronousTransfers.run`` calls the function immediately and
+        returns a ``Deferred`` that fires with its result.
+        """
+        result = SynchronousTransfers().run(lambda x, y: x + y, 1, y=2)
+        self.assertEqual(3, self.successResultOf(result))
+
+
+class ThreadedTransfersTests(TestCase):
+    """
+    Tests for ``ThreadedTransfers``.
+    """
+    def setUp(self):
+        self.transfers = ThreadedTransfers(reactor, maximum=1)
+        self.addCleanup(self.transfers.stop)
+
+    def test_thread(self):
+        """
+        ``ThreadedTransfers.run`` calls the function in a thread other than
+        the reactor thread.
+        """
+        d = self.transfers.run(lambda: current_thread().ident)
+        d.addCallback(self.assertNotEqual, current_thread().ident)
+        return d
+
+    def test_maximum(self):
+        """
+        No more than ``maximum`` transfers run at the same time; later ones
+        wait for earlier ones to finish.
+        """
+        started = []
+        release = Event()
+        self.addCleanup(release.set)
+
+        def first():
+            started.append(1)
+            release.wait(30)
+
+        running = [self.transfers.run(first),
+                   self.transfers.run(started.append, 2)]
+        d = deferLater(reactor, 0.1, lambda: None)
+
+        def check_waiting(_):
+            self.assertEqual([1], started)
+            release.set()
+            return gatherResults(running)
+        d.addCallback(check_waiting)
+        d.addCallback(lambda _: self.assertEqual([1, 2], started))
+        return d
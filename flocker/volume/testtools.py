@@ -14,6 +14,8 @@ from characteristic import attributes
 from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
 from twisted.internet import reactor
+from twisted.internet.ssl import DistinguishedName, KeyPair, PrivateCertificate
+from twisted.python.usage import UsageError
 from twisted.trial.unittest import SynchronousTestCase
 
 from ..common import ProcessNode
@@ -21,6 +23,7 @@ from ._ipc import RemoteVolumeManager
 
 from .filesystems.zfs import StoragePool
 from .service import VolumeService
+from ._transfer import CHUNK_SIZE
 from .filesystems.memory import FilesystemStoragePool
 
 
@@ -57,6 +60,64 @@ def service_for_pool(test, pool):
     return service
 
 
+@attributes(["certificate_authority", "certificate", "stranger"])
+class VolumeTransferCertificates(object):
+    """
+    PEM files for testing volume transfers over TLS.
+
+    :ivar FilePath certificate_authority: The certificate of a cluster's
+        certificate authority.
+    :ivar FilePath certificate: A node certificate and private key signed by
+        that authority.
+    :ivar FilePath stranger: A node certificate and private key signed by
+        some other authority.
+    """
+
+
+def make_volume_transfer_certificates(test_case):
+    """
+    Generate the certificates of a pretend cluster.
+
+    :param TestCase test_case: The test which will use the certificates.
+
+    :return: A ``VolumeTransferCertificates``.
+    """
+    directory = FilePath(test_case.mktemp())
+    directory.createDirectory()
+
+    def sign(issuer, name):
+        """
+        Create a certificate for a new key, signed with SHA-256 since
+        OpenSSL rejects the MD5 signatures Twisted makes by default.
+
+        :param issuer: ``None`` for a self-signed certificate, or the
+            ``PrivateCertificate`` of the certificate authority.
+        :param bytes name: The common name of the certificate.
+
+        :return: A ``PrivateCertificate``.
+        """
+        key = KeyPair.generate(size=2048)
+        subject = DistinguishedName(commonName=name)
+        if issuer is None:
+            issuer_key, issuer_name = key, subject
+        else:
+            issuer_key, issuer_name = issuer.privateKey, issuer.getSubject()
+        certificate = issuer_key.signRequestObject(
+            issuer_name, key.requestObject(subject, "sha256"), 1,
+            digestAlgorithm="sha256")
+        return PrivateCertificate.fromCertificateAndKeyPair(certificate, key)
+
+    cluster = sign(None, b"cluster")
+    paths = dict(
+        (name, directory.child(name + b".pem"))
+        for name in [b"certificate_authority", b"certificate", b"stranger"])
+    paths[b"certificate_authority"].setContent(cluster.dumpPEM())
+    paths[b"certificate"].setContent(sign(cluster, b"node").dumpPEM())
+    paths[b"stranger"].setContent(
+        sign(sign(None, b"other"), b"stranger").dumpPEM())
+    return VolumeTransferCertificates(**paths)
+
+
 def create_zfs_pool(test_case):
     """Create a new ZFS pool, then delete it after the test is over.
 
@@ -212,6 +273,48 @@ def make_volume_options_tests(make_options, extra_arguments=None):
             parseOptions(options, [b"--mountpoint", mountpoint])
             self.assertEqual(mountpoint, options["mountpoint"])
 
+        def test_default_compression(self):
+            """
+            By default no compressions are used.
+            """
+            options = make_options()
+            parseOptions(options, [])
+            self.assertEqual([], options["compression"])
+
+        def test_compression(self):
+            """
+            The options class accepts a comma-separated list of compressions
+            as the ``--compression`` parameter.
+            """
+            options = make_options()
+            parseOptions(options, [b"--compression", b"zstd,gzip"])
+            self.assertEqual([b"zstd", b"gzip"], options["compression"])
+
+        def test_unknown_compression(self):
+            """
+            An unknown compression is rejected.
+            """
+            options = make_options()
+            self.assertRaises(
+                UsageError, parseOptions, options,
+                [b"--compression", b"gzip,nope"])
+
+        def test_default_buffer_size(self):
+            """
+            By default the buffer size is ``CHUNK_SIZE``.
+            """
+            options = make_options()
+            parseOptions(options, [])
+            self.assertEqual(CHUNK_SIZE, options["buffer-size"])
+
+        def test_buffer_size(self):
+            """
+            The options class accepts a ``--buffer-size`` parameter.
+            """
+            options = make_options()
+            parseOptions(options, [b"--buffer-size", b"4096"])
+            self.assertEqual(4096, options["buffer-size"])
+
     dummy_options = make_options()
     VolumeOptionsTests.__name__ = dummy_options.__class__.__name__ + "Tests"
     return VolumeOptionsTests
@@ -149,6 +149,7 @@ setup(
         "PyYAML == 3.10",
 
         "treq == 0.2.1",
+        "pyOpenSSL >= 0.14",
 
         "psutil == 2.1.2",
         "netifaces >= 0.8",